@@ -1,19 +1,28 @@
+# Первым: отсчет времени запуска процесса API (utils/startup_timing.py)
+from utils import startup_timing
 import uvicorn
+import asyncio
 import json
-from typing import Optional
-from fastapi import FastAPI, HTTPException, Request, Header, Query
-from fastapi.responses import JSONResponse, RedirectResponse
-from aiogram import Bot
+import time
+from typing import List, Optional
+from datetime import date, datetime
+from fastapi import FastAPI, HTTPException, Request, Header, Query, Depends
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
 from db.mongo import get_db
+from db.migrate_timestamps import time_range, timestamps_migrated
 from db.redis_client import get_redis
+from db.counters import apply_order_change
 from db.models import (
-    IncomingOrder, UpdateOrder, utcnow_iso, get_status_history_update,
+    IncomingOrder, UpdateOrder, utcnow, utcnow_iso, as_datetime, status_history_fields, payment_history_key,
     CouriersOnShiftResponse, CourierOnShift, CourierOrdersStats,
     CourierLocationResponse, LocationData,
     CourierRouteResponse, RouteData, RouteTimeRange,
-    ActiveOrdersResponse, PaginationInfo,
+    NearbyCouriersResponse, NearbyCourier,
+    SuggestedCouriersResponse, SuggestedCourier,
+    ActiveOrdersResponse,
     AssignCourierRequest, CloseShiftRequest,
-    OrderCompleteResponse, OrderDeleteResponse, OrderAssignResponse, CloseShiftResponse
+    OrderCompleteResponse, OrderDeleteResponse, OrderAssignResponse, CloseShiftResponse,
+    QueryOffendersResponse, QueryOffender
 )
 from keyboards.orders_kb import new_order_kb, in_transit_kb
 from utils.logger import setup_logging
@@ -25,10 +34,69 @@ from handlers.admin import (
     get_courier_location, get_courier_route
 )
 from utils.webhooks import send_webhook, prepare_order_data
-from config import BOT_TOKEN, API_HOST, API_PORT, TIMEZONE
+from utils.metrics import REGISTRY, CONTENT_TYPE, HTTP_REQUEST_SECONDS, refresh_business_gauges
+from utils.query_trace import trace_queries
+from utils.traffic_recorder import get_recorder, HttpRecorderMiddleware
+from utils.loop_monitor import start_loop_monitor
+from utils.bot_registry import get_bot, close_bot
+from db.audit import close_audit_sink
+from utils.response_cache import cached_endpoint
+from utils.fast_json import ORJSONResponse
+from utils.compression import CompressionMiddleware
+from utils.data_versions import bump_versions
+from utils.admin_acl import get_admin_acl
+from config import (
+    API_HOST, API_PORT, TIMEZONE, METRICS_TOKEN, COMPRESSION_MIN_BYTES,
+    TRACK_VIEWER_LEAFLET_URL, TRACK_VIEWER_TILE_URL
+)
 
 app = FastAPI(title="Courier Local API")
-bot = Bot(BOT_TOKEN)
+# Общий Bot процесса (одна сессия и пул соединений с ботом и планировщиком)
+bot = get_bot()
+
+# Запись запросов для воспроизведения нагрузки (TRAFFIC_RECORD_DIR)
+if get_recorder() is not None:
+    app.add_middleware(HttpRecorderMiddleware, recorder=get_recorder())
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """
+    Длительность запросов по шаблону маршрута (а не фактическому пути - иначе метки не ограничены)
+    и трассировка запросов MongoDB (utils.query_trace).
+    """
+    started = time.perf_counter()
+    status = "500"
+    with trace_queries(request.method) as trace:
+        try:
+            response = await call_next(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            route = getattr(request.scope.get("route"), "path", "unmatched")
+            trace.handler = f"{request.method} {route}"
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=request.method,
+                route=route,
+                status=status
+            )
+
+# Сжатие ответов (gzip/brotli) - внешний слой, метрики и запись трафика видят несжатые ответы
+if COMPRESSION_MIN_BYTES >= 0:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MIN_BYTES)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """Метрики в формате Prometheus"""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    try:
+        # Сбор не должен зависать, если MongoDB недоступна: отдаем последние значения
+        await asyncio.wait_for(refresh_business_gauges(), timeout=2)
+    except Exception as e:
+        import logging
+        logging.getLogger(__name__).warning(f"[API] ⚠️ Не удалось обновить gauge метрик: {e!r}")
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
 
 def get_client_ip(request: Request) -> Optional[str]:
     """
@@ -78,12 +146,23 @@ def _is_local_ip(ip: str) -> bool:
 async def on_startup():
     # Инициализация уже выполняется в bot.py, здесь только логирование
     setup_logging()
+    # В bot.main loop общий с ботом и планировщиком: повторный запуск ничего не делает
+    start_loop_monitor()
+    startup_timing.mark("api")
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # При запуске из bot.main сессию закрывает bot.main, повторное закрытие ничего не делает
+    await close_audit_sink()
+    await get_admin_acl().close()
+    await close_bot()
 
 # --- Admin API Authentication ---
 
 async def verify_admin(x_admin_user_id: int = Header(..., alias="X-Admin-User-ID")) -> int:
     """
-    Проверяет права администратора через заголовок X-Admin-User-ID.
+    Проверяет права администратора через заголовок X-Admin-User-ID
+    (по кэшу прав в памяти процесса, без запроса к MongoDB).
     Вызывает HTTPException(403) если пользователь не является супер-админом.
     Используется как dependency в FastAPI endpoints.
     """
@@ -101,45 +180,44 @@ async def create_order(payload: IncomingOrder, request: Request):
     import logging
     logger = logging.getLogger(__name__)
     
-    logger.info(f"[API] 📥 Входящий запрос на создание заказа: external_id={payload.external_id}, courier_tg_chat_id={payload.courier_tg_chat_id} (type: {type(payload.courier_tg_chat_id).__name__})")
-    logger.debug(f"[API] 📋 Данные заказа: payment_status={payload.payment_status}, priority={payload.priority}, address={payload.address[:50]}...")
+    logger.info("[API] 📥 Входящий запрос на создание заказа: external_id=%s, courier_tg_chat_id=%s (type: %s)", payload.external_id, payload.courier_tg_chat_id, type(payload.courier_tg_chat_id).__name__)
+    logger.debug("[API] 📋 Данные заказа: payment_status=%s, priority=%s, address=%s...", payload.payment_status, payload.priority, payload.address[:50])
     
     # Получаем IP адрес клиента
     client_ip = get_client_ip(request)
     if client_ip:
-        logger.info(f"[API] 🌐 IP адрес клиента: {client_ip}")
+        logger.info("[API] 🌐 IP адрес клиента: %s", client_ip)
     else:
-        logger.debug(f"[API] 🌐 Локальный запрос, IP не сохраняется")
+        logger.debug("[API] 🌐 Локальный запрос, IP не сохраняется")
     
     db = await get_db()
     redis = get_redis()
-    logger.debug(f"[API] 🔌 Подключение к БД и Redis установлено")
+    logger.debug("[API] 🔌 Подключение к БД и Redis установлено")
 
     # Find courier by tg_chat_id
-    logger.debug(f"[API] 🔍 Поиск курьера по tg_chat_id={payload.courier_tg_chat_id}")
+    logger.debug("[API] 🔍 Поиск курьера по tg_chat_id=%s", payload.courier_tg_chat_id)
     courier = await db.couriers.find_one({"tg_chat_id": payload.courier_tg_chat_id})
     if not courier:
-        logger.warning(f"[API] ⚠️ Курьер не найден: {payload.courier_tg_chat_id}")
+        logger.warning("[API] ⚠️ Курьер не найден: %s", payload.courier_tg_chat_id)
         raise HTTPException(status_code=404, detail="Courier not found")
     
-    logger.info(f"[API] ✅ Курьер найден: _id={courier.get('_id')}, name={courier.get('name')}, tg_chat_id={courier.get('tg_chat_id')}")
+    logger.info("[API] ✅ Курьер найден: _id=%s, name=%s, tg_chat_id=%s", courier.get('_id'), courier.get('name'), courier.get('tg_chat_id'))
 
     # Ensure external order id uniqueness (also enforced by unique index)
-    logger.debug(f"[API] 🔍 Проверка уникальности external_id={payload.external_id}")
+    logger.debug("[API] 🔍 Проверка уникальности external_id=%s", payload.external_id)
     existing_order = await db.couriers_deliveries.find_one({"external_id": payload.external_id})
     if existing_order:
-        logger.warning(f"[API] ⚠️ Заказ с external_id {payload.external_id} уже существует")
+        logger.warning("[API] ⚠️ Заказ с external_id %s уже существует", payload.external_id)
         raise HTTPException(status_code=409, detail="Order with this external_id already exists")
-    logger.debug(f"[API] ✅ external_id уникален")
+    logger.debug("[API] ✅ external_id уникален")
 
     # Инициализируем историю статусов
-    current_time = utcnow_iso()
+    current_time = utcnow()
     status_history = {
         "waiting": current_time
     }
     # Добавляем начальный статус оплаты
-    payment_status_key = "un_paid" if payload.payment_status == "NOT_PAID" else "paid"
-    status_history[payment_status_key] = current_time
+    status_history[payment_history_key(payload.payment_status)] = current_time
     
     order_doc = {
         "external_id": payload.external_id,
@@ -164,6 +242,8 @@ async def create_order(payload: IncomingOrder, request: Request):
         },
         "address": payload.address,
         "map_url": payload.map_url,
+        "lat": payload.lat,
+        "lon": payload.lon,
         "notes": payload.notes,
         "photos": [],
         "pay_photo": [],
@@ -173,68 +253,70 @@ async def create_order(payload: IncomingOrder, request: Request):
     if client_ip:
         order_doc["client_ip"] = client_ip
     
-    logger.debug(f"[API] 📝 Документ заказа подготовлен: courier_tg_chat_id={order_doc['courier_tg_chat_id']} (type: {type(order_doc['courier_tg_chat_id']).__name__})")
+    logger.debug("[API] 📝 Документ заказа подготовлен: courier_tg_chat_id=%s (type: %s)", order_doc['courier_tg_chat_id'], type(order_doc['courier_tg_chat_id']).__name__)
     
-    logger.debug(f"[API] 💾 Сохранение заказа в БД...")
+    logger.debug("[API] 💾 Сохранение заказа в БД...")
     res = await db.couriers_deliveries.insert_one(order_doc)
     order_doc["_id"] = res.inserted_id
+    await apply_order_change(db, None, order_doc)
     
-    logger.info(f"[API] ✅ Заказ успешно создан: _id={order_doc['_id']}, external_id={payload.external_id}, courier_tg_chat_id={order_doc['courier_tg_chat_id']}")
+    logger.info("[API] ✅ Заказ успешно создан: _id=%s, external_id=%s, courier_tg_chat_id=%s", order_doc['_id'], payload.external_id, order_doc['courier_tg_chat_id'])
 
     # Проверка статуса смены курьера (Redis + MongoDB fallback)
-    logger.debug(f"[API] 🔍 Проверка статуса смены курьера: tg_chat_id={courier['tg_chat_id']}")
+    logger.debug("[API] 🔍 Проверка статуса смены курьера: tg_chat_id=%s", courier['tg_chat_id'])
     is_on_redis = await redis.get(f"courier:shift:{courier['tg_chat_id']}")
     is_on_mongo = courier.get("is_on_shift", False)
     
-    logger.debug(f"[API] 📊 Статус смены: Redis={is_on_redis}, MongoDB={is_on_mongo}, tg_chat_id={courier['tg_chat_id']}")
+    logger.debug("[API] 📊 Статус смены: Redis=%s, MongoDB=%s, tg_chat_id=%s", is_on_redis, is_on_mongo, courier['tg_chat_id'])
     
     # Если ключ в Redis истек, но курьер на смене в MongoDB - восстанавливаем ключ
     if is_on_redis != "on" and is_on_mongo:
-        logger.warning(f"[API] ⚠️ Ключ в Redis истек, но курьер на смене в MongoDB. Восстанавливаем ключ в Redis.")
+        logger.warning("[API] ⚠️ Ключ в Redis истек, но курьер на смене в MongoDB. Восстанавливаем ключ в Redis.")
         from config import SHIFT_TTL
         await redis.setex(f"courier:shift:{courier['tg_chat_id']}", SHIFT_TTL, "on")
         is_on_redis = "on"
-        logger.info(f"[API] ✅ Ключ в Redis восстановлен для курьера {courier['tg_chat_id']}")
+        logger.info("[API] ✅ Ключ в Redis восстановлен для курьера %s", courier['tg_chat_id'])
     
     # Отправляем сообщение, если курьер на смене (Redis или MongoDB)
     is_on_shift = is_on_redis == "on" or is_on_mongo
     if is_on_shift:
-        logger.info(f"[API] 🚚 Курьер на смене, отправка уведомления в Telegram...")
+        logger.info("[API] 🚚 Курьер на смене, отправка уведомления в Telegram...")
         
         # Используем унифицированную функцию форматирования заказа
         text = format_order_text(order_doc)
+        kb = new_order_kb(payload.external_id)
 
         try:
-            logger.debug(f"[API] 📤 Отправка Telegram сообщения курьеру {courier['tg_chat_id']} для заказа {payload.external_id}")
+            logger.debug("[API] 📤 Отправка Telegram сообщения курьеру %s для заказа %s", courier['tg_chat_id'], payload.external_id)
             message = await bot.send_message(
                 courier["tg_chat_id"],
                 text,
                 parse_mode="HTML",
-                reply_markup=new_order_kb(payload.external_id)
+                reply_markup=kb
             )
-            logger.info(f"[API] ✅ Telegram сообщение успешно отправлено курьеру {courier['tg_chat_id']}")
+            logger.info("[API] ✅ Telegram сообщение успешно отправлено курьеру %s", courier['tg_chat_id'])
             
             # Сохраняем message_id в заказе
-            from utils.order_messages import save_order_message_id
-            await save_order_message_id(order_doc, message.message_id)
+            from utils.order_messages import save_order_message_id, render_hash
+            await save_order_message_id(order_doc, message.message_id, render_hash(text, kb))
         except Exception as e:
-            logger.error(f"[API] ❌ Ошибка отправки Telegram сообщения курьеру {courier['tg_chat_id']}: {e}", exc_info=True)
+            logger.error("[API] ❌ Ошибка отправки Telegram сообщения курьеру %s: %s", courier['tg_chat_id'], e, exc_info=True)
             pass
     else:
-        logger.info(f"[API] ⏸️ Курьер {courier['tg_chat_id']} не на смене, уведомление пропущено")
+        logger.info("[API] ⏸️ Курьер %s не на смене, уведомление пропущено", courier['tg_chat_id'])
 
     # Уведомление менеджеру о назначении заказа на курьера (только для реальных заказов)
     is_test = is_test_order(payload.external_id)
     if not is_test:
         try:
             await notify_manager(bot, courier, f"📦 Заказ {payload.external_id} назначен на курьера {courier.get('name', 'Неизвестный')}")
-            logger.info(f"[API] ✅ Менеджер уведомлен о назначении заказа {payload.external_id} на курьера {courier.get('name')}")
+            logger.info("[API] ✅ Менеджер уведомлен о назначении заказа %s на курьера %s", payload.external_id, courier.get('name'))
         except Exception as e:
-            logger.error(f"[API] ❌ Ошибка уведомления менеджера о назначении заказа: {e}", exc_info=True)
+            logger.error("[API] ❌ Ошибка уведомления менеджера о назначении заказа: %s", e, exc_info=True)
     else:
-        logger.info(f"[API] 🧪 Тестовый заказ {payload.external_id} - уведомление менеджеру не отправляется")
+        logger.info("[API] 🧪 Тестовый заказ %s - уведомление менеджеру не отправляется", payload.external_id)
 
-    logger.info(f"[API] ✅ Создание заказа завершено: external_id={payload.external_id}, order_id={order_doc['_id']}")
+    logger.info("[API] ✅ Создание заказа завершено: external_id=%s, order_id=%s", payload.external_id, order_doc['_id'])
     return JSONResponse({"ok": True, "order_id": str(order_doc["_id"]), "external_id": payload.external_id})
 
 @app.patch("/api/orders/{external_id}")
@@ -251,13 +333,12 @@ async def update_order(external_id: str, payload: UpdateOrder):
         raise HTTPException(status_code=404, detail="Order not found")
     logger.debug(f"[API] ✅ Заказ найден: _id={order.get('_id')}")
     
-    update_data = {"updated_at": utcnow_iso()}
+    update_data = {"updated_at": utcnow()}
     
     # Если обновляется payment_status, добавляем запись в историю
     if payload.payment_status is not None:
         update_data["payment_status"] = payload.payment_status
-        status_history_update = get_status_history_update(order, new_payment_status=payload.payment_status)
-        update_data.update(status_history_update)
+        update_data.update(status_history_fields(new_payment_status=payload.payment_status))
     
     if payload.is_cash_payment is not None:
         update_data["is_cash_payment"] = payload.is_cash_payment
@@ -269,11 +350,15 @@ async def update_order(external_id: str, payload: UpdateOrder):
         update_data["address"] = payload.address
     if payload.map_url is not None:
         update_data["map_url"] = payload.map_url
+    if payload.lat is not None and payload.lon is not None:
+        update_data["lat"] = payload.lat
+        update_data["lon"] = payload.lon
     if payload.notes is not None:
         update_data["notes"] = payload.notes
     
     logger.debug(f"[API] 💾 Обновление данных заказа: {update_data}")
     await db.couriers_deliveries.update_one({"external_id": external_id}, {"$set": update_data})
+    await bump_versions("orders", chat_id=order.get("courier_tg_chat_id"))
     logger.info(f"[API] ✅ Заказ {external_id} обновлен: {update_data}")
     
     return JSONResponse({"ok": True, "external_id": external_id})
@@ -471,7 +556,8 @@ async def location_redirect(key: str, lang: str = None):
 # --- Admin API Endpoints ---
 
 @app.get("/api/admin/couriers/on-shift", response_model=CouriersOnShiftResponse)
-async def get_couriers_on_shift(admin_user_id: int = verify_admin):
+@cached_endpoint("couriers_on_shift", ttl=60, scopes=[("shift", None), ("orders", None)])
+async def get_couriers_on_shift(admin_user_id: int = Depends(verify_admin)):
     """
     Главный экран - список курьеров на смене.
     Возвращает список всех курьеров с is_on_shift: True с полной информацией.
@@ -518,10 +604,63 @@ async def get_couriers_on_shift(admin_user_id: int = verify_admin):
     
     return CouriersOnShiftResponse(couriers=result_couriers)
 
+@app.get("/api/admin/couriers/nearby", response_model=NearbyCouriersResponse)
+async def get_nearby_couriers(
+    lat: float = Query(..., ge=-90, le=90, description="Широта точки"),
+    lon: float = Query(..., ge=-180, le=180, description="Долгота точки"),
+    radius: float = Query(3000, gt=0, le=100000, description="Радиус поиска в метрах"),
+    limit: int = Query(20, ge=1, le=100, description="Максимальное количество курьеров"),
+    admin_user_id: int = Depends(verify_admin)
+):
+    """
+    Курьеры на смене рядом с точкой (для выбора курьера при назначении заказа).
+    Поиск выполняется по Redis GEO set, результат отсортирован по расстоянию.
+    """
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    logger.info(f"[API] 📍 Админ {admin_user_id} ищет курьеров рядом с {lat},{lon} (радиус {radius} м)")
+    
+    from utils.courier_geo import find_nearby_couriers
+    nearby = await find_nearby_couriers(lat, lon, radius, limit)
+    
+    names = {}
+    if nearby:
+        db = await get_db()
+        cursor = db.couriers.find(
+            {"tg_chat_id": {"$in": [item["chat_id"] for item in nearby]}},
+            {"tg_chat_id": 1, "name": 1, "username": 1}
+        )
+        async for courier in cursor:
+            names[courier["tg_chat_id"]] = courier
+    
+    result_couriers = []
+    for item in nearby:
+        courier = names.get(item["chat_id"])
+        if not courier:
+            continue
+        result_couriers.append(NearbyCourier(
+            chat_id=item["chat_id"],
+            name=courier.get("name", "Unknown"),
+            username=courier.get("username"),
+            distance_m=item["distance_m"],
+            lat=item["lat"],
+            lon=item["lon"]
+        ))
+    
+    logger.info(f"[API] 📊 Найдено {len(result_couriers)} курьеров рядом")
+    
+    return NearbyCouriersResponse(
+        center={"lat": lat, "lon": lon},
+        radius_m=radius,
+        couriers=result_couriers
+    )
+
 @app.get("/api/admin/couriers/{chat_id}/location", response_model=CourierLocationResponse)
+@cached_endpoint("courier_location", ttl=30, scopes=[("location", "chat_id")])
 async def get_courier_location_endpoint(
     chat_id: int,
-    admin_user_id: int = verify_admin
+    admin_user_id: int = Depends(verify_admin)
 ):
     """
     Текущее местоположение курьера.
@@ -550,9 +689,10 @@ async def get_courier_location_endpoint(
     )
 
 @app.get("/api/admin/couriers/{chat_id}/route", response_model=CourierRouteResponse)
+@cached_endpoint("courier_route", ttl=60, scopes=[("location", "chat_id")])
 async def get_courier_route_endpoint(
     chat_id: int,
-    admin_user_id: int = verify_admin
+    admin_user_id: int = Depends(verify_admin)
 ):
     """
     Маршрут курьера за последние 72 часа.
@@ -581,11 +721,12 @@ async def get_courier_route_endpoint(
     )
 
 @app.get("/api/admin/couriers/{chat_id}/orders/active", response_model=ActiveOrdersResponse)
+@cached_endpoint("courier_active_orders", ttl=60, scopes=[("orders", "chat_id")])
 async def get_courier_active_orders(
     chat_id: int,
     page: int = Query(0, ge=0),
     per_page: int = Query(10, ge=1, le=100),
-    admin_user_id: int = verify_admin
+    admin_user_id: int = Depends(verify_admin)
 ):
     """
     Активные заказы курьера.
@@ -602,7 +743,7 @@ async def get_courier_active_orders(
     all_orders = await db.couriers_deliveries.find({
         "courier_tg_chat_id": chat_id,
         "status": {"$in": ["waiting", "in_transit"]}
-    }).sort("priority", -1).sort("created_at", 1).to_list(1000)
+    }).sort([("priority", -1), ("created_at", 1)]).to_list(1000)
     
     total = len(all_orders)
     total_pages = (total + per_page - 1) // per_page if total > 0 else 1
@@ -612,31 +753,18 @@ async def get_courier_active_orders(
     end_idx = start_idx + per_page
     orders = all_orders[start_idx:end_idx]
     
-    # Преобразуем ObjectId в строки для JSON
-    orders_json = []
-    for order in orders:
-        order_dict = dict(order)
-        if "_id" in order_dict:
-            order_dict["_id"] = str(order_dict["_id"])
-        if "assigned_to" in order_dict and order_dict["assigned_to"]:
-            order_dict["assigned_to"] = str(order_dict["assigned_to"])
-        orders_json.append(order_dict)
-    
-    return ActiveOrdersResponse(
-        orders=orders_json,
-        pagination=PaginationInfo(
-            page=page,
-            per_page=per_page,
-            total=total,
-            total_pages=total_pages
-        )
-    )
+    # Документы сериализуются как есть (ObjectId, datetime - utils.fast_json), без валидации списка моделью
+    return ORJSONResponse({
+        "ok": True,
+        "orders": orders,
+        "pagination": {"page": page, "per_page": per_page, "total": total, "total_pages": total_pages}
+    })
 
 @app.get("/api/admin/couriers/{chat_id}/orders/completed", response_model=ActiveOrdersResponse)
 async def get_courier_completed_orders(
     chat_id: int,
     page: int = Query(0, ge=0),
-    admin_user_id: int = verify_admin
+    admin_user_id: int = Depends(verify_admin)
 ):
     """
     Закрытые заказы курьера.
@@ -666,30 +794,18 @@ async def get_courier_completed_orders(
     end_idx = start_idx + PER_PAGE
     orders = all_orders[start_idx:end_idx]
     
-    # Преобразуем ObjectId в строки для JSON
-    orders_json = []
-    for order in orders:
-        order_dict = dict(order)
-        if "_id" in order_dict:
-            order_dict["_id"] = str(order_dict["_id"])
-        if "assigned_to" in order_dict and order_dict["assigned_to"]:
-            order_dict["assigned_to"] = str(order_dict["assigned_to"])
-        orders_json.append(order_dict)
-    
-    return ActiveOrdersResponse(
-        orders=orders_json,
-        pagination=PaginationInfo(
-            page=page,
-            per_page=PER_PAGE,
-            total=total,
-            total_pages=total_pages
-        )
-    )
+    # Документы сериализуются как есть (ObjectId, datetime - utils.fast_json), без валидации списка моделью
+    return ORJSONResponse({
+        "ok": True,
+        "orders": orders,
+        "pagination": {"page": page, "per_page": PER_PAGE, "total": total, "total_pages": total_pages}
+    })
 
 @app.get("/api/admin/couriers/{chat_id}")
+@cached_endpoint("courier_details", ttl=30, scopes=[("shift", "chat_id"), ("orders", "chat_id"), ("location", "chat_id")])
 async def get_courier_details(
     chat_id: int,
-    admin_user_id: int = verify_admin
+    admin_user_id: int = Depends(verify_admin)
 ):
     """
     Детальная информация о курьере.
@@ -745,7 +861,7 @@ async def get_courier_details(
 @app.post("/api/admin/orders/{external_id}/complete", response_model=OrderCompleteResponse)
 async def complete_order(
     external_id: str,
-    admin_user_id: int = verify_admin
+    admin_user_id: int = Depends(verify_admin)
 ):
     """
     Завершить заказ.
@@ -758,38 +874,23 @@ async def complete_order(
     
     db = await get_db()
     
-    # Проверяем заказ
-    from handlers.orders import validate_order_for_action
-    is_valid, order, error_msg = await validate_order_for_action(
+    # Атомарно закрываем заказ (waiting/in_transit -> done), записываем что закрыл администратор
+    from utils.order_transitions import transition_order
+    updated_order, error_msg = await transition_order(
         external_id,
-        admin_user_id,
-        allow_admin=True
+        "done",
+        extra_fields={"closed_by_admin_id": admin_user_id}
     )
     
-    if not is_valid:
+    if not updated_order:
         raise HTTPException(status_code=400, detail=error_msg or "Cannot complete order")
     
-    current_courier_chat_id = order.get("courier_tg_chat_id")
-    address = order.get("address", "")
+    current_courier_chat_id = updated_order.get("courier_tg_chat_id")
+    address = updated_order.get("address", "")
     
-    # Удаляем сообщения о заказе перед закрытием
+    # Удаляем сообщения о заказе (id из документа, возвращенного переходом)
     from utils.order_messages import delete_order_messages_from_courier
-    await delete_order_messages_from_courier(bot, order)
-    
-    # Обновляем заказ
-    await db.couriers_deliveries.update_one(
-        {"external_id": external_id},
-        {
-            "$set": {
-                "status": "done",
-                "closed_by_admin_id": admin_user_id,
-                "updated_at": utcnow_iso()
-            }
-        }
-    )
-    
-    # Получаем обновленный заказ для webhook
-    updated_order = await db.couriers_deliveries.find_one({"external_id": external_id})
+    await delete_order_messages_from_courier(bot, updated_order, refresh=False)
     
     # Проверка: если заказ тестовый, не отправляем webhook
     is_test = is_test_order(external_id)
@@ -817,7 +918,7 @@ async def complete_order(
 @app.delete("/api/admin/orders/{external_id}", response_model=OrderDeleteResponse)
 async def delete_order(
     external_id: str,
-    admin_user_id: int = verify_admin
+    admin_user_id: int = Depends(verify_admin)
 ):
     """
     Удалить заказ.
@@ -843,6 +944,7 @@ async def delete_order(
     
     # Удаляем заказ
     await db.couriers_deliveries.delete_one({"external_id": external_id})
+    await apply_order_change(db, order, None)
     
     # Отправляем сообщение курьеру
     try:
@@ -855,11 +957,39 @@ async def delete_order(
     
     return OrderDeleteResponse(external_id=external_id)
 
+@app.get("/api/admin/orders/{external_id}/suggested-couriers", response_model=SuggestedCouriersResponse)
+async def get_suggested_couriers(
+    external_id: str,
+    limit: int = Query(10, ge=1, le=50, description="Максимальное количество курьеров"),
+    admin_user_id: int = Depends(verify_admin)
+):
+    """
+    Рекомендованные курьеры для назначения заказа.
+    Курьеры на смене ранжируются по расстоянию до адреса, загрузке и приоритету заказа.
+    """
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    logger.info(f"[API] 🎯 Админ {admin_user_id} запрашивает рекомендации курьеров для заказа {external_id}")
+    
+    db = await get_db()
+    order = await db.couriers_deliveries.find_one({"external_id": external_id})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    from utils.courier_suggest import suggest_couriers
+    suggestions = await suggest_couriers(order, limit=limit)
+    
+    return SuggestedCouriersResponse(
+        external_id=external_id,
+        couriers=[SuggestedCourier(**item) for item in suggestions]
+    )
+
 @app.patch("/api/admin/orders/{external_id}/assign", response_model=OrderAssignResponse)
 async def assign_courier_to_order(
     external_id: str,
     payload: AssignCourierRequest,
-    admin_user_id: int = verify_admin
+    admin_user_id: int = Depends(verify_admin)
 ):
     """
     Назначить курьера на заказ.
@@ -901,10 +1031,11 @@ async def assign_courier_to_order(
             "$set": {
                 "courier_tg_chat_id": payload.courier_chat_id,
                 "assigned_to": new_courier["_id"],
-                "updated_at": utcnow_iso()
+                "updated_at": utcnow()
             }
         }
     )
+    await apply_order_change(db, order, {**order, "courier_tg_chat_id": payload.courier_chat_id})
     
     # Обновляем курьера заказа в Odoo
     try:
@@ -936,8 +1067,8 @@ async def assign_courier_to_order(
             reply_markup=kb
         )
         # Сохраняем message_id в заказе
-        from utils.order_messages import save_order_message_id
-        await save_order_message_id(order, message.message_id)
+        from utils.order_messages import save_order_message_id, render_hash
+        await save_order_message_id(order, message.message_id, render_hash(text, kb))
     except Exception as e:
         logger.warning(f"[API] ⚠️ Не удалось отправить сообщение новому курьеру {payload.courier_chat_id}: {e}")
     
@@ -947,7 +1078,7 @@ async def assign_courier_to_order(
 async def close_courier_shift(
     chat_id: int,
     payload: CloseShiftRequest,
-    admin_user_id: int = verify_admin
+    admin_user_id: int = Depends(verify_admin)
 ):
     """
     Закрыть смену курьера.
@@ -985,24 +1116,25 @@ async def close_courier_shift(
         
         from utils.odoo import update_order_courier
         
+        # Удаляем сообщения о заказах у старого курьера: несколько deleteMessages на весь чат
+        from utils.order_messages import clear_chat_order_messages
+        await clear_chat_order_messages(bot, chat_id, [order.get("external_id") for order in active_orders])
+        
         transferred_count = 0
         for order in active_orders:
             external_id = order.get("external_id")
             try:
-                # Удаляем сообщения у старого курьера перед передачей
-                from utils.order_messages import delete_order_messages_from_courier
-                await delete_order_messages_from_courier(bot, order)
-                
                 await db.couriers_deliveries.update_one(
                     {"external_id": external_id},
                     {
                         "$set": {
                             "courier_tg_chat_id": payload.transfer_to_chat_id,
                             "assigned_to": new_courier["_id"],
-                            "updated_at": utcnow_iso()
+                            "updated_at": utcnow()
                         }
                     }
                 )
+                await apply_order_change(db, order, {**order, "courier_tg_chat_id": payload.transfer_to_chat_id})
                 
                 try:
                     await update_order_courier(external_id, str(payload.transfer_to_chat_id))
@@ -1033,15 +1165,15 @@ async def close_courier_shift(
                         reply_markup=kb
                     )
                     # Сохраняем message_id в заказе
-                    from utils.order_messages import save_order_message_id
-                    await save_order_message_id(updated_order, message.message_id)
+                    from utils.order_messages import save_order_message_id, render_hash
+                    await save_order_message_id(updated_order, message.message_id, render_hash(text, kb))
                 except Exception as e:
                     logger.warning(f"[API] ⚠️ Не удалось отправить сообщение новому курьеру {payload.transfer_to_chat_id} о заказе {order.get('external_id')}: {e}")
         except Exception as e:
             logger.warning(f"[API] ⚠️ Ошибка отправки сообщений новому курьеру: {e}")
     
     # Сохраняем время начала смены для подсчета заказов
-    shift_started_at = courier.get("shift_started_at")
+    shift_started_at = as_datetime(courier.get("shift_started_at"))
     current_shift_id = courier.get("current_shift_id")
     
     # Подсчет заказов за смену
@@ -1052,12 +1184,12 @@ async def close_courier_shift(
         try:
             orders_count = await db.couriers_deliveries.count_documents({
                 "courier_tg_chat_id": chat_id,
-                "created_at": {"$gte": shift_started_at}
+                **await time_range(db, "created_at", {"$gte": shift_started_at})
             })
             complete_orders_count = await db.couriers_deliveries.count_documents({
                 "courier_tg_chat_id": chat_id,
                 "status": "done",
-                "created_at": {"$gte": shift_started_at}
+                **await time_range(db, "created_at", {"$gte": shift_started_at})
             })
         except Exception as e:
             logger.warning(f"[API] ⚠️ Ошибка подсчета заказов за смену: {e}", exc_info=True)
@@ -1068,13 +1200,22 @@ async def close_courier_shift(
         {"$set": {"is_on_shift": False}, "$unset": {"current_shift_id": "", "shift_started_at": ""}}
     )
     
+    await bump_versions("shift", chat_id=chat_id)
+    
     # Удаляем данные из Redis
     await redis.delete(f"courier:shift:{chat_id}")
-    await redis.delete(f"courier:loc:{chat_id}")
+    from utils.courier_geo import remove_courier_position
+    await remove_courier_position(chat_id)
+    
+    # Убираем из чата оставшиеся сообщения о заказах (заказы в работе не трогаем)
+    from utils.order_messages import clear_chat_order_messages
+    await clear_chat_order_messages(bot, chat_id, keep_active=True)
     
     # Записываем в историю
     from db.models import Action, ShiftHistory
     await Action.log(db, chat_id, "shift_end")
+    from utils.track_stats import shift_track_stats, format_track_stats
+    track_stats = await shift_track_stats(db, chat_id, current_shift_id)
     await ShiftHistory.log(
         db,
         chat_id,
@@ -1082,7 +1223,8 @@ async def close_courier_shift(
         shift_id=current_shift_id,
         total_orders=orders_count,
         complete_orders=complete_orders_count,
-        shift_started_at=shift_started_at
+        shift_started_at=shift_started_at,
+        track_stats=track_stats
     )
     
     # Обновление статуса в Odoo
@@ -1092,12 +1234,13 @@ async def close_courier_shift(
     except Exception as e:
         logger.warning(f"[API] ⚠️ Не удалось обновить статус курьера в Odoo: {e}")
     
-    # Отправляем сообщение курьеру
+    # Отправляем сообщение курьеру (с пробегом и стоянками, если трек есть)
+    courier_text = "🔴 Ваша смена завершена офис-менеджером."
+    stats_text = format_track_stats(track_stats)
+    if stats_text:
+        courier_text += "\n" + stats_text
     try:
-        await bot.send_message(
-            chat_id,
-            "🔴 Ваша смена завершена офис-менеджером.\n\nСпасибо за работу!"
-        )
+        await bot.send_message(chat_id, courier_text + "\n\nСпасибо за работу!")
     except Exception as e:
         logger.warning(f"[API] ⚠️ Не удалось отправить сообщение курьеру {chat_id}: {e}")
     
@@ -1107,4 +1250,236 @@ async def close_courier_shift(
     
     logger.info(f"[API] ✅ Смена курьера {chat_id} закрыта админом")
     
-    return CloseShiftResponse(chat_id=chat_id, message=message)
+    return CloseShiftResponse(chat_id=chat_id, message=message, track_stats=track_stats)
+
+@app.get("/api/admin/debug/queries", response_model=QueryOffendersResponse)
+async def get_query_offenders(
+    limit: int = Query(20, ge=1, le=200, description="Максимальное количество обработчиков"),
+    reset: bool = Query(False, description="Очистить статистику после ответа"),
+    admin_user_id: int = Depends(verify_admin)
+):
+    """
+    Обработчики, превысившие бюджет round-trip к MongoDB или повторяющие
+    одну форму запроса (N+1), с момента запуска процесса.
+    """
+    from utils.query_trace import top_offenders, reset_offenders
+    from config import MONGO_ROUNDTRIP_BUDGET, MONGO_REPEAT_THRESHOLD
+    
+    offenders = top_offenders(limit)
+    if reset:
+        reset_offenders()
+    
+    return QueryOffendersResponse(
+        roundtrip_budget=MONGO_ROUNDTRIP_BUDGET,
+        repeat_threshold=MONGO_REPEAT_THRESHOLD,
+        offenders=[QueryOffender(**item) for item in offenders]
+    )
+
+@app.get("/api/admin/debug/profile", response_class=Response)
+async def get_profile(
+    seconds: float = Query(10, gt=0, le=60, description="Длительность профилирования, секунды"),
+    interval_ms: float = Query(5, ge=1, le=100, description="Интервал между сэмплами, миллисекунды"),
+    threads: str = Query("loop", pattern="^(loop|all)$", description="loop - только поток event loop, all - все потоки"),
+    admin_user_id: int = Depends(verify_admin)
+):
+    """
+    Сэмплирующий профилировщик: стеки в свернутом формате (flamegraph.pl, speedscope).
+    Сэмплы снимаются в отдельном потоке, event loop продолжает обслуживать запросы.
+    """
+    import logging
+    from utils.loop_monitor import sample_stacks, format_folded, get_loop_thread_id, ProfilerBusy
+    logger = logging.getLogger(__name__)
+    
+    thread_ids = [get_loop_thread_id()] if threads == "loop" else None
+    
+    logger.info(f"[ADMIN] 🔬 Профилирование {seconds} с ({threads}) запрошено админом {admin_user_id}")
+    try:
+        stacks = await asyncio.to_thread(sample_stacks, seconds, interval_ms / 1000, thread_ids)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profiling is already in progress")
+    
+    return Response(
+        format_folded(stacks),
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Profile-Samples": str(sum(stacks.values()))}
+    )
+
+# --- Export ---
+
+@app.get("/api/admin/export/orders", response_class=Response)
+async def export_orders(
+    date_from: Optional[datetime] = Query(None, description="created_at от (включительно), ISO 8601"),
+    date_to: Optional[datetime] = Query(None, description="created_at до (не включительно), ISO 8601"),
+    courier: Optional[int] = Query(None, description="Telegram chat ID курьера"),
+    brand: Optional[str] = Query(None),
+    status: Optional[List[str]] = Query(None, description="Статусы (параметр можно повторить)"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    cursor: Optional[str] = Query(None, description="_id последней полученной строки (продолжение выгрузки)"),
+    limit: int = Query(0, ge=0, description="Максимум строк (0 - все)"),
+    admin_user_id: int = Depends(verify_admin)
+):
+    """
+    Потоковая выгрузка заказов (NDJSON или CSV), упорядоченная по _id.
+    Память сервера не зависит от количества строк.
+    """
+    import logging
+    from utils.export import ORDER_FIELDS, build_filter, export_response, parse_cursor
+    logger = logging.getLogger(__name__)
+    
+    try:
+        after = parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    db = await get_db()
+    query = build_filter(
+        "created_at", date_from, date_to, after, legacy=not await timestamps_migrated(db),
+        courier_tg_chat_id=courier, brand=brand, status=status
+    )
+    logger.info(f"[API] 📤 Админ {admin_user_id} выгружает заказы ({format}): {query}")
+    return export_response(db.couriers_deliveries, query, ORDER_FIELDS, format, "orders", limit)
+
+@app.get("/api/admin/export/shifts", response_class=Response)
+async def export_shifts(
+    date_from: Optional[datetime] = Query(None, description="timestamp события от (включительно), ISO 8601"),
+    date_to: Optional[datetime] = Query(None, description="timestamp события до (не включительно), ISO 8601"),
+    courier: Optional[int] = Query(None, description="Telegram chat ID курьера"),
+    event: Optional[str] = Query(None, pattern="^(shift_started|shift_ended)$"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    cursor: Optional[str] = Query(None, description="_id последней полученной строки (продолжение выгрузки)"),
+    limit: int = Query(0, ge=0, description="Максимум строк (0 - все)"),
+    admin_user_id: int = Depends(verify_admin)
+):
+    """
+    Потоковая выгрузка истории смен (shift_history) в NDJSON или CSV, упорядоченная по _id.
+    """
+    import logging
+    from utils.export import SHIFT_FIELDS, build_filter, export_response, parse_cursor
+    logger = logging.getLogger(__name__)
+    
+    try:
+        after = parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    db = await get_db()
+    query = build_filter(
+        "timestamp", date_from, date_to, after, legacy=not await timestamps_migrated(db),
+        courier_tg_chat_id=courier, event=event
+    )
+    logger.info(f"[API] 📤 Админ {admin_user_id} выгружает историю смен ({format}): {query}")
+    return export_response(db.shift_history, query, SHIFT_FIELDS, format, "shifts", limit)
+
+# --- Track ---
+
+@app.get("/api/admin/couriers/{chat_id}/shifts/{shift_id}/track", response_class=Response)
+async def get_shift_track(
+    chat_id: int,
+    shift_id: str,
+    format: str = Query("geojson", pattern="^(geojson|gpx|polyline)$"),
+    simplify: float = Query(0, ge=0, le=1000, description="Допуск упрощения трека, метры (0 - все точки)"),
+    download: bool = Query(False, description="Отдать файлом (Content-Disposition: attachment)"),
+    admin_user_id: int = Depends(verify_admin)
+):
+    """
+    Полный трек смены курьера в GeoJSON, GPX или Google encoded polyline.
+    Точки передаются потоком из курсора locations, без ограничения количества.
+    """
+    import logging
+    from utils.track import track_query, track_response
+    logger = logging.getLogger(__name__)
+    
+    db = await get_db()
+    if not await db.locations.find_one(track_query(chat_id, shift_id), {"_id": 1}):
+        logger.warning(f"[API] ⚠️ Нет точек смены {shift_id} курьера {chat_id}")
+        raise HTTPException(status_code=404, detail="No locations found for shift")
+    
+    logger.info(f"[API] 🗺️ Админ {admin_user_id} запросил трек смены {shift_id} курьера {chat_id} ({format}, simplify={simplify})")
+    return await track_response(db.locations, chat_id, shift_id, format, simplify, download)
+
+@app.get("/api/admin/couriers/{chat_id}/shifts/{shift_id}/stats")
+async def get_shift_stats(chat_id: int, shift_id: str, admin_user_id: int = Depends(verify_admin)):
+    """
+    Аналитика трека смены: пробег, время в движении и на стоянках, стоянки.
+    Для завершенной смены берется из shift_history, для текущей считается по locations.
+    """
+    import logging
+    from utils.track_stats import shift_track_stats
+    logger = logging.getLogger(__name__)
+    
+    db = await get_db()
+    ended = await db.shift_history.find_one(
+        {"shift_id": shift_id, "courier_tg_chat_id": chat_id, "event": "shift_ended"},
+        {"_id": 0, "track_stats": 1}
+    )
+    if ended and ended.get("track_stats"):
+        return ORJSONResponse({"ok": True, "chat_id": chat_id, "shift_id": shift_id, "finished": True, "track_stats": ended["track_stats"]})
+    
+    track_stats = await shift_track_stats(db, chat_id, shift_id)
+    if track_stats is None or (not ended and track_stats["points"] == 0):
+        logger.warning(f"[API] ⚠️ Нет данных смены {shift_id} курьера {chat_id}")
+        raise HTTPException(status_code=404, detail="Shift not found")
+    
+    logger.info(f"[API] 📏 Админ {admin_user_id} запросил аналитику смены {shift_id} курьера {chat_id}")
+    return ORJSONResponse({"ok": True, "chat_id": chat_id, "shift_id": shift_id, "finished": ended is not None, "track_stats": track_stats})
+
+@app.get("/api/admin/couriers/{chat_id}/shifts/{shift_id}/track/view", response_class=HTMLResponse, include_in_schema=False)
+async def view_shift_track(chat_id: int, shift_id: str):
+    """
+    Страница просмотра трека (Leaflet). Страница не содержит данных: трек
+    загружается из track API с заголовком X-Admin-User-ID, введенным на странице.
+    """
+    from utils.track import viewer_page
+    
+    if not TRACK_VIEWER_LEAFLET_URL:
+        raise HTTPException(status_code=404, detail="Track viewer is disabled")
+    return HTMLResponse(viewer_page(TRACK_VIEWER_LEAFLET_URL, TRACK_VIEWER_TILE_URL))
+
+# --- Analytics ---
+
+@app.get("/api/admin/analytics/delivery-times")
+@cached_endpoint("delivery_times", ttl=300, scopes=[])
+async def get_delivery_times(
+    date_from: Optional[date] = Query(None, description="Первый день периода (по умолчанию - 30 дней назад)"),
+    date_to: Optional[date] = Query(None, description="Последний день периода включительно (по умолчанию - сегодня)"),
+    group_by: str = Query("courier", pattern="^(courier|brand|source|none)$"),
+    courier: Optional[int] = Query(None, description="Telegram chat ID курьера"),
+    brand: Optional[str] = Query(None),
+    source: Optional[str] = Query(None),
+    percentiles: str = Query("50,75,90,95", pattern=r"^\d{1,2}(\.\d+)?(,\d{1,2}(\.\d+)?)*$"),
+    admin_user_id: int = Depends(verify_admin)
+):
+    """
+    Процентили времени назначение -> забрал (pickup) и забрал -> доставил (delivery)
+    по курьерам, брендам или источникам за период (из агрегатов delivery_stats_daily).
+    """
+    import logging
+    from datetime import timedelta
+    from db.delivery_stats import query_stats
+    logger = logging.getLogger(__name__)
+    
+    date_to = date_to or datetime.now(TIMEZONE).date()
+    date_from = date_from or date_to - timedelta(days=29)
+    if date_from > date_to or (date_to - date_from).days > 366:
+        raise HTTPException(status_code=400, detail="Invalid period: date_from must be <= date_to, at most 366 days")
+    
+    db = await get_db()
+    started = time.perf_counter()
+    report = await query_stats(
+        db, date_from.isoformat(), date_to.isoformat(),
+        group_by=None if group_by == "none" else group_by,
+        percentiles=[float(p) for p in percentiles.split(",")],
+        chat_id=courier, brand=brand, source=source
+    )
+    logger.info(
+        f"[API] ⏱️ Админ {admin_user_id} запросил время доставки {date_from}..{date_to} по {group_by}: "
+        f"{len(report['groups'])} групп за {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return ORJSONResponse({
+        "ok": True,
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "group_by": group_by,
+        "unit": "seconds",
+        **report,
+    })
@@ -0,0 +1,380 @@
+"""
+Нагрузочный тест: настоящие api_server.app и aiogram Dispatcher (bot.build_dispatcher)
+против локальных заменителей (bench/stand_ins.py).
+
+Сценарий:
+    - N курьеров на смене присылают live-локацию (edited_message) каждые --location-interval секунд
+    - M заказов в минуту создаются через POST /api/orders (курьеры по кругу)
+    - курьер проходит по каждому заказу кнопки: Поехали -> Проверь оплату -> Заказ выполнен
+
+Отчет: количество, ошибки, пропускная способность и p50/p95/p99 по каждому пути.
+С --baseline сравнивает p95 с сохраненным значением и завершается с кодом 1,
+если путь стал медленнее больше чем на --tolerance.
+
+Запуск (MongoDB/Redis на localhost, база shipbot_bench очищается):
+    python -m bench.load --couriers 20 --orders-per-minute 120 --duration 60
+    python -m bench.load --mongo mongomock --redis fakeredis --duration 30
+    python -m bench.load --baseline bench/baseline.json                    # проверка регрессий
+    python -m bench.load --baseline bench/baseline.json --update-baseline  # сохранить baseline
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stand_ins import FakeOdooServer, FakeTelegramServer, asgi_request, use_backends  # noqa: E402
+
+BENCH_TOKEN = "123456:BENCH-TOKEN"
+BENCH_DB_NAME = "shipbot_bench"
+BASE_CHAT_ID = 700_000_000
+# external_id заказов: положительные (не тестовые) - проходят webhook и проверку оплаты в Odoo
+BASE_EXTERNAL_ID = 900_000_000
+
+# Центр Буэнос-Айреса
+_LAT, _LON = -34.6037, -58.3816
+
+class Recorder:
+    """Длительности и ошибки по путям"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def measure(self, path: str, coro) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await coro
+        except Exception:
+            self.errors[path] += 1
+            result = None
+        self.latencies[path].append(time.perf_counter() - started)
+        return result
+
+    def error(self, path: str):
+        self.errors[path] += 1
+
+    def report(self, duration: float) -> Dict[str, Dict[str, float]]:
+        import numpy as np
+        report = {}
+        for path in sorted(self.latencies):
+            values = np.array(self.latencies[path]) * 1000
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            report[path] = {
+                "count": int(values.size),
+                "errors": self.errors.get(path, 0),
+                "rps": round(values.size / duration, 2),
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+            }
+        return report
+
+def _user(chat_id: int) -> Dict[str, Any]:
+    return {"id": chat_id, "is_bot": False, "first_name": f"Courier {chat_id}"}
+
+def _chat(chat_id: int) -> Dict[str, Any]:
+    return {"id": chat_id, "type": "private"}
+
+class UpdateFactory:
+    """Конструктор Update в формате Bot API"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+
+    def _update(self, **payload):
+        from aiogram.types import Update
+        return Update.model_validate({"update_id": next(self._update_ids), **payload}, context={"bot": self.bot})
+
+    def live_location(self, chat_id: int, message_id: int, lat: float, lon: float):
+        now = int(time.time())
+        return self._update(edited_message={
+            "message_id": message_id, "date": now, "edit_date": now,
+            "chat": _chat(chat_id), "from": _user(chat_id),
+            "location": {"latitude": lat, "longitude": lon, "live_period": 28800},
+        })
+
+    def callback(self, chat_id: int, data: str, message_id: int):
+        return self._update(callback_query={
+            "id": str(next(self._callback_ids)), "from": _user(chat_id), "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": message_id, "date": int(time.time()), "chat": _chat(chat_id),
+                "from": {"id": 1, "is_bot": True, "first_name": "bench"}, "text": "order",
+            },
+        })
+
+async def seed(chat_ids: List[int], admin_ids: Iterable[int] = ()):
+    """Курьеры на смене со свежей локацией и супер-админы"""
+    from db.mongo import get_db
+    from db.redis_client import get_redis
+    from db.models import utcnow
+    from config import SHIFT_TTL
+
+    db = await get_db()
+    redis = get_redis()
+    now = utcnow()
+    docs = []
+    for index, chat_id in enumerate(chat_ids):
+        docs.append({
+            "name": f"Bench Courier {index}",
+            "tg_chat_id": chat_id,
+            "is_on_shift": True,
+            "shift_started_at": now,
+            "current_shift_id": f"bench-shift-{chat_id}",
+            "last_location": {"lat": _LAT, "lon": _LON, "updated_at": now},
+        })
+        await redis.setex(f"courier:shift:{chat_id}", SHIFT_TTL, "on")
+    if docs:
+        await db.couriers.insert_many(docs)
+    admin_ids = list(admin_ids)
+    if admin_ids:
+        await db.bot_super_admins.insert_one({"adminsType": {str(admin_id): "SUPER_ADMIN" for admin_id in admin_ids}})
+        from utils.admin_acl import get_admin_acl
+        get_admin_acl().invalidate_local()
+
+async def reset_database():
+    from db.mongo import get_db
+    from config import MONGO_DB_NAME
+    if "bench" not in MONGO_DB_NAME:
+        raise SystemExit(f"MONGO_DB_NAME={MONGO_DB_NAME}: нагрузочный тест очищает базу, используйте базу с 'bench' в имени")
+    db = await get_db()
+    for name in await db.list_collection_names():
+        await db[name].delete_many({})
+
+async def location_worker(recorder: Recorder, dp, bot, updates: UpdateFactory, chat_id: int,
+                          interval: float, deadline: float, offset: float):
+    await asyncio.sleep(offset)
+    step = 0
+    while time.monotonic() < deadline:
+        step += 1
+        update = updates.live_location(chat_id, 1, _LAT + step * 1e-5, _LON + (chat_id % 100) * 1e-4)
+        await recorder.measure("bot:location", dp.feed_update(bot, update))
+        await asyncio.sleep(interval)
+
+async def order_producer(recorder: Recorder, app, couriers: int, per_minute: float, deadline: float,
+                         queues: List[asyncio.Queue]):
+    interval = 60 / per_minute
+    for index in itertools.count():
+        if time.monotonic() >= deadline:
+            break
+        courier_index = index % couriers
+        external_id = str(BASE_EXTERNAL_ID + index)
+        status, _ = await recorder.measure("api:create_order", asgi_request(app, "POST", "/api/orders", {
+            "courier_tg_chat_id": BASE_CHAT_ID + courier_index,
+            "external_id": external_id,
+            "client_name": "Bench Client",
+            "client_phone": "+5491100000000",
+            "address": "Av. Corrientes 1234, Buenos Aires",
+            "lat": _LAT, "lon": _LON,
+            "payment_status": "NOT_PAID",
+        })) or (599, b"")
+        if status >= 400:
+            recorder.error("api:create_order")
+        else:
+            queues[courier_index].put_nowait(external_id)
+        await asyncio.sleep(interval)
+
+async def courier_flow_worker(recorder: Recorder, dp, bot, updates: UpdateFactory, chat_id: int,
+                              queue: asyncio.Queue, deadline: float, think_time: float):
+    while time.monotonic() < deadline:
+        try:
+            external_id = await asyncio.wait_for(queue.get(), timeout=max(deadline - time.monotonic(), 0.01))
+        except asyncio.TimeoutError:
+            break
+        for path, data in (
+            ("bot:order_go", f"order:go:{external_id}"),
+            ("bot:check_payment", f"order:check_payment:{external_id}"),
+            ("bot:order_done", f"order:done:{external_id}"),
+        ):
+            await recorder.measure(path, dp.feed_update(bot, updates.callback(chat_id, data, 1)))
+            await asyncio.sleep(think_time)
+
+def compare_with_baseline(report: Dict[str, Dict[str, float]], baseline: Dict[str, Any],
+                          tolerance: float, floor_ms: float) -> List[str]:
+    """
+    Пути, у которых p95 вырос больше чем на tolerance (и больше чем на floor_ms).
+
+    Returns:
+        Список описаний регрессий
+    """
+    regressions = []
+    for path, expected in baseline.get("paths", {}).items():
+        current = report.get(path)
+        if current is None:
+            regressions.append(f"{path}: нет измерений")
+            continue
+        limit = max(expected["p95_ms"] * (1 + tolerance), expected["p95_ms"] + floor_ms)
+        if current["p95_ms"] > limit:
+            regressions.append(f"{path}: p95 {current['p95_ms']} ms > {limit:.2f} ms (baseline {expected['p95_ms']} ms)")
+    return regressions
+
+def format_report(report: Dict[str, Dict[str, float]]) -> str:
+    lines = [f"{'path':22} {'count':>7} {'errors':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for path, row in report.items():
+        lines.append(
+            f"{path:22} {row['count']:>7} {row['errors']:>7} {row['rps']:>8} "
+            f"{row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9}"
+        )
+    return "\n".join(lines)
+
+class BenchApp:
+    """Запущенные заменители, приложение API, бот и Dispatcher"""
+
+    def __init__(self, telegram, odoo, app, bot, dp):
+        self.telegram = telegram
+        self.odoo = odoo
+        self.app = app
+        self.bot = bot
+        self.dp = dp
+        self.updates = UpdateFactory(bot)
+
+    async def close(self):
+        from utils.bot_registry import close_bot
+        from db.audit import close_audit_sink
+        from utils.admin_acl import get_admin_acl
+        await close_audit_sink()
+        await get_admin_acl().close()
+        await close_bot()
+        await self.telegram.stop()
+        await self.odoo.stop()
+
+    def print_calls(self):
+        print(f"\nTelegram: {dict(self.telegram.calls)}\nOdoo: {dict(self.odoo.calls)}")
+
+async def start_bench_app(args) -> BenchApp:
+    """
+    Запускает заменители Telegram/Odoo, настраивает окружение, импортирует приложение
+    и очищает базу shipbot_bench.
+    """
+    telegram = await FakeTelegramServer(args.telegram_latency_ms).start()
+    odoo = await FakeOdooServer(args.odoo_latency_ms).start()
+
+    # Окружение задается до импорта модулей приложения (config читает его при импорте)
+    os.environ.update({
+        "BOT_TOKEN": BENCH_TOKEN,
+        "ODOO_URL": odoo.jsonrpc_url,
+        "ODOO_LOGIN": "bench",
+        "ODOO_API_KEY": "bench",
+        "WEBHOOK_URL": odoo.webhook_url,
+        "MANAGER_CHAT_ID": "1",
+        "LOG_LEVEL": args.log_level,
+        "TRAFFIC_RECORD_DIR": "",
+    })
+    os.environ.setdefault("MONGO_DB_NAME", BENCH_DB_NAME)
+
+    use_backends(args.mongo, args.redis)
+    from aiogram.client.telegram import TelegramAPIServer
+    import api_server
+    from bot import build_dispatcher
+    from utils.bot_registry import get_bot
+
+    # Общий Bot процесса (как в bot.main): API и обработчики ходят в заменитель Telegram
+    bot = get_bot()
+    bot.session.api = TelegramAPIServer.from_base(telegram.base_url)
+    dp = build_dispatcher()
+
+    await reset_database()
+    if args.mongo == "uri":
+        from db.mongo import init_indexes
+        await init_indexes()
+    return BenchApp(telegram, odoo, api_server.app, bot, dp)
+
+def add_common_arguments(parser: argparse.ArgumentParser):
+    """Параметры заменителей, бэкендов и baseline (общие для load и replay)"""
+    parser.add_argument("--odoo-latency-ms", type=float, default=50)
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument("--mongo", choices=("uri", "mongomock"), default="uri")
+    parser.add_argument("--redis", choices=("url", "fakeredis"), default="url")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", action="store_true", help="отчет в JSON")
+    parser.add_argument("--baseline", help="JSON с baseline p95 по путям")
+    parser.add_argument("--update-baseline", action="store_true", help="записать текущие p95 в --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимый рост p95 (доля)")
+    parser.add_argument("--floor-ms", type=float, default=2.0, help="рост p95 меньше этого не считается регрессией")
+
+def finish_report(report: Dict[str, Dict[str, float]], bench: BenchApp, args, params: Dict[str, Any]) -> int:
+    """
+    Печатает отчет и сравнивает его с baseline (или сохраняет baseline).
+
+    Returns:
+        Код выхода: 1 при регрессии или отсутствующем baseline
+    """
+    if args.json:
+        print(json.dumps({"report": report, "telegram_calls": bench.telegram.calls, "odoo_calls": bench.odoo.calls},
+                         ensure_ascii=False, indent=2))
+    else:
+        print(format_report(report))
+        bench.print_calls()
+
+    if not args.baseline:
+        return 0
+    if args.update_baseline:
+        baseline = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "params": params,
+            "paths": {path: {"p95_ms": row["p95_ms"]} for path, row in report.items()},
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"Baseline сохранен: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"Baseline {args.baseline} не найден, запустите с --update-baseline")
+        return 1
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("params") != params:
+        print(f"⚠️ Параметры запуска отличаются от baseline: {baseline.get('params')}")
+    regressions = compare_with_baseline(report, baseline, args.tolerance, args.floor_ms)
+    for line in regressions:
+        print(f"❌ {line}")
+    return 1 if regressions else 0
+
+async def run(args) -> int:
+    bench = await start_bench_app(args)
+    chat_ids = [BASE_CHAT_ID + index for index in range(args.couriers)]
+    await seed(chat_ids)
+
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    queues = [asyncio.Queue() for _ in range(args.couriers)]
+    tasks = [order_producer(recorder, bench.app, args.couriers, args.orders_per_minute, deadline, queues)]
+    for index, chat_id in enumerate(chat_ids):
+        offset = args.location_interval * index / args.couriers
+        tasks.append(location_worker(recorder, bench.dp, bench.bot, bench.updates, chat_id,
+                                     args.location_interval, deadline, offset))
+        tasks.append(courier_flow_worker(recorder, bench.dp, bench.bot, bench.updates, chat_id,
+                                         queues[index], deadline, args.think_time))
+    await asyncio.gather(*tasks)
+    report = recorder.report(time.monotonic() - started)
+    await bench.close()
+
+    params = {key: getattr(args, key) for key in (
+        "couriers", "orders_per_minute", "duration", "location_interval",
+        "odoo_latency_ms", "telegram_latency_ms", "mongo", "redis"
+    )}
+    return finish_report(report, bench, args, params)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API и бота с локальными заменителями")
+    parser.add_argument("--couriers", type=int, default=20)
+    parser.add_argument("--orders-per-minute", type=float, default=120)
+    parser.add_argument("--duration", type=float, default=60, help="секунды")
+    parser.add_argument("--location-interval", type=float, default=5, help="секунды между точками курьера")
+    parser.add_argument("--think-time", type=float, default=0.2, help="пауза курьера между кнопками, секунды")
+    add_common_arguments(parser)
+    return asyncio.run(run(parser.parse_args(argv)))
+
+if __name__ == "__main__":
+    sys.exit(main())
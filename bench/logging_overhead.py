@@ -0,0 +1,148 @@
+"""
+Бенчмарк накладных расходов логирования на один запрос create_order.
+
+Сравнивает:
+    before - синхронные FileHandler + StreamHandler на DEBUG, f-строки,
+             прежний EmojiFormatter (цепочка поисков подстрок)
+    after  - logging_config.configure_logging: QueueHandler/QueueListener,
+             уровень INFO, %-форматирование
+
+Время измеряется в вызывающем потоке (то, что платит event loop).
+
+Запуск:
+    python -m bench.logging_overhead [--requests 2000]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging_config  # noqa: E402
+
+logger = logging.getLogger("api_server")
+
+class LegacyEmojiFormatter(logging.Formatter):
+    """Копия прежнего EmojiFormatter.format (для сравнения)"""
+
+    def format(self, record):
+        level_emoji = logging_config.EmojiFormatter.LEVEL_EMOJIS.get(record.levelname, '')
+        emojis = logging_config.EmojiFormatter.MODULE_EMOJIS
+        context_emoji = ''
+        message = record.getMessage()
+        module_name = record.name.split('.')[-1]
+        for context in emojis:
+            if f'[{context}]' in message or (context not in ('API', 'ORDERS') and context.lower() in module_name.lower()):
+                context_emoji = emojis[context]
+                break
+        emoji_prefix = f"{level_emoji} {context_emoji}".strip()
+        if emoji_prefix:
+            emoji_prefix += " "
+        record.msg = f"{emoji_prefix}{record.msg}"
+        return super().format(record)
+
+def configure_legacy(log_path: str, stream):
+    logging_config.stop_logging()
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.setLevel(logging.DEBUG)
+    file_handler = logging.FileHandler(log_path, mode='a', encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(
+        '%(asctime)s [%(levelname)s] [%(filename)s:%(lineno)d] %(funcName)s: %(message)s'
+    ))
+    console_handler = logging.StreamHandler(stream)
+    console_handler.setFormatter(LegacyEmojiFormatter(
+        '%(asctime)s │ %(levelname)-8s │ %(filename)s:%(lineno)d │ %(funcName)s │ %(message)s'
+    ))
+    library_filter = logging_config.LibraryLogFilter()
+    for handler in (file_handler, console_handler):
+        handler.addFilter(library_filter)
+        root.addHandler(handler)
+    return [file_handler, console_handler]
+
+class _Payload:
+    external_id = "123456"
+    courier_tg_chat_id = 987654321
+    payment_status = "NOT_PAID"
+    priority = 1
+    address = "Av. Corrientes 1234, Piso 5, Departamento B, Buenos Aires, Argentina"
+
+_COURIER = {"_id": "65f0c0ffee", "name": "Courier", "tg_chat_id": 987654321}
+
+def request_fstrings(payload=_Payload, courier=_COURIER):
+    """Логи create_order до изменений (f-строки)"""
+    logger.info(f"[API] 📥 Входящий запрос на создание заказа: external_id={payload.external_id}, courier_tg_chat_id={payload.courier_tg_chat_id} (type: {type(payload.courier_tg_chat_id).__name__})")
+    logger.debug(f"[API] 📋 Данные заказа: payment_status={payload.payment_status}, priority={payload.priority}, address={payload.address[:50]}...")
+    logger.debug("[API] 🔌 Подключение к БД и Redis установлено")
+    logger.debug(f"[API] 🔍 Поиск курьера по tg_chat_id={payload.courier_tg_chat_id}")
+    logger.info(f"[API] ✅ Курьер найден: _id={courier.get('_id')}, name={courier.get('name')}, tg_chat_id={courier.get('tg_chat_id')}")
+    logger.debug(f"[API] 🔍 Проверка уникальности external_id={payload.external_id}")
+    logger.debug("[API] ✅ external_id уникален")
+    logger.debug("[API] 💾 Сохранение заказа в БД...")
+    logger.info(f"[API] ✅ Заказ успешно создан: _id={courier['_id']}, external_id={payload.external_id}, courier_tg_chat_id={courier['tg_chat_id']}")
+    logger.debug(f"[API] 🔍 Проверка статуса смены курьера: tg_chat_id={courier['tg_chat_id']}")
+    logger.debug(f"[API] 📊 Статус смены: Redis={True}, MongoDB={True}, tg_chat_id={courier['tg_chat_id']}")
+    logger.info("[API] 🚚 Курьер на смене, отправка уведомления в Telegram...")
+    logger.debug(f"[API] 📤 Отправка Telegram сообщения курьеру {courier['tg_chat_id']} для заказа {payload.external_id}")
+    logger.info(f"[API] ✅ Telegram сообщение успешно отправлено курьеру {courier['tg_chat_id']}")
+    logger.info(f"[API] ✅ Создание заказа завершено: external_id={payload.external_id}, order_id={courier['_id']}")
+
+def request_lazy(payload=_Payload, courier=_COURIER):
+    """Логи create_order после изменений (%-форматирование)"""
+    logger.info("[API] 📥 Входящий запрос на создание заказа: external_id=%s, courier_tg_chat_id=%s (type: %s)", payload.external_id, payload.courier_tg_chat_id, type(payload.courier_tg_chat_id).__name__)
+    logger.debug("[API] 📋 Данные заказа: payment_status=%s, priority=%s, address=%s...", payload.payment_status, payload.priority, payload.address[:50])
+    logger.debug("[API] 🔌 Подключение к БД и Redis установлено")
+    logger.debug("[API] 🔍 Поиск курьера по tg_chat_id=%s", payload.courier_tg_chat_id)
+    logger.info("[API] ✅ Курьер найден: _id=%s, name=%s, tg_chat_id=%s", courier.get('_id'), courier.get('name'), courier.get('tg_chat_id'))
+    logger.debug("[API] 🔍 Проверка уникальности external_id=%s", payload.external_id)
+    logger.debug("[API] ✅ external_id уникален")
+    logger.debug("[API] 💾 Сохранение заказа в БД...")
+    logger.info("[API] ✅ Заказ успешно создан: _id=%s, external_id=%s, courier_tg_chat_id=%s", courier['_id'], payload.external_id, courier['tg_chat_id'])
+    logger.debug("[API] 🔍 Проверка статуса смены курьера: tg_chat_id=%s", courier['tg_chat_id'])
+    logger.debug("[API] 📊 Статус смены: Redis=%s, MongoDB=%s, tg_chat_id=%s", True, True, courier['tg_chat_id'])
+    logger.info("[API] 🚚 Курьер на смене, отправка уведомления в Telegram...")
+    logger.debug("[API] 📤 Отправка Telegram сообщения курьеру %s для заказа %s", courier['tg_chat_id'], payload.external_id)
+    logger.info("[API] ✅ Telegram сообщение успешно отправлено курьеру %s", courier['tg_chat_id'])
+    logger.info("[API] ✅ Создание заказа завершено: external_id=%s, order_id=%s", payload.external_id, courier['_id'])
+
+def measure(func, requests: int) -> float:
+    """Среднее время одного запроса в микросекундах"""
+    for _ in range(min(100, requests)):
+        func()
+    started = time.perf_counter()
+    for _ in range(requests):
+        func()
+    return (time.perf_counter() - started) / requests * 1e6
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Накладные расходы логирования на запрос create_order")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w", encoding="utf-8") as devnull:
+        handlers = configure_legacy(os.path.join(tmp, "before.log"), devnull)
+        results["before (sync, DEBUG, f-strings)"] = measure(request_fstrings, args.requests)
+        for handler in handlers:
+            handler.close()
+
+        logging_config.configure_logging(os.path.join(tmp, "after.log"), devnull, level_name="INFO")
+        results["after (queue, INFO, %-style)"] = measure(request_lazy, args.requests)
+        drain_started = time.perf_counter()
+        logging_config.stop_logging()
+        drain_ms = (time.perf_counter() - drain_started) * 1000
+
+        logging_config.configure_logging(os.path.join(tmp, "after_debug.log"), devnull, level_name="DEBUG")
+        results["after (queue, DEBUG, %-style)"] = measure(request_lazy, args.requests)
+        logging_config.stop_logging()
+
+    for name, value in results.items():
+        print(f"{name:34} {value:8.1f} µs/запрос")
+    print(f"{'drain QueueListener (INFO run)':34} {drain_ms:8.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
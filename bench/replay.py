@@ -0,0 +1,193 @@
+"""
+Воспроизведение записанного трафика (utils/traffic_recorder.py, TRAFFIC_RECORD_DIR)
+против настоящих api_server.app и Dispatcher с локальными заменителями - так же,
+как bench/load.py, но с реальным распределением запросов вместо синтетического.
+
+Записи воспроизводятся с исходными интервалами (--speed 2 - вдвое быстрее,
+--speed 0 - последовательно без пауз). Перед запуском база shipbot_bench
+заполняется курьерами (chat ID из обновлений и тел запросов) и супер-админами
+(X-Admin-User-ID из записанных запросов), ID уже обезличены при записи.
+
+Отчет: p50/p95/p99 по путям (bot:location, bot:callback:order:go, bot:message:/start,
+api:POST /api/orders, ...) и отставание от расписания. --baseline как в bench/load.py.
+
+Запуск:
+    python -m bench.replay logs/traffic/traffic-*.ndjson.gz --mongo mongomock --redis fakeredis
+    python -m bench.replay logs/traffic/*.ndjson.gz --speed 5 --kinds update
+    python -m bench.replay recorded.ndjson.gz --baseline bench/replay-baseline.json --update-baseline
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.load import BenchApp, Recorder, add_common_arguments, finish_report, seed, start_bench_app  # noqa: E402
+from bench.stand_ins import asgi_request  # noqa: E402
+
+def read_entries(paths: Iterable[str], kinds: Optional[Set[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Читает записи из файлов .ndjson.gz (или .ndjson), отсортированные по времени.
+    Оборванный хвост файла (процесс остановлен во время записи) пропускается.
+    """
+    entries = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if kinds is None or entry.get("kind") in kinds:
+                        entries.append(entry)
+        except EOFError:
+            print(f"⚠️ {path}: файл оборван, прочитано до последней полной записи")
+    entries.sort(key=lambda entry: entry["t"])
+    return entries
+
+def _update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    for key in ("message", "edited_message", "callback_query"):
+        event = update.get(key)
+        if event:
+            user = event.get("from") or event.get("chat") or {}
+            return user.get("id")
+    return None
+
+def collect_ids(entries: List[Dict[str, Any]]) -> Tuple[List[int], List[int]]:
+    """
+    Returns:
+        (chat ID курьеров, ID супер-админов) в порядке появления
+    """
+    couriers: Dict[int, None] = {}
+    admins: Dict[int, None] = {}
+    for entry in entries:
+        if entry["kind"] == "update":
+            chat_id = _update_chat_id(entry["update"])
+            if isinstance(chat_id, int):
+                couriers[chat_id] = None
+        elif entry["kind"] == "http":
+            body = entry.get("body")
+            if isinstance(body, dict) and str(body.get("courier_tg_chat_id") or "").isdigit():
+                couriers[int(body["courier_tg_chat_id"])] = None
+            if entry.get("admin_id"):
+                admins[int(entry["admin_id"])] = None
+    return list(couriers), list(admins)
+
+def entry_path(entry: Dict[str, Any]) -> str:
+    """Путь в отчете для записи"""
+    if entry["kind"] == "http":
+        return f"api:{entry['method']} {entry.get('route') or entry['path']}"
+    update = entry["update"]
+    callback = update.get("callback_query")
+    if callback:
+        prefix = ":".join(str(callback.get("data") or "").split(":")[:2])
+        return f"bot:callback:{prefix}"
+    message = update.get("message") or update.get("edited_message") or {}
+    if "location" in message:
+        return "bot:location"
+    text = message.get("text") or ""
+    if text.startswith("/"):
+        return f"bot:message:{text.split()[0]}"
+    return "bot:message"
+
+async def replay_entry(recorder: Recorder, bench: BenchApp, entry: Dict[str, Any]):
+    path = entry_path(entry)
+    if entry["kind"] == "update":
+        from aiogram.types import Update
+        try:
+            update = Update.model_validate(entry["update"], context={"bot": bench.bot})
+        except ValueError:
+            recorder.error(path)
+            return
+        await recorder.measure(path, bench.dp.feed_update(bench.bot, update))
+        return
+
+    url = entry["path"] + (f"?{entry['query']}" if entry.get("query") else "")
+    headers = {"X-Admin-User-ID": str(entry["admin_id"])} if entry.get("admin_id") else None
+    result = await recorder.measure(path, asgi_request(bench.app, entry["method"], url, entry.get("body"), headers))
+    status = result[0] if result else 599
+    # Ошибкой считается только расхождение с записанным ответом (404/400 могли быть и в проде)
+    if status >= 500 or (entry.get("status") and entry["status"] < 400 <= status):
+        recorder.error(path)
+
+async def replay(recorder: Recorder, bench: BenchApp, entries: List[Dict[str, Any]], speed: float) -> List[float]:
+    """
+    Воспроизводит записи по исходному расписанию.
+
+    Returns:
+        Отставания запуска от расписания в секундах
+    """
+    if speed <= 0:
+        for entry in entries:
+            await replay_entry(recorder, bench, entry)
+        return []
+
+    lags = []
+    tasks = []
+    t0 = entries[0]["t"]
+    started = time.monotonic()
+    for entry in entries:
+        scheduled = started + (entry["t"] - t0) / speed
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lags.append(max(time.monotonic() - scheduled, 0))
+        tasks.append(asyncio.create_task(replay_entry(recorder, bench, entry)))
+    await asyncio.gather(*tasks)
+    return lags
+
+async def run(args) -> int:
+    kinds = set(args.kinds.split(",")) if args.kinds else None
+    entries = read_entries(args.files, kinds)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        print("Нет записей для воспроизведения")
+        return 1
+    couriers, admins = collect_ids(entries)
+    span = entries[-1]["t"] - entries[0]["t"]
+    print(f"Записей: {len(entries)} за {span:.0f} с, курьеров: {len(couriers)}, админов: {len(admins)}")
+
+    bench = await start_bench_app(args)
+    await seed(couriers, admins)
+
+    recorder = Recorder()
+    started = time.monotonic()
+    lags = await replay(recorder, bench, entries, args.speed)
+    report = recorder.report(time.monotonic() - started)
+    await bench.close()
+
+    if lags and not args.json:
+        import numpy as np
+        p50, p99 = np.percentile(np.array(lags) * 1000, [50, 99])
+        print(f"Отставание от расписания: p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+    params = {
+        "files": sorted(os.path.basename(path) for path in args.files),
+        "entries": len(entries),
+        "speed": args.speed,
+        "odoo_latency_ms": args.odoo_latency_ms,
+        "telegram_latency_ms": args.telegram_latency_ms,
+        "mongo": args.mongo,
+        "redis": args.redis,
+    }
+    return finish_report(report, bench, args, params)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Воспроизведение записанного трафика с локальными заменителями")
+    parser.add_argument("files", nargs="+", help="файлы traffic-*.ndjson.gz")
+    parser.add_argument("--speed", type=float, default=1, help="множитель скорости, 0 - без пауз")
+    parser.add_argument("--kinds", help="update,http (по умолчанию все)")
+    parser.add_argument("--limit", type=int, default=0, help="воспроизвести только первые N записей")
+    add_common_arguments(parser)
+    return asyncio.run(run(parser.parse_args(argv)))
+
+if __name__ == "__main__":
+    sys.exit(main())
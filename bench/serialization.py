@@ -0,0 +1,147 @@
+"""
+Бенчмарк сериализации списка заказов (GET /api/admin/couriers/{chat_id}/orders/*).
+
+Сравнивает на одинаковом наборе документов MongoDB (ObjectId, datetime с таймзоной):
+    before - копия dict(order) с ручным str(ObjectId), валидация ActiveOrdersResponse
+             через response_model и stdlib json в JSONResponse
+    after  - документы как есть в ORJSONResponse (utils.fast_json), без валидации
+
+Для ответа after печатается размер и время сжатия gzip/brotli (utils.compression).
+Запросы выполняются через ASGI в том же процессе: время включает маршрутизацию FastAPI.
+
+Запуск:
+    python -m bench.serialization [--orders 1000] [--requests 200]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from bench.stand_ins import asgi_request  # noqa: E402
+from db.models import ActiveOrdersResponse, PaginationInfo, utcnow  # noqa: E402
+from utils import compression  # noqa: E402
+from utils.fast_json import ORJSONResponse  # noqa: E402
+
+def make_orders(count: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """Документы заказов в форме couriers_deliveries (как их возвращает Motor)"""
+    rng = random.Random(seed)
+    now = utcnow()
+    orders = []
+    for index in range(count):
+        created_at = now - timedelta(minutes=rng.randint(0, 24 * 60))
+        orders.append({
+            "_id": ObjectId(),
+            "external_id": str(900_000_000 + index),
+            "courier_tg_chat_id": 700_000_000,
+            "assigned_to": ObjectId(),
+            "status": rng.choice(["waiting", "in_transit", "done"]),
+            "payment_status": rng.choice(["NOT_PAID", "PAID"]),
+            "is_cash_payment": rng.random() < 0.3,
+            "delivery_time": "14:00-16:00",
+            "priority": rng.randint(0, 3),
+            "brand": "icambio",
+            "source": "odoo",
+            "created_at": created_at,
+            "updated_at": created_at + timedelta(minutes=rng.randint(0, 90)),
+            "status_history": {"waiting": created_at, "not_paid": created_at},
+            "client": {
+                "name": f"Cliente {index}",
+                "phone": f"+54 9 11 {rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+                "chat_id": None,
+                "tg": None,
+                "contact_url": None,
+            },
+            "address": f"Av. Corrientes {rng.randint(100, 9999)}, Piso {rng.randint(1, 20)}, Buenos Aires",
+            "map_url": "https://maps.google.com/?q=-34.6037,-58.3816",
+            "lat": -34.6 + rng.random() / 10,
+            "lon": -58.4 + rng.random() / 10,
+            "notes": "Tocar timbre" if rng.random() < 0.5 else None,
+            "photos": [],
+            "pay_photo": [],
+            "courier_message_ids": [rng.randint(1, 10 ** 6) for _ in range(2)],
+        })
+    return orders
+
+def build_app(orders: List[Dict[str, Any]]) -> FastAPI:
+    app = FastAPI()
+    pagination = {"page": 0, "per_page": len(orders), "total": len(orders), "total_pages": 1}
+
+    @app.get("/before", response_model=ActiveOrdersResponse)
+    async def before():
+        # Прежняя реализация эндпоинтов списков заказов
+        orders_json = []
+        for order in orders:
+            order_dict = dict(order)
+            if "_id" in order_dict:
+                order_dict["_id"] = str(order_dict["_id"])
+            if "assigned_to" in order_dict and order_dict["assigned_to"]:
+                order_dict["assigned_to"] = str(order_dict["assigned_to"])
+            orders_json.append(order_dict)
+        return ActiveOrdersResponse(orders=orders_json, pagination=PaginationInfo(**pagination))
+
+    @app.get("/after", response_model=ActiveOrdersResponse)
+    async def after():
+        return ORJSONResponse({"ok": True, "orders": orders, "pagination": pagination})
+
+    return app
+
+async def measure(app: FastAPI, path: str, requests: int) -> Dict[str, float]:
+    """Среднее время запроса (ms) и размер тела"""
+    status, body = await asgi_request(app, "GET", path)
+    if status != 200:
+        raise SystemExit(f"{path}: HTTP {status} {body[:200]!r}")
+    for _ in range(min(10, requests)):
+        await asgi_request(app, "GET", path)
+    started = time.perf_counter()
+    for _ in range(requests):
+        await asgi_request(app, "GET", path)
+    return {"ms": (time.perf_counter() - started) / requests * 1000, "bytes": len(body), "body": body}
+
+def measure_compression(body: bytes, encoding: str, repeats: int = 20) -> Dict[str, float]:
+    compressed = compression.compress_body(body, encoding)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        compression.compress_body(body, encoding)
+    return {"ms": (time.perf_counter() - started) / repeats * 1000, "bytes": len(compressed)}
+
+async def run(args) -> int:
+    app = build_app(make_orders(args.orders))
+    results = {
+        "before (dict copy + pydantic + json)": await measure(app, "/before", args.requests),
+        "after (ORJSONResponse)": await measure(app, "/after", args.requests),
+    }
+    print(f"Заказов в ответе: {args.orders}, запросов: {args.requests}\n")
+    for name, result in results.items():
+        print(f"{name:40} {result['ms']:8.2f} ms/запрос  {result['bytes'] / 1024:8.1f} KiB")
+    before, after = results.values()
+    print(f"{'ускорение':40} {before['ms'] / after['ms']:8.1f}x")
+
+    print()
+    encodings = ["gzip"] + (["br"] if compression.brotli is not None else [])
+    for encoding in encodings:
+        result = measure_compression(after["body"], encoding)
+        print(
+            f"{'after + ' + encoding:40} {result['ms']:8.2f} ms сжатие    {result['bytes'] / 1024:8.1f} KiB "
+            f"({result['bytes'] / after['bytes']:.0%})"
+        )
+    if compression.brotli is None:
+        print("brotli не установлен (pip install brotli): сравнение только с gzip")
+    return 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Сериализация и сжатие списков заказов")
+    parser.add_argument("--orders", type=int, default=1000, help="заказов в одном ответе")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
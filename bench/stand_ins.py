@@ -0,0 +1,200 @@
+"""
+Локальные заменители внешних сервисов для нагрузочных тестов.
+
+    FakeTelegramServer - Bot API (/bot<token>/<method>): отвечает правдоподобными
+                         объектами Message/True, считает вызовы по методам
+    FakeOdooServer     - Odoo JSON-RPC (/jsonrpc) и прием webhook (/shipbot-to-odoo)
+
+Задержка ответа настраивается (latency_ms), чтобы моделировать медленные внешние API.
+Бэкенды MongoDB/Redis выбираются в use_backends: реальный сервер по URI
+или mongomock-motor / fakeredis (bench/requirements.txt), если установлены.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+from aiohttp import web
+
+# Методы Bot API, которые возвращают Message
+_MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendLocation", "sendDocument",
+    "editMessageText", "editMessageReplyMarkup", "editMessageCaption",
+}
+
+class _FakeServer:
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self.calls: Counter = Counter()
+        self._runner: Optional[web.AppRunner] = None
+        self.port: Optional[int] = None
+
+    def _app(self) -> web.Application:
+        raise NotImplementedError
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    async def start(self):
+        self._runner = web.AppRunner(self._app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+class FakeTelegramServer(_FakeServer):
+    """Bot API: /bot<token>/<method>"""
+
+    def __init__(self, latency_ms: float = 0):
+        super().__init__(latency_ms)
+        self._message_ids = itertools.count(1000)
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        return app
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params: Dict[str, Any] = await request.json()
+        else:
+            params = dict(await request.post())
+        await self._delay()
+
+        if method == "getMe":
+            result: Any = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method in _MESSAGE_METHODS:
+            chat_id = int(params.get("chat_id") or 0)
+            result = {
+                "message_id": int(params.get("message_id") or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": str(params.get("text") or ""),
+            }
+        else:
+            # answerCallbackQuery, deleteMessage(s), sendChatAction, ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+class FakeOdooServer(_FakeServer):
+    """Odoo JSON-RPC (/jsonrpc) и прием исходящих webhook (/shipbot-to-odoo)"""
+
+    def _app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/jsonrpc", self._handle_rpc)
+        app.router.add_post("/shipbot-to-odoo", self._handle_webhook)
+        return app
+
+    @property
+    def jsonrpc_url(self) -> str:
+        return f"{self.base_url}/jsonrpc"
+
+    @property
+    def webhook_url(self) -> str:
+        return f"{self.base_url}/shipbot-to-odoo"
+
+    async def _handle_rpc(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        params = payload.get("params", {})
+        await self._delay()
+
+        if params.get("service") == "common":
+            self.calls["authenticate"] += 1
+            return web.json_response({"jsonrpc": "2.0", "id": payload.get("id"), "result": 2})
+
+        args = params.get("args", [])
+        model, method_name, method_args = args[3], args[4], args[5]
+        self.calls[f"{model}.{method_name}"] += 1
+        if method_name == "read":
+            result: Any = [{"id": record_id, "payment_status": "paid"} for record_id in method_args[0]]
+        elif method_name == "search_read":
+            result = []
+        elif method_name in ("create", "message_post"):
+            result = 1
+        else:
+            result = True
+        return web.json_response({"jsonrpc": "2.0", "id": payload.get("id"), "result": result})
+
+    async def _handle_webhook(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        self.calls[f"webhook.{data.get('event_type')}"] += 1
+        await self._delay()
+        return web.json_response({"ok": True})
+
+def use_backends(mongo: str, redis: str):
+    """
+    Подменяет клиентов db.mongo / db.redis_client на mongomock-motor / fakeredis.
+
+    Args:
+        mongo: "uri" (MONGO_URI из окружения) или "mongomock"
+        redis: "url" (REDIS_URL из окружения) или "fakeredis"
+    """
+    if mongo == "mongomock":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("mongomock-motor не установлен: pip install -r bench/requirements.txt")
+        import db.mongo
+        db.mongo._client = AsyncMongoMockClient(tz_aware=True)
+
+    if redis == "fakeredis":
+        try:
+            from fakeredis import FakeAsyncRedis
+        except ImportError:
+            raise SystemExit("fakeredis не установлен: pip install -r bench/requirements.txt")
+        import db.redis_client
+        db.redis_client._redis = FakeAsyncRedis(decode_responses=True)
+
+async def asgi_request(app, method: str, path: str, body: Any = None,
+                       headers: Optional[Dict[str, str]] = None) -> tuple:
+    """
+    Выполняет HTTP запрос к ASGI приложению в том же процессе (без сети).
+
+    Returns:
+        (status, тело ответа в bytes)
+    """
+    raw_body = json.dumps(body).encode() if body is not None else b""
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(raw_body)).encode())]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode(), value.encode()))
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "", "headers": raw_headers,
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 80),
+    }
+    sent = False
+    messages = []
+    response_complete = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": raw_body, "more_body": False}
+        # Клиент "отключается" только после полного ответа
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            response_complete.set()
+
+    await app(scope, receive, send)
+    status = next((m["status"] for m in messages if m["type"] == "http.response.start"), 500)
+    return status, b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
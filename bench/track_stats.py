@@ -0,0 +1,149 @@
+"""
+Бенчмарк аналитики трека смены (utils/track_stats.py) на длинных сменах.
+
+Синтетическая смена: поездки со скоростью 15-45 км/ч, стоянки по 2-20 минут
+с дрожанием GPS ~3 м, редкие скачки GPS и разрывы трансляции.
+Сравнивает:
+    python - построчный цикл по точкам (math, тот же алгоритм)
+    numpy  - compute_track_stats
+и проверяет совпадение результатов.
+
+Запуск:
+    python -m bench.track_stats [--points 1000 10000 100000] [--interval 10] [--repeat 5]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+from config import (  # noqa: E402
+    TRACK_MOVING_SPEED_KMH, TRACK_JITTER_METERS, TRACK_MAX_SPEED_KMH, TRACK_GAP_SECONDS, TRACK_STOP_MIN_SECONDS
+)
+from utils.geodesy import EARTH_RADIUS_KM  # noqa: E402
+from utils.track_stats import compute_track_stats  # noqa: E402
+
+def make_shift(points: int, interval: float, seed: int = 42) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Точки смены (lats, lons, timestamps_ns), старт в центре Буэнос-Айреса"""
+    rng = random.Random(seed)
+    lat, lon = -34.6037, -58.3816
+    timestamp = 1_705_312_200.0
+    lats, lons, timestamps = [], [], []
+    while len(lats) < points:
+        if rng.random() < 0.5:
+            # Поездка
+            speed_kmh = rng.uniform(15, 45)
+            heading = rng.uniform(0, 2 * math.pi)
+            for _ in range(rng.randint(20, 120)):
+                step_km = speed_kmh * interval / 3600
+                heading += rng.gauss(0, 0.2)
+                lat += step_km / 111.32 * math.cos(heading)
+                lon += step_km / (111.32 * math.cos(math.radians(lat))) * math.sin(heading)
+                timestamp += interval
+                lats.append(lat)
+                lons.append(lon)
+                timestamps.append(timestamp)
+        else:
+            # Стоянка с дрожанием ~3 м
+            for _ in range(int(rng.uniform(120, 1200) / interval)):
+                timestamp += interval
+                lats.append(lat + rng.gauss(0, 0.00003))
+                lons.append(lon + rng.gauss(0, 0.00003))
+                timestamps.append(timestamp)
+        if rng.random() < 0.05:
+            # Скачок GPS
+            timestamp += interval
+            lats.append(lat + 0.05)
+            lons.append(lon)
+            timestamps.append(timestamp)
+        if rng.random() < 0.02:
+            # Разрыв трансляции
+            timestamp += TRACK_GAP_SECONDS * 2
+    return (
+        np.array(lats[:points]),
+        np.array(lons[:points]),
+        (np.array(timestamps[:points]) * 1e9).astype(np.int64),
+    )
+
+def python_stats(lats: List[float], lons: List[float], timestamps_ns: List[int]) -> Dict[str, Any]:
+    """Тот же расчет циклом по точкам (как было бы без numpy)"""
+    distance_km = moving = stationary = gap = max_speed = 0.0
+    stops = []
+    run_seconds, run_start = 0.0, None
+    for i in range(1, len(lats)):
+        lat1, lat2 = math.radians(lats[i - 1]), math.radians(lats[i])
+        dlat = lat2 - lat1
+        dlon = math.radians(lons[i] - lons[i - 1])
+        a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+        km = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+        seconds = (timestamps_ns[i] - timestamps_ns[i - 1]) / 1e9
+        speed = km / seconds * 3600 if seconds > 0 else math.inf
+        is_stationary = False
+        if seconds > TRACK_GAP_SECONDS:
+            gap += seconds
+        elif speed <= TRACK_MAX_SPEED_KMH:
+            if speed >= TRACK_MOVING_SPEED_KMH and km * 1000 >= TRACK_JITTER_METERS:
+                distance_km += km
+                moving += seconds
+                max_speed = max(max_speed, speed)
+            else:
+                stationary += seconds
+                is_stationary = True
+        if is_stationary:
+            if run_start is None:
+                run_start, run_seconds = i - 1, 0.0
+            run_seconds += seconds
+        elif run_start is not None:
+            if run_seconds >= TRACK_STOP_MIN_SECONDS:
+                stops.append((run_start, i - 1, run_seconds))
+            run_start = None
+    if run_start is not None and run_seconds >= TRACK_STOP_MIN_SECONDS:
+        stops.append((run_start, len(lats) - 1, run_seconds))
+    return {
+        "distance_km": round(distance_km, 2),
+        "moving_seconds": int(moving),
+        "stationary_seconds": int(stationary),
+        "gap_seconds": int(gap),
+        "max_speed_kmh": round(max_speed, 1),
+        "stops_count": len(stops),
+    }
+
+def timed(function, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1000
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Аналитика трека смены: python против numpy")
+    parser.add_argument("--points", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--interval", type=float, default=10, help="секунд между точками")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'точек':>8} {'часов':>6} {'python, ms':>11} {'numpy, ms':>10} {'ускорение':>10}  км / стоянок")
+    for points in args.points:
+        lats, lons, timestamps = make_shift(points, args.interval)
+        lists = (lats.tolist(), lons.tolist(), timestamps.tolist())
+        vectorized = compute_track_stats(lats, lons, timestamps)
+        reference = python_stats(*lists)
+        mismatch = [key for key, value in reference.items() if value != vectorized[key]]
+        if mismatch:
+            print(f"Результаты расходятся ({points} точек): {mismatch}\n  python: {reference}\n  numpy:  {vectorized}")
+            return 1
+        python_ms = timed(lambda: python_stats(*lists), args.repeat)
+        numpy_ms = timed(lambda: compute_track_stats(lats, lons, timestamps), args.repeat)
+        hours = (timestamps[-1] - timestamps[0]) / 1e9 / 3600
+        print(
+            f"{points:>8} {hours:>6.1f} {python_ms:>11.2f} {numpy_ms:>10.2f} {python_ms / numpy_ms:>9.1f}x  "
+            f"{vectorized['distance_km']} / {vectorized['stops_count']}"
+        )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
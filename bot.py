@@ -1,19 +1,35 @@
+# Первым: отсчет времени запуска (utils/startup_timing.py)
+from utils import startup_timing
 import asyncio
+import importlib
 import logging
 import signal
 import sys
-from aiogram import Bot, Dispatcher
+from aiogram import Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from handlers import start, shift, orders, photo, errors, admin, location, report
 from utils.logger import setup_logging
-from db.mongo import init_indexes
-from config import BOT_TOKEN, API_HOST, API_PORT
+from db.mongo import init_indexes, migrate_timestamp_fields, reconcile_counters_on_startup, migrate_order_messages
+from config import API_HOST, API_PORT, SHIPBOT_ROLE, API_WORKERS, OUTBOX_ENABLED
 import uvicorn
-from api_server import app
 from utils.scheduler import run_scheduler
+from utils.outbox import run_outbox_worker
+from utils.metrics import instrument_router
+from utils.query_trace import trace_router
+from utils.traffic_recorder import get_recorder, UpdateRecorderMiddleware
+from utils.loop_monitor import start_loop_monitor
+from utils.bot_registry import get_bot, close_bot
+from db.audit import close_audit_sink
+from utils.admin_acl import get_admin_acl
+
+startup_timing.mark("imports", log=False)
+
+ROLES = ("api", "bot", "scheduler", "worker", "all")
 
 async def run_api_server():
     """Запускает FastAPI сервер"""
+    # Импорт только в ролях с API: модуль создает приложение и middleware
+    from api_server import app
     config = uvicorn.Config(
         app,
         host=API_HOST,
@@ -24,13 +40,12 @@ async def run_api_server():
     server = uvicorn.Server(config)
     await server.serve()
 
-async def run_bot():
-    """Запускает Telegram бота"""
-    import logging
-    logger = logging.getLogger(__name__)
-    logger.info("[BOT] Initializing bot...")
-    
-    bot = Bot(BOT_TOKEN)
+def build_dispatcher() -> Dispatcher:
+    """
+    Создает Dispatcher со всеми роутерами и middleware метрик.
+    Используется при запуске бота и в нагрузочных тестах (bench/).
+    Роутеры модулей handlers подключаются к одному Dispatcher, поэтому вызывается один раз на процесс.
+    """
     storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
     dp.include_router(admin.router)
@@ -42,18 +57,38 @@ async def run_bot():
     dp.include_router(photo.router)
     dp.include_router(errors.router)
 
+    # Метрики длительности обработчиков и трассировка запросов MongoDB по роутерам
+    for name, module in (("admin", admin), ("start", start), ("shift", shift), ("location", location),
+                         ("report", report), ("orders", orders), ("photo", photo)):
+        instrument_router(module.router, name)
+        trace_router(module.router, name)
+
+    # Запись обновлений для воспроизведения нагрузки (TRAFFIC_RECORD_DIR)
+    recorder = get_recorder()
+    if recorder is not None:
+        dp.update.outer_middleware(UpdateRecorderMiddleware(recorder))
+    return dp
+
+async def run_bot():
+    """Запускает Telegram бота"""
+    import logging
+    logger = logging.getLogger(__name__)
+    logger.info("[BOT] Initializing bot...")
+    
+    bot = get_bot()
+    dp = build_dispatcher()
+    dp.startup.register(lambda: startup_timing.mark("polling"))
+
     try:
         logger.info("[BOT] Starting polling...")
         # Добавляем edited_message в allowed_updates для обработки лайв-локации
-        await dp.start_polling(bot, allowed_updates=["message", "edited_message", "callback_query"])
+        # Сессия общая с API и планировщиком, ее закрывает main
+        await dp.start_polling(bot, allowed_updates=["message", "edited_message", "callback_query"], close_bot_session=False)
     finally:
-        await bot.session.close()
         logger.info("[BOT] Bot stopped")
 
 # Глобальные переменные для управления задачами
-_scheduler_task = None
-_bot_task = None
-_api_task = None
+_tasks = {}
 _shutdown_flag = False
 
 def signal_handler(signum, frame):
@@ -63,12 +98,99 @@ def signal_handler(signum, frame):
     logger.info(f"[BOT] Получен сигнал {signum}, инициируем остановку...")
     _shutdown_flag = True
 
-async def main():
-    global _scheduler_task, _bot_task, _api_task, _shutdown_flag
+def _log_index_sync_result(task: asyncio.Task):
+    """Логирует результат фоновой синхронизации индексов"""
+    logger = logging.getLogger(__name__)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error:
+        logger.error(f"[BOT] ❌ Ошибка синхронизации индексов: {error}", exc_info=error)
+    else:
+        logger.info(f"[BOT] ✅ Индексы синхронизированы: {task.result() or 'без изменений'}")
+
+def _log_migration_result(task: asyncio.Task):
+    """Логирует результат фоновой миграции полей времени"""
+    logger = logging.getLogger(__name__)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error:
+        logger.error(f"[BOT] ❌ Ошибка миграции полей времени: {error}", exc_info=error)
+    elif task.result():
+        logger.info(f"[BOT] ✅ Поля времени сконвертированы в BSON date: {task.result()}")
+
+def _log_counters_result(task: asyncio.Task):
+    """Логирует результат сверки счетчиков заказов при запуске"""
+    logger = logging.getLogger(__name__)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error:
+        logger.error(f"[BOT] ❌ Ошибка сверки счетчиков заказов: {error}", exc_info=error)
+    else:
+        logger.info(f"[BOT] ✅ Счетчики заказов сверены, исправлено документов: {task.result()}")
+
+def _log_order_messages_result(task: asyncio.Task):
+    """Логирует результат переноса сообщений о заказах в реестр при запуске"""
+    logger = logging.getLogger(__name__)
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error:
+        logger.error(f"[BOT] ❌ Ошибка переноса сообщений о заказах в реестр: {error}", exc_info=error)
+    else:
+        logger.info(f"[BOT] ✅ Сообщения о заказах перенесены в реестр: {task.result()}")
+
+def role_services(role: str) -> dict:
+    """
+    Сервисы процесса для роли.
+
+    Args:
+        role: api | bot | scheduler | worker | all
+
+    Returns:
+        Словарь имя -> корутина-функция запуска
+    """
+    services = {}
+    if role in ("bot", "all"):
+        services["bot"] = run_bot
+    if role in ("api", "all"):
+        services["api"] = run_api_server
+    if role in ("scheduler", "all"):
+        services["scheduler"] = run_scheduler
+    # В роли all воркер очереди нужен, только если вызовы ставятся в очередь
+    if role == "worker" or (role == "all" and OUTBOX_ENABLED):
+        services["worker"] = run_outbox_worker
+    return services
+
+async def main(role: str = "all"):
+    global _shutdown_flag
     
     logger = setup_logging(logging.INFO)
-    logger.info("[BOT] Starting bot, API server and scheduler...")
-    await init_indexes()
+    startup_timing.mark("logging")
+    services = role_services(role)
+    logger.info(f"[BOT] Starting role '{role}': {', '.join(services)}...")
+    if "api" in services:
+        # Модули API загружаются до запуска loop-сервисов, а не внутри работающего event loop
+        importlib.import_module("api_server")
+        startup_timing.mark("api_import")
+    # Сервисы процесса делят один event loop: блокировки видны в логе и метриках
+    start_loop_monitor()
+    # Обслуживание базы выполняет один процесс (scheduler или all), а не каждая копия API/воркера
+    if role in ("scheduler", "all"):
+        # Индексы синхронизируются в фоне, не задерживая запуск polling и API
+        index_task = asyncio.create_task(init_indexes())
+        index_task.add_done_callback(_log_index_sync_result)
+        # Старые документы со строковыми датами конвертируются в фоне (чтение поддерживает оба формата)
+        migration_task = asyncio.create_task(migrate_timestamp_fields())
+        migration_task.add_done_callback(_log_migration_result)
+        # Счетчики заказов за месяц и заказы в работе (после развертывания коллекция пуста),
+        # сверка ждет конвертации дат: created_at сравнивается как BSON date
+        counters_task = asyncio.create_task(reconcile_counters_on_startup(migration_task))
+        counters_task.add_done_callback(_log_counters_result)
+        order_messages_task = asyncio.create_task(migrate_order_messages())
+        order_messages_task.add_done_callback(_log_order_messages_result)
 
     # Регистрируем обработчики сигналов
     signal.signal(signal.SIGTERM, signal_handler)
@@ -76,10 +198,10 @@ async def main():
 
     try:
         # Запускаем все задачи
-        _bot_task = asyncio.create_task(run_bot())
-        _api_task = asyncio.create_task(run_api_server())
-        _scheduler_task = asyncio.create_task(run_scheduler())
+        for name, service in services.items():
+            _tasks[name] = asyncio.create_task(service())
         
+        startup_timing.mark("services")
         logger.info("[BOT] Все сервисы запущены, ожидание завершения...")
         
         # Создаем задачу для проверки флага остановки
@@ -91,7 +213,7 @@ async def main():
         
         # Ждем сигнала остановки или завершения одной из задач
         done, pending = await asyncio.wait(
-            [_bot_task, _api_task, _scheduler_task, shutdown_checker],
+            [*_tasks.values(), shutdown_checker],
             return_when=asyncio.FIRST_COMPLETED
         )
         
@@ -105,8 +227,8 @@ async def main():
         # Если получили сигнал остановки, отменяем все задачи
         if _shutdown_flag:
             logger.info("[BOT] Получен сигнал остановки, отменяем все задачи...")
-            for task in [_bot_task, _api_task, _scheduler_task]:
-                if task and not task.done():
+            for task in _tasks.values():
+                if not task.done():
                     task.cancel()
                     try:
                         await task
@@ -115,22 +237,48 @@ async def main():
         
         # Ждем завершения всех задач с таймаутом
         logger.info("[BOT] Ожидание завершения задач...")
-        for task in [_bot_task, _api_task, _scheduler_task]:
-            if task and not task.done():
+        for name, task in _tasks.items():
+            if not task.done():
                 try:
                     await asyncio.wait_for(task, timeout=5.0)
                 except (asyncio.TimeoutError, asyncio.CancelledError):
-                    logger.warning(f"[BOT] Задача не завершилась в срок")
+                    logger.warning(f"[BOT] Задача {name} не завершилась в срок")
         
     except Exception as e:
         logger.error(f"[BOT] Критическая ошибка: {e}", exc_info=True)
         raise
     finally:
+        # Остаток буфера аудита записывается до остановки процесса
+        await close_audit_sink()
+        await get_admin_acl().close()
+        await close_bot()
         logger.info("[BOT] Все сервисы остановлены")
 
+def run_api_workers(workers: int):
+    """
+    Роль api с несколькими процессами uvicorn (по процессу на ядро).
+    Каждый процесс импортирует api_server и создает свой Bot и клиентов MongoDB/Redis.
+    """
+    setup_logging(logging.INFO)
+    logging.getLogger(__name__).info(f"[BOT] Starting role 'api' with {workers} uvicorn workers...")
+    uvicorn.run("api_server:app", host=API_HOST, port=API_PORT, workers=workers, log_level="info", loop="asyncio")
+
+def parse_args(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Courier bot: polling, API, scheduler and outbox worker")
+    parser.add_argument("--role", choices=ROLES, default=SHIPBOT_ROLE,
+                        help="сервисы процесса (по умолчанию SHIPBOT_ROLE или all)")
+    parser.add_argument("--workers", type=int, default=API_WORKERS,
+                        help="процессов uvicorn для роли api (по умолчанию API_WORKERS)")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        asyncio.run(main())
+        if args.role == "api" and args.workers > 1:
+            run_api_workers(args.workers)
+        else:
+            asyncio.run(main(args.role))
     except (KeyboardInterrupt, SystemExit):
         logging.getLogger(__name__).info("[BOT] Прервано пользователем")
     except Exception as e:
@@ -15,6 +15,12 @@ ODOO_API_KEY = os.getenv("ODOO_API_KEY", "")
 
 # Telegram Bot
 BOT_TOKEN = os.getenv("BOT_TOKEN", "PUT_YOUR_TELEGRAM_BOT_TOKEN_HERE")
+# Общая сессия Bot API (utils/bot_registry.py) для бота, API и планировщика
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "100"))  # одновременных соединений
+TELEGRAM_KEEPALIVE_SECONDS = float(os.getenv("TELEGRAM_KEEPALIVE_SECONDS", "60"))
+TELEGRAM_TIMEOUT_SECONDS = float(os.getenv("TELEGRAM_TIMEOUT_SECONDS", "30"))  # getUpdates добавляет к нему таймаут polling
+# Одновременных запросов deleteMessages при очистке чатов курьеров (utils/order_messages.py)
+TELEGRAM_DELETE_CONCURRENCY = int(os.getenv("TELEGRAM_DELETE_CONCURRENCY", "4"))
 
 # Mongo
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
@@ -31,7 +37,6 @@ API_PORT = int(os.getenv("API_PORT", "5055"))
 SHIFT_TTL = int(os.getenv("SHIFT_TTL", str(12 * 60 * 60)))        # 12 hours
 LOC_TTL   = int(os.getenv("LOC_TTL",   str(12 * 60 * 60)))        # 12 hours
 PHOTO_WAIT_TTL = int(os.getenv("PHOTO_WAIT_TTL", str(10 * 60)))   # 10 minutes
-ORDER_LOCK_TTL = int(os.getenv("ORDER_LOCK_TTL", str(30)))        # 30 seconds
 LIVE_LOCATION_DURATION = int(os.getenv("LIVE_LOCATION_DURATION", str(8 * 60 * 60)))  # 8 hours
 LOCATION_REQUEST_INTERVAL = int(os.getenv("LOCATION_REQUEST_INTERVAL", str(20)))  # 20 seconds
 LOCATION_REDIRECT_TTL = int(os.getenv("LOCATION_REDIRECT_TTL", str(24 * 60 * 60)))  # 24 hours
@@ -39,6 +44,80 @@ LOCATION_REDIRECT_TTL = int(os.getenv("LOCATION_REDIRECT_TTL", str(24 * 60 * 60)
 # API Base URL for redirects
 API_BASE_URL = os.getenv("API_BASE_URL", "https://icambio-test-odoo.setrealtora.ru")
 
+# Logging
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json (JSON lines в файле)
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")  # size | time
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))  # 50 MB (LOG_ROTATION=size)
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")  # LOG_ROTATION=time
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "7"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Сэмплирование логов ниже WARNING для частых путей: "logger=N" (пишется 1 из N), через запятую
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "handlers.location=20")
+
+# Metrics (/metrics): если токен задан, требуется заголовок Authorization: Bearer <token>
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Трассировка MongoDB: предупреждение, если обработчик делает больше round-trip
+# или повторяет одну форму запроса (N+1) указанное число раз
+MONGO_ROUNDTRIP_BUDGET = int(os.getenv("MONGO_ROUNDTRIP_BUDGET", "8"))
+MONGO_REPEAT_THRESHOLD = int(os.getenv("MONGO_REPEAT_THRESHOLD", "3"))
+
+# Роли процесса (python bot.py --role ...): api | bot | scheduler | worker | all
+SHIPBOT_ROLE = os.getenv("SHIPBOT_ROLE", "all")
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))  # процессов uvicorn для роли api
+# Очередь исходящих вызовов (webhook, Odoo, сообщения менеджеру) для роли worker
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "0").lower() in ("1", "true", "yes")
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+
+# Журналы аудита (ship_bot_user_action, shift_history): буфер с пакетной записью (db/audit.py)
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "200"))  # 0 - запись inline в обработчике
+AUDIT_FLUSH_INTERVAL_MS = float(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "1000"))
+AUDIT_BUFFER_MAX = int(os.getenv("AUDIT_BUFFER_MAX", "20000"))  # сверх лимита записи отбрасываются
+# Срок хранения (TTL индекс по timestamp, 0 - хранить бессрочно)
+AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", "180"))
+SHIFT_HISTORY_RETENTION_DAYS = int(os.getenv("SHIFT_HISTORY_RETENTION_DAYS", "0"))
+
+# Мониторинг event loop: интервал проверки (0 - выключено) и порог, после которого
+# в лог пишется стек заблокированного loop
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv("LOOP_MONITOR_INTERVAL_MS", "100"))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "250"))
+
+# Запись трафика для bench/replay.py (пусто - выключено)
+TRAFFIC_RECORD_DIR = os.getenv("TRAFFIC_RECORD_DIR", "")
+TRAFFIC_RECORD_SALT = os.getenv("TRAFFIC_RECORD_SALT", "shipbot")  # соль псевдонимов chat ID
+TRAFFIC_RECORD_MAX_MB = int(os.getenv("TRAFFIC_RECORD_MAX_MB", "512"))  # лимит на файл (до сжатия)
+
+# Кэш прав администраторов (utils/admin_acl.py): перечитывание bot_super_admins не реже,
+# чем раз в указанное число секунд (сброс во всех процессах - python -m utils.admin_acl --invalidate)
+ADMIN_ACL_TTL_SECONDS = float(os.getenv("ADMIN_ACL_TTL_SECONDS", "60"))
+
+# Кэш ответов admin API (ETag/304, utils/response_cache.py)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+
+# Сжатие ответов API (utils/compression.py): gzip или brotli (если установлен) от указанного размера
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))  # 0 - сжимать все, -1 - выключено
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# Выгрузки /api/admin/export/*: документов за один getMore курсора
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Страница просмотра трека смены (Leaflet): каталог с leaflet.js и leaflet.css
+# (можно указать свою копию, например /static/leaflet), пусто - страница выключена
+TRACK_VIEWER_LEAFLET_URL = os.getenv("TRACK_VIEWER_LEAFLET_URL", "https://unpkg.com/leaflet@1.9.4/dist").rstrip("/")
+TRACK_VIEWER_TILE_URL = os.getenv("TRACK_VIEWER_TILE_URL", "https://tile.openstreetmap.org/{z}/{x}/{y}.png")
+
+# Аналитика трека смены (utils/track_stats.py)
+TRACK_MOVING_SPEED_KMH = float(os.getenv("TRACK_MOVING_SPEED_KMH", "3"))  # медленнее - стоянка (дрожание GPS)
+TRACK_JITTER_METERS = float(os.getenv("TRACK_JITTER_METERS", "10"))  # смещение меньше - дрожание GPS, не движение
+TRACK_MAX_SPEED_KMH = float(os.getenv("TRACK_MAX_SPEED_KMH", "150"))  # быстрее - скачок GPS, отрезок пропускается
+TRACK_GAP_SECONDS = int(os.getenv("TRACK_GAP_SECONDS", "900"))  # интервал между точками больше - разрыв трансляции
+TRACK_STOP_MIN_SECONDS = int(os.getenv("TRACK_STOP_MIN_SECONDS", "180"))  # минимальная длительность стоянки
+
+# Дневные агрегаты времени доставки (db/delivery_stats.py): период обновления сегодня/вчера, минуты (0 - выключено)
+DELIVERY_STATS_REFRESH_MINUTES = int(os.getenv("DELIVERY_STATS_REFRESH_MINUTES", "15"))
+
 # Manager
 MANAGER_CHAT_ID = int(os.getenv("MANAGER_CHAT_ID", "0"))
 
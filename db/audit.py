@@ -0,0 +1,187 @@
+"""
+Буферизированная запись журналов аудита (ship_bot_user_action, shift_history).
+
+Action.log и ShiftHistory.log не ждут insert_one: документ кладется в буфер
+процесса, фоновая задача записывает накопленное одним insert_many(ordered=False)
+на коллекцию - по заполнении пачки (AUDIT_BATCH_SIZE) или по таймеру
+(AUDIT_FLUSH_INTERVAL_MS). При остановке процесса буфер записывается (close_audit_sink).
+
+Если буфер переполнен (AUDIT_BUFFER_MAX, например MongoDB недоступна), новые записи
+отбрасываются; количество видно в метрике shipbot_audit_entries_total{outcome="dropped"}
+и в логе. AUDIT_BATCH_SIZE=0 возвращает запись inline (insert_one в обработчике).
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+from pymongo.errors import BulkWriteError
+from config import AUDIT_BATCH_SIZE, AUDIT_FLUSH_INTERVAL_MS, AUDIT_BUFFER_MAX
+from utils.metrics import REGISTRY, Counter, Gauge
+import logging
+
+logger = logging.getLogger(__name__)
+
+AUDIT_ENTRIES = REGISTRY.register(Counter(
+    "shipbot_audit_entries_total", "Audit log entries by outcome", ("collection", "outcome")
+))
+AUDIT_BUFFERED = REGISTRY.register(Gauge(
+    "shipbot_audit_buffered", "Audit log entries waiting to be written"
+))
+
+# Не чаще одного предупреждения об отброшенных записях за интервал (секунды)
+_DROP_LOG_INTERVAL = 10
+
+class AuditSink:
+    """Буфер записей аудита с фоновой пакетной записью"""
+
+    def __init__(self, batch_size: int = AUDIT_BATCH_SIZE, flush_interval: float = AUDIT_FLUSH_INTERVAL_MS / 1000,
+                 max_buffered: int = AUDIT_BUFFER_MAX):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        # Полное имя коллекции -> (коллекция Motor, документы)
+        self._buffers: Dict[str, Tuple[object, List[dict]]] = {}
+        self._size = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stopping = False
+        self._dropped_since_log = 0
+        self._last_drop_log = 0.0
+        AUDIT_BUFFERED.set_function(lambda: self._size)
+
+    def add(self, collection, document: dict) -> bool:
+        """
+        Добавляет документ в буфер (без ожидания записи).
+
+        Args:
+            collection: Коллекция Motor (db.ship_bot_user_action, db.shift_history)
+            document: Документ для вставки
+
+        Returns:
+            False, если буфер переполнен и запись отброшена
+        """
+        if self._size >= self.max_buffered:
+            self._dropped(collection.name, 1)
+            return False
+        self._ensure_task()
+        _, documents = self._buffers.setdefault(collection.full_name, (collection, []))
+        documents.append(document)
+        self._size += 1
+        if self._size >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def _ensure_task(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("[AUDIT] ⚠️ Ошибка записи журнала аудита: %s", e)
+
+    async def flush(self):
+        """Записывает весь буфер (по одному insert_many на коллекцию)"""
+        if not self._buffers:
+            return
+        async with self._flush_lock:
+            buffers, self._buffers = self._buffers, {}
+            self._size -= sum(len(documents) for _, documents in buffers.values())
+            errors = []
+            for collection, documents in buffers.values():
+                try:
+                    await self._write(collection, documents)
+                except Exception as e:
+                    errors.append(f"{collection.name}: {e}")
+            if errors:
+                raise RuntimeError("; ".join(errors))
+
+    async def _write(self, collection, documents: List[dict]):
+        name = collection.name
+        try:
+            result = await collection.insert_many(documents, ordered=False)
+            AUDIT_ENTRIES.inc(len(result.inserted_ids), collection=name, outcome="written")
+        except BulkWriteError as e:
+            # ordered=False: остальные документы пачки записаны
+            failed = len(e.details.get("writeErrors", []))
+            AUDIT_ENTRIES.inc(len(documents) - failed, collection=name, outcome="written")
+            AUDIT_ENTRIES.inc(failed, collection=name, outcome="failed")
+            logger.warning("[AUDIT] ⚠️ %s: не записано %s из %s записей", name, failed, len(documents))
+        except Exception:
+            # Сеть/MongoDB недоступна: возвращаем пачку в буфер, пока есть место
+            requeue = documents[:max(self.max_buffered - self._size, 0)]
+            if requeue:
+                _, pending = self._buffers.setdefault(collection.full_name, (collection, []))
+                pending[:0] = requeue
+                self._size += len(requeue)
+            if len(requeue) < len(documents):
+                self._dropped(name, len(documents) - len(requeue))
+            raise
+
+    def _dropped(self, collection_name: str, count: int):
+        AUDIT_ENTRIES.inc(count, collection=collection_name, outcome="dropped")
+        self._dropped_since_log += count
+        now = time.monotonic()
+        if now - self._last_drop_log >= _DROP_LOG_INTERVAL:
+            logger.warning(
+                "[AUDIT] ⚠️ Буфер аудита переполнен (%s), отброшено записей: %s",
+                self.max_buffered, self._dropped_since_log
+            )
+            self._dropped_since_log = 0
+            self._last_drop_log = now
+
+    async def close(self):
+        """Останавливает фоновую запись и записывает остаток буфера"""
+        if self._task is not None:
+            # Не отменяем задачу: отмена посреди flush() потеряла бы пачку, уже вынутую из буфера
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        if self._flush_lock is None:
+            return
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error("[AUDIT] ❌ Не удалось записать журнал аудита при остановке (%s записей): %s", self._size, e)
+
+_sink: Optional[AuditSink] = None
+
+def get_audit_sink() -> Optional[AuditSink]:
+    """Буфер аудита процесса (None при AUDIT_BATCH_SIZE=0 - запись inline)"""
+    global _sink
+    if _sink is None and AUDIT_BATCH_SIZE > 0:
+        _sink = AuditSink()
+    return _sink
+
+async def write_audit(collection, document: dict):
+    """
+    Записывает документ аудита через буфер процесса или inline, если буфер выключен.
+
+    Args:
+        collection: Коллекция Motor
+        document: Документ для вставки
+    """
+    sink = get_audit_sink()
+    if sink is None:
+        await collection.insert_one(document)
+        return
+    sink.add(collection, document)
+
+async def close_audit_sink():
+    """Записывает остаток буфера при остановке процесса (повторный вызов ничего не делает)"""
+    global _sink
+    if _sink is None:
+        return
+    sink, _sink = _sink, None
+    await sink.close()
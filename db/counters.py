@@ -0,0 +1,219 @@
+"""
+Материализованные счетчики заказов курьера (коллекция courier_counters).
+
+Документы:
+    {chat_id, day: "YYYY-MM-DD", created, done, cancelled} - заказы по дню создания
+    {chat_id, day: "current", waiting, in_transit}        - заказы в работе сейчас
+
+Счетчики меняются атомарным $inc при каждом изменении заказа (apply_order_change),
+поэтому чтение статистики - один find по уникальному индексу (chat_id, day).
+Расхождения (сбои между записью заказа и счетчика) исправляет reconcile_counters,
+который планировщик запускает раз в сутки.
+
+Первичное заполнение за месяц:
+    python -m db.counters --days 31
+"""
+import argparse
+import asyncio
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Tuple
+from pymongo import UpdateOne
+from config import TIMEZONE
+from db.models import as_datetime
+from utils.data_versions import bump_versions
+import logging
+
+logger = logging.getLogger(__name__)
+
+CURRENT_DAY = "current"
+DAILY_FIELDS = ("created", "done", "cancelled")
+IN_FLIGHT_FIELDS = ("waiting", "in_transit")
+
+def day_key(value: Any = None) -> str:
+    """
+    Ключ дня счетчика в таймзоне приложения.
+
+    Args:
+        value: datetime или ISO строка (по умолчанию - текущий момент)
+
+    Returns:
+        Строка "YYYY-MM-DD"
+    """
+    dt = as_datetime(value) if value is not None else None
+    if dt is None:
+        dt = datetime.now(TIMEZONE)
+    return dt.astimezone(TIMEZONE).strftime("%Y-%m-%d")
+
+def _order_contribution(order: Optional[Dict[str, Any]]) -> List[Tuple[int, str, str]]:
+    """Список (chat_id, day, field), в которые заказ вносит +1"""
+    if not order or order.get("courier_tg_chat_id") is None:
+        return []
+    chat_id = order["courier_tg_chat_id"]
+    day = day_key(order.get("created_at"))
+    status = order.get("status")
+
+    contribution = [(chat_id, day, "created")]
+    if status in IN_FLIGHT_FIELDS:
+        contribution.append((chat_id, CURRENT_DAY, status))
+    elif status in ("done", "cancelled"):
+        contribution.append((chat_id, day, status))
+    return contribution
+
+async def apply_order_change(db, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+    """
+    Применяет к счетчикам изменение заказа.
+
+    Вклад старого состояния вычитается, нового - прибавляется, все изменения
+    уходят одним bulk_write (upsert + $inc). Ошибки логируются и не прерывают
+    основной сценарий - расхождение исправит reconcile_counters.
+
+    Args:
+        db: База данных Motor
+        before: Заказ до изменения (None при создании)
+        after: Заказ после изменения (None при удалении)
+    """
+    # Кэш admin API: заказы курьеров до и после изменения (передача заказа меняет обоих)
+    await bump_versions("orders", chat_ids=[(order or {}).get("courier_tg_chat_id") for order in (before, after)])
+
+    increments: Dict[Tuple[int, str], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for chat_id, day, field in _order_contribution(before):
+        increments[(chat_id, day)][field] -= 1
+    for chat_id, day, field in _order_contribution(after):
+        increments[(chat_id, day)][field] += 1
+
+    requests = []
+    for (chat_id, day), fields in increments.items():
+        inc = {field: value for field, value in fields.items() if value}
+        if inc:
+            requests.append(UpdateOne({"chat_id": chat_id, "day": day}, {"$inc": inc}, upsert=True))
+    if not requests:
+        return
+
+    try:
+        await db.courier_counters.bulk_write(requests, ordered=False)
+    except Exception as e:
+        logger.error("[COUNTERS] ❌ Ошибка обновления счетчиков: %s", e, exc_info=True)
+
+async def get_courier_counters(db, chat_id: int, day: Optional[str] = None) -> Dict[str, int]:
+    """
+    Счетчики курьера за день и заказы в работе (один запрос).
+
+    Args:
+        db: База данных Motor
+        chat_id: Telegram chat ID курьера
+        day: Ключ дня (по умолчанию - сегодня)
+
+    Returns:
+        dict с ключами created, done, cancelled, waiting, in_transit
+    """
+    day = day or day_key()
+    result = {field: 0 for field in DAILY_FIELDS + IN_FLIGHT_FIELDS}
+    async for doc in db.courier_counters.find({"chat_id": chat_id, "day": {"$in": [day, CURRENT_DAY]}}):
+        fields = IN_FLIGHT_FIELDS if doc["day"] == CURRENT_DAY else DAILY_FIELDS
+        for field in fields:
+            result[field] = max(doc.get(field, 0), 0)
+    return result
+
+async def get_courier_period_counters(db, chat_id: int, start_day: str, end_day: str) -> Dict[str, int]:
+    """
+    Сумма дневных счетчиков курьера за период (включительно).
+
+    Args:
+        db: База данных Motor
+        chat_id: Telegram chat ID курьера
+        start_day: Первый день периода "YYYY-MM-DD"
+        end_day: Последний день периода "YYYY-MM-DD"
+
+    Returns:
+        dict с ключами created, done, cancelled
+    """
+    result = {field: 0 for field in DAILY_FIELDS}
+    async for doc in db.courier_counters.find({"chat_id": chat_id, "day": {"$gte": start_day, "$lte": end_day}}):
+        for field in DAILY_FIELDS:
+            result[field] += max(doc.get(field, 0), 0)
+    return result
+
+async def reconcile_counters(db, days: int = 2) -> int:
+    """
+    Пересчитывает счетчики по заказам и исправляет расхождения.
+
+    Проверяются дни за последние `days` суток и заказы в работе.
+
+    Args:
+        db: База данных Motor
+        days: Сколько последних дней пересчитывать
+
+    Returns:
+        Количество исправленных документов счетчиков
+    """
+    from db.migrate_timestamps import timestamps_migrated
+    # $dateToString по created_at: документы со строковыми датами пропали бы из счетчиков
+    if not await timestamps_migrated(db):
+        logger.warning("[COUNTERS] ⚠️ Миграция полей времени не завершена, сверка счетчиков отложена")
+        return 0
+    now = datetime.now(TIMEZONE)
+    start = datetime(now.year, now.month, now.day, tzinfo=TIMEZONE) - timedelta(days=days - 1)
+    days_range = [day_key(start + timedelta(days=i)) for i in range(days)]
+
+    expected: Dict[Tuple[int, str], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    daily_pipeline = [
+        {"$match": {"created_at": {"$gte": start}, "courier_tg_chat_id": {"$ne": None}}},
+        {"$group": {
+            "_id": {
+                "chat_id": "$courier_tg_chat_id",
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at", "timezone": str(TIMEZONE)}},
+                "status": "$status"
+            },
+            "count": {"$sum": 1}
+        }}
+    ]
+    async for row in db.couriers_deliveries.aggregate(daily_pipeline):
+        key = (row["_id"]["chat_id"], row["_id"]["day"])
+        expected[key]["created"] += row["count"]
+        if row["_id"]["status"] in ("done", "cancelled"):
+            expected[key][row["_id"]["status"]] += row["count"]
+
+    in_flight_pipeline = [
+        {"$match": {"status": {"$in": list(IN_FLIGHT_FIELDS)}, "courier_tg_chat_id": {"$ne": None}}},
+        {"$group": {"_id": {"chat_id": "$courier_tg_chat_id", "status": "$status"}, "count": {"$sum": 1}}}
+    ]
+    async for row in db.couriers_deliveries.aggregate(in_flight_pipeline):
+        expected[(row["_id"]["chat_id"], CURRENT_DAY)][row["_id"]["status"]] = row["count"]
+
+    actual = {}
+    async for doc in db.courier_counters.find({"day": {"$in": days_range + [CURRENT_DAY]}}):
+        actual[(doc["chat_id"], doc["day"])] = doc
+
+    requests = []
+    changed_chats = set()
+    for key in set(expected) | set(actual):
+        chat_id, day = key
+        fields = IN_FLIGHT_FIELDS if day == CURRENT_DAY else DAILY_FIELDS
+        wanted = {field: expected.get(key, {}).get(field, 0) for field in fields}
+        current = {field: actual.get(key, {}).get(field, 0) for field in fields}
+        if wanted != current:
+            requests.append(UpdateOne({"chat_id": chat_id, "day": day}, {"$set": wanted}, upsert=True))
+            changed_chats.add(chat_id)
+            logger.info("[COUNTERS] 🔧 Расхождение %s/%s: %s -> %s", chat_id, day, current, wanted)
+
+    if requests:
+        await db.courier_counters.bulk_write(requests, ordered=False)
+        await bump_versions("orders", chat_ids=changed_chats)
+    return len(requests)
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Пересчет счетчиков заказов курьеров")
+    parser.add_argument("--days", type=int, default=31, help="сколько последних дней пересчитать")
+    args = parser.parse_args(argv)
+
+    from db.mongo import get_db
+    logging.basicConfig(level=logging.INFO)
+    db = await get_db()
+    fixed = await reconcile_counters(db, days=args.days)
+    print(f"Исправлено документов счетчиков: {fixed}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
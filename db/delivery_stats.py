@@ -0,0 +1,283 @@
+"""
+Дневные агрегаты времени доставки (коллекция delivery_stats_daily).
+
+По status_history выполненных заказов считаются две длительности:
+    pickup   - waiting -> in_transit (назначение -> курьер забрал заказ)
+    delivery - in_transit -> done    (забрал -> доставил)
+
+Документ агрегата - день выполнения (status_history.done, время Buenos Aires),
+курьер, бренд и источник:
+    {_id: "YYYY-MM-DD|chat_id|brand|source", day, chat_id, brand, source, run_id,
+     metrics: {pickup: {count, sum, min, max, hist: [[bucket, n], ...]}, delivery: {...}}}
+
+Процентили не складываются, поэтому агрегат хранит гистограмму длительностей
+по логарифмическим корзинам (шаг BUCKET_RATIO, погрешность процентиля ~5%):
+гистограммы любых дней, курьеров и брендов суммируются.
+
+Агрегаты дня пересчитываются целиком pipeline'ом с $merge (идемпотентно):
+планировщик обновляет сегодня и вчера каждые DELIVERY_STATS_REFRESH_MINUTES,
+поэтому запрос за 90 дней читает ~90 x курьеры документов вместо заказов.
+
+Первичное заполнение:
+    python -m db.delivery_stats --days 90
+"""
+import argparse
+import asyncio
+import math
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+from bson import ObjectId
+from config import TIMEZONE
+import logging
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "delivery_stats_daily"
+METRICS = {
+    "pickup": ("waiting", "in_transit"),
+    "delivery": ("in_transit", "done"),
+}
+GROUP_FIELDS = {"courier": "chat_id", "brand": "brand", "source": "source"}
+DEFAULT_PERCENTILES = (50, 75, 90, 95)
+
+# Корзины: 0 - меньше BUCKET_MIN_SECONDS, 1..N-2 - [min*ratio^(i-1), min*ratio^i), N-1 - остальное
+BUCKET_MIN_SECONDS = 30.0
+BUCKET_RATIO = 1.1
+BUCKET_COUNT = 2 + math.ceil(math.log(48 * 3600 / BUCKET_MIN_SECONDS) / math.log(BUCKET_RATIO))
+
+def bucket_bounds(index: int) -> tuple:
+    """Границы корзины в секундах (верхняя последней корзины - inf)"""
+    if index == 0:
+        return 0.0, BUCKET_MIN_SECONDS
+    upper = BUCKET_MIN_SECONDS * BUCKET_RATIO ** index if index < BUCKET_COUNT - 1 else math.inf
+    return BUCKET_MIN_SECONDS * BUCKET_RATIO ** (index - 1), upper
+
+def _duration_expr(start_key: str, end_key: str) -> Dict[str, Any]:
+    """Секунды между status_history.<start> и <end> или null, если отметки нет"""
+    start, end = f"$status_history.{start_key}", f"$status_history.{end_key}"
+    return {"$cond": [
+        {"$and": [{"$eq": [{"$type": start}, "date"]}, {"$eq": [{"$type": end}, "date"]}, {"$gte": [end, start]}]},
+        {"$divide": [{"$subtract": [end, start]}, 1000]},
+        None,
+    ]}
+
+def _bucket_expr(value: str) -> Dict[str, Any]:
+    return {"$cond": [
+        {"$lt": [value, BUCKET_MIN_SECONDS]},
+        0,
+        {"$min": [BUCKET_COUNT - 1, {"$add": [1, {"$floor": {
+            "$divide": [{"$ln": {"$divide": [value, BUCKET_MIN_SECONDS]}}, math.log(BUCKET_RATIO)]
+        }}]}]},
+    ]}
+
+def rollup_pipeline(start: datetime, end: datetime, run_id: str) -> List[Dict[str, Any]]:
+    """
+    Pipeline агрегатов за [start, end) по времени выполнения заказа.
+    Результат пишется в delivery_stats_daily через $merge (документы дня заменяются).
+    """
+    key = {"day": "$day", "chat_id": "$chat_id", "brand": "$brand", "source": "$source"}
+    return [
+        {"$match": {
+            "status": "done",
+            "status_history.done": {"$gte": start, "$lt": end},
+            "courier_tg_chat_id": {"$ne": None},
+            "external_id": {"$not": {"$regex": "^-"}},  # тестовые заказы
+        }},
+        {"$project": {
+            "_id": 0,
+            "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$status_history.done", "timezone": str(TIMEZONE)}},
+            "chat_id": "$courier_tg_chat_id",
+            "brand": {"$ifNull": ["$brand", ""]},
+            "source": {"$ifNull": ["$source", ""]},
+            "m": [{"k": name, "v": _duration_expr(*keys)} for name, keys in METRICS.items()],
+        }},
+        {"$unwind": "$m"},
+        {"$match": {"m.v": {"$ne": None}}},
+        {"$group": {
+            "_id": {**key, "metric": "$m.k", "bucket": _bucket_expr("$m.v")},
+            "n": {"$sum": 1}, "sum": {"$sum": "$m.v"}, "min": {"$min": "$m.v"}, "max": {"$max": "$m.v"},
+        }},
+        {"$sort": {"_id.bucket": 1}},
+        {"$group": {
+            "_id": {name: f"$_id.{name}" for name in (*key, "metric")},
+            "count": {"$sum": "$n"}, "sum": {"$sum": "$sum"}, "min": {"$min": "$min"}, "max": {"$max": "$max"},
+            "hist": {"$push": ["$_id.bucket", "$n"]},
+        }},
+        {"$group": {
+            "_id": {name: f"$_id.{name}" for name in key},
+            "metrics": {"$push": {"k": "$_id.metric", "v": {
+                "count": "$count", "sum": "$sum", "min": "$min", "max": "$max", "hist": "$hist"
+            }}},
+        }},
+        {"$project": {
+            "_id": {"$concat": [
+                "$_id.day", "|", {"$toString": "$_id.chat_id"}, "|", {"$toString": "$_id.brand"}, "|", {"$toString": "$_id.source"}
+            ]},
+            "day": "$_id.day",
+            "chat_id": "$_id.chat_id",
+            "brand": "$_id.brand",
+            "source": "$_id.source",
+            "metrics": {"$arrayToObject": "$metrics"},
+            "run_id": {"$literal": run_id},
+        }},
+        {"$merge": {"into": COLLECTION, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+def _day_start(day: datetime) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=TIMEZONE)
+
+async def refresh_rollups(db, days: int = 2, until: Optional[datetime] = None) -> int:
+    """
+    Пересчитывает агрегаты за последние `days` дней (включая текущий).
+
+    Args:
+        db: База данных Motor
+        days: Сколько дней пересчитать
+        until: Последний день (по умолчанию - сегодня)
+
+    Returns:
+        Количество документов агрегатов за период
+    """
+    from db.migrate_timestamps import timestamps_migrated
+    # Строковые status_history.done не попадут в агрегаты: пересчет после миграции
+    if not await timestamps_migrated(db):
+        logger.warning("[STATS] ⚠️ Миграция полей времени не завершена, пересчет агрегатов отложен")
+        return 0
+    end = _day_start(until or datetime.now(TIMEZONE)) + timedelta(days=1)
+    start = end - timedelta(days=days)
+    run_id = str(ObjectId())
+    day_range = {
+        "$gte": start.strftime("%Y-%m-%d"),
+        "$lt": end.strftime("%Y-%m-%d"),
+    }
+    await db.couriers_deliveries.aggregate(rollup_pipeline(start, end, run_id)).to_list(None)
+    # Комбинации курьер/бренд/источник, которых больше нет в днях периода (заказ передан, изменен)
+    stale = await db[COLLECTION].delete_many({"day": day_range, "run_id": {"$ne": run_id}})
+    total = await db[COLLECTION].count_documents({"day": day_range})
+    logger.info("[STATS] 📊 Агрегаты времени доставки за %s дн. обновлены: %s документов, удалено %s", days, total, stale.deleted_count)
+    return total
+
+def percentile(hist: Sequence[int], count: int, p: float, low: float, high: float) -> Optional[float]:
+    """
+    Процентиль по гистограмме (линейная интерполяция внутри корзины).
+
+    Args:
+        hist: Количество значений по корзинам (длина BUCKET_COUNT)
+        count: Всего значений
+        p: Процентиль 0..100
+        low, high: Минимум и максимум значений (ограничивают интерполяцию)
+    """
+    if not count:
+        return None
+    rank = p / 100 * count
+    seen = 0
+    for index, n in enumerate(hist):
+        if not n:
+            continue
+        if seen + n >= rank:
+            lower, upper = bucket_bounds(index)
+            lower, upper = max(lower, low), min(upper, high)
+            value = lower + (upper - lower) * max(rank - seen, 0) / n
+            return round(min(max(value, low), high), 1)
+        seen += n
+    return round(high, 1)
+
+def summarize(parts: Sequence[Dict[str, Any]], percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> Dict[str, Any]:
+    """
+    Сводка метрики по строкам query_stats: count, avg, min, max и процентили (секунды).
+
+    Args:
+        parts: {count, sum, min, max, hists: [гистограмма агрегата, ...]}
+    """
+    hist = [0] * BUCKET_COUNT
+    count, total = 0, 0.0
+    low, high = math.inf, -math.inf
+    for part in parts:
+        count += part["count"]
+        total += part["sum"]
+        low, high = min(low, part["min"]), max(high, part["max"])
+        for pairs in part["hists"]:
+            for bucket, n in pairs:
+                hist[int(bucket)] += int(n)
+    if not count:
+        return {"count": 0}
+    summary = {"count": count, "avg": round(total / count, 1), "min": round(low, 1), "max": round(high, 1)}
+    for p in percentiles:
+        summary[f"p{p:g}"] = percentile(hist, count, p, low, high)
+    return summary
+
+async def query_stats(
+    db,
+    start_day: str,
+    end_day: str,
+    group_by: Optional[str] = None,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    **equals: Any
+) -> Dict[str, Any]:
+    """
+    Процентили времени доставки за период по агрегатам.
+
+    Args:
+        db: База данных Motor
+        start_day, end_day: Период "YYYY-MM-DD" (включительно)
+        group_by: courier | brand | source | None (итог без группировки)
+        percentiles: Процентили 0..100
+        equals: Фильтры chat_id / brand / source (None пропускается)
+
+    Returns:
+        {"total": {"pickup": {...}, "delivery": {...}}, "groups": [{"key": ..., "pickup": ..., "delivery": ...}]},
+        группы по убыванию числа доставок; для courier - с именем курьера (name)
+    """
+    match: Dict[str, Any] = {"day": {"$gte": start_day, "$lte": end_day}}
+    match.update({field: value for field, value in equals.items() if value is not None})
+    key = f"${GROUP_FIELDS[group_by]}" if group_by else {"$literal": None}
+    pipeline = [
+        {"$match": match},
+        {"$project": {"key": key, "m": {"$objectToArray": "$metrics"}}},
+        {"$unwind": "$m"},
+        {"$group": {
+            "_id": {"key": "$key", "metric": "$m.k"},
+            "count": {"$sum": "$m.v.count"}, "sum": {"$sum": "$m.v.sum"},
+            "min": {"$min": "$m.v.min"}, "max": {"$max": "$m.v.max"},
+            "hists": {"$push": "$m.v.hist"},
+        }},
+    ]
+    by_key: Dict[Any, Dict[str, List[Dict[str, Any]]]] = {}
+    async for row in db[COLLECTION].aggregate(pipeline):
+        by_key.setdefault(row["_id"]["key"], {}).setdefault(row["_id"]["metric"], []).append(row)
+
+    groups = []
+    for group_key, metrics in by_key.items():
+        group = {"key": group_key}
+        for name in METRICS:
+            group[name] = summarize(metrics.get(name, []), percentiles)
+        groups.append(group)
+    groups.sort(key=lambda group: -group["delivery"]["count"])
+    if group_by == "courier" and groups:
+        names = {}
+        async for courier in db.couriers.find({"tg_chat_id": {"$in": list(by_key)}}, {"tg_chat_id": 1, "name": 1}):
+            names[courier["tg_chat_id"]] = courier.get("name")
+        for group in groups:
+            group["name"] = names.get(group["key"])
+
+    total = {
+        name: summarize([part for metrics in by_key.values() for part in metrics.get(name, [])], percentiles)
+        for name in METRICS
+    }
+    return {"total": total, "groups": groups if group_by else []}
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Пересчет дневных агрегатов времени доставки")
+    parser.add_argument("--days", type=int, default=90, help="сколько последних дней пересчитать")
+    args = parser.parse_args(argv)
+
+    from db.mongo import get_db
+    logging.basicConfig(level=logging.INFO)
+    db = await get_db()
+    total = await refresh_rollups(db, days=args.days)
+    print(f"Документов агрегатов за {args.days} дн.: {total}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
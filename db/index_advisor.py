@@ -0,0 +1,187 @@
+"""
+Советник по индексам: прогоняет explain() по каталогу запросов приложения
+и отмечает полные сканирования коллекций (COLLSCAN) и сортировки в памяти.
+
+Запуск:
+    python -m db.index_advisor          # отчет, код выхода 1 при наличии COLLSCAN
+    python -m db.index_advisor --json   # отчет в JSON
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from config import TIMEZONE
+
+_SAMPLE_CHAT_ID = 0
+_SAMPLE_TIME = datetime.now(TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0)
+_SAMPLE_TIME_NS = 0
+
+def _query(name: str, collection: str, filter: Dict[str, Any], sort: Optional[List] = None,
+           kind: str = "find", source: str = "") -> Dict[str, Any]:
+    return {"name": name, "collection": collection, "filter": filter, "sort": sort, "kind": kind, "source": source}
+
+# Каталог форм запросов приложения (значения - образцы, важна только форма)
+QUERY_CATALOG: List[Dict[str, Any]] = [
+    _query("courier_by_chat_id", "couriers", {"tg_chat_id": _SAMPLE_CHAT_ID},
+           source="handlers/*: couriers.find_one"),
+    _query("couriers_on_shift", "couriers", {"is_on_shift": True},
+           source="get_couriers_on_shift, cb_on_shift_couriers, auto_end_all_shifts"),
+    _query("couriers_by_name", "couriers", {}, sort=[("name", 1)],
+           source="cb_order_assign_courier, cb_del_user"),
+    _query("order_by_external_id", "couriers_deliveries", {"external_id": "0"},
+           source="validate_order_for_action, update_order"),
+    _query("courier_waiting_orders", "couriers_deliveries",
+           {"courier_tg_chat_id": _SAMPLE_CHAT_ID, "status": "waiting"},
+           sort=[("priority", -1), ("created_at", 1)], source="show_waiting_orders"),
+    _query("courier_active_orders", "couriers_deliveries",
+           {"courier_tg_chat_id": _SAMPLE_CHAT_ID, "status": {"$in": ["waiting", "in_transit"]}},
+           sort=[("priority", -1), ("created_at", 1)], source="show_active_orders, get_courier_active_orders"),
+    _query("courier_closed_orders", "couriers_deliveries",
+           {"courier_tg_chat_id": _SAMPLE_CHAT_ID, "status": {"$in": ["done", "cancelled"]}},
+           sort=[("updated_at", -1)], source="get_courier_completed_orders"),
+    _query("courier_orders_today", "couriers_deliveries",
+           {"courier_tg_chat_id": _SAMPLE_CHAT_ID, "created_at": {"$gte": _SAMPLE_TIME}},
+           kind="count", source="end_shift_logic, reconcile_counters"),
+    _query("courier_done_today", "couriers_deliveries",
+           {"courier_tg_chat_id": _SAMPLE_CHAT_ID, "status": "done", "created_at": {"$gte": _SAMPLE_TIME}},
+           kind="count", source="reconcile_counters"),
+    _query("courier_done_since_shift", "couriers_deliveries",
+           {"courier_tg_chat_id": _SAMPLE_CHAT_ID, "status": "done", "updated_at": {"$gte": _SAMPLE_TIME}},
+           kind="count", source="end_shift_logic"),
+    _query("courier_history_today", "couriers_deliveries",
+           {"courier_tg_chat_id": _SAMPLE_CHAT_ID, "created_at": {"$gte": _SAMPLE_TIME}},
+           sort=[("created_at", -1)], source="cmd_history_today"),
+    _query("courier_history_before_today", "couriers_deliveries",
+           {"courier_tg_chat_id": _SAMPLE_CHAT_ID, "created_at": {"$lt": _SAMPLE_TIME}},
+           sort=[("created_at", -1)], source="show_history_page"),
+    _query("all_active_orders", "couriers_deliveries",
+           {"status": {"$in": ["waiting", "in_transit"]}},
+           sort=[("priority", -1), ("created_at", 1)], source="_show_all_orders_page"),
+    _query("delivered_today_total", "couriers_deliveries",
+           {"status": "done", "updated_at": {"$gte": _SAMPLE_TIME}},
+           kind="count", source="cb_all_deliveries"),
+    _query("courier_counters_today", "courier_counters",
+           {"chat_id": _SAMPLE_CHAT_ID, "day": {"$in": ["2000-01-01", "current"]}},
+           source="get_courier_counters"),
+    _query("courier_counters_month", "courier_counters",
+           {"chat_id": _SAMPLE_CHAT_ID, "day": {"$gte": "2000-01-01", "$lte": "2000-01-31"}},
+           source="get_courier_period_counters"),
+    _query("delivery_stats_rollup", "couriers_deliveries",
+           {"status": "done", "status_history.done": {"$gte": _SAMPLE_TIME, "$lt": _SAMPLE_TIME}},
+           source="db.delivery_stats.refresh_rollups"),
+    _query("delivery_stats_window", "delivery_stats_daily",
+           {"day": {"$gte": "2000-01-01", "$lte": "2000-03-31"}}, source="db.delivery_stats.query_stats"),
+    _query("order_messages_by_order", "order_messages", {"external_id": "0"},
+           source="delete_order_messages_from_courier"),
+    _query("order_messages_in_chat", "order_messages",
+           {"chat_id": _SAMPLE_CHAT_ID, "external_id": {"$in": ["0"]}},
+           source="reconcile_order_messages, clear_chat_order_messages"),
+    _query("last_courier_location", "locations", {"chat_id": _SAMPLE_CHAT_ID},
+           sort=[("timestamp_ns", -1)], source="get_courier_location, generate_location_redirect_key"),
+    _query("courier_route_72h", "locations",
+           {"chat_id": _SAMPLE_CHAT_ID, "timestamp_ns": {"$gte": _SAMPLE_TIME_NS}},
+           sort=[("timestamp_ns", 1)], source="get_courier_route, route_redirect"),
+    _query("shift_track", "locations", {"shift_id": "sample", "chat_id": _SAMPLE_CHAT_ID},
+           sort=[("timestamp_ns", 1)], source="GET /api/admin/couriers/{chat_id}/shifts/{shift_id}/track"),
+    _query("old_locations_cleanup", "locations", {"timestamp_ns": {"$lt": _SAMPLE_TIME_NS}},
+           kind="count", source="cleanup_old_locations"),
+]
+
+def _collect_stages(plan: Dict[str, Any], stages: List[str]):
+    """Рекурсивно собирает стадии плана (classic и SBE форматы)"""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        stages.append(plan["stage"])
+    for key in ("queryPlan", "inputStage"):
+        if key in plan:
+            _collect_stages(plan[key], stages)
+    for child in plan.get("inputStages", []):
+        _collect_stages(child, stages)
+
+def _explain_command(query: Dict[str, Any]) -> Dict[str, Any]:
+    if query["kind"] == "count":
+        return {"count": query["collection"], "query": query["filter"]}
+    command = {"find": query["collection"], "filter": query["filter"]}
+    if query["sort"]:
+        command["sort"] = dict(query["sort"])
+    return command
+
+async def explain_catalog(db) -> List[Dict[str, Any]]:
+    """
+    Выполняет explain(queryPlanner) для каждого запроса каталога.
+
+    Returns:
+        Список результатов: {name, collection, source, stages, index, collscan, in_memory_sort}
+    """
+    from bson import SON
+    results = []
+    for query in QUERY_CATALOG:
+        explain = await db.command(SON([("explain", _explain_command(query)), ("verbosity", "queryPlanner")]))
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        stages: List[str] = []
+        _collect_stages(winning_plan, stages)
+        index_name = _find_index_name(winning_plan)
+        results.append({
+            "name": query["name"],
+            "collection": query["collection"],
+            "source": query["source"],
+            "stages": stages,
+            "index": index_name,
+            "collscan": "COLLSCAN" in stages,
+            "in_memory_sort": "SORT" in stages
+        })
+    return results
+
+def _find_index_name(plan: Dict[str, Any]) -> Optional[str]:
+    if not isinstance(plan, dict):
+        return None
+    if plan.get("indexName"):
+        return plan["indexName"]
+    for key in ("queryPlan", "inputStage"):
+        if key in plan:
+            name = _find_index_name(plan[key])
+            if name:
+                return name
+    for child in plan.get("inputStages", []):
+        name = _find_index_name(child)
+        if name:
+            return name
+    return None
+
+def format_report(results: List[Dict[str, Any]]) -> str:
+    lines = []
+    for item in results:
+        if item["collscan"]:
+            mark = "❌ COLLSCAN"
+        elif item["in_memory_sort"]:
+            mark = "⚠️ SORT"
+        else:
+            mark = "✅"
+        lines.append(
+            f"{mark:12} {item['collection']}.{item['name']}: "
+            f"{' <- '.join(item['stages'])} (index: {item['index'] or '-'}) [{item['source']}]"
+        )
+    collscans = sum(1 for item in results if item["collscan"])
+    lines.append(f"\nЗапросов: {len(results)}, COLLSCAN: {collscans}")
+    return "\n".join(lines)
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="explain() по каталогу запросов приложения")
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    args = parser.parse_args(argv)
+
+    from db.mongo import get_db
+    db = await get_db()
+    results = await explain_catalog(db)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(format_report(results))
+    return 1 if any(item["collscan"] for item in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,274 @@
+"""
+Декларативный реестр индексов MongoDB.
+
+Каждый индекс соответствует конкретной форме запроса приложения
+(равенство -> сортировка -> диапазон). При старте init_indexes сравнивает
+реестр с фактическими индексами коллекций: недостающие создаются,
+устаревшие (отсутствующие в реестре) удаляются.
+
+Коллекции с неизменившимся реестром (отпечаток в schema_meta) не проверяются.
+После ручного изменения индексов в базе:
+    python -m db.indexes --force
+"""
+import asyncio
+import sys
+import time
+from typing import Dict, List, Any, Tuple
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel
+from db.schema_meta import fingerprint, load_fingerprints, save_fingerprints
+from config import AUDIT_RETENTION_DAYS, SHIFT_HISTORY_RETENTION_DAYS
+import logging
+
+logger = logging.getLogger(__name__)
+
+_META_KEY = "indexes"
+
+# Опции, которые влияют на идентичность индекса
+_IDENTITY_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+class IndexSpec:
+    """Описание индекса: ключи, опции и форма запроса, которую он обслуживает"""
+
+    def __init__(self, keys: List[Tuple[str, Any]], purpose: str = "", **options):
+        self.keys = list(keys)
+        self.purpose = purpose
+        self.options = options
+
+    @property
+    def name(self) -> str:
+        """Имя индекса в формате MongoDB по умолчанию (field_1_field_-1)"""
+        return self.options.get("name") or "_".join(f"{field}_{direction}" for field, direction in self.keys)
+
+    def identity(self) -> Tuple:
+        return (
+            tuple(self.keys),
+            tuple((opt, _freeze(self.options.get(opt))) for opt in _IDENTITY_OPTIONS if self.options.get(opt) is not None)
+        )
+
+    def to_model(self) -> IndexModel:
+        return IndexModel(self.keys, name=self.name, **{k: v for k, v in self.options.items() if k != "name"})
+
+def _retention_index(days: int) -> List[IndexSpec]:
+    """TTL индекс по timestamp (срок хранения журнала), пусто при days=0"""
+    if days <= 0:
+        return []
+    return [IndexSpec([("timestamp", ASCENDING)], "срок хранения журнала (TTL)", expireAfterSeconds=days * 24 * 60 * 60)]
+
+INDEXES: Dict[str, List[IndexSpec]] = {
+    "couriers": [
+        IndexSpec([("tg_chat_id", ASCENDING)], "поиск курьера по chat_id", unique=True),
+        IndexSpec([("name", ASCENDING)], "списки курьеров по имени"),
+        IndexSpec([("is_on_shift", ASCENDING)], "курьеры на смене"),
+        IndexSpec([("last_location.geo", GEOSPHERE)], "курьеры рядом с точкой ($geoNear)"),
+    ],
+    "couriers_deliveries": [
+        IndexSpec([("external_id", ASCENDING)], "поиск заказа по external_id", unique=True),
+        IndexSpec(
+            [("courier_tg_chat_id", ASCENDING), ("status", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)],
+            "активные/ожидающие заказы курьера с сортировкой по приоритету"
+        ),
+        IndexSpec(
+            [("courier_tg_chat_id", ASCENDING), ("status", ASCENDING), ("created_at", ASCENDING)],
+            "статистика курьера: заказы в статусе с даты создания"
+        ),
+        IndexSpec(
+            [("courier_tg_chat_id", ASCENDING), ("status", ASCENDING), ("updated_at", DESCENDING)],
+            "закрытые заказы курьера, подсчет за смену по updated_at"
+        ),
+        IndexSpec(
+            [("courier_tg_chat_id", ASCENDING), ("created_at", DESCENDING)],
+            "заказы курьера за период, история"
+        ),
+        IndexSpec(
+            [("status", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)],
+            "все активные заказы (админ)"
+        ),
+        IndexSpec([("status", ASCENDING), ("updated_at", DESCENDING)], "сводка доставок по статусу за день"),
+        IndexSpec([("status", ASCENDING), ("status_history.done", ASCENDING)], "агрегаты времени доставки по дню выполнения"),
+    ],
+    "order_messages": [
+        IndexSpec([("chat_id", ASCENDING), ("message_id", ASCENDING)], "сообщение в чате (сверка)", unique=True),
+        IndexSpec([("chat_id", ASCENDING), ("external_id", ASCENDING)], "сообщения заказов в чате курьера"),
+        IndexSpec([("external_id", ASCENDING)], "сообщения заказа во всех чатах"),
+    ],
+    "delivery_stats_daily": [
+        IndexSpec([("day", ASCENDING), ("chat_id", ASCENDING)], "процентили времени доставки за период"),
+    ],
+    # Журналы аудита пишутся в каждом обработчике: минимум индексов на вставку
+    "ship_bot_user_action": [
+        IndexSpec([("user_id", ASCENDING), ("timestamp", DESCENDING)], "действия пользователя за период"),
+        IndexSpec(
+            [("order_id", ASCENDING)], "действия по заказу",
+            partialFilterExpression={"order_id": {"$type": "string"}}
+        ),
+        *_retention_index(AUDIT_RETENTION_DAYS),
+    ],
+    "locations": [
+        IndexSpec([("chat_id", ASCENDING), ("timestamp_ns", DESCENDING)], "последняя локация и маршрут курьера"),
+        IndexSpec([("timestamp_ns", DESCENDING)], "очистка старых локаций"),
+        IndexSpec([("shift_id", ASCENDING), ("timestamp_ns", ASCENDING)], "трек смены по времени"),
+    ],
+    "courier_counters": [
+        IndexSpec([("chat_id", ASCENDING), ("day", ASCENDING)], "счетчики курьера за день/период", unique=True),
+    ],
+    "shift_history": [
+        IndexSpec([("courier_tg_chat_id", ASCENDING), ("timestamp", DESCENDING)], "история смен курьера"),
+        IndexSpec([("shift_id", ASCENDING)], "события смены"),
+        *_retention_index(SHIFT_HISTORY_RETENTION_DAYS),
+    ],
+}
+
+def _normalize_direction(value: Any) -> Any:
+    # index_information() может вернуть 1.0 вместо 1
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def _freeze(value: Any) -> Any:
+    """Хешируемое значение опции: partialFilterExpression - вложенный dict"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return _normalize_direction(value)
+
+def _existing_identity(info: Dict[str, Any]) -> Tuple:
+    keys = tuple((field, _normalize_direction(direction)) for field, direction in info["key"])
+    options = []
+    for opt in _IDENTITY_OPTIONS:
+        value = info.get(opt)
+        if value is not None and value is not False:
+            options.append((opt, _freeze(value)))
+    return keys, tuple(options)
+
+async def diff_collection_indexes(collection, specs: List[IndexSpec]) -> Tuple[List[IndexSpec], List[str]]:
+    """
+    Сравнивает реестр с фактическими индексами коллекции.
+
+    Returns:
+        (индексы для создания, имена индексов для удаления)
+    """
+    existing = await collection.index_information()
+    existing_by_identity = {
+        _existing_identity(info): name
+        for name, info in existing.items()
+        if name != "_id_"
+    }
+    wanted = {spec.identity(): spec for spec in specs}
+
+    to_create = [spec for identity, spec in wanted.items() if identity not in existing_by_identity]
+    to_drop = [name for identity, name in existing_by_identity.items() if identity not in wanted]
+
+    # Индекс с тем же именем, но другими опциями нужно пересоздать
+    create_names = {spec.name for spec in to_create}
+    for name in create_names:
+        if name in existing and name not in to_drop:
+            to_drop.append(name)
+    return to_create, to_drop
+
+def collection_fingerprint(specs: List[IndexSpec]) -> str:
+    """Отпечаток реестра индексов коллекции (ключи и опции, без описаний)"""
+    return fingerprint([
+        [[list(key) for key in spec.keys], sorted((k, v) for k, v in spec.options.items())]
+        for spec in specs
+    ])
+
+async def sync_collection_indexes(collection, specs: List[IndexSpec], drop_obsolete: bool = True) -> Dict[str, List[str]]:
+    """
+    Приводит индексы одной коллекции в соответствие с реестром.
+
+    Returns:
+        {"created": [...], "dropped": [...]}
+    """
+    collection_name = collection.name
+    to_create, to_drop = await diff_collection_indexes(collection, specs)
+
+    # Индексы с тем же именем, но другими опциями удаляем до создания,
+    # остальные устаревшие - после, чтобы запросы не оставались без индекса
+    create_names = {spec.name for spec in to_create}
+    conflicting = [name for name in to_drop if name in create_names]
+    obsolete = [name for name in to_drop if name not in create_names] if drop_obsolete else []
+
+    dropped = []
+    for name in conflicting:
+        await collection.drop_index(name)
+        dropped.append(name)
+        logger.info("[INDEXES] 🔄 %s: индекс %s будет пересоздан", collection_name, name)
+
+    created = []
+    if to_create:
+        created = await collection.create_indexes([spec.to_model() for spec in to_create])
+        for name in created:
+            logger.info("[INDEXES] ✅ %s: создан индекс %s", collection_name, name)
+
+    for name in obsolete:
+        await collection.drop_index(name)
+        dropped.append(name)
+        logger.info("[INDEXES] 🗑️ %s: удален индекс %s", collection_name, name)
+
+    return {"created": created, "dropped": dropped}
+
+async def sync_indexes(db, drop_obsolete: bool = True, force: bool = False) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Приводит индексы коллекций в соответствие с реестром INDEXES.
+
+    Коллекции, реестр которых не изменился с прошлой успешной синхронизации
+    (отпечаток в schema_meta), пропускаются; остальные синхронизируются параллельно.
+
+    Args:
+        db: База данных Motor
+        drop_obsolete: Удалять индексы, отсутствующие в реестре
+        force: Проверить все коллекции, игнорируя сохраненные отпечатки
+            (например, после ручного удаления индекса)
+
+    Returns:
+        {collection: {"created": [...], "dropped": [...]}}
+    """
+    started = time.perf_counter()
+    wanted = {name: collection_fingerprint(specs) for name, specs in INDEXES.items()}
+    stored = {} if force else await load_fingerprints(db, _META_KEY)
+    changed = [name for name, value in wanted.items() if stored.get(name) != value]
+    if not changed:
+        logger.debug("[INDEXES] Реестр индексов не изменился, проверка пропущена (%s коллекций)", len(wanted))
+        return {}
+
+    results = await asyncio.gather(
+        *(sync_collection_indexes(db[name], INDEXES[name], drop_obsolete) for name in changed),
+        return_exceptions=True
+    )
+
+    report = {}
+    synced = {}
+    errors = []
+    for name, result in zip(changed, results):
+        if isinstance(result, Exception):
+            errors.append(f"{name}: {result}")
+            continue
+        synced[name] = wanted[name]
+        if result["created"] or result["dropped"]:
+            report[name] = result
+    # Отпечатки сохраняются только для успешно синхронизированных коллекций
+    await save_fingerprints(db, _META_KEY, synced)
+    logger.info(
+        "[INDEXES] ⏱️ Синхронизация индексов: %s из %s коллекций за %.0f ms",
+        len(changed), len(wanted), (time.perf_counter() - started) * 1000
+    )
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return report
+
+async def main(argv=None) -> int:
+    import argparse
+    from db.mongo import get_db
+    parser = argparse.ArgumentParser(description="Синхронизация индексов MongoDB с реестром db.indexes.INDEXES")
+    parser.add_argument("--force", action="store_true", help="проверить все коллекции, игнорируя отпечатки")
+    parser.add_argument("--keep-obsolete", action="store_true", help="не удалять индексы, отсутствующие в реестре")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    db = await get_db()
+    report = await sync_indexes(db, drop_obsolete=not args.keep_obsolete, force=args.force)
+    print(f"Изменения: {report or 'нет'}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,152 @@
+"""
+Реестр сообщений о заказах в чатах курьеров (коллекция order_messages).
+
+Документ на каждое отправленное сообщение:
+    {chat_id, external_id, message_id, content_hash, created_at}
+content_hash - хеш текста и клавиатуры (utils.order_messages.render_hash),
+по нему сверка сообщений редактирует только изменившиеся.
+
+Индексы (chat_id, message_id), (chat_id, external_id) и external_id позволяют
+одним запросом найти все сообщения заказа во всех чатах или все сообщения чата.
+
+Раньше message_id хранились в заказе (courier_message_ids, courier_message_hashes).
+Перенос в реестр выполняется при запуске бота (роль scheduler/all, db.mongo.migrate_order_messages),
+вручную:
+    python -m db.message_registry
+"""
+import argparse
+import asyncio
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pymongo import DeleteMany, UpdateOne
+from db.models import utcnow
+import logging
+
+logger = logging.getLogger(__name__)
+
+_PROJECTION = {"chat_id": 1, "external_id": 1, "message_id": 1, "content_hash": 1}
+
+def _register_request(chat_id: int, external_id: str, message_id: int, content_hash: Optional[str]) -> UpdateOne:
+    return UpdateOne(*_register_update(chat_id, external_id, message_id, content_hash), upsert=True)
+
+def _register_update(chat_id: int, external_id: str, message_id: int, content_hash: Optional[str]):
+    return (
+        {"chat_id": chat_id, "message_id": message_id},
+        {"$set": {"external_id": external_id, "content_hash": content_hash}, "$setOnInsert": {"created_at": utcnow()}},
+    )
+
+async def register(db, chat_id: int, external_id: str, message_id: int, content_hash: Optional[str] = None) -> None:
+    """
+    Сохраняет отправленное сообщение о заказе.
+
+    Args:
+        db: База данных Motor
+        chat_id: Chat ID, куда отправлено сообщение
+        external_id: Номер заказа
+        message_id: ID сообщения из Telegram
+        content_hash: Хеш содержимого (None - неизвестно, сверка отредактирует сообщение)
+    """
+    await db.order_messages.update_one(*_register_update(chat_id, external_id, message_id, content_hash), upsert=True)
+
+async def order_messages(db, external_id: str) -> List[Dict[str, Any]]:
+    """Сообщения заказа во всех чатах"""
+    return await db.order_messages.find({"external_id": external_id}, _PROJECTION).to_list(None)
+
+async def chat_messages(
+    db,
+    chat_id: int,
+    external_ids: Optional[Iterable[str]] = None,
+    exclude: Iterable[str] = ()
+) -> List[Dict[str, Any]]:
+    """
+    Сообщения о заказах в чате.
+
+    Args:
+        db: База данных Motor
+        chat_id: Chat ID
+        external_ids: Только эти заказы (None - все)
+        exclude: Кроме этих заказов
+    """
+    query: Dict[str, Any] = {"chat_id": chat_id}
+    exclude = set(exclude)
+    if external_ids is not None:
+        query["external_id"] = {"$in": [external_id for external_id in external_ids if external_id not in exclude]}
+    elif exclude:
+        query["external_id"] = {"$nin": list(exclude)}
+    return await db.order_messages.find(query, _PROJECTION).to_list(None)
+
+async def forget(db, entries: List[Dict[str, Any]]) -> None:
+    """Удаляет записи реестра (документы chat_messages / order_messages)"""
+    if entries:
+        await db.order_messages.delete_many({"_id": {"$in": [entry["_id"] for entry in entries]}})
+
+async def apply_reconcile(
+    db,
+    chat_id: int,
+    edited: Dict[int, str],
+    sent: List[Tuple[str, int, str]],
+    removed: List[int]
+) -> None:
+    """
+    Записывает результат сверки сообщений чата одним bulk_write.
+
+    Args:
+        db: База данных Motor
+        chat_id: Chat ID курьера
+        edited: message_id -> новый content_hash
+        sent: (external_id, message_id, content_hash) отправленных сообщений
+        removed: message_id удаляемых сообщений
+    """
+    requests = [
+        UpdateOne({"chat_id": chat_id, "message_id": message_id}, {"$set": {"content_hash": content_hash}})
+        for message_id, content_hash in edited.items()
+    ]
+    requests += [_register_request(chat_id, *message) for message in sent]
+    if removed:
+        requests.append(DeleteMany({"chat_id": chat_id, "message_id": {"$in": removed}}))
+    if requests:
+        await db.order_messages.bulk_write(requests, ordered=False)
+
+async def migrate_legacy(db) -> int:
+    """
+    Переносит courier_message_ids / courier_message_hashes из заказов в реестр.
+
+    Returns:
+        int: Число перенесенных сообщений
+    """
+    moved = 0
+    cursor = db.couriers_deliveries.find(
+        {"courier_message_ids.0": {"$exists": True}},
+        {"external_id": 1, "courier_tg_chat_id": 1, "courier_message_ids": 1, "courier_message_hashes": 1}
+    )
+    async for order in cursor:
+        chat_id = order.get("courier_tg_chat_id")
+        hashes = order.get("courier_message_hashes") or {}
+        requests = [
+            _register_request(chat_id, order["external_id"], message_id, hashes.get(str(message_id)))
+            for message_id in order.get("courier_message_ids") or []
+            if isinstance(message_id, int)
+        ]
+        if chat_id and requests:
+            await db.order_messages.bulk_write(requests, ordered=False)
+            moved += len(requests)
+        await db.couriers_deliveries.update_one(
+            {"_id": order["_id"]},
+            {"$unset": {"courier_message_ids": "", "courier_message_hashes": ""}}
+        )
+    logger.info("[ORDER_MESSAGES] ✅ В реестр перенесено %s сообщений", moved)
+    return moved
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Перенос message_id сообщений о заказах из заказов в реестр order_messages")
+    parser.parse_args(argv)
+
+    from db.mongo import get_db
+    logging.basicConfig(level=logging.INFO)
+    db = await get_db()
+    moved = await migrate_legacy(db)
+    print(f"Перенесено сообщений: {moved}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,170 @@
+"""
+Миграция полей времени из ISO строк в BSON date.
+
+Старые документы хранили created_at/updated_at/status_history.*/shift_started_at/timestamp
+как строки utcnow_iso(). Код читает оба формата (db.models.as_datetime), поэтому миграцию
+можно выполнять на работающем сервисе: преобразование идет на стороне сервера
+update-пайплайном, документы с уже сконвертированными полями не затрагиваются.
+
+Пока миграция не завершена (отпечатки в schema_meta), диапазонные запросы строятся
+через time_range: условие по BSON date дополняется тем же условием по ISO строке,
+иначе несконвертированные документы не попадут в выборку. Агрегации, которые
+форматируют даты на сервере (счетчики, сводки доставок), до завершения пропускаются.
+
+Запуск:
+    python -m db.migrate_timestamps
+
+Откат на релиз со строковыми датами: остановить бот, API и воркеры, затем
+    python -m db.migrate_timestamps --rollback
+(BSON date -> ISO строки в формате utcnow_iso, отпечатки миграции удаляются),
+и запустить предыдущий релиз. При повторном обновлении миграция выполнится заново.
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from config import TIMEZONE
+from db.models import as_datetime
+from db.schema_meta import COLLECTION, fingerprint, load_fingerprints, save_fingerprints
+import logging
+
+logger = logging.getLogger(__name__)
+
+_META_KEY = "timestamp_migration"
+
+_STATUS_HISTORY_KEYS = ("waiting", "in_transit", "done", "cancelled", "paid", "un_paid")
+
+# Поля времени, хранившиеся строками, по коллекциям
+TIMESTAMP_FIELDS: Dict[str, List[str]] = {
+    "couriers_deliveries": ["created_at", "updated_at"] + [f"status_history.{key}" for key in _STATUS_HISTORY_KEYS],
+    "couriers": ["shift_started_at", "last_location.updated_at"],
+    "shift_history": ["timestamp", "shift_started_at"],
+    "ship_bot_user_action": ["timestamp"],
+    "locations": ["timestamp"],
+}
+
+def _conversion_pipeline(field: str) -> List[Dict]:
+    # onError оставляет строку как есть: такие значения продолжают читаться через as_datetime
+    return [{"$set": {field: {"$dateFromString": {"dateString": f"${field}", "onError": f"${field}"}}}}]
+
+def _rollback_pipeline(field: str) -> List[Dict]:
+    # Формат utcnow_iso: 2024-01-31T12:00:00-03:00 (%z дает -0300, двоеточие вставляется отдельно)
+    offset = {"$dateToString": {"date": f"${field}", "format": "%z", "timezone": str(TIMEZONE)}}
+    return [{"$set": {field: {"$concat": [
+        {"$dateToString": {"date": f"${field}", "format": "%Y-%m-%dT%H:%M:%S", "timezone": str(TIMEZONE)}},
+        {"$substrCP": [offset, 0, 3]}, ":", {"$substrCP": [offset, 3, 2]},
+    ]}}}]
+
+# Проверка завершения миграции кешируется: после завершения - навсегда, до - на минуту
+_MIGRATED_RECHECK_SECONDS = 60
+_migrated = False
+_checked_at: Optional[float] = None
+
+async def timestamps_migrated(db) -> bool:
+    """Все коллекции TIMESTAMP_FIELDS сконвертированы (отпечатки в schema_meta совпадают с текущим списком полей)"""
+    global _migrated, _checked_at
+    if _migrated:
+        return True
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < _MIGRATED_RECHECK_SECONDS:
+        return False
+    _checked_at = now
+    stored = await load_fingerprints(db, _META_KEY)
+    _migrated = all(stored.get(name) == fingerprint(fields) for name, fields in TIMESTAMP_FIELDS.items())
+    return _migrated
+
+def time_filter(field: str, bounds: Dict[str, datetime], legacy: bool) -> Dict[str, Any]:
+    """
+    Условие диапазона по полю времени.
+
+    Args:
+        field: Поле времени (created_at, status_history.done, ...)
+        bounds: Операторы диапазона -> datetime ({"$gte": start, "$lt": end})
+        legacy: Учитывать несконвертированные ISO строки (миграция не завершена)
+
+    Returns:
+        {field: bounds} или $or с тем же диапазоном по ISO строкам
+        (строки utcnow_iso в одной таймзоне сравниваются лексикографически)
+    """
+    if not legacy:
+        return {field: bounds}
+    strings = {op: as_datetime(value).isoformat() for op, value in bounds.items()}
+    return {"$or": [{field: bounds}, {field: strings}]}
+
+async def time_range(db, field: str, bounds: Dict[str, datetime]) -> Dict[str, Any]:
+    """Условие диапазона по полю времени с учетом строковых дат до завершения миграции (см. time_filter)"""
+    return time_filter(field, bounds, legacy=not await timestamps_migrated(db))
+
+async def migrate_timestamps(db, force: bool = False) -> Dict[str, int]:
+    """
+    Конвертирует строковые поля времени в BSON date.
+    Коллекции, уже пройденные с тем же списком полей (отпечаток в schema_meta), пропускаются:
+    новые документы пишутся с BSON date, повторное сканирование ничего не изменит.
+
+    Args:
+        db: База данных Motor
+        force: Пройти все коллекции, игнорируя сохраненные отпечатки
+
+    Returns:
+        {"collection.field": количество измененных документов} (только ненулевые)
+    """
+    wanted = {name: fingerprint(fields) for name, fields in TIMESTAMP_FIELDS.items()}
+    stored = {} if force else await load_fingerprints(db, _META_KEY)
+    report = {}
+    for collection_name, fields in TIMESTAMP_FIELDS.items():
+        if stored.get(collection_name) == wanted[collection_name]:
+            continue
+        collection = db[collection_name]
+        for field in fields:
+            result = await collection.update_many(
+                {field: {"$type": "string"}},
+                _conversion_pipeline(field)
+            )
+            if result.modified_count:
+                report[f"{collection_name}.{field}"] = result.modified_count
+                logger.info("[MIGRATION] ✅ %s.%s: сконвертировано %s", collection_name, field, result.modified_count)
+        await save_fingerprints(db, _META_KEY, {collection_name: wanted[collection_name]})
+    global _migrated
+    _migrated = True
+    return report
+
+async def rollback_timestamps(db) -> Dict[str, int]:
+    """
+    Конвертирует BSON date обратно в ISO строки (формат utcnow_iso) для отката на предыдущий релиз.
+    Выполняется на остановленном сервисе: текущий релиз продолжает писать BSON date.
+
+    Returns:
+        {"collection.field": количество измененных документов} (только ненулевые)
+    """
+    report = {}
+    for collection_name, fields in TIMESTAMP_FIELDS.items():
+        collection = db[collection_name]
+        for field in fields:
+            result = await collection.update_many({field: {"$type": "date"}}, _rollback_pipeline(field))
+            if result.modified_count:
+                report[f"{collection_name}.{field}"] = result.modified_count
+                logger.info("[MIGRATION] ↩️ %s.%s: возвращено в строки %s", collection_name, field, result.modified_count)
+    # Без отпечатков следующий запуск текущего релиза снова выполнит миграцию
+    await db[COLLECTION].delete_one({"_id": _META_KEY})
+    return report
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    from db.mongo import get_db
+    parser = argparse.ArgumentParser(description="Конвертация строковых полей времени в BSON date")
+    parser.add_argument("--rollback", action="store_true", help="вернуть BSON date в ISO строки (откат релиза)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    db = await get_db()
+    if args.rollback:
+        report = await rollback_timestamps(db)
+        print(f"Возвращено в строки: {report or 'нечего конвертировать'}")
+        return 0
+    # Ручной запуск проходит все коллекции
+    report = await migrate_timestamps(db, force=True)
+    print(f"Сконвертировано: {report or 'нечего конвертировать'}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -2,12 +2,13 @@ from typing import Optional, List, Dict, Any
 from pydantic import BaseModel, Field
 from datetime import datetime
 from config import TIMEZONE
+from db.audit import write_audit
 
 # --- Order Document Structure ---
 # Заказ в MongoDB (коллекция couriers_deliveries) содержит следующие поля:
-# - courier_message_ids: List[int] = [] - массив message_id сообщений с заказом, 
-#   отправленных курьеру в Telegram. Используется для последующего удаления 
-#   всех сообщений о заказе из чата курьера.
+# - courier_message_ids, courier_message_hashes - устаревшие поля: message_id сообщений
+#   с заказом теперь хранятся в реестре order_messages (db/message_registry.py),
+#   перенос - python -m db.message_registry.
 
 # --- Pydantic schemas for FastAPI input ---
 class IncomingOrder(BaseModel):
@@ -20,6 +21,8 @@ class IncomingOrder(BaseModel):
     contact_url: Optional[str] = None
     address: str
     map_url: Optional[str] = None
+    lat: Optional[float] = Field(default=None, ge=-90, le=90, description="Широта адреса доставки")
+    lon: Optional[float] = Field(default=None, ge=-180, le=180, description="Долгота адреса доставки")
     notes: Optional[str] = None
     brand: Optional[str] = None
     source: Optional[str] = None
@@ -35,6 +38,8 @@ class UpdateOrder(BaseModel):
     priority: Optional[int] = None
     address: Optional[str] = None
     map_url: Optional[str] = None
+    lat: Optional[float] = Field(default=None, ge=-90, le=90)
+    lon: Optional[float] = Field(default=None, ge=-180, le=180)
     notes: Optional[str] = None
 
 # --- Admin API Models ---
@@ -82,6 +87,34 @@ class CourierRouteResponse(BaseModel):
     chat_id: int
     route: RouteData
 
+class NearbyCourier(BaseModel):
+    chat_id: int
+    name: str
+    username: Optional[str] = None
+    distance_m: float
+    lat: float
+    lon: float
+
+class NearbyCouriersResponse(BaseModel):
+    ok: bool = True
+    center: Dict[str, float]
+    radius_m: float
+    couriers: List[NearbyCourier]
+
+class SuggestedCourier(BaseModel):
+    chat_id: int
+    name: str
+    username: Optional[str] = None
+    score: float
+    distance_m: Optional[float] = None
+    waiting: int
+    in_transit: int
+
+class SuggestedCouriersResponse(BaseModel):
+    ok: bool = True
+    external_id: str
+    couriers: List[SuggestedCourier]
+
 class PaginationInfo(BaseModel):
     page: int
     per_page: int
@@ -117,47 +150,108 @@ class CloseShiftResponse(BaseModel):
     ok: bool = True
     chat_id: int
     message: str
+    track_stats: Optional[Dict[str, Any]] = None
+
+class QueryOffender(BaseModel):
+    handler: str
+    flagged: int
+    max_roundtrips: int
+    avg_roundtrips: float
+    reasons: Dict[str, int]
+    top_repeated_shape: Optional[str] = None
+    top_repeated_count: int = 0
+    last_seen: Optional[float] = None
+
+class QueryOffendersResponse(BaseModel):
+    ok: bool = True
+    roundtrip_budget: int
+    repeat_threshold: int
+    offenders: List[QueryOffender]
 
 # Helpers
+def utcnow() -> datetime:
+    """
+    Возвращает текущее время в таймзоне Buenos Aires (без микросекунд).
+    Используется для всех полей времени в MongoDB - хранится как BSON date.
+    """
+    return datetime.now(TIMEZONE).replace(microsecond=0)
+
 def utcnow_iso() -> str:
-    """Возвращает текущее время в таймзоне Buenos Aires в ISO формате"""
-    now = datetime.now(TIMEZONE)
-    return now.replace(microsecond=0).isoformat()
+    """Возвращает текущее время в таймзоне Buenos Aires в ISO формате (для webhook и внешних JSON)"""
+    return utcnow().isoformat()
+
+def as_datetime(value: Any) -> Optional[datetime]:
+    """
+    Приводит значение поля времени к datetime в таймзоне Buenos Aires.
+    Принимает BSON date (datetime) и ISO-строки документов, записанных до миграции.
+
+    Returns:
+        datetime или None, если значение пустое или не распознано
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    elif isinstance(value, str):
+        try:
+            dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    else:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=TIMEZONE)
+    return dt.astimezone(TIMEZONE)
+
+def to_iso(value: Any) -> Optional[str]:
+    """Форматирует поле времени (datetime или ISO-строка) в ISO строку для JSON"""
+    dt = as_datetime(value)
+    return dt.isoformat() if dt else value
+
+def json_compatible(value: Any) -> Any:
+    """Рекурсивно заменяет datetime на ISO строки (для отправки документов в JSON)"""
+    if isinstance(value, datetime):
+        return to_iso(value)
+    if isinstance(value, dict):
+        return {k: json_compatible(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_compatible(v) for v in value]
+    return value
 
 ORDER_STATUSES = ("waiting", "in_transit", "done", "cancelled")
 PAYMENT_STATUSES = ("NOT_PAID", "PAID", "REFUND")
 
-def get_status_history_update(order: Dict[str, Any], new_status: Optional[str] = None, new_payment_status: Optional[str] = None) -> Dict[str, Any]:
+def payment_history_key(payment_status: str) -> str:
     """
-    Создает обновление для MongoDB с записью статуса и времени в историю заказа.
+    Ключ истории статусов для статуса оплаты.
+    Маппинг: NOT_PAID -> un_paid, PAID -> paid, REFUND -> paid (отмена заказа тоже считается как paid)
+    """
+    return "un_paid" if payment_status == "NOT_PAID" else "paid"
+
+def status_history_fields(new_status: Optional[str] = None, new_payment_status: Optional[str] = None, at: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Создает поля $set с записью статуса и времени в историю заказа.
+    Используются точечные ключи (status_history.<key>), поэтому история
+    не перечитывается и не перезаписывается целиком.
     
     Args:
-        order: Текущий документ заказа из БД
         new_status: Новый статус заказа (waiting, in_transit, done, cancelled)
         new_payment_status: Новый статус оплаты (NOT_PAID, PAID, REFUND)
+        at: Время изменения (по умолчанию - текущее)
     
     Returns:
-        Словарь с обновлением для MongoDB ($set операция)
+        Словарь для $set, например {"status_history.done": datetime}
     """
-    # Получаем текущую историю статусов или создаем новую
-    status_history = order.get("status_history", {})
-    current_time = utcnow_iso()
+    current_time = at or utcnow()
+    fields = {}
     
-    # Если передан новый статус заказа, записываем его
     if new_status and new_status in ORDER_STATUSES:
-        status_history[new_status] = current_time
+        fields[f"status_history.{new_status}"] = current_time
     
-    # Если передан новый статус оплаты, маппим его и записываем
     if new_payment_status and new_payment_status in PAYMENT_STATUSES:
-        # Маппинг: NOT_PAID -> un_paid, PAID -> paid, REFUND -> paid (отмена заказа тоже считается как paid)
-        if new_payment_status == "NOT_PAID":
-            payment_status_key = "un_paid"
-        else:  # PAID или REFUND
-            payment_status_key = "paid"
-        status_history[payment_status_key] = current_time
+        fields[f"status_history.{payment_history_key(new_payment_status)}"] = current_time
     
-    # Возвращаем обновление для MongoDB
-    return {"status_history": status_history}
+    return fields
 
 # Action types
 ACTION_TYPES = (
@@ -197,14 +291,14 @@ class Action:
             "order_id": order_id,
             "details": details or {},
             "metadata": metadata or {},
-            "timestamp": utcnow_iso()
+            "timestamp": utcnow()
         }
     
     @staticmethod
     async def log(db, user_id: int, action_type: str, **kwargs):
-        """Быстрое логирование действия"""
+        """Быстрое логирование действия (через буфер аудита, без ожидания записи)"""
         action = Action.create(user_id, action_type, **kwargs)
-        await db.ship_bot_user_action.insert_one(action)
+        await write_audit(db.ship_bot_user_action, action)
 
 class ShiftHistory:
     """Модель для истории смен курьеров"""
@@ -216,7 +310,8 @@ class ShiftHistory:
         shift_id: Optional[str] = None,
         total_orders: int = 0,
         complete_orders: int = 0,
-        shift_started_at: Optional[str] = None
+        shift_started_at: Optional[datetime] = None,
+        track_stats: Optional[dict] = None
     ) -> dict:
         """
         Создает документ истории смены для записи в БД
@@ -227,13 +322,13 @@ class ShiftHistory:
             shift_id: ID смены (опционально)
             total_orders: Общее количество заказов за смену
             complete_orders: Количество завершенных заказов
-            shift_started_at: Время начала смены (ISO формат)
+            shift_started_at: Время начала смены
+            track_stats: Аналитика трека смены (utils/track_stats.py), для shift_ended
         """
-        now = datetime.now(TIMEZONE)
-        timestamp = now.replace(microsecond=0).isoformat()
-        time_readable = now.strftime("%d.%m.%Y %H:%M")
+        timestamp = utcnow()
+        time_readable = timestamp.strftime("%d.%m.%Y %H:%M")
         
-        return {
+        document = {
             "courier_tg_chat_id": courier_tg_chat_id,
             "event": event,
             "shift_id": shift_id,
@@ -241,11 +336,14 @@ class ShiftHistory:
             "complete_orders": complete_orders,
             "timestamp": timestamp,
             "time": time_readable,
-            "shift_started_at": shift_started_at
+            "shift_started_at": as_datetime(shift_started_at)
         }
+        if track_stats is not None:
+            document["track_stats"] = track_stats
+        return document
     
     @staticmethod
     async def log(db, courier_tg_chat_id: int, event: str, **kwargs):
-        """Быстрое логирование истории смены"""
+        """Быстрое логирование истории смены (через буфер аудита, без ожидания записи)"""
         shift_history = ShiftHistory.create(courier_tg_chat_id, event, **kwargs)
-        await db.shift_history.insert_one(shift_history)
+        await write_audit(db.shift_history, shift_history)
@@ -1,37 +1,64 @@
-from typing import Optional
+import asyncio
+from typing import Awaitable, Optional
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
-from pymongo import ASCENDING, DESCENDING
-from config import MONGO_URI, MONGO_DB_NAME
+from config import MONGO_URI, MONGO_DB_NAME, TIMEZONE
+from utils.metrics import mongo_command_metrics
+from utils.query_trace import query_trace_listener
 
 _client: Optional[AsyncIOMotorClient] = None
 
 async def get_db() -> AsyncIOMotorDatabase:
     global _client
     if _client is None:
-        _client = AsyncIOMotorClient(MONGO_URI, uuidRepresentation="standard")
+        # tz_aware: поля времени (BSON date) читаются как datetime в таймзоне приложения
+        # event_listeners: длительность команд для /metrics и трассировка по обработчикам
+        _client = AsyncIOMotorClient(
+            MONGO_URI, uuidRepresentation="standard", tz_aware=True, tzinfo=TIMEZONE,
+            event_listeners=[mongo_command_metrics, query_trace_listener]
+        )
     return _client[MONGO_DB_NAME]
 
 async def init_indexes():
+    """
+    Синхронизирует индексы с декларативным реестром db.indexes.INDEXES:
+    создает недостающие и удаляет устаревшие.
+    """
+    from db.indexes import sync_indexes
     db = await get_db()
-    # Couriers
-    await db.couriers.create_index([("tg_chat_id", ASCENDING)], unique=True)
-    await db.couriers.create_index([("name", ASCENDING)])
-    # Couriers Deliveries
-    await db.couriers_deliveries.create_index([("external_id", ASCENDING)], unique=True)
-    await db.couriers_deliveries.create_index([("assigned_to", ASCENDING)])
-    await db.couriers_deliveries.create_index([("status", ASCENDING)])
-    await db.couriers_deliveries.create_index([("created_at", ASCENDING)])
-    # Actions
-    await db.ship_bot_user_action.create_index([("user_id", ASCENDING)])
-    await db.ship_bot_user_action.create_index([("action_type", ASCENDING)])
-    await db.ship_bot_user_action.create_index([("timestamp", ASCENDING)])
-    await db.ship_bot_user_action.create_index([("order_id", ASCENDING)])
-    # Locations
-    await db.locations.create_index([("chat_id", ASCENDING), ("date", ASCENDING), ("shift_id", ASCENDING)])
-    await db.locations.create_index([("timestamp_ns", DESCENDING)])
-    await db.locations.create_index([("shift_id", ASCENDING)])
-    # Shift History
-    await db.shift_history.create_index([("courier_tg_chat_id", ASCENDING)])
-    await db.shift_history.create_index([("event", ASCENDING)])
-    await db.shift_history.create_index([("shift_id", ASCENDING)])
-    await db.shift_history.create_index([("timestamp", DESCENDING)])
+    return await sync_indexes(db)
+
+async def migrate_timestamp_fields():
+    """
+    Конвертирует оставшиеся строковые поля времени в BSON date (см. db.migrate_timestamps).
+    """
+    from db.migrate_timestamps import migrate_timestamps
+    db = await get_db()
+    return await migrate_timestamps(db)
+
+async def reconcile_counters_on_startup(migration: Optional[Awaitable] = None):
+    """
+    Сверяет счетчики заказов курьеров с заказами за текущий месяц и заказы в работе (см. db.counters).
+    Без сверки при запуске счетчики после развертывания пусты до сверки в 23:00,
+    а заказы, уже бывшие в работе, уводят документ "current" в минус.
+
+    Args:
+        migration: Задача конвертации полей времени (migrate_timestamp_fields).
+            Сверка фильтрует created_at как BSON date и выполняется после нее,
+            иначе документы со строковыми датами не попадут в счетчики за месяц.
+    """
+    from datetime import datetime
+    from db.counters import reconcile_counters
+    if migration is not None:
+        # shield: отмена сверки не прерывает миграцию; ошибка миграции отменяет сверку
+        await asyncio.shield(migration)
+    db = await get_db()
+    return await reconcile_counters(db, days=max(datetime.now(TIMEZONE).day, 2))
+
+async def migrate_order_messages():
+    """
+    Переносит message_id сообщений о заказах из заказов (courier_message_ids) в реестр order_messages.
+    Повторный запуск безопасен: перенесенные поля удаляются из заказа.
+    """
+    from db.message_registry import migrate_legacy
+    db = await get_db()
+    return await migrate_legacy(db)
@@ -1,11 +1,26 @@
+import time
 from typing import Optional
 from redis.asyncio import Redis
 from config import REDIS_URL
+from utils.metrics import REDIS_COMMAND_SECONDS
+
+class InstrumentedRedis(Redis):
+    """Redis-клиент с метрикой длительности команд (shipbot_redis_command_seconds)"""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await super().execute_command(*args, **options)
+            outcome = "ok"
+            return result
+        finally:
+            REDIS_COMMAND_SECONDS.observe(time.perf_counter() - started, command=str(args[0]).upper(), outcome=outcome)
 
 _redis: Optional[Redis] = None
 
 def get_redis() -> Redis:
     global _redis
     if _redis is None:
-        _redis = Redis.from_url(REDIS_URL, decode_responses=True)
+        _redis = InstrumentedRedis.from_url(REDIS_URL, decode_responses=True)
     return _redis
@@ -0,0 +1,39 @@
+"""
+Отпечатки (fingerprint) служебных операций запуска в коллекции schema_meta.
+
+Синхронизация индексов и миграции при запуске пропускаются, если описание
+(реестр индексов коллекции, список мигрируемых полей) не изменилось с прошлого
+успешного выполнения: запуск не ждет index_information() и сканирования коллекций.
+"""
+import hashlib
+import json
+from typing import Any, Dict
+from db.models import utcnow
+
+COLLECTION = "schema_meta"
+
+def fingerprint(value: Any) -> str:
+    """Стабильный хэш JSON-представления описания (порядок ключей не важен)"""
+    raw = json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+async def load_fingerprints(db, key: str) -> Dict[str, str]:
+    """
+    Returns:
+        Сохраненные отпечатки {имя: fingerprint} для операции key (пусто, если еще не выполнялась)
+    """
+    doc = await db[COLLECTION].find_one({"_id": key}, {"fingerprints": 1})
+    return (doc or {}).get("fingerprints", {})
+
+async def save_fingerprints(db, key: str, fingerprints: Dict[str, str]):
+    """Сохраняет отпечатки успешно выполненных частей операции key"""
+    if not fingerprints:
+        return
+    await db[COLLECTION].update_one(
+        {"_id": key},
+        {"$set": {
+            **{f"fingerprints.{name}": value for name, value in fingerprints.items()},
+            "updated_at": utcnow(),
+        }},
+        upsert=True
+    )
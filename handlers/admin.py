@@ -2,14 +2,19 @@ from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+import asyncio
 from typing import Optional, Dict, Any, Tuple
 from datetime import datetime, timedelta
 from db.mongo import get_db
-from keyboards.admin_kb import admin_main_kb, back_to_admin_kb, user_list_kb, confirm_delete_kb, broadcast_kb, request_user_kb, courier_location_kb, courier_location_with_back_kb, location_back_kb, route_back_kb, active_orders_kb, order_edit_kb, courier_list_kb, all_deliveries_kb, all_orders_list_kb, courier_transfer_kb
+from db.migrate_timestamps import time_range
+from keyboards.admin_kb import admin_main_kb, back_to_admin_kb, user_list_kb, confirm_delete_kb, broadcast_kb, request_user_kb, courier_location_kb, courier_location_with_back_kb, location_back_kb, route_back_kb, active_orders_kb, order_edit_kb, courier_list_kb, all_deliveries_kb, delivery_times_kb, all_orders_list_kb, courier_transfer_kb
 from db.redis_client import get_redis
+from db.counters import apply_order_change, get_courier_counters
 from utils.url_shortener import shorten_url
 from utils.test_orders import is_test_order
 from utils.webhooks import send_webhook, prepare_order_data
+from utils.admin_acl import get_admin_acl
+from utils.data_versions import bump_versions
 from config import TIMEZONE
 
 router = Router()
@@ -56,22 +61,8 @@ async def _create_courier_in_odoo(name: str, tg_id: str, username: Optional[str]
         return False
 
 async def is_super_admin(user_id: int) -> bool:
-    import logging
-    logger = logging.getLogger(__name__)
-    db = await get_db()
-    
-    doc = await db.bot_super_admins.find_one()
-    logger.info(f"First doc in bot_super_admins: {doc}")
-    
-    if not doc:
-        logger.warning("No documents found in bot_super_admin collection")
-        return False
-    
-    admins = doc.get("adminsType", {})
-    logger.info(f"adminsType: {admins}")
-    user_type = admins.get(str(user_id))
-    logger.info(f"User {user_id} type: {user_type}")
-    return user_type == "SUPER_ADMIN"
+    """Проверка прав супер-админа по кэшу bot_super_admins (utils/admin_acl.py)"""
+    return await get_admin_acl().is_super_admin(user_id)
 
 # --- Reusable helper functions for API ---
 
@@ -82,30 +73,19 @@ async def get_courier_statistics(chat_id: int, db) -> Dict[str, Any]:
     Returns:
         dict с ключами: total_today, delivered_today, waiting_orders, status, status_text
     """
-    now = datetime.now(TIMEZONE)
-    start_today = datetime(now.year, now.month, now.day, tzinfo=TIMEZONE)
-    
-    total_today = await db.couriers_deliveries.count_documents({
-        "courier_tg_chat_id": chat_id,
-        "created_at": {"$gte": start_today.isoformat()}
-    })
-    
-    delivered_today = await db.couriers_deliveries.count_documents({
-        "courier_tg_chat_id": chat_id,
-        "status": "done",
-        "created_at": {"$gte": start_today.isoformat()}
-    })
-    
-    waiting_orders = await db.couriers_deliveries.count_documents({
-        "courier_tg_chat_id": chat_id,
-        "status": {"$in": ["waiting", "in_transit"]}
-    })
+    # Материализованные счетчики (db.counters) вместо count_documents по заказам
+    counters = await get_courier_counters(db, chat_id)
+    total_today = counters["created"]
+    delivered_today = counters["done"]
+    waiting_orders = counters["waiting"] + counters["in_transit"]
     
     # Определяем статус курьера
-    in_transit_order = await db.couriers_deliveries.find_one({
-        "courier_tg_chat_id": chat_id,
-        "status": "in_transit"
-    })
+    in_transit_order = None
+    if counters["in_transit"]:
+        in_transit_order = await db.couriers_deliveries.find_one(
+            {"courier_tg_chat_id": chat_id, "status": "in_transit"},
+            {"external_id": 1}
+        )
     
     if in_transit_order:
         status_text = f"В пути ({in_transit_order.get('external_id', 'N/A')})"
@@ -126,9 +106,10 @@ async def get_courier_statistics(chat_id: int, db) -> Dict[str, Any]:
         "in_transit_order": in_transit_order
     }
 
-def format_shift_time(shift_started_at: Optional[str]) -> Tuple[str, Optional[str]]:
+def format_shift_time(shift_started_at: Optional[Any]) -> Tuple[str, Optional[str]]:
     """
     Форматирует время начала смены в читаемый формат.
+    Принимает datetime (BSON date) или ISO строку.
     
     Returns:
         tuple: (readable_text, iso_string)
@@ -136,21 +117,14 @@ def format_shift_time(shift_started_at: Optional[str]) -> Tuple[str, Optional[st
     if not shift_started_at:
         return "Не указано", None
     
-    try:
-        if shift_started_at.endswith('Z'):
-            shift_dt = datetime.fromisoformat(shift_started_at.replace('Z', '+00:00'))
-        else:
-            shift_dt = datetime.fromisoformat(shift_started_at)
-        if shift_dt.tzinfo is None:
-            shift_dt = shift_dt.replace(tzinfo=TIMEZONE)
-        elif shift_dt.tzinfo != TIMEZONE:
-            shift_dt = shift_dt.astimezone(TIMEZONE)
-        months_ru = ["янв", "фев", "мар", "апр", "май", "июн", "июл", "авг", "сен", "окт", "ноя", "дек"]
-        month_ru = months_ru[shift_dt.month - 1]
-        shift_time_text = f"{shift_dt.day} {month_ru}. {shift_dt.strftime('%H:%M')}"
-        return shift_time_text, shift_started_at
-    except:
-        return shift_started_at, shift_started_at
+    from db.models import as_datetime
+    shift_dt = as_datetime(shift_started_at)
+    if shift_dt is None:
+        return str(shift_started_at), str(shift_started_at)
+    months_ru = ["янв", "фев", "мар", "апр", "май", "июн", "июл", "авг", "сен", "окт", "ноя", "дек"]
+    month_ru = months_ru[shift_dt.month - 1]
+    shift_time_text = f"{shift_dt.day} {month_ru}. {shift_dt.strftime('%H:%M')}"
+    return shift_time_text, shift_dt.isoformat()
 
 async def get_courier_location(chat_id: int) -> Optional[Dict[str, Any]]:
     """
@@ -439,6 +413,7 @@ async def process_add_user(message: Message, state: FSMContext, bot: Bot):
         "odoo_id": str(user_id),  # odoo_id = courier_tg_chat_id (основной идентификатор)
     }
     await db.couriers.insert_one(courier)
+    await bump_versions("shift", chat_id=user_id)
     logger.info(f"[ADMIN] ✅ Админ {message.from_user.id} добавил пользователя {user_id} ({full_name}), Odoo: {'создан' if odoo_created else 'ошибка'}")
     
     odoo_status = "\n✅ Odoo: создан/обновлен" if odoo_created else "\n⚠️ Odoo: не создан"
@@ -576,6 +551,7 @@ async def cb_delete_user(call: CallbackQuery):
     
     logger.debug(f"[ADMIN] 💾 Удаление курьера {chat_id} из БД")
     result = await db.couriers.delete_one({"tg_chat_id": chat_id})
+    await bump_versions("shift", chat_id=chat_id)
     
     from db.models import Action
     await Action.log(db, call.from_user.id, "admin_del_user", details={"deleted_user_id": chat_id, "name": courier_name})
@@ -761,7 +737,6 @@ async def cb_on_shift_couriers(call: CallbackQuery):
         return
     
     db = await get_db()
-    from datetime import datetime
     
     # Получаем всех курьеров на смене
     logger.debug(f"[ADMIN] 🔍 Поиск курьеров на смене")
@@ -782,9 +757,6 @@ async def cb_on_shift_couriers(call: CallbackQuery):
     await call.message.delete()
     
     # Для каждого курьера формируем отдельное сообщение
-    now = datetime.now(TIMEZONE)
-    start_today = datetime(now.year, now.month, now.day, tzinfo=TIMEZONE)
-    
     for idx, courier in enumerate(couriers):
         chat_id = courier.get("tg_chat_id")
         name = courier.get("name", "Unknown")
@@ -792,53 +764,14 @@ async def cb_on_shift_couriers(call: CallbackQuery):
         username_text = f"@{username}" if username else ""
         
         # Статистика заказов за сегодня
-        total_today = await db.couriers_deliveries.count_documents({
-            "courier_tg_chat_id": chat_id,
-            "created_at": {"$gte": start_today.isoformat()}
-        })
-        
-        delivered_today = await db.couriers_deliveries.count_documents({
-            "courier_tg_chat_id": chat_id,
-            "status": "done",
-            "created_at": {"$gte": start_today.isoformat()}
-        })
-        
-        waiting_orders = await db.couriers_deliveries.count_documents({
-            "courier_tg_chat_id": chat_id,
-            "status": {"$in": ["waiting", "in_transit"]}
-        })
-        
-        # Определяем статус курьера
-        in_transit_order = await db.couriers_deliveries.find_one({
-            "courier_tg_chat_id": chat_id,
-            "status": "in_transit"
-        })
-        
-        if in_transit_order:
-            status_text = f"В пути ({in_transit_order.get('external_id', 'N/A')})"
-        elif waiting_orders > 0:
-            status_text = "Есть заказы"
-        else:
-            status_text = "Нет заказов"
+        stats = await get_courier_statistics(chat_id, db)
+        total_today = stats["total_today"]
+        delivered_today = stats["delivered_today"]
+        waiting_orders = stats["waiting_orders"]
+        status_text = stats["status_text"]
         
         # Время начала смены
-        shift_started_at = courier.get("shift_started_at")
-        shift_time_text = "Не указано"
-        if shift_started_at:
-            try:
-                if shift_started_at.endswith('Z'):
-                    shift_dt = datetime.fromisoformat(shift_started_at.replace('Z', '+00:00'))
-                else:
-                    shift_dt = datetime.fromisoformat(shift_started_at)
-                if shift_dt.tzinfo is None:
-                    shift_dt = shift_dt.replace(tzinfo=TIMEZONE)
-                elif shift_dt.tzinfo != TIMEZONE:
-                    shift_dt = shift_dt.astimezone(TIMEZONE)
-                months_ru = ["янв", "фев", "мар", "апр", "май", "июн", "июл", "авг", "сен", "окт", "ноя", "дек"]
-                month_ru = months_ru[shift_dt.month - 1]
-                shift_time_text = f"{shift_dt.day} {month_ru}. {shift_dt.strftime('%H:%M')}"
-            except:
-                shift_time_text = shift_started_at
+        shift_time_text, _ = format_shift_time(courier.get("shift_started_at"))
         
         text = (
             f"👤 {name} {username_text}\n\n"
@@ -1063,7 +996,6 @@ async def cb_back_to_courier(call: CallbackQuery):
     try:
         # Перестраиваем текст сообщения из актуальных данных базы
         db = await get_db()
-        from datetime import datetime, timezone
         
         courier = await db.couriers.find_one({"tg_chat_id": chat_id})
         if not courier:
@@ -1074,54 +1006,13 @@ async def cb_back_to_courier(call: CallbackQuery):
         username = courier.get("username")
         username_text = f"@{username}" if username else ""
         
-        now = datetime.now(TIMEZONE)
-        start_today = datetime(now.year, now.month, now.day, tzinfo=TIMEZONE)
-        
-        total_today = await db.couriers_deliveries.count_documents({
-            "courier_tg_chat_id": chat_id,
-            "created_at": {"$gte": start_today.isoformat()}
-        })
-        
-        delivered_today = await db.couriers_deliveries.count_documents({
-            "courier_tg_chat_id": chat_id,
-            "status": "done",
-            "created_at": {"$gte": start_today.isoformat()}
-        })
-        
-        waiting_orders = await db.couriers_deliveries.count_documents({
-            "courier_tg_chat_id": chat_id,
-            "status": {"$in": ["waiting", "in_transit"]}
-        })
-        
-        in_transit_order = await db.couriers_deliveries.find_one({
-            "courier_tg_chat_id": chat_id,
-            "status": "in_transit"
-        })
+        stats = await get_courier_statistics(chat_id, db)
+        total_today = stats["total_today"]
+        delivered_today = stats["delivered_today"]
+        waiting_orders = stats["waiting_orders"]
+        status_text = stats["status_text"]
         
-        if in_transit_order:
-            status_text = f"В пути ({in_transit_order.get('external_id', 'N/A')})"
-        elif waiting_orders > 0:
-            status_text = "Есть заказы"
-        else:
-            status_text = "Нет заказов"
-        
-        shift_started_at = courier.get("shift_started_at")
-        shift_time_text = "Не указано"
-        if shift_started_at:
-            try:
-                if shift_started_at.endswith('Z'):
-                    shift_dt = datetime.fromisoformat(shift_started_at.replace('Z', '+00:00'))
-                else:
-                    shift_dt = datetime.fromisoformat(shift_started_at)
-                if shift_dt.tzinfo is None:
-                    shift_dt = shift_dt.replace(tzinfo=TIMEZONE)
-                elif shift_dt.tzinfo != TIMEZONE:
-                    shift_dt = shift_dt.astimezone(TIMEZONE)
-                months_ru = ["янв", "фев", "мар", "апр", "май", "июн", "июл", "авг", "сен", "окт", "ноя", "дек"]
-                month_ru = months_ru[shift_dt.month - 1]
-                shift_time_text = f"{shift_dt.day} {month_ru}. {shift_dt.strftime('%H:%M')}"
-            except:
-                shift_time_text = shift_started_at
+        shift_time_text, _ = format_shift_time(courier.get("shift_started_at"))
         
         text = (
             f"👤 {name} {username_text}\n\n"
@@ -1258,10 +1149,7 @@ async def cb_all_deliveries(call: CallbackQuery):
     # Обычно done заказы обновляются при завершении, используем updated_at
     delivered_today = await db.couriers_deliveries.count_documents({
         "status": "done",
-        "updated_at": {
-            "$gte": start_today.isoformat(),
-            "$lte": end_today.isoformat()
-        }
+        **await time_range(db, "updated_at", {"$gte": start_today, "$lte": end_today})
     })
     
     text = (
@@ -1274,6 +1162,72 @@ async def cb_all_deliveries(call: CallbackQuery):
     await call.message.edit_text(text, reply_markup=all_deliveries_kb())
     await call.answer()
 
+def _format_seconds(seconds: Optional[float]) -> str:
+    """Длительность для экрана времени доставки: 45 с, 12 мин, 1 ч 05 мин"""
+    if seconds is None:
+        return "—"
+    if seconds < 60:
+        return f"{seconds:.0f} с"
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    return f"{minutes // 60} ч {minutes % 60:02d} мин"
+
+def _format_delivery_metric(metric: Dict[str, Any]) -> str:
+    if not metric.get("count"):
+        return "нет данных"
+    return f"p50 {_format_seconds(metric['p50'])} · p90 {_format_seconds(metric['p90'])}"
+
+@router.callback_query(F.data.startswith("admin:delivery_times:"))
+async def cb_delivery_times(call: CallbackQuery):
+    """Экран 'Время доставки' - процентили забора и доставки по курьерам/брендам/источникам"""
+    import logging
+    from html import escape
+    from aiogram.exceptions import TelegramBadRequest
+    from db.delivery_stats import query_stats
+    logger = logging.getLogger(__name__)
+    
+    if not await is_super_admin(call.from_user.id):
+        await call.answer("❌ Доступ запрещен", show_alert=True)
+        return
+    
+    _, _, days, group_by = call.data.split(":")
+    days = int(days)
+    logger.info(f"[ADMIN] ⏱ Админ {call.from_user.id} запрашивает время доставки за {days} дн. ({group_by})")
+    
+    db = await get_db()
+    today = datetime.now(TIMEZONE).date()
+    report = await query_stats(
+        db, (today - timedelta(days=days - 1)).isoformat(), today.isoformat(),
+        group_by=group_by, percentiles=(50, 90)
+    )
+    
+    titles = {"courier": "курьерам", "brand": "брендам", "source": "источникам"}
+    total = report["total"]
+    lines = [
+        f"⏱ <b>Время доставки за {days} дн.</b> (по {titles[group_by]})",
+        "",
+        f"Доставок: {total['delivery'].get('count', 0)}",
+        f"🕐 Назначен → забрал: {_format_delivery_metric(total['pickup'])}",
+        f"🚚 Забрал → доставил: {_format_delivery_metric(total['delivery'])}",
+    ]
+    max_groups = 15
+    for group in report["groups"][:max_groups]:
+        title = group.get("name") or group["key"] or "—"
+        lines.append("")
+        lines.append(f"<b>{escape(str(title))}</b> · {group['delivery'].get('count', 0)}")
+        lines.append(f"  🕐 {_format_delivery_metric(group['pickup'])}")
+        lines.append(f"  🚚 {_format_delivery_metric(group['delivery'])}")
+    if len(report["groups"]) > max_groups:
+        lines.append(f"\n... и еще {len(report['groups']) - max_groups}")
+    
+    try:
+        await call.message.edit_text("\n".join(lines), parse_mode="HTML", reply_markup=delivery_times_kb(days, group_by))
+    except TelegramBadRequest as e:
+        # Повторное нажатие выбранного периода/группировки: текст не изменился
+        logger.debug(f"[ADMIN] Экран времени доставки не обновлен: {e}")
+    await call.answer()
+
 @router.callback_query(F.data == "admin:view_all_orders")
 async def cb_view_all_orders(call: CallbackQuery):
     """Обработчик кнопки 'Посмотреть все' - показывает список всех активных заказов"""
@@ -1301,7 +1255,7 @@ async def _show_all_orders_page(call: CallbackQuery, page: int = 0):
     # Получаем все активные заказы (waiting и in_transit) без фильтра по курьеру
     all_orders = await db.couriers_deliveries.find({
         "status": {"$in": ["waiting", "in_transit"]}
-    }).sort("priority", -1).sort("created_at", 1).to_list(1000)
+    }).sort([("priority", -1), ("created_at", 1)]).to_list(1000)
     
     if not all_orders:
         await call.message.edit_text(
@@ -1367,7 +1321,7 @@ async def _show_active_orders_page(call: CallbackQuery, chat_id: int, page: int
     all_orders = await db.couriers_deliveries.find({
         "courier_tg_chat_id": chat_id,
         "status": {"$in": ["waiting", "in_transit"]}
-    }).sort("priority", -1).sort("created_at", 1).to_list(100)
+    }).sort([("priority", -1), ("created_at", 1)]).to_list(100)
     
     if not all_orders:
         await call.message.edit_text(
@@ -1470,15 +1424,15 @@ async def cb_order_complete(call: CallbackQuery, bot: Bot):
     
     logger.info(f"[ADMIN] ✅ Админ {call.from_user.id} завершает заказ {external_id}")
     
-    # Проверяем заказ перед действием (для админов allow_admin=True)
-    from handlers.orders import validate_order_for_action
-    is_valid, order, error_msg = await validate_order_for_action(
+    # Атомарно закрываем заказ (waiting/in_transit -> done), записываем что закрыл администратор
+    from utils.order_transitions import transition_order
+    updated_order, error_msg = await transition_order(
         external_id,
-        call.from_user.id,
-        allow_admin=True
+        "done",
+        extra_fields={"closed_by_admin_id": call.from_user.id}
     )
     
-    if not is_valid:
+    if not updated_order:
         logger.warning(f"[ADMIN] ⚠️ Действие отклонено для заказа {external_id}: {error_msg}")
         try:
             await call.message.edit_text(error_msg or "Действие невозможно")
@@ -1491,31 +1445,17 @@ async def cb_order_complete(call: CallbackQuery, bot: Bot):
     
     # Если исходный courier_chat_id не передан, используем текущий из заказа
     if original_courier_chat_id is None:
-        original_courier_chat_id = order.get("courier_tg_chat_id")
+        original_courier_chat_id = updated_order.get("courier_tg_chat_id")
     
     # Для отправки сообщения используем текущего курьера заказа
-    current_courier_chat_id = order.get("courier_tg_chat_id")
-    address = order.get("address", "")
+    current_courier_chat_id = updated_order.get("courier_tg_chat_id")
+    address = updated_order.get("address", "")
     
-    # Удаляем сообщения о заказе перед закрытием
+    # Удаляем сообщения о заказе (id из документа, возвращенного переходом)
     from utils.order_messages import delete_order_messages_from_courier
-    await delete_order_messages_from_courier(bot, order)
+    await delete_order_messages_from_courier(bot, updated_order, refresh=False)
     
-    # Обновляем заказ: статус done, записываем что закрыл администратор
     from db.models import utcnow_iso
-    await db.couriers_deliveries.update_one(
-        {"external_id": external_id},
-        {
-            "$set": {
-                "status": "done",
-                "closed_by_admin_id": call.from_user.id,
-                "updated_at": utcnow_iso()
-            }
-        }
-    )
-    
-    # Получаем обновленный заказ для webhook
-    updated_order = await db.couriers_deliveries.find_one({"external_id": external_id})
     
     # Проверка: если заказ тестовый (отрицательный external_id), не отправляем webhook
     is_test = is_test_order(external_id)
@@ -1596,6 +1536,7 @@ async def cb_order_delete(call: CallbackQuery, bot: Bot):
     
     # Удаляем заказ
     await db.couriers_deliveries.delete_one({"external_id": external_id})
+    await apply_order_change(db, order, None)
     
     # Отправляем сообщение курьеру
     try:
@@ -1636,17 +1577,34 @@ async def cb_order_assign_courier(call: CallbackQuery):
     
     logger.info(f"[ADMIN] 👤 Админ {call.from_user.id} назначает курьера для заказа {external_id}")
     
+    from utils.courier_suggest import ORDER_FIELDS, suggest_couriers
     db = await get_db()
-    couriers = await db.couriers.find().sort("name", 1).to_list(1000)
+    # Список курьеров и поля заказа для подбора читаются параллельно
+    couriers, order = await asyncio.gather(
+        db.couriers.find().sort("name", 1).to_list(1000),
+        db.couriers_deliveries.find_one({"external_id": external_id}, ORDER_FIELDS)
+    )
     
     if not couriers:
         await call.answer("❌ Нет доступных курьеров", show_alert=True)
         return
     
+    # Рекомендованные курьеры на смене (по расстоянию и загрузке)
+    suggestions = []
+    if order:
+        try:
+            suggestions = await suggest_couriers(order, limit=5)
+        except Exception as e:
+            logger.warning(f"[ADMIN] ⚠️ Не удалось подобрать курьеров для заказа {external_id}: {e}", exc_info=True)
+    
+    text = f"👤 Назначить курьера для заказа {external_id}:\n\nВыберите курьера:"
+    if suggestions:
+        text += "\n⭐ - рекомендованные курьеры на смене (расстояние, активные заказы)"
+    
     # Передаем исходный courier_chat_id в клавиатуру для сохранения контекста
     await call.message.edit_text(
-        f"👤 Назначить курьера для заказа {external_id}:\n\nВыберите курьера:",
-        reply_markup=courier_list_kb(couriers, external_id, original_courier_chat_id)
+        text,
+        reply_markup=courier_list_kb(couriers, external_id, original_courier_chat_id, suggestions)
     )
     await call.answer()
 
@@ -1704,17 +1662,18 @@ async def cb_assign_courier(call: CallbackQuery, bot: Bot):
         await delete_order_messages_from_courier(bot, order)
     
     # Обновляем заказ в БД
-    from db.models import utcnow_iso
+    from db.models import utcnow
     await db.couriers_deliveries.update_one(
         {"external_id": external_id},
         {
             "$set": {
                 "courier_tg_chat_id": new_courier_chat_id,
                 "assigned_to": new_courier["_id"],
-                "updated_at": utcnow_iso()
+                "updated_at": utcnow()
             }
         }
     )
+    await apply_order_change(db, order, {**order, "courier_tg_chat_id": new_courier_chat_id})
     
     # Обновляем курьера заказа в Odoo
     try:
@@ -1748,8 +1707,8 @@ async def cb_assign_courier(call: CallbackQuery, bot: Bot):
             reply_markup=kb
         )
         # Сохраняем message_id в заказе
-        from utils.order_messages import save_order_message_id
-        await save_order_message_id(order, message.message_id)
+        from utils.order_messages import save_order_message_id, render_hash
+        await save_order_message_id(order, message.message_id, render_hash(text, kb))
     except Exception as e:
         logger.warning(f"[ADMIN] ⚠️ Не удалось отправить сообщение новому курьеру {new_courier_chat_id}: {e}")
     
@@ -1854,17 +1813,17 @@ async def cb_transfer_orders(call: CallbackQuery, bot: Bot):
         return
     
     # Передаем заказы новому курьеру
-    from db.models import utcnow_iso
+    from db.models import utcnow
     from utils.odoo import update_order_courier
     
+    # Удаляем сообщения о заказах у старого курьера: несколько deleteMessages на весь чат
+    from utils.order_messages import clear_chat_order_messages
+    await clear_chat_order_messages(bot, courier_to_close_chat_id, [order.get("external_id") for order in active_orders])
+    
     transferred_count = 0
     for order in active_orders:
         external_id = order.get("external_id")
         try:
-            # Удаляем сообщения у старого курьера перед передачей
-            from utils.order_messages import delete_order_messages_from_courier
-            await delete_order_messages_from_courier(bot, order)
-            
             # Обновляем в БД
             await db.couriers_deliveries.update_one(
                 {"external_id": external_id},
@@ -1872,10 +1831,11 @@ async def cb_transfer_orders(call: CallbackQuery, bot: Bot):
                     "$set": {
                         "courier_tg_chat_id": new_courier_chat_id,
                         "assigned_to": new_courier["_id"],
-                        "updated_at": utcnow_iso()
+                        "updated_at": utcnow()
                     }
                 }
             )
+            await apply_order_change(db, order, {**order, "courier_tg_chat_id": new_courier_chat_id})
             
             # Обновляем в Odoo
             try:
@@ -1910,8 +1870,8 @@ async def cb_transfer_orders(call: CallbackQuery, bot: Bot):
                     reply_markup=kb
                 )
                 # Сохраняем message_id в заказе
-                from utils.order_messages import save_order_message_id
-                await save_order_message_id(updated_order, message.message_id)
+                from utils.order_messages import save_order_message_id, render_hash
+                await save_order_message_id(updated_order, message.message_id, render_hash(text, kb))
             except Exception as e:
                 logger.warning(f"[ADMIN] ⚠️ Не удалось отправить сообщение новому курьеру {new_courier_chat_id} о заказе {order.get('external_id')}: {e}")
     except Exception as e:
@@ -1942,6 +1902,7 @@ async def _close_shift_final(call: CallbackQuery, bot: Bot, courier_chat_id: int
     """Финальное закрытие смены курьера"""
     import logging
     logger = logging.getLogger(__name__)
+    from db.models import as_datetime
     
     db = await get_db()
     redis = get_redis()
@@ -1952,7 +1913,7 @@ async def _close_shift_final(call: CallbackQuery, bot: Bot, courier_chat_id: int
         return
     
     # Сохраняем время начала смены для подсчета заказов
-    shift_started_at = courier.get("shift_started_at")
+    shift_started_at = as_datetime(courier.get("shift_started_at"))
     current_shift_id = courier.get("current_shift_id")
     user_id = courier_chat_id  # Используем chat_id как user_id
     
@@ -1964,12 +1925,12 @@ async def _close_shift_final(call: CallbackQuery, bot: Bot, courier_chat_id: int
         try:
             orders_count = await db.couriers_deliveries.count_documents({
                 "courier_tg_chat_id": courier_chat_id,
-                "created_at": {"$gte": shift_started_at}
+                **await time_range(db, "created_at", {"$gte": shift_started_at})
             })
             complete_orders_count = await db.couriers_deliveries.count_documents({
                 "courier_tg_chat_id": courier_chat_id,
                 "status": "done",
-                "created_at": {"$gte": shift_started_at}
+                **await time_range(db, "created_at", {"$gte": shift_started_at})
             })
         except Exception as e:
             logger.warning(f"[ADMIN] ⚠️ Ошибка подсчета заказов за смену: {e}", exc_info=True)
@@ -1980,13 +1941,22 @@ async def _close_shift_final(call: CallbackQuery, bot: Bot, courier_chat_id: int
         {"$set": {"is_on_shift": False}, "$unset": {"current_shift_id": "", "shift_started_at": ""}}
     )
     
+    await bump_versions("shift", chat_id=courier_chat_id)
+    
     # Удаляем данные из Redis
     await redis.delete(f"courier:shift:{courier_chat_id}")
-    await redis.delete(f"courier:loc:{courier_chat_id}")
+    from utils.courier_geo import remove_courier_position
+    await remove_courier_position(courier_chat_id)
+    
+    # Убираем из чата оставшиеся сообщения о заказах (заказы в работе не трогаем)
+    from utils.order_messages import clear_chat_order_messages
+    await clear_chat_order_messages(bot, courier_chat_id, keep_active=True)
     
     # Записываем в историю
     from db.models import Action, ShiftHistory
     await Action.log(db, user_id, "shift_end")
+    from utils.track_stats import shift_track_stats, format_track_stats
+    track_stats = await shift_track_stats(db, courier_chat_id, current_shift_id)
     await ShiftHistory.log(
         db,
         courier_chat_id,
@@ -1994,7 +1964,8 @@ async def _close_shift_final(call: CallbackQuery, bot: Bot, courier_chat_id: int
         shift_id=current_shift_id,
         total_orders=orders_count,
         complete_orders=complete_orders_count,
-        shift_started_at=shift_started_at
+        shift_started_at=shift_started_at,
+        track_stats=track_stats
     )
     
     # Обновление статуса в Odoo
@@ -2004,12 +1975,13 @@ async def _close_shift_final(call: CallbackQuery, bot: Bot, courier_chat_id: int
     except Exception as e:
         logger.warning(f"[ADMIN] ⚠️ Не удалось обновить статус курьера в Odoo: {e}")
     
-    # Отправляем сообщение курьеру
+    # Отправляем сообщение курьеру (с пробегом и стоянками, если трек есть)
+    courier_text = "🔴 Ваша смена завершена офис-менеджером."
+    stats_text = format_track_stats(track_stats)
+    if stats_text:
+        courier_text += "\n" + stats_text
     try:
-        await bot.send_message(
-            courier_chat_id,
-            "🔴 Ваша смена завершена офис-менеджером.\n\nСпасибо за работу!"
-        )
+        await bot.send_message(courier_chat_id, courier_text + "\n\nСпасибо за работу!")
     except Exception as e:
         logger.warning(f"[ADMIN] ⚠️ Не удалось отправить сообщение курьеру {courier_chat_id}: {e}")
     
@@ -1,16 +1,20 @@
 from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from db.mongo import get_db
+from db.migrate_timestamps import time_range
 from db.redis_client import get_redis
 from keyboards.orders_kb import new_order_kb, in_transit_kb, problem_only_kb
 from keyboards.main_menu import main_menu
 from utils.notifications import notify_manager
 from utils.order_format import format_order_text
 from utils.test_orders import is_test_order
-from config import ORDER_LOCK_TTL, PHOTO_WAIT_TTL, TIMEZONE
-from db.models import utcnow_iso, get_status_history_update
+from config import PHOTO_WAIT_TTL, TIMEZONE
+from db.models import utcnow, utcnow_iso, as_datetime, status_history_fields
+from utils.order_transitions import order_action_error, transition_order, ERROR_NOT_PAID
+from utils.data_versions import bump_versions
 from datetime import datetime, timedelta
 from typing import Optional, Tuple
+from pymongo import ReturnDocument
 import logging
 
 router = Router()
@@ -37,42 +41,35 @@ async def validate_order_for_action(
         - Объект заказа или None
         - Сообщение об ошибке или None
     """
-    import logging
-    logger = logging.getLogger(__name__)
-    
     db = await get_db()
     order = await db.couriers_deliveries.find_one({"external_id": external_id})
     
-    if not order:
-        logger.warning(f"[ORDERS] ⚠️ Заказ {external_id} не найден (возможно удален)")
-        return False, None, "Заказ не найден или удален"
-    
-    # Проверяем, что заказ не закрыт
-    status = order.get("status")
-    if status in ["done", "cancelled"]:
-        logger.warning(f"[ORDERS] ⚠️ Попытка выполнить действие с закрытым заказом {external_id} (status: {status})")
-        return False, order, "Заказ уже закрыт"
-    
-    # Проверяем ожидаемые статусы (если указаны)
-    if expected_statuses and status not in expected_statuses:
-        logger.warning(f"[ORDERS] ⚠️ Неверный статус заказа {external_id}: ожидался {expected_statuses}, получен {status}")
-        return False, order, "Заказ в неверном статусе"
-    
-    # Проверяем, что заказ принадлежит текущему курьеру (если не админ)
-    if not allow_admin:
-        order_courier_chat_id = order.get("courier_tg_chat_id")
-        # Приводим к одному типу для сравнения
-        if isinstance(order_courier_chat_id, str):
-            order_courier_chat_id = int(order_courier_chat_id)
-        if isinstance(user_chat_id, str):
-            user_chat_id = int(user_chat_id)
-            
-        if order_courier_chat_id != user_chat_id:
-            logger.warning(f"[ORDERS] ⚠️ Попытка выполнить действие с заказом {external_id} другого курьера. Заказ: {order_courier_chat_id}, Пользователь: {user_chat_id}")
-            return False, order, "Заказ назначен другому курьеру"
+    error_msg = order_action_error(
+        order,
+        external_id,
+        user_chat_id=None if allow_admin else user_chat_id,
+        expected_statuses=expected_statuses
+    )
+    if error_msg:
+        return False, order, error_msg
     
     return True, order, None
 
+async def answer_order_missing(call: CallbackQuery, external_id: str):
+    """
+    Ответ на callback, если заказ удален во время действия (find_one_and_update вернул None).
+
+    Args:
+        call: Callback курьера
+        external_id: ID заказа
+    """
+    error_msg = order_action_error(None, external_id)
+    try:
+        await call.message.edit_text(error_msg)
+    except:
+        pass
+    await call.answer(error_msg, show_alert=True)
+
 async def validate_courier_shift_and_location(chat_id: int) -> Tuple[bool, Optional[str]]:
     """
     Проверяет условия для действий курьера с заказом:
@@ -117,17 +114,9 @@ async def validate_courier_shift_and_location(chat_id: int) -> Tuple[bool, Optio
     
     # Проверяем, что последнее гео было не позднее 15 минут назад
     try:
-        last_geo_time_str = last_location.get("updated_at")
-        if last_geo_time_str.endswith('Z'):
-            last_geo_time = datetime.fromisoformat(last_geo_time_str.replace('Z', '+00:00'))
-        else:
-            last_geo_time = datetime.fromisoformat(last_geo_time_str)
-        
-        # Конвертируем в таймзону если нужно
-        if last_geo_time.tzinfo is None:
-            last_geo_time = last_geo_time.replace(tzinfo=TIMEZONE)
-        elif last_geo_time.tzinfo != TIMEZONE:
-            last_geo_time = last_geo_time.astimezone(TIMEZONE)
+        last_geo_time = as_datetime(last_location.get("updated_at"))
+        if last_geo_time is None:
+            raise ValueError(f"invalid updated_at: {last_location.get('updated_at')!r}")
         
         now = datetime.now(TIMEZONE)
         time_diff = now - last_geo_time
@@ -208,29 +197,22 @@ async def show_waiting_orders(chat_id: int, message: Message):
     }
     logger.debug(f"[ORDERS] 🔍 MongoDB запрос для ожидающих заказов: {query}")
     
-    cursor = db.couriers_deliveries.find(query).sort("priority", -1).sort("created_at", 1)
+    cursor = db.couriers_deliveries.find(query).sort([("priority", -1), ("created_at", 1)])
     
     found = False
     order_count = 0
-    # Получаем bot из message для удаления сообщений
-    bot = message.bot
+    rendered = []
     
     async for order in cursor:
         found = True
         order_count += 1
         logger.info(f"[ORDERS] ✅ Найден ожидающий заказ #{order_count}: external_id={order.get('external_id')}, priority={order.get('priority')}")
-        
-        # Удаляем старые сообщения этого заказа перед отправкой нового
-        from utils.order_messages import delete_order_messages_from_courier
-        await delete_order_messages_from_courier(bot, order)
-        
-        text = format_order_text(order)
-        sent_message = await message.answer(text, parse_mode="HTML", reply_markup=new_order_kb(order["external_id"]))
-        logger.debug(f"[ORDERS] 📤 Отправлен ожидающий заказ {order.get('external_id')} в chat_id {chat_id}")
-        
-        # Сохраняем message_id в заказе
-        from utils.order_messages import save_order_message_id
-        await save_order_message_id(order, sent_message.message_id)
+        rendered.append((order, format_order_text(order), new_order_kb(order["external_id"])))
+    
+    # Существующие сообщения редактируются только при изменениях, новые отправляются
+    if rendered:
+        from utils.order_messages import reconcile_order_messages
+        await reconcile_order_messages(message.bot, chat_id, rendered)
     
     if not found:
         logger.info(f"[ORDERS] ⚠️ Ожидающих заказов не найдено для chat_id {chat_id}")
@@ -275,33 +257,27 @@ async def show_active_orders(chat_id: int, message: Message):
     }
     logger.debug(f"[ORDERS] 🔍 MongoDB запрос: {query}")
     
-    cursor = db.couriers_deliveries.find(query).sort("priority", -1).sort("created_at", 1)
+    cursor = db.couriers_deliveries.find(query).sort([("priority", -1), ("created_at", 1)])
     
     found = False
     order_count = 0
-    # Получаем bot из message для удаления сообщений
-    bot = message.bot
+    rendered = []
     
     async for order in cursor:
         found = True
         order_count += 1
         logger.info(f"[ORDERS] ✅ Найден активный заказ #{order_count}: external_id={order.get('external_id')}, status={order.get('status')}, priority={order.get('priority')}")
         
-        # Удаляем старые сообщения этого заказа перед отправкой нового
-        from utils.order_messages import delete_order_messages_from_courier
-        await delete_order_messages_from_courier(bot, order)
-        
-        text = format_order_text(order)
         if order["status"] == "waiting":
-            sent_message = await message.answer(text, parse_mode="HTML", reply_markup=new_order_kb(order["external_id"]))
-            logger.debug(f"[ORDERS] 📤 Отправлен ожидающий заказ {order.get('external_id')} в chat_id {chat_id}")
-        elif order["status"] == "in_transit":
-            sent_message = await message.answer(text, parse_mode="HTML", reply_markup=in_transit_kb(order["external_id"], order))
-            logger.debug(f"[ORDERS] 📤 Отправлен заказ в пути {order.get('external_id')} в chat_id {chat_id}")
-        
-        # Сохраняем message_id в заказе
-        from utils.order_messages import save_order_message_id
-        await save_order_message_id(order, sent_message.message_id)
+            kb = new_order_kb(order["external_id"])
+        else:
+            kb = in_transit_kb(order["external_id"], order)
+        rendered.append((order, format_order_text(order), kb))
+    
+    # Существующие сообщения редактируются только при изменениях, новые отправляются
+    if rendered:
+        from utils.order_messages import reconcile_order_messages
+        await reconcile_order_messages(message.bot, chat_id, rendered)
     
     if not found:
         logger.warning(f"[ORDERS] ⚠️ Активных заказов не найдено для chat_id {chat_id}. Всего заказов: {all_orders_count}, Заказов как int: {orders_as_int}")
@@ -316,8 +292,8 @@ async def cb_order_go(call: CallbackQuery, bot: Bot):
     external_id = call.data.split(":", 2)[2]
     logger.info(f"[ORDERS] 🚚 Пользователь {call.from_user.id} принимает заказ {external_id}")
     
-    # Проверяем заказ перед действием
-    is_valid, order, error_msg = await validate_order_for_action(
+    # Проверяем заказ до смены и геолокации: ошибки по заказу показываются первыми
+    is_valid, _, error_msg = await validate_order_for_action(
         external_id,
         call.message.chat.id,
         expected_statuses=["waiting"]
@@ -341,28 +317,23 @@ async def cb_order_go(call: CallbackQuery, bot: Bot):
         return
     
     db = await get_db()
-    redis = get_redis()
-
-    # lock to avoid double accept
-    lock_key = f"order:lock:{external_id}"
-    logger.debug(f"[ORDERS] 🔒 Установка блокировки для заказа {external_id}")
-    ok = await redis.set(lock_key, "1", ex=ORDER_LOCK_TTL, nx=True)
-    if not ok:
-        logger.warning(f"[ORDERS] ⚠️ Заказ {external_id} уже обрабатывается")
-        await call.answer("Кто-то уже обрабатывает этот заказ", show_alert=True)
-        return
 
     logger.debug(f"[ORDERS] 💾 Обновление статуса заказа {external_id} на 'in_transit'")
     
-    # Обновляем статус заказа на "in_transit" без изменения payment_status
+    # Атомарный переход waiting -> in_transit без изменения payment_status:
+    # проверка выше не защищает от гонки, повторное нажатие или параллельный
+    # запрос не пройдут предусловие по статусу
     # Для тестовых заказов оплата будет установлена только при проверке оплаты
-    status_history_update = get_status_history_update(order, new_status="in_transit")
-    await db.couriers_deliveries.update_one(
-        {"_id": order["_id"]}, 
-        {"$set": {"status": "in_transit", "updated_at": utcnow_iso(), **status_history_update}}
-    )
+    order, error_msg = await transition_order(external_id, "in_transit", courier_chat_id=call.message.chat.id)
     
-    order = await db.couriers_deliveries.find_one({"_id": order["_id"]})
+    if not order:
+        logger.warning(f"[ORDERS] ⚠️ Действие отклонено для заказа {external_id}: {error_msg}")
+        try:
+            await call.message.edit_text(error_msg or "Действие невозможно")
+        except:
+            pass
+        await call.answer(error_msg or "Действие невозможно", show_alert=True)
+        return
     
     from db.models import Action
     await Action.log(db, call.from_user.id, "order_accepted", order_id=external_id)
@@ -475,14 +446,21 @@ async def cb_order_finish_after_payment(call: CallbackQuery, bot: Bot):
     external_id = call.data.split(":", 2)[2]
     logger.info(f"[ORDERS] ✅ Пользователь {call.from_user.id} завершает заказ {external_id} после оплаты")
     
-    # Проверяем заказ перед действием
-    is_valid, order, error_msg = await validate_order_for_action(
+    db = await get_db()
+    redis = get_redis()
+    
+    # Завершаем заказ сразу без запроса фото доставки: атомарный переход in_transit -> done
+    # вместе с отметкой оплаты. Повторное нажатие не пройдет предусловие по статусу.
+    logger.debug(f"[ORDERS] 💾 Закрытие заказа {external_id} после оплаты наличными")
+    updated_order, error_msg = await transition_order(
         external_id,
-        call.message.chat.id,
-        expected_statuses=["in_transit"]
+        "done",
+        courier_chat_id=call.message.chat.id,
+        from_statuses=["in_transit"],
+        new_payment_status="PAID"
     )
     
-    if not is_valid:
+    if not updated_order:
         logger.warning(f"[ORDERS] ⚠️ Действие отклонено для заказа {external_id}: {error_msg}")
         try:
             await call.message.edit_text(error_msg or "Действие невозможно")
@@ -491,9 +469,6 @@ async def cb_order_finish_after_payment(call: CallbackQuery, bot: Bot):
         await call.answer(error_msg or "Действие невозможно", show_alert=True)
         return
     
-    db = await get_db()
-    redis = get_redis()
-    
     # Проверка: если заказ тестовый (отрицательный external_id), автоматически устанавливаем оплату "PAID"
     is_test = is_test_order(external_id)
     if is_test:
@@ -518,24 +493,6 @@ async def cb_order_finish_after_payment(call: CallbackQuery, bot: Bot):
         except Exception as e:
             logger.error(f"[ORDERS] ❌ Ошибка при обновлении статуса оплаты в Odoo для заказа {external_id}: {e}", exc_info=True)
     
-    # Завершаем заказ сразу без запроса фото доставки
-    logger.debug(f"[ORDERS] 💾 Закрытие заказа {external_id} после оплаты наличными")
-    status_history_update = get_status_history_update(order, new_status="done", new_payment_status="PAID")
-    await db.couriers_deliveries.update_one(
-        {"external_id": external_id},
-        {
-            "$set": {
-                "status": "done",
-                "payment_status": "PAID",
-                "updated_at": utcnow_iso(),
-                **status_history_update
-            }
-        }
-    )
-    
-    # Получаем обновленный заказ для webhook
-    updated_order = await db.couriers_deliveries.find_one({"external_id": external_id})
-    
     from db.models import Action
     await Action.log(db, call.from_user.id, "order_completed", order_id=external_id, details={"after_payment": True})
     logger.info(f"[ORDERS] ✅ Пользователь {call.from_user.id} завершил заказ {external_id} после оплаты")
@@ -606,16 +563,21 @@ async def cb_order_check_payment(call: CallbackQuery, bot: Bot):
     if is_test:
         logger.info(f"[ORDERS] 🧪 Тестовый заказ {external_id} - автоматически устанавливаем оплату PAID, пропускаем проверку в Odoo")
         # Для тестовых заказов автоматически устанавливаем оплату "PAID" без обращения к Odoo
-        await db.couriers_deliveries.update_one(
+        order = await db.couriers_deliveries.find_one_and_update(
             {"external_id": external_id},
             {
                 "$set": {
                     "payment_status": "PAID",
-                    "updated_at": utcnow_iso()
+                    "updated_at": utcnow(),
+                    **status_history_fields(new_payment_status="PAID")
                 }
-            }
+            },
+            return_document=ReturnDocument.AFTER
         )
-        order = await db.couriers_deliveries.find_one({"external_id": external_id})
+        if order is None:
+            await answer_order_missing(call, external_id)
+            return
+        await bump_versions("orders", chat_id=order.get("courier_tg_chat_id"))
         text = format_order_text(order)
         from keyboards.orders_kb import in_transit_kb
         await call.message.edit_text(text, parse_mode="HTML", reply_markup=in_transit_kb(external_id, order))
@@ -730,18 +692,21 @@ async def cb_order_check_payment(call: CallbackQuery, bot: Bot):
     
     # Обновляем статус оплаты в базе данных
     logger.debug(f"[ORDERS] 💾 Обновление статуса оплаты заказа {external_id} с '{old_payment_status}' на '{new_payment_status}'")
-    await db.couriers_deliveries.update_one(
+    order = await db.couriers_deliveries.find_one_and_update(
         {"external_id": external_id},
         {
             "$set": {
                 "payment_status": new_payment_status,
-                "updated_at": utcnow_iso()
+                "updated_at": utcnow(),
+                **status_history_fields(new_payment_status=new_payment_status)
             }
-        }
+        },
+        return_document=ReturnDocument.AFTER
     )
-    
-    # Получаем обновленный заказ
-    order = await db.couriers_deliveries.find_one({"external_id": external_id})
+    if order is None:
+        await answer_order_missing(call, external_id)
+        return
+    await bump_versions("orders", chat_id=order.get("courier_tg_chat_id"))
     
     # Логируем действие
     from db.models import Action
@@ -773,22 +738,6 @@ async def cb_order_done(call: CallbackQuery, bot: Bot):
     external_id = call.data.split(":", 2)[2]
     logger.info(f"[ORDERS] ✅ Пользователь {call.from_user.id} завершает заказ {external_id}")
     
-    # Проверяем заказ перед действием
-    is_valid, order, error_msg = await validate_order_for_action(
-        external_id,
-        call.message.chat.id,
-        expected_statuses=["in_transit"]
-    )
-    
-    if not is_valid:
-        logger.warning(f"[ORDERS] ⚠️ Действие отклонено для заказа {external_id}: {error_msg}")
-        try:
-            await call.message.edit_text(error_msg or "Действие невозможно")
-        except:
-            pass
-        await call.answer(error_msg or "Действие невозможно", show_alert=True)
-        return
-    
     # Проверяем смену и геолокацию курьера
     is_valid_shift, shift_error = await validate_courier_shift_and_location(call.message.chat.id)
     if not is_valid_shift:
@@ -802,105 +751,84 @@ async def cb_order_done(call: CallbackQuery, bot: Bot):
     # Проверка: тестовые заказы должны пройти проверку оплаты перед завершением
     is_test = is_test_order(external_id)
     
-    # Проверяем наличие client_ip - для таких заказов разрешаем завершение даже при NOT_PAID
-    has_client_ip = bool(order.get("client_ip"))
+    # Закрываем заказ атомарным переходом in_transit -> done.
+    # Если статус оплаты "не оплачен", заказ не закрывается (предусловие в фильтре)
+    # Исключение: заказы с client_ip могут быть завершены без проверки оплаты
+    # Фото для завершения не требуется, если оплата подтверждена
+    from db.models import Action
+    from utils.webhooks import send_webhook, prepare_order_data
     
-    # Проверяем статус оплаты
-    payment_status = order.get("payment_status")
-    is_cash_payment = order.get("is_cash_payment", False)
+    logger.debug(f"[ORDERS] 💾 Закрытие заказа {external_id} без фото")
+    updated_order, error_msg = await transition_order(
+        external_id,
+        "done",
+        courier_chat_id=call.message.chat.id,
+        from_statuses=["in_transit"],
+        require_paid=True
+    )
     
-    # Если статус оплаты "не оплачен", не позволяем завершить заказ
-    # Исключение: заказы с client_ip могут быть завершены без проверки оплаты
-    if payment_status == "NOT_PAID" and not has_client_ip:
-        if is_test:
-            logger.warning(f"[ORDERS] ⚠️ Тестовый заказ {external_id} - оплата не подтверждена, нужно проверить оплату")
-            await call.answer("Сначала проверьте оплату (тестовый заказ)", show_alert=True)
-        else:
-            logger.warning(f"[ORDERS] ⚠️ Попытка завершить заказ {external_id} без оплаты")
-            await call.answer("Сначала проверьте оплату", show_alert=True)
+    if not updated_order:
+        if error_msg == ERROR_NOT_PAID:
+            if is_test:
+                logger.warning(f"[ORDERS] ⚠️ Тестовый заказ {external_id} - оплата не подтверждена, нужно проверить оплату")
+                await call.answer("Сначала проверьте оплату (тестовый заказ)", show_alert=True)
+            else:
+                await call.answer("Сначала проверьте оплату", show_alert=True)
+            return
+        logger.warning(f"[ORDERS] ⚠️ Действие отклонено для заказа {external_id}: {error_msg}")
+        try:
+            await call.message.edit_text(error_msg or "Действие невозможно")
+        except:
+            pass
+        await call.answer(error_msg or "Действие невозможно", show_alert=True)
         return
     
-    # Если оплата подтверждена (PAID), завершаем без фото независимо от наличия client_ip
-    # Фото больше не требуется для завершения заказов без client_ip, если оплата подтверждена
-    requires_photo = False
+    has_client_ip = bool(updated_order.get("client_ip"))
     
-    # Удаляем сообщения о заказе перед закрытием
+    # Удаляем сообщения о заказе (id берем из документа, возвращенного переходом)
     from utils.order_messages import delete_order_messages_from_courier
-    await delete_order_messages_from_courier(bot, order)
+    await delete_order_messages_from_courier(bot, updated_order, refresh=False)
     
-    if requires_photo:
-        # Для наличных заказов без client_ip просим фото подтверждения доставки
-        redis = get_redis()
-        logger.debug(f"[ORDERS] ⏳ Установка флага ожидания фото для chat_id {call.message.chat.id}")
-        await redis.setex(f"courier:photo_wait:{call.message.chat.id}", PHOTO_WAIT_TTL, external_id)
-        
-        from db.models import Action
-        await Action.log(db, call.from_user.id, "order_completed", order_id=external_id)
-        logger.debug(f"[ORDERS] 📝 Действие 'order_completed' залогировано для заказа {external_id}")
-        
-        await call.message.answer("📸 Пришли фото подтверждение (чек или доставка)")
-        await call.answer()
+    await Action.log(db, call.from_user.id, "order_completed", order_id=external_id, details={"no_photo": True})
+    logger.info(f"[ORDERS] ✅ Пользователь {call.from_user.id} завершил заказ {external_id} без фото")
+    
+    # Отправка webhook только для реальных заказов (не тестовых)
+    if not is_test:
+        order_data = await prepare_order_data(db, updated_order)
+        webhook_data = {
+            **order_data,
+            "timestamp": utcnow_iso()
+        }
+        await send_webhook("order_completed", webhook_data)
     else:
-        # Для всех остальных случаев закрываем заказ сразу без фото
-        from db.models import Action
-        from utils.webhooks import send_webhook, prepare_order_data
-        
-        logger.debug(f"[ORDERS] 💾 Закрытие заказа {external_id} без фото")
-        status_history_update = get_status_history_update(order, new_status="done")
-        await db.couriers_deliveries.update_one(
-            {"external_id": external_id},
-            {
-                "$set": {
-                    "status": "done",
-                    "updated_at": utcnow_iso(),
-                    **status_history_update
-                }
-            }
-        )
-        
-        # Получаем обновленный заказ для webhook
-        updated_order = await db.couriers_deliveries.find_one({"external_id": external_id})
-        
-        await Action.log(db, call.from_user.id, "order_completed", order_id=external_id, details={"no_photo": True})
-        logger.info(f"[ORDERS] ✅ Пользователь {call.from_user.id} завершил заказ {external_id} без фото")
-        
-        # Отправка webhook только для реальных заказов (не тестовых)
-        if not is_test:
-            order_data = await prepare_order_data(db, updated_order)
-            webhook_data = {
-                **order_data,
-                "timestamp": utcnow_iso()
-            }
-            await send_webhook("order_completed", webhook_data)
-        else:
-            logger.info(f"[ORDERS] 🧪 Тестовый заказ {external_id} - webhook не отправляется")
-        
-        address = updated_order.get("address", "")
-        await call.message.answer(f"✅ Заказ {external_id}, {address} выполнен.")
-        await call.answer()
-        
-        # Для заказов с client_ip редактируем сообщение, удаляя кнопку "Завершить Заказ"
-        # и оставляя только "Проблема с заказом"
-        if has_client_ip:
-            try:
-                text = format_order_text(updated_order)
-                await call.message.edit_text(text, parse_mode="HTML", reply_markup=problem_only_kb(external_id))
-                logger.info(f"[ORDERS] ✅ Сообщение отредактировано для заказа {external_id} с client_ip - удалена кнопка 'Завершить Заказ'")
-            except Exception as e:
-                logger.warning(f"[ORDERS] ⚠️ Не удалось отредактировать сообщение для заказа {external_id}: {e}")
-        
-        # Уведомление менеджера только для реальных заказов (не тестовых)
-        if not is_test:
-            courier = await db.couriers.find_one({"tg_chat_id": call.message.chat.id})
-            if courier:
-                await notify_manager(bot, courier, f"📦 Курьер {courier['name']} завершил заказ {external_id}")
-        else:
-            logger.info(f"[ORDERS] 🧪 Тестовый заказ {external_id} - уведомление менеджеру не отправляется")
-        
-        # Показываем список активных заказов (waiting и in_transit)
-        # Только если это не заказ с client_ip (для них уже отредактировано сообщение)
-        if not has_client_ip:
-            await show_active_orders(call.message.chat.id, call.message)
+        logger.info(f"[ORDERS] 🧪 Тестовый заказ {external_id} - webhook не отправляется")
+    
+    address = updated_order.get("address", "")
+    await call.message.answer(f"✅ Заказ {external_id}, {address} выполнен.")
+    await call.answer()
+    
+    # Для заказов с client_ip редактируем сообщение, удаляя кнопку "Завершить Заказ"
+    # и оставляя только "Проблема с заказом"
+    if has_client_ip:
+        try:
+            text = format_order_text(updated_order)
+            await call.message.edit_text(text, parse_mode="HTML", reply_markup=problem_only_kb(external_id))
+            logger.info(f"[ORDERS] ✅ Сообщение отредактировано для заказа {external_id} с client_ip - удалена кнопка 'Завершить Заказ'")
+        except Exception as e:
+            logger.warning(f"[ORDERS] ⚠️ Не удалось отредактировать сообщение для заказа {external_id}: {e}")
+    
+    # Уведомление менеджера только для реальных заказов (не тестовых)
+    if not is_test:
+        courier = await db.couriers.find_one({"tg_chat_id": call.message.chat.id})
+        if courier:
+            await notify_manager(bot, courier, f"📦 Курьер {courier['name']} завершил заказ {external_id}")
+    else:
+        logger.info(f"[ORDERS] 🧪 Тестовый заказ {external_id} - уведомление менеджеру не отправляется")
+    
+    # Показываем список активных заказов (waiting и in_transit)
+    # Только если это не заказ с client_ip (для них уже отредактировано сообщение)
+    if not has_client_ip:
+        await show_active_orders(call.message.chat.id, call.message)
 
 @router.callback_query(F.data.startswith("order:problem:"))
 async def cb_order_problem(call: CallbackQuery):
@@ -950,11 +878,11 @@ async def cmd_history_today(message: Message):
         return
     
     now = datetime.now(TIMEZONE)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     
     cursor = db.couriers_deliveries.find({
         "courier_tg_chat_id": message.chat.id,
-        "created_at": {"$gte": today_start}
+        **await time_range(db, "created_at", {"$gte": today_start})
     }).sort("created_at", -1)
     
     found = False
@@ -992,12 +920,12 @@ async def cb_history_page(call: CallbackQuery):
 async def show_history_page(message: Message, page: int):
     db = await get_db()
     now = datetime.now(TIMEZONE)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     
     skip = page * 30
     cursor = db.couriers_deliveries.find({
         "courier_tg_chat_id": message.chat.id,
-        "created_at": {"$lt": today_start}
+        **await time_range(db, "created_at", {"$lt": today_start})
     }).sort("created_at", -1).skip(skip).limit(30)
     
     orders = await cursor.to_list(length=30)
@@ -1047,9 +975,9 @@ async def catch_problem_text(message: Message, bot: Bot):
         return
     
     # Save message to order history
-    timestamp = utcnow_iso()
+    timestamp = utcnow()
     problem_entry = {
-        f"courier-{timestamp}": message.text
+        f"courier-{timestamp.isoformat()}": message.text
     }
     
     await db.couriers_deliveries.update_one(
@@ -1059,6 +987,7 @@ async def catch_problem_text(message: Message, bot: Bot):
             "$set": {"updated_at": timestamp}
         }
     )
+    await bump_versions("orders", chat_id=order.get("courier_tg_chat_id"))
     
     await redis.delete(f"courier:problem_wait:{message.chat.id}")
     
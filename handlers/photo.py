@@ -4,7 +4,8 @@ from db.redis_client import get_redis
 from db.mongo import get_db
 from utils.notifications import notify_manager
 from utils.test_orders import is_test_order
-from db.models import utcnow_iso, get_status_history_update
+from db.models import utcnow
+from utils.data_versions import bump_versions
 
 router = Router()
 
@@ -33,10 +34,11 @@ async def handle_photo(message: Message, bot: Bot):
         await db.couriers_deliveries.update_one(
             {"external_id": external_id},
             {
-                "$set": {"updated_at": utcnow_iso()},
-                "$push": {"pay_photo": {"file_id": file_id, "uploaded_at": utcnow_iso()}}
+                "$set": {"updated_at": utcnow()},
+                "$push": {"pay_photo": {"file_id": file_id, "uploaded_at": utcnow()}}
             }
         )
+        await bump_versions("orders", chat_id=chat_id)
 
         from db.models import Action
         await Action.log(db, message.from_user.id, "payment_photo_sent", order_id=external_id, details={"file_id": file_id})
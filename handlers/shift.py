@@ -2,8 +2,12 @@ from aiogram import Router, F, Bot
 from aiogram.types import Message, CallbackQuery
 from keyboards.main_menu import main_menu
 from db.mongo import get_db
+from db.migrate_timestamps import time_range
 from db.redis_client import get_redis
-from config import SHIFT_TTL, LOC_TTL, MANAGER_CHAT_ID, TIMEZONE
+from config import SHIFT_TTL, MANAGER_CHAT_ID, TIMEZONE
+from utils.courier_geo import geo_point, update_courier_position, remove_courier_position
+from utils.data_versions import bump_versions
+from db.models import as_datetime
 from bson import ObjectId
 from datetime import datetime
 from typing import Tuple, Optional
@@ -24,31 +28,21 @@ def get_shift_start_instruction() -> str:
         "5️⃣ Нажми 'Отправить'"
     )
 
-def format_shift_start_time(shift_started_at: str) -> str:
+def format_shift_start_time(shift_started_at) -> str:
     """Форматирует дату и время начала смены для отображения"""
-    try:
-        # Парсим ISO формат даты
-        if shift_started_at.endswith('Z'):
-            dt = datetime.fromisoformat(shift_started_at.replace('Z', '+00:00'))
-        else:
-            dt = datetime.fromisoformat(shift_started_at)
-        # Конвертируем в таймзону Buenos Aires если нужно
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=TIMEZONE)
-        elif dt.tzinfo != TIMEZONE:
-            dt = dt.astimezone(TIMEZONE)
-        # Форматируем в читаемый формат: ДД.ММ.ГГГГ ЧЧ:ММ
-        return dt.strftime("%d.%m.%Y %H:%M")
-    except Exception as e:
-        logger.warning(f"[SHIFT] ⚠️ Ошибка форматирования даты {shift_started_at}: {e}")
-        return shift_started_at
+    dt = as_datetime(shift_started_at)
+    if dt is None:
+        logger.warning(f"[SHIFT] ⚠️ Ошибка форматирования даты {shift_started_at}")
+        return str(shift_started_at)
+    # Форматируем в читаемый формат: ДД.ММ.ГГГГ ЧЧ:ММ
+    return dt.strftime("%d.%m.%Y %H:%M")
 
-async def check_shift_status(chat_id: int) -> Tuple[bool, Optional[str]]:
+async def check_shift_status(chat_id: int) -> Tuple[bool, Optional[datetime]]:
     """
     Проверяет статус смены курьера
     
     Returns:
-        Tuple[bool, Optional[str]]: (is_on_shift, shift_started_at)
+        Tuple[bool, Optional[datetime]]: (is_on_shift, shift_started_at)
     """
     db = await get_db()
     courier = await db.couriers.find_one({"tg_chat_id": chat_id})
@@ -56,7 +50,7 @@ async def check_shift_status(chat_id: int) -> Tuple[bool, Optional[str]]:
         return False, None
     
     is_on_shift = courier.get("is_on_shift", False)
-    shift_started_at = courier.get("shift_started_at")
+    shift_started_at = as_datetime(courier.get("shift_started_at"))
     
     return is_on_shift, shift_started_at
 
@@ -178,7 +172,8 @@ async def handle_location(message: Message, bot: Bot):
         last_location = {
             "lat": loc.latitude,
             "lon": loc.longitude,
-            "updated_at": now.replace(microsecond=0).isoformat()
+            "geo": geo_point(loc.latitude, loc.longitude),
+            "updated_at": now.replace(microsecond=0)
         }
         logger.debug(f"[SHIFT] 💾 Обновление курьера в БД: shift_id={shift_id}")
 
@@ -191,11 +186,12 @@ async def handle_location(message: Message, bot: Bot):
                 "current_shift_id": shift_id
             }}
         )
+        await bump_versions("shift", chat_id=chat_id)
         logger.info(f"[SHIFT] ✅ Курьер обновлен в БД: is_on_shift=True, shift_id={shift_id}")
 
         logger.debug(f"[SHIFT] 💾 Обновление Redis: shift и location для chat_id={chat_id}")
         await redis.setex(f"courier:shift:{chat_id}", SHIFT_TTL, "on")
-        await redis.setex(f"courier:loc:{chat_id}", LOC_TTL, f"{last_location['lat']},{last_location['lon']}")
+        await update_courier_position(chat_id, loc.latitude, loc.longitude)
         logger.debug(f"[SHIFT] ✅ Redis обновлен")
 
         location_doc = {
@@ -204,7 +200,7 @@ async def handle_location(message: Message, bot: Bot):
             "date": date_key,
             "lat": loc.latitude,
             "lon": loc.longitude,
-            "timestamp": now.isoformat(),
+            "timestamp": now,
             "timestamp_ns": int(now.timestamp() * 1_000_000_000)
         }
         logger.debug(f"[SHIFT] 💾 Сохранение локации в БД: lat={loc.latitude}, lon={loc.longitude}")
@@ -302,7 +298,7 @@ async def end_shift_logic(chat_id: int, user_id: int, bot: Bot, message_or_call=
         return False
     
     # Сохраняем время начала смены для подсчета заказов
-    shift_started_at = courier.get("shift_started_at")
+    shift_started_at = as_datetime(courier.get("shift_started_at"))
     
     # Check for unfinished orders (пропускаем в автоматическом режиме)
     if not auto_mode:
@@ -335,21 +331,21 @@ async def end_shift_logic(chat_id: int, user_id: int, bot: Bot, message_or_call=
             # Общее количество заказов за смену
             orders_count = await db.couriers_deliveries.count_documents({
                 "courier_tg_chat_id": chat_id,
-                "created_at": {"$gte": shift_started_at}
+                **await time_range(db, "created_at", {"$gte": shift_started_at})
             })
 
             # Количество завершенных заказов за смену
             complete_orders_count = await db.couriers_deliveries.count_documents({
                 "courier_tg_chat_id": chat_id,
                 "status": "done",
-                "updated_at": {"$gte": shift_started_at}
+                **await time_range(db, "updated_at", {"$gte": shift_started_at})
             })
 
             # Количество отмененных заказов за смену
             cancelled_orders_count = await db.couriers_deliveries.count_documents({
                 "courier_tg_chat_id": chat_id,
                 "status": "cancelled",
-                "updated_at": {"$gte": shift_started_at}
+                **await time_range(db, "updated_at", {"$gte": shift_started_at})
             })
 
             logger.info(f"[SHIFT] 📊 Заказов за смену: {orders_count}, завершено: {complete_orders_count}, отмененно: {cancelled_orders_count}")
@@ -358,14 +354,23 @@ async def end_shift_logic(chat_id: int, user_id: int, bot: Bot, message_or_call=
 
     logger.debug(f"[SHIFT] 💾 Обновление статуса курьера: is_on_shift=False")
     await db.couriers.update_one({"_id": courier["_id"]}, {"$set": {"is_on_shift": False}, "$unset": {"current_shift_id": ""}})
+    await bump_versions("shift", chat_id=chat_id)
     logger.debug(f"[SHIFT] 🗑️ Удаление данных из Redis: shift и location")
     await redis.delete(f"courier:shift:{chat_id}")
-    await redis.delete(f"courier:loc:{chat_id}")
+    await remove_courier_position(chat_id)
+    
+    # Убираем из чата оставшиеся сообщения о заказах (заказы в работе не трогаем)
+    from utils.order_messages import clear_chat_order_messages
+    await clear_chat_order_messages(bot, chat_id, keep_active=True)
 
     from db.models import Action, ShiftHistory
     await Action.log(db, user_id, "shift_end")
     logger.info(f"[SHIFT] ✅ Пользователь {user_id} завершил смену")
     
+    # Пробег и стоянки за смену по точкам локации
+    from utils.track_stats import shift_track_stats, format_track_stats
+    track_stats = await shift_track_stats(db, chat_id, current_shift_id)
+    
     # Записываем завершение смены в историю
     await ShiftHistory.log(
         db,
@@ -374,7 +379,8 @@ async def end_shift_logic(chat_id: int, user_id: int, bot: Bot, message_or_call=
         shift_id=current_shift_id,
         total_orders=orders_count,
         complete_orders=complete_orders_count,
-        shift_started_at=shift_started_at
+        shift_started_at=shift_started_at,
+        track_stats=track_stats
     )
     logger.debug(f"[SHIFT] 📝 История смены 'shift_ended' записана, shift_id={current_shift_id}, заказов: {orders_count}, завершено: {complete_orders_count}")
 
@@ -414,6 +420,7 @@ async def end_shift_logic(chat_id: int, user_id: int, bot: Bot, message_or_call=
     # Добавляем информацию об отмененных заказах только если они есть
     if cancelled_orders_count > 0:
         shift_message += f"\n❌ Отмененных заказов: {cancelled_orders_count}"
+    shift_message += format_track_stats(track_stats)
     
     # Отправка сообщения курьеру
     if message_or_call:
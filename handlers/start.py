@@ -54,23 +54,16 @@ async def cmd_main(message: Message):
     from db.models import Action
     await Action.log(db, message.from_user.id, "user_start")
 
-    # stats
+    # stats: материализованные счетчики courier_counters (db.counters)
+    from db.counters import get_courier_counters, get_courier_period_counters, day_key
     now = datetime.now(TIMEZONE)
-    start_month = datetime(now.year, now.month, 1, tzinfo=TIMEZONE)
-    start_today = datetime(now.year, now.month, now.day, tzinfo=TIMEZONE)
+    today_key = day_key(now)
+    counters = await get_courier_counters(db, message.chat.id, today_key)
+    month_counters = await get_courier_period_counters(db, message.chat.id, now.strftime("%Y-%m-01"), today_key)
 
-    monthly = await db.orders.count_documents({
-        "assigned_to": courier["_id"],
-        "created_at": {"$gte": start_month.isoformat()}
-    })
-    today = await db.orders.count_documents({
-        "assigned_to": courier["_id"],
-        "created_at": {"$gte": start_today.isoformat()}
-    })
-    active = await db.orders.count_documents({
-        "assigned_to": courier["_id"],
-        "status": {"$in": ["waiting", "in_transit"]}
-    })
+    monthly = month_counters["created"]
+    today = counters["created"]
+    active = counters["waiting"] + counters["in_transit"]
 
     text = (
         f"Привет, {courier['name']}!\n\n"
@@ -22,9 +22,29 @@ def all_deliveries_kb() -> InlineKeyboardMarkup:
     """Клавиатура для сообщения 'Все доставки'"""
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="👁 Посмотреть все", callback_data="admin:view_all_orders")],
+        [InlineKeyboardButton(text="⏱ Время доставки", callback_data="admin:delivery_times:30:courier")],
         [InlineKeyboardButton(text="◀️ Назад", callback_data="admin:back")]
     ])
 
+def delivery_times_kb(days: int, group_by: str) -> InlineKeyboardMarkup:
+    """Клавиатура экрана 'Время доставки': период и группировка (текущие отмечены •)"""
+    def mark(text: str, selected: bool) -> str:
+        return f"• {text}" if selected else text
+
+    periods = [
+        InlineKeyboardButton(text=mark(f"{period} дн.", period == days), callback_data=f"admin:delivery_times:{period}:{group_by}")
+        for period in (7, 30, 90)
+    ]
+    groups = [
+        InlineKeyboardButton(text=mark(title, key == group_by), callback_data=f"admin:delivery_times:{days}:{key}")
+        for key, title in (("courier", "Курьеры"), ("brand", "Бренды"), ("source", "Источники"))
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=[
+        periods,
+        groups,
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="admin:all_deliveries")]
+    ])
+
 def all_orders_list_kb(orders: list, page: int = 0, total_pages: int = 1) -> InlineKeyboardMarkup:
     """Клавиатура со списком всех активных заказов (без привязки к курьеру)"""
     buttons = []
@@ -224,23 +244,33 @@ def courier_transfer_kb(couriers: list, courier_to_close_chat_id: int) -> Inline
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def courier_list_kb(couriers: list, external_id: str, original_courier_chat_id: int = None) -> InlineKeyboardMarkup:
-    """Клавиатура со списком курьеров для назначения заказа"""
+def courier_list_kb(couriers: list, external_id: str, original_courier_chat_id: int = None, suggestions: list = None) -> InlineKeyboardMarkup:
+    """
+    Клавиатура со списком курьеров для назначения заказа.
+    Рекомендованные курьеры (suggestions) выводятся первыми в порядке ранжирования,
+    остальные - по алфавиту.
+    """
+    def assign_callback(courier_chat_id: int) -> str:
+        # Передаем исходный courier_chat_id для возврата к его списку заказов
+        if original_courier_chat_id:
+            return f"admin:assign_courier:{external_id}:{courier_chat_id}:{original_courier_chat_id}"
+        return f"admin:assign_courier:{external_id}:{courier_chat_id}"
+
     buttons = []
+    suggested_ids = set()
+    for item in suggestions or []:
+        suggested_ids.add(item["chat_id"])
+        text = f"⭐ {item['name']}"
+        if item.get("distance_m") is not None:
+            text += f" · {item['distance_m'] / 1000:.1f} км"
+        text += f" · 📦 {item['waiting'] + item['in_transit']}"
+        buttons.append([InlineKeyboardButton(text=text, callback_data=assign_callback(item["chat_id"]))])
     for courier in couriers:
-        name = courier.get("name", "Unknown")
         courier_chat_id = courier.get("tg_chat_id")
-        # Передаем исходный courier_chat_id для возврата к его списку заказов
-        if original_courier_chat_id:
-            buttons.append([InlineKeyboardButton(
-                text=name,
-                callback_data=f"admin:assign_courier:{external_id}:{courier_chat_id}:{original_courier_chat_id}"
-            )])
-        else:
-            buttons.append([InlineKeyboardButton(
-                text=name,
-                callback_data=f"admin:assign_courier:{external_id}:{courier_chat_id}"
-            )])
+        if courier_chat_id in suggested_ids:
+            continue
+        name = courier.get("name", "Unknown")
+        buttons.append([InlineKeyboardButton(text=name, callback_data=assign_callback(courier_chat_id))])
     # Кнопка "Назад" - зависит от того, откуда открыт заказ
     if original_courier_chat_id:
         buttons.append([InlineKeyboardButton(text="◀️ Назад", callback_data=f"admin:order_edit:{external_id}:{original_courier_chat_id}")])
@@ -1,6 +1,16 @@
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import re
 import sys
+import threading
+from config import (
+    LOG_LEVEL, LOG_FORMAT, LOG_ROTATION, LOG_MAX_BYTES, LOG_ROTATE_WHEN,
+    LOG_BACKUP_COUNT, LOG_QUEUE_SIZE, LOG_SAMPLING
+)
 
 # Функция для получения домашней директории (может использоваться глобально):
 def get_home_directory():
@@ -20,7 +30,7 @@ class EmojiFormatter(logging.Formatter):
         'CRITICAL': '🔥',
     }
     
-    # Эмодзи для разных модулей/контекстов
+    # Эмодзи для разных модулей/контекстов (порядок = приоритет)
     MODULE_EMOJIS = {
         'API': '🌐',
         'ORDERS': '📦',
@@ -34,84 +44,140 @@ class EmojiFormatter(logging.Formatter):
         'BOT': '🤖',
     }
     
-    def format(self, record):
-        # Добавляем эмодзи для уровня
-        level_emoji = self.LEVEL_EMOJIS.get(record.levelname, '')
-        
-        # Определяем контекст по имени модуля или сообщению
-        context_emoji = ''
-        message = record.getMessage()
-        module_name = record.name.split('.')[-1]
-        
-        # Проверяем сообщение на наличие префиксов
-        if '[API]' in message:
-            context_emoji = self.MODULE_EMOJIS.get('API', '')
-        elif '[ORDERS]' in message:
-            context_emoji = self.MODULE_EMOJIS.get('ORDERS', '')
-        elif '[ADMIN]' in message or 'admin' in module_name.lower():
-            context_emoji = self.MODULE_EMOJIS.get('ADMIN', '')
-        elif '[SHIFT]' in message or 'shift' in module_name.lower():
-            context_emoji = self.MODULE_EMOJIS.get('SHIFT', '')
-        elif '[LOCATION]' in message or 'location' in module_name.lower():
-            context_emoji = self.MODULE_EMOJIS.get('LOCATION', '')
-        elif '[WEBHOOK]' in message or 'webhook' in module_name.lower():
-            context_emoji = self.MODULE_EMOJIS.get('WEBHOOK', '')
-        elif '[ODOO]' in message or 'odoo' in module_name.lower():
-            context_emoji = self.MODULE_EMOJIS.get('ODOO', '')
-        elif '[REDIS]' in message or 'redis' in module_name.lower():
-            context_emoji = self.MODULE_EMOJIS.get('REDIS', '')
-        elif '[MONGO]' in message or 'mongo' in module_name.lower():
-            context_emoji = self.MODULE_EMOJIS.get('MONGO', '')
-        elif '[BOT]' in message or 'bot' in module_name.lower():
-            context_emoji = self.MODULE_EMOJIS.get('BOT', '')
-        
-        # Формируем эмодзи строку
-        emoji_prefix = f"{level_emoji} {context_emoji}".strip()
+    # Контексты, которые определяются и по имени модуля (не только по префиксу [..])
+    _MODULE_NAME_CONTEXTS = ('ADMIN', 'SHIFT', 'LOCATION', 'WEBHOOK', 'ODOO', 'REDIS', 'MONGO', 'BOT')
+    
+    # Один проход по сообщению вместо цепочки поисков подстрок
+    _PREFIX_RE = re.compile(r"\[(" + "|".join(MODULE_EMOJIS) + r")\]")
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._module_cache = {}
+    
+    def _module_context(self, name: str) -> str:
+        """Контекст по имени логгера (кешируется: имен логгеров немного)"""
+        context = self._module_cache.get(name)
+        if context is None:
+            module_name = name.split('.')[-1].lower()
+            context = next((ctx for ctx in self._MODULE_NAME_CONTEXTS if ctx.lower() in module_name), '')
+            self._module_cache[name] = context
+        return context
+    
+    def _context_emoji(self, record) -> str:
+        # Приоритет как раньше: контекст, встреченный раньше в MODULE_EMOJIS, выигрывает
+        contexts = set(self._PREFIX_RE.findall(record.message))
+        module_context = self._module_context(record.name)
+        if module_context:
+            contexts.add(module_context)
+        for context, emoji in self.MODULE_EMOJIS.items():
+            if context in contexts:
+                return emoji
+        return ''
+    
+    def formatMessage(self, record):
+        # Эмодзи добавляются только в вывод этого форматтера, запись не изменяется
+        # (иначе префикс попадал бы и в файл, который пишется той же записью)
+        emoji_prefix = f"{self.LEVEL_EMOJIS.get(record.levelname, '')} {self._context_emoji(record)}".strip()
+        original = record.message
         if emoji_prefix:
-            emoji_prefix += " "
-        
-        # Обновляем сообщение с эмодзи
-        record.msg = f"{emoji_prefix}{record.msg}"
-        
-        return super().format(record)
+            record.message = f"{emoji_prefix} {original}"
+        try:
+            return super().formatMessage(record)
+        finally:
+            record.message = original
 
 
-# Настройка логов
-LOG_PATH = os.path.join(get_home_directory(), "logs", "odoo_ship_bot.log")
-os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+class JsonFormatter(logging.Formatter):
+    """Форматтер JSON lines: одна запись - один JSON объект в строке"""
+    
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": f"{record.filename}:{record.lineno}",
+            "func": record.funcName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
 
-# Получаем корневой логгер
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
 
-# Удаляем существующие обработчики, если есть
-logger.handlers.clear()
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает 1 из N записей ниже WARNING для заданных логгеров (частые пути, например пинги локации).
+    WARNING и выше проходят всегда.
+    """
+    
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._counters = {}
+        self._rate_cache = {}
+        self._lock = threading.Lock()
+    
+    def _rate(self, name: str) -> int:
+        rate = self._rate_cache.get(name)
+        if rate is None:
+            rate = 1
+            for prefix, value in self.rates.items():
+                if name == prefix or name.startswith(prefix + "."):
+                    rate = value
+                    break
+            self._rate_cache[name] = rate
+        return rate
+    
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate <= 1:
+            return True
+        with self._lock:
+            count = self._counters.get(record.name, 0)
+            self._counters[record.name] = count + 1
+        return count % rate == 0
 
-# Формат для файла (без эмодзи для читаемости)
-file_formatter = logging.Formatter(
-    '%(asctime)s [%(levelname)s] [%(filename)s:%(lineno)d] %(funcName)s: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
 
-# Формат для консоли (с эмодзи и цветами)
-console_formatter = EmojiFormatter(
-    '%(asctime)s │ %(levelname)-8s │ %(filename)s:%(lineno)d │ %(funcName)s │ %(message)s',
-    datefmt='%H:%M:%S'
-)
+def parse_sampling(value: str):
+    """Разбирает LOG_SAMPLING вида "handlers.location=20,utils.webhooks=5" """
+    rates = {}
+    for item in (value or "").split(","):
+        name, _, rate = item.strip().partition("=")
+        if name and rate.strip().isdigit():
+            rates[name] = int(rate)
+    return rates
 
-# Обработчик для файла
-file_handler = logging.FileHandler(LOG_PATH, mode='a', encoding='utf-8')
-file_handler.setLevel(logging.DEBUG)
-file_handler.setFormatter(file_formatter)
-logger.addHandler(file_handler)
 
-# Обработчик для консоли
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.DEBUG)
-console_handler.setFormatter(console_formatter)
-if hasattr(sys.stdout, 'reconfigure'):
-    sys.stdout.reconfigure(encoding='utf-8')
-logger.addHandler(console_handler)
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполнении очереди отбрасывает запись (не блокирует event loop)"""
+    
+    dropped = 0
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+    
+    def prepare(self, record):
+        # Сообщение фиксируется сразу (аргументы могут измениться позже),
+        # трассировку и форматирование выполняет поток QueueListener
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """QueueListener, который при остановке дожидается места в очереди для sentinel"""
+    
+    def enqueue_sentinel(self):
+        # put_nowait в заполненную очередь бросит queue.Full, и поток не остановится
+        self.queue.put(self._sentinel)
+
 
 # Фильтр для исключения библиотечных логов
 class LibraryLogFilter(logging.Filter):
@@ -172,10 +238,103 @@ class LibraryLogFilter(logging.Filter):
         # Пропускаем все остальные логи
         return True
 
-# Применяем фильтр к обработчикам
-library_filter = LibraryLogFilter()
-file_handler.addFilter(library_filter)
-console_handler.addFilter(library_filter)
+# Настройка логов
+LOG_PATH = os.path.join(get_home_directory(), "logs", "odoo_ship_bot.log")
+
+queue_listener = None
+
+def configure_logging(log_path: str = LOG_PATH, stream=None, level_name: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """
+    Настраивает корневой логгер: в обработчике остается только QueueHandler,
+    запись в файл (с ротацией) и консоль выполняет QueueListener в отдельном потоке.
+    
+    Args:
+        log_path: Путь к файлу лога
+        stream: Поток для консольного вывода (по умолчанию sys.stdout)
+        level_name: Уровень логирования (LOG_LEVEL)
+        log_format: Формат файла: text или json (LOG_FORMAT)
+    
+    Returns:
+        Корневой логгер
+    """
+    global queue_listener
+    stop_logging()
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    
+    level = logging.getLevelName(level_name)
+    if not isinstance(level, int):
+        level = logging.INFO
+    
+    # Получаем корневой логгер
+    root = logging.getLogger()
+    root.setLevel(level)
+    
+    # Удаляем существующие обработчики, если есть
+    root.handlers.clear()
+    
+    # Формат для файла (без эмодзи для читаемости)
+    if log_format == "json":
+        file_formatter = JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%S')
+    else:
+        file_formatter = logging.Formatter(
+            '%(asctime)s [%(levelname)s] [%(filename)s:%(lineno)d] %(funcName)s: %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
+    
+    # Формат для консоли (с эмодзи и цветами)
+    console_formatter = EmojiFormatter(
+        '%(asctime)s │ %(levelname)-8s │ %(filename)s:%(lineno)d │ %(funcName)s │ %(message)s',
+        datefmt='%H:%M:%S'
+    )
+    
+    # Обработчик для файла с ротацией по размеру или по времени
+    if LOG_ROTATION == "time":
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_path, mode='a', maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    file_handler.setLevel(level)
+    file_handler.setFormatter(file_formatter)
+    
+    # Обработчик для консоли
+    if stream is None:
+        stream = sys.stdout
+        if hasattr(sys.stdout, 'reconfigure'):
+            sys.stdout.reconfigure(encoding='utf-8')
+    console_handler = logging.StreamHandler(stream)
+    console_handler.setLevel(level)
+    console_handler.setFormatter(console_formatter)
+    
+    # Фильтр библиотечных логов выполняется в потоке QueueListener
+    library_filter = LibraryLogFilter()
+    file_handler.addFilter(library_filter)
+    console_handler.addFilter(library_filter)
+    
+    # Event loop только кладет запись в очередь; частые пути сэмплируются до постановки в очередь
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sampling(LOG_SAMPLING)))
+    root.addHandler(queue_handler)
+    
+    queue_listener = DrainingQueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    queue_listener.start()
+    return root
+
+def stop_logging():
+    """Останавливает QueueListener, дописывая оставшиеся в очереди записи"""
+    global queue_listener
+    if queue_listener is not None:
+        queue_listener.stop()
+        for handler in queue_listener.handlers:
+            handler.close()
+        queue_listener = None
+
+atexit.register(stop_logging)
+
+logger = configure_logging()
 
 # Отключаем DEBUG логи от библиотек - оставляем только WARNING и выше
 # MongoDB драйверы
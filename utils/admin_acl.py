@@ -0,0 +1,149 @@
+"""
+Кэш прав администраторов (bot_super_admins.adminsType) в памяти процесса.
+
+Проверка прав в обработчиках админки, /start и зависимости verify_admin
+(X-Admin-User-ID на /api/admin/*) - поиск в словаре без запроса к MongoDB.
+
+Актуальность:
+    - кэш перечитывается не реже раза в ADMIN_ACL_TTL_SECONDS;
+    - публикация в Redis канал acl:invalidate сбрасывает кэш во всех процессах
+      (бот, копии API, планировщик). После ручного изменения bot_super_admins:
+          python -m utils.admin_acl --invalidate
+
+Если MongoDB недоступна при обновлении, используется последний загруженный список.
+"""
+import asyncio
+import sys
+import time
+from typing import Dict, Optional
+from config import ADMIN_ACL_TTL_SECONDS
+from db.mongo import get_db
+from db.redis_client import get_redis
+import logging
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = "acl:invalidate"
+SUPER_ADMIN = "SUPER_ADMIN"
+
+class AdminACL:
+    """Словарь user_id -> тип администратора с обновлением по TTL и сигналу из Redis"""
+
+    def __init__(self, ttl: float = ADMIN_ACL_TTL_SECONDS):
+        self.ttl = ttl
+        self._admins: Optional[Dict[str, str]] = None
+        self._expires_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def role(self, user_id: int) -> Optional[str]:
+        """
+        Returns:
+            Тип администратора из adminsType (например SUPER_ADMIN) или None
+        """
+        if self._admins is None or time.monotonic() >= self._expires_at:
+            await self._refresh()
+        return self._admins.get(str(user_id))
+
+    async def is_super_admin(self, user_id: int) -> bool:
+        return await self.role(user_id) == SUPER_ADMIN
+
+    def invalidate_local(self):
+        """Помечает кэш устаревшим: следующая проверка перечитает список"""
+        self._expires_at = 0.0
+
+    async def _refresh(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        self._ensure_listener()
+        # Один запрос к MongoDB на все одновременные проверки
+        async with self._lock:
+            if self._admins is not None and time.monotonic() < self._expires_at:
+                return
+            try:
+                self._admins = await self._load()
+            except Exception as e:
+                if self._admins is None:
+                    raise
+                logger.warning("[ACL] ⚠️ Не удалось обновить список администраторов, используется предыдущий: %s", e)
+            self._expires_at = time.monotonic() + self.ttl
+
+    async def _load(self) -> Dict[str, str]:
+        db = await get_db()
+        doc = await db.bot_super_admins.find_one({}, {"adminsType": 1})
+        if not doc:
+            logger.warning("[ACL] ⚠️ No documents found in bot_super_admins collection")
+            return {}
+        admins = {str(user_id): user_type for user_id, user_type in (doc.get("adminsType") or {}).items()}
+        logger.debug("[ACL] Загружен список администраторов: %s", len(admins))
+        return admins
+
+    def _ensure_listener(self):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        """Подписка на INVALIDATE_CHANNEL (переподключение при ошибках Redis)"""
+        delay = 1
+        while True:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                delay = 1
+                # Сообщения, пропущенные до подписки, покрывает перечитывание после нее
+                self.invalidate_local()
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.invalidate_local()
+                        logger.debug("[ACL] Кэш администраторов сброшен по сигналу")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("[ACL] ⚠️ Подписка на %s прервана: %s, повтор через %s с", INVALIDATE_CHANNEL, e, delay)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+_acl = AdminACL()
+
+def get_admin_acl() -> AdminACL:
+    return _acl
+
+async def is_super_admin(user_id: int) -> bool:
+    """Проверка прав супер-админа по кэшу adminsType"""
+    return await _acl.is_super_admin(user_id)
+
+async def invalidate_admin_acl():
+    """Сбрасывает кэш администраторов во всех процессах (после изменения bot_super_admins)"""
+    _acl.invalidate_local()
+    await get_redis().publish(INVALIDATE_CHANNEL, str(time.time()))
+
+async def main(argv=None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="Кэш прав администраторов (bot_super_admins)")
+    parser.add_argument("--invalidate", action="store_true", help="сбросить кэш во всех процессах")
+    args = parser.parse_args(argv)
+    if args.invalidate:
+        await invalidate_admin_acl()
+        print("Кэш администраторов сброшен")
+        return 0
+    admins = await AdminACL()._load()
+    for user_id, user_type in sorted(admins.items()):
+        print(f"{user_id}\t{user_type}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
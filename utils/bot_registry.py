@@ -0,0 +1,91 @@
+"""
+Общий экземпляр Bot для бота (polling), API и планировщика.
+
+Один Bot - одна aiohttp сессия и один пул соединений к api.telegram.org на процесс:
+лимит одновременных запросов (TELEGRAM_POOL_SIZE) общий для всех подсистем,
+соединения переиспользуются (keep-alive) между обработчиками, API и планировщиком.
+Сессия закрывается один раз при остановке процесса (close_bot).
+"""
+import asyncio
+import ssl
+from typing import Optional
+import certifi
+from aiohttp import ClientSession, TCPConnector
+from aiogram import Bot, __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from config import BOT_TOKEN, TELEGRAM_POOL_SIZE, TELEGRAM_KEEPALIVE_SECONDS, TELEGRAM_TIMEOUT_SECONDS
+from utils.metrics import instrument_bot
+import logging
+
+logger = logging.getLogger(__name__)
+
+_bot: Optional[Bot] = None
+
+class PooledSession(AiohttpSession):
+    """
+    AiohttpSession с явным TCPConnector: лимит пула и keep-alive задаются здесь,
+    а не через внутренние поля aiogram. aiogram получает aiohttp сессию только
+    через create_session (запросы Bot API и bot.download).
+    """
+
+    def __init__(self, limit: int, keepalive_timeout: float, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self._pool_limit = limit
+        self._keepalive_timeout = keepalive_timeout
+        self._client: Optional[ClientSession] = None
+
+    async def create_session(self) -> ClientSession:
+        if self._client is None or self._client.closed:
+            connector = TCPConnector(
+                ssl=ssl.create_default_context(cafile=certifi.where()),
+                limit=self._pool_limit,
+                keepalive_timeout=self._keepalive_timeout,
+                ttl_dns_cache=3600,
+            )
+            self._client = ClientSession(connector=connector, headers={"User-Agent": f"aiogram/{aiogram_version}"})
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None and not self._client.closed:
+            await self._client.close()
+            # Даем SSL соединениям закрыться (рекомендация aiohttp для graceful shutdown)
+            await asyncio.sleep(0.25)
+
+def create_session() -> PooledSession:
+    """
+    Сессия Bot API с настроенным пулом соединений.
+
+    Returns:
+        PooledSession: limit - общий лимит соединений, keep-alive и таймаут запроса из config
+    """
+    return PooledSession(
+        limit=TELEGRAM_POOL_SIZE,
+        keepalive_timeout=TELEGRAM_KEEPALIVE_SECONDS,
+        timeout=TELEGRAM_TIMEOUT_SECONDS
+    )
+
+def get_bot() -> Bot:
+    """
+    Общий Bot процесса (создается при первом вызове, с метриками запросов к Bot API).
+    Сетевая сессия открывается лениво при первом запросе.
+    """
+    global _bot
+    if _bot is None:
+        _bot = instrument_bot(Bot(BOT_TOKEN, session=create_session()))
+        logger.debug(
+            "[BOT] Создан общий Bot: пул %s, keep-alive %s с, таймаут %s с",
+            TELEGRAM_POOL_SIZE, TELEGRAM_KEEPALIVE_SECONDS, TELEGRAM_TIMEOUT_SECONDS
+        )
+    return _bot
+
+async def close_bot():
+    """Закрывает сессию общего Bot (повторный вызов ничего не делает)"""
+    global _bot
+    if _bot is None:
+        return
+    bot, _bot = _bot, None
+    try:
+        await bot.session.close()
+        logger.debug("[BOT] Сессия общего Bot закрыта")
+    except Exception as e:
+        logger.warning("[BOT] Ошибка при закрытии сессии бота: %s", e)
@@ -0,0 +1,170 @@
+"""
+Сжатие ответов API (gzip, brotli) по заголовку Accept-Encoding.
+
+Сжимаются ответы с текстовым content-type (JSON, NDJSON, CSV, HTML) от
+COMPRESSION_MIN_BYTES; brotli выбирается, если клиент его принимает и установлен
+пакет brotli (pip install brotli), иначе gzip. Потоковые ответы сжимаются по частям.
+Ответы с уже заданным Content-Encoding, 304 и ответы без тела не меняются.
+"""
+import gzip
+import zlib
+from typing import Optional
+from config import COMPRESSION_MIN_BYTES, COMPRESSION_GZIP_LEVEL, COMPRESSION_BROTLI_QUALITY
+
+try:
+    import brotli
+except ImportError:  # сжатие brotli необязательно
+    brotli = None
+
+_COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/geo+json", "application/gpx+xml",
+    "text/", "image/svg+xml",
+)
+
+def _accepted_encodings(header: str) -> dict:
+    """Accept-Encoding -> {кодировка: q}"""
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+def choose_encoding(header: str) -> Optional[str]:
+    """
+    Кодировка ответа по Accept-Encoding.
+
+    Returns:
+        "br", "gzip" или None (без сжатия)
+    """
+    accepted = _accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    candidates = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = accepted.get(encoding, wildcard)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+class _Compressor:
+    """Потоковый компрессор gzip или brotli"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            # wbits 16+: формат gzip (заголовок и CRC) при потоковом сжатии
+            self._zlib = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        """Сжимает часть и сбрасывает буфер: клиент получает записи потока без задержки"""
+        if self.encoding == "br":
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self) -> bytes:
+        if self.encoding == "br":
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """Сжимает тело целиком"""
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+class CompressionMiddleware:
+    """ASGI middleware сжатия ответов"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSend(send, encoding, self.minimum_size))
+
+class _CompressingSend:
+    """Обертка send: решение о сжатии принимается по заголовкам и первой части тела"""
+
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if self.passthrough:
+            await self.send(message)
+            return
+        if message["type"] == "http.response.start":
+            headers = {name.lower(): value for name, value in message.get("headers", [])}
+            content_type = headers.get(b"content-type", b"").decode("latin-1")
+            if (
+                message["status"] in (204, 304)
+                or b"content-encoding" in headers
+                or not content_type.startswith(_COMPRESSIBLE_TYPES)
+            ):
+                self.passthrough = True
+                await self.send(message)
+                return
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            if not more_body and len(body) < self.minimum_size:
+                # Маленький ответ целиком: без сжатия
+                self.passthrough = True
+                await self.send(start)
+                await self.send(message)
+                return
+            headers = [
+                (name, value) for name, value in start.get("headers", [])
+                if name.lower() not in (b"content-length", b"etag")
+            ]
+            headers.append((b"content-encoding", self.encoding.encode()))
+            headers.append((b"vary", b"Accept-Encoding"))
+            etag = dict((name.lower(), value) for name, value in start.get("headers", [])).get(b"etag")
+            if etag is not None:
+                # Сжатое представление не совпадает побайтно с несжатым: ETag становится слабым (как в nginx),
+                # If-None-Match с W/ по-прежнему дает 304
+                headers.append((b"etag", etag if etag.startswith(b"W/") else b"W/" + etag))
+            if not more_body:
+                compressed = compress_body(body, self.encoding)
+                headers.append((b"content-length", str(len(compressed)).encode()))
+                await self.send({**start, "headers": headers})
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            self.compressor = _Compressor(self.encoding)
+            await self.send({**start, "headers": headers})
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.flush()
+        if chunk or not more_body:
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
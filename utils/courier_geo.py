@@ -0,0 +1,141 @@
+from typing import List, Dict, Any
+from db.redis_client import get_redis
+from db.mongo import get_db
+from config import LOC_TTL
+from utils.data_versions import add_version_bumps
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Redis GEO set с позициями курьеров на смене (member = chat_id)
+COURIERS_GEO_KEY = "couriers:geo"
+
+def geo_point(lat: float, lon: float) -> Dict[str, Any]:
+    """
+    Формирует GeoJSON точку для 2dsphere индекса.
+
+    Args:
+        lat: Широта
+        lon: Долгота
+
+    Returns:
+        GeoJSON Point (порядок координат: lon, lat)
+    """
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+async def update_courier_position(chat_id: int, lat: float, lon: float):
+    """
+    Обновляет позицию курьера в Redis: строку courier:loc:{chat_id}, GEO set
+    и версию location для кэша admin API. Команды уходят одним pipeline (один round trip).
+
+    Args:
+        chat_id: Telegram chat ID курьера
+        lat: Широта
+        lon: Долгота
+    """
+    redis = get_redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.setex(f"courier:loc:{chat_id}", LOC_TTL, f"{lat},{lon}")
+    pipe.geoadd(COURIERS_GEO_KEY, (lon, lat, str(chat_id)))
+    add_version_bumps(pipe, "location", chat_id=chat_id)
+    await pipe.execute()
+
+async def remove_courier_position(chat_id: int):
+    """
+    Удаляет позицию курьера из Redis (при завершении смены).
+
+    Args:
+        chat_id: Telegram chat ID курьера
+    """
+    redis = get_redis()
+    pipe = redis.pipeline(transaction=False)
+    pipe.delete(f"courier:loc:{chat_id}")
+    pipe.zrem(COURIERS_GEO_KEY, str(chat_id))
+    add_version_bumps(pipe, "location", chat_id=chat_id)
+    await pipe.execute()
+
+async def find_nearby_couriers(lat: float, lon: float, radius_m: float, limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Ищет курьеров на смене в радиусе от точки.
+
+    Основной путь - GEOSEARCH по Redis GEO set (O(N+log(M)) от числа найденных,
+    не зависит от размера парка). Курьеры, у которых истек ключ смены,
+    отфильтровываются одним MGET и удаляются из GEO set.
+    При недоступности Redis используется 2dsphere индекс couriers.last_location.geo.
+
+    Args:
+        lat: Широта точки
+        lon: Долгота точки
+        radius_m: Радиус поиска в метрах
+        limit: Максимальное количество курьеров
+
+    Returns:
+        Список словарей {chat_id, distance_m, lat, lon}, отсортированный по расстоянию
+    """
+    redis = get_redis()
+    try:
+        found = await redis.geosearch(
+            COURIERS_GEO_KEY,
+            longitude=lon,
+            latitude=lat,
+            radius=radius_m,
+            unit="m",
+            sort="ASC",
+            count=limit,
+            withdist=True,
+            withcoord=True
+        )
+    except Exception as e:
+        logger.warning("[GEO] ⚠️ GEOSEARCH недоступен, используем MongoDB: %s", e)
+        return await _find_nearby_couriers_mongo(lat, lon, radius_m, limit)
+
+    if not found:
+        return []
+
+    # Проверяем, что курьеры все еще на смене
+    shift_flags = await redis.mget([f"courier:shift:{member}" for member, _, _ in found])
+
+    result = []
+    stale = []
+    for (member, distance, (member_lon, member_lat)), shift_flag in zip(found, shift_flags):
+        if shift_flag != "on":
+            stale.append(member)
+            continue
+        result.append({
+            "chat_id": int(member),
+            "distance_m": round(float(distance), 1),
+            "lat": float(member_lat),
+            "lon": float(member_lon)
+        })
+
+    if stale:
+        await redis.zrem(COURIERS_GEO_KEY, *stale)
+        logger.debug("[GEO] 🗑️ Удалены устаревшие позиции: %s", stale)
+
+    return result
+
+async def _find_nearby_couriers_mongo(lat: float, lon: float, radius_m: float, limit: int) -> List[Dict[str, Any]]:
+    """Резервный поиск через $geoNear по 2dsphere индексу couriers.last_location.geo"""
+    db = await get_db()
+    pipeline = [
+        {"$geoNear": {
+            "near": geo_point(lat, lon),
+            "key": "last_location.geo",
+            "distanceField": "distance_m",
+            "maxDistance": radius_m,
+            "spherical": True,
+            "query": {"is_on_shift": True}
+        }},
+        {"$limit": limit},
+        {"$project": {"tg_chat_id": 1, "distance_m": 1, "last_location": 1}}
+    ]
+    result = []
+    async for courier in db.couriers.aggregate(pipeline):
+        last_location = courier.get("last_location") or {}
+        result.append({
+            "chat_id": courier["tg_chat_id"],
+            "distance_m": round(float(courier["distance_m"]), 1),
+            "lat": last_location.get("lat"),
+            "lon": last_location.get("lon")
+        })
+    return result
@@ -0,0 +1,220 @@
+import re
+import time
+from typing import Optional, List, Dict, Any, Tuple
+import numpy as np
+from db.mongo import get_db
+from db.redis_client import get_redis
+from utils.courier_geo import COURIERS_GEO_KEY
+from utils.geodesy import haversine_km
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Время жизни снимка состояния курьеров (секунды)
+SNAPSHOT_TTL = 5.0
+
+# Веса скоринга (меньше - лучше). 1 км расстояния ~ 1 балл.
+W_DISTANCE = 1.0          # за километр до точки заказа
+W_WAITING = 2.0           # за каждый заказ в ожидании
+W_IN_TRANSIT = 3.0        # за каждый заказ в пути
+W_PRIORITY_LOAD = 0.5     # за суммарный приоритет активных заказов курьера
+PRIORITY_URGENCY = 0.5    # усиление штрафа за загрузку для приоритетных заказов
+UNKNOWN_DISTANCE_KM = 50.0  # расстояние для курьеров без известной позиции
+
+# Координаты в ссылках Google Maps: ...@lat,lon... или ...?q=lat,lon
+_MAP_URL_COORDS = re.compile(r"(?:@|[?&](?:q|query|ll|destination)=)(-?\d{1,2}\.\d+),\s*(-?\d{1,3}\.\d+)")
+
+class CourierSnapshot:
+    """
+    Снимок состояния курьеров на смене в виде numpy массивов
+    (позиции и загрузка), используется для векторного скоринга.
+    """
+    __slots__ = ("chat_ids", "names", "usernames", "lat", "lon", "waiting", "in_transit", "priority_load", "built_at")
+
+    def __init__(self, couriers: List[Dict[str, Any]]):
+        self.chat_ids = np.array([c["chat_id"] for c in couriers], dtype=np.int64)
+        self.names = [c["name"] for c in couriers]
+        self.usernames = [c.get("username") for c in couriers]
+        self.lat = np.array([c["lat"] if c.get("lat") is not None else np.nan for c in couriers], dtype=np.float64)
+        self.lon = np.array([c["lon"] if c.get("lon") is not None else np.nan for c in couriers], dtype=np.float64)
+        self.waiting = np.array([c.get("waiting", 0) for c in couriers], dtype=np.float64)
+        self.in_transit = np.array([c.get("in_transit", 0) for c in couriers], dtype=np.float64)
+        self.priority_load = np.array([c.get("priority_load", 0) for c in couriers], dtype=np.float64)
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+_snapshot: Optional[CourierSnapshot] = None
+
+# Поля заказа, которые нужны для подбора (проекция запроса заказа)
+ORDER_FIELDS = {"lat": 1, "lon": 1, "map_url": 1, "priority": 1, "courier_tg_chat_id": 1}
+
+def order_coordinates(order: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """
+    Возвращает координаты точки доставки заказа.
+    Берет поля lat/lon заказа, иначе пытается извлечь координаты из map_url.
+
+    Returns:
+        (lat, lon) или None, если координаты неизвестны
+    """
+    lat, lon = order.get("lat"), order.get("lon")
+    if lat is not None and lon is not None:
+        return float(lat), float(lon)
+
+    map_url = order.get("map_url")
+    if map_url:
+        match = _MAP_URL_COORDS.search(map_url)
+        if match:
+            lat, lon = float(match.group(1)), float(match.group(2))
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return lat, lon
+    return None
+
+def rank_couriers(
+    snapshot: CourierSnapshot,
+    coords: Optional[Tuple[float, float]],
+    order_priority: int = 0,
+    exclude_chat_id: Optional[int] = None,
+    limit: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    Ранжирует курьеров из снимка для заказа.
+
+    Стоимость = расстояние + загрузка (waiting/in_transit/приоритеты активных заказов),
+    штраф за загрузку усиливается для приоритетных заказов. Меньше - лучше.
+
+    Args:
+        snapshot: Снимок состояния курьеров
+        coords: Координаты заказа (lat, lon) или None
+        order_priority: Приоритет заказа
+        exclude_chat_id: Курьер, которого нужно исключить (текущий исполнитель)
+        limit: Максимальное количество курьеров в результате
+
+    Returns:
+        Список курьеров, отсортированный по возрастанию стоимости
+    """
+    if not len(snapshot):
+        return []
+
+    if coords is not None:
+        distance_km = haversine_km(coords[0], coords[1], snapshot.lat, snapshot.lon)
+        distance_km = np.where(np.isnan(distance_km), UNKNOWN_DISTANCE_KM, distance_km)
+    else:
+        distance_km = np.zeros(len(snapshot))
+
+    urgency = 1.0 + max(order_priority or 0, 0) * PRIORITY_URGENCY
+    load = W_WAITING * snapshot.waiting + W_IN_TRANSIT * snapshot.in_transit + W_PRIORITY_LOAD * snapshot.priority_load
+    score = W_DISTANCE * distance_km + urgency * load
+
+    if exclude_chat_id is not None:
+        score = np.where(snapshot.chat_ids == exclude_chat_id, np.inf, score)
+
+    # Исключенные курьеры не занимают места в top-k
+    eligible = np.flatnonzero(np.isfinite(score))
+    count = min(limit, len(eligible))
+    if count <= 0:
+        return []
+    if count < len(eligible):
+        top = eligible[np.argpartition(score[eligible], count - 1)[:count]]
+        top = top[np.argsort(score[top], kind="stable")]
+    else:
+        top = eligible[np.argsort(score[eligible], kind="stable")]
+
+    result = []
+    for i in top:
+        has_position = coords is not None and not np.isnan(snapshot.lat[i])
+        result.append({
+            "chat_id": int(snapshot.chat_ids[i]),
+            "name": snapshot.names[i],
+            "username": snapshot.usernames[i],
+            "score": round(float(score[i]), 2),
+            "distance_m": round(float(distance_km[i]) * 1000, 1) if has_position else None,
+            "waiting": int(snapshot.waiting[i]),
+            "in_transit": int(snapshot.in_transit[i])
+        })
+    return result
+
+async def build_courier_snapshot() -> CourierSnapshot:
+    """
+    Строит снимок курьеров на смене: профиль из MongoDB, позиции из Redis GEO set
+    (fallback - last_location), загрузка - одной агрегацией по активным заказам.
+    """
+    db = await get_db()
+    redis = get_redis()
+
+    couriers = await db.couriers.find(
+        {"is_on_shift": True},
+        {"tg_chat_id": 1, "name": 1, "username": 1, "last_location": 1}
+    ).to_list(None)
+    if not couriers:
+        return CourierSnapshot([])
+
+    chat_ids = [c["tg_chat_id"] for c in couriers]
+
+    positions = {}
+    try:
+        geo = await redis.geopos(COURIERS_GEO_KEY, *[str(chat_id) for chat_id in chat_ids])
+        for chat_id, pos in zip(chat_ids, geo):
+            if pos:
+                positions[chat_id] = (float(pos[1]), float(pos[0]))
+    except Exception as e:
+        logger.warning("[SUGGEST] ⚠️ Не удалось получить позиции из Redis: %s", e)
+
+    loads = {}
+    pipeline = [
+        {"$match": {"courier_tg_chat_id": {"$in": chat_ids}, "status": {"$in": ["waiting", "in_transit"]}}},
+        {"$group": {
+            "_id": {"courier": "$courier_tg_chat_id", "status": "$status"},
+            "count": {"$sum": 1},
+            "priority": {"$sum": {"$ifNull": ["$priority", 0]}}
+        }}
+    ]
+    async for row in db.couriers_deliveries.aggregate(pipeline):
+        load = loads.setdefault(row["_id"]["courier"], {"waiting": 0, "in_transit": 0, "priority_load": 0})
+        load[row["_id"]["status"]] = row["count"]
+        load["priority_load"] += row["priority"]
+
+    items = []
+    for courier in couriers:
+        chat_id = courier["tg_chat_id"]
+        lat, lon = positions.get(chat_id, (None, None))
+        if lat is None:
+            last_location = courier.get("last_location") or {}
+            lat, lon = last_location.get("lat"), last_location.get("lon")
+        items.append({
+            "chat_id": chat_id,
+            "name": courier.get("name", "Unknown"),
+            "username": courier.get("username"),
+            "lat": lat,
+            "lon": lon,
+            **loads.get(chat_id, {})
+        })
+    return CourierSnapshot(items)
+
+async def get_courier_snapshot(force: bool = False) -> CourierSnapshot:
+    """Возвращает закешированный снимок курьеров, перестраивая его раз в SNAPSHOT_TTL секунд"""
+    global _snapshot
+    if force or _snapshot is None or time.monotonic() - _snapshot.built_at > SNAPSHOT_TTL:
+        _snapshot = await build_courier_snapshot()
+    return _snapshot
+
+async def suggest_couriers(order: Dict[str, Any], limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Подбирает курьеров на смене для заказа.
+
+    Args:
+        order: Документ заказа из couriers_deliveries
+        limit: Максимальное количество курьеров
+
+    Returns:
+        Список курьеров, лучшие первыми (см. rank_couriers)
+    """
+    snapshot = await get_courier_snapshot()
+    return rank_couriers(
+        snapshot,
+        order_coordinates(order),
+        order_priority=order.get("priority", 0),
+        exclude_chat_id=order.get("courier_tg_chat_id"),
+        limit=limit
+    )
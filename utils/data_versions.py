@@ -0,0 +1,68 @@
+"""
+Версии данных для кэша ответов admin API (utils/response_cache.py).
+
+Версия - счетчик в Redis, который увеличивается при записи:
+    cache:ver:<scope>              - любое изменение области (списки курьеров)
+    cache:ver:<scope>:<chat_id>    - изменение данных одного курьера
+    cache:ver:epoch                - сброс всего кэша (invalidate_all)
+Области: orders (заказы и счетчики), shift (смены и профиль курьера),
+location (позиция курьера).
+
+Кэшированный ответ, зависящий от области, перестает совпадать по ETag после
+увеличения ее версии. Модуль не зависит от FastAPI: его вызывают обработчики бота.
+"""
+import sys
+from typing import Iterable, Optional
+from db.redis_client import get_redis
+import logging
+
+logger = logging.getLogger(__name__)
+
+VERSION_PREFIX = "cache:ver:"
+EPOCH_KEY = "cache:ver:epoch"
+
+def version_key(scope: str, chat_id: Optional[int] = None) -> str:
+    return f"{VERSION_PREFIX}{scope}" if chat_id is None else f"{VERSION_PREFIX}{scope}:{chat_id}"
+
+def add_version_bumps(pipe, *scopes: str, chat_id: Optional[int] = None):
+    """Добавляет увеличение версий в pipeline Redis вызывающего кода (без отдельного round trip)"""
+    for scope in scopes:
+        pipe.incr(version_key(scope))
+        if chat_id is not None:
+            pipe.incr(version_key(scope, chat_id))
+
+async def bump_versions(*scopes: str, chat_id: Optional[int] = None, chat_ids: Iterable[Optional[int]] = ()):
+    """
+    Помечает данные измененными.
+
+    Args:
+        scopes: orders | shift | location
+        chat_id: Курьер, данные которого изменились
+        chat_ids: Несколько курьеров (например, при передаче заказа)
+
+    Ошибки Redis логируются: кэшированные ответы устареют не позже TTL эндпоинта.
+    """
+    targets = {target for target in (chat_id, *chat_ids) if target is not None}
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        # Общая версия области увеличивается один раз, версии курьеров - для каждого
+        add_version_bumps(pipe, *scopes)
+        for target in targets:
+            for scope in scopes:
+                pipe.incr(version_key(scope, target))
+        await pipe.execute()
+    except Exception as e:
+        logger.warning("[CACHE] ⚠️ Не удалось обновить версии %s (chat_id=%s): %s", scopes, chat_id, e)
+
+async def invalidate_all():
+    """Сбрасывает все кэшированные ответы (например, после ручных правок в базе)"""
+    await get_redis().incr(EPOCH_KEY)
+
+async def main() -> int:
+    await invalidate_all()
+    print("Кэш ответов admin API сброшен")
+    return 0
+
+if __name__ == "__main__":
+    import asyncio
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,196 @@
+"""
+Потоковая выгрузка заказов и истории смен (NDJSON / CSV).
+
+Строки читаются курсором Motor (проекция, EXPORT_BATCH_SIZE документов за getMore)
+и сразу пишутся в StreamingResponse частями ~64 KB: память не зависит от числа строк.
+
+Строки упорядочены по _id, каждая содержит _id. Прерванную выгрузку можно
+продолжить: передайте _id последней полученной строки в параметре cursor -
+выгрузка начнется со следующей. Фильтр по датам дополнительно ограничивает
+диапазон _id (ObjectId содержит время вставки), чтобы запрос шел по индексу _id.
+"""
+import csv
+import io
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi.responses import StreamingResponse
+from config import EXPORT_BATCH_SIZE, TIMEZONE
+from db.migrate_timestamps import time_filter
+from utils.fast_json import dumps
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+ORDER_FIELDS = (
+    "_id", "external_id", "courier_tg_chat_id", "status", "payment_status", "is_cash_payment",
+    "priority", "brand", "source", "delivery_time", "created_at", "updated_at",
+    "address", "lat", "lon", "client.name", "client.phone", "notes",
+    "status_history.in_transit", "status_history.done", "status_history.cancelled",
+)
+
+SHIFT_FIELDS = (
+    "_id", "courier_tg_chat_id", "event", "shift_id", "total_orders", "complete_orders",
+    "shift_started_at", "timestamp",
+    "track_stats.distance_km", "track_stats.moving_seconds", "track_stats.stationary_seconds",
+    "track_stats.max_speed_kmh", "track_stats.stops_count",
+)
+
+# Запас для диапазона _id: документы, вставленные позже поля времени (буфер аудита, миграции)
+_ID_TIME_SLACK = timedelta(days=1)
+_CHUNK_BYTES = 64 * 1024
+
+def parse_cursor(token: Optional[str]) -> Optional[ObjectId]:
+    """
+    Returns:
+        ObjectId последней полученной строки или None
+
+    Raises:
+        ValueError: Некорректный токен
+    """
+    if not token:
+        return None
+    try:
+        return ObjectId(token)
+    except (InvalidId, TypeError):
+        raise ValueError(f"Invalid cursor: {token}")
+
+def _localize(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=TIMEZONE)
+    return value
+
+def build_filter(
+    time_field: str,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    cursor: Optional[ObjectId] = None,
+    legacy: bool = False,
+    **equals: Any
+) -> Dict[str, Any]:
+    """
+    Фильтр выгрузки.
+
+    Args:
+        time_field: Поле времени для диапазона (created_at, timestamp)
+        date_from, date_to: Полуинтервал [date_from, date_to); без таймзоны - время Buenos Aires
+        cursor: _id последней полученной строки
+        legacy: Учитывать строковые даты (миграция db.migrate_timestamps не завершена)
+        equals: Поле -> значение (None пропускается, список -> $in)
+    """
+    query: Dict[str, Any] = {}
+    id_range: Dict[str, Any] = {}
+    date_from, date_to = _localize(date_from), _localize(date_to)
+    if date_from or date_to:
+        time_range = {}
+        if date_from:
+            time_range["$gte"] = date_from
+            id_range["$gte"] = ObjectId.from_datetime(date_from - _ID_TIME_SLACK)
+        if date_to:
+            time_range["$lt"] = date_to
+            id_range["$lt"] = ObjectId.from_datetime(date_to + _ID_TIME_SLACK)
+        query.update(time_filter(time_field, time_range, legacy))
+    if cursor is not None:
+        id_range["$gt"] = cursor
+    if id_range:
+        query["_id"] = id_range
+    for field, value in equals.items():
+        if value is None or value == []:
+            continue
+        query[field] = {"$in": list(value)} if isinstance(value, (list, tuple, set)) else value
+    return query
+
+def _lookup(document: Dict[str, Any], path: str) -> Any:
+    value: Any = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return dumps(value).decode()
+    return value if isinstance(value, (int, float)) else str(value)
+
+async def stream_rows(cursor, fields: Sequence[str], fmt: str, name: str = "") -> AsyncIterator[bytes]:
+    """
+    Строки выгрузки частями по ~64 KB.
+
+    Args:
+        cursor: Курсор Motor (закрывается по окончании или при отключении клиента)
+        fields: Поля (вложенные через точку)
+        fmt: ndjson | csv
+        name: Имя выгрузки для лога
+    """
+    buffer = io.StringIO() if fmt == "csv" else None
+    writer = csv.writer(buffer) if buffer is not None else None
+    chunk: List[bytes] = []
+    size = 0
+    rows = 0
+    try:
+        if writer is not None:
+            writer.writerow(fields)
+        async for document in cursor:
+            rows += 1
+            if writer is not None:
+                writer.writerow([_csv_value(_lookup(document, field)) for field in fields])
+                line = buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            else:
+                line = dumps(document) + b"\n"
+            chunk.append(line)
+            size += len(line)
+            if size >= _CHUNK_BYTES:
+                yield b"".join(chunk)
+                chunk, size = [], 0
+        if writer is not None and rows == 0:
+            chunk.append(buffer.getvalue().encode())
+        if chunk:
+            yield b"".join(chunk)
+        logger.info("[EXPORT] ✅ Выгрузка %s (%s) завершена: %s строк", name, fmt, rows)
+    finally:
+        await cursor.close()
+
+def export_response(
+    collection,
+    query: Dict[str, Any],
+    fields: Iterable[str],
+    fmt: str,
+    filename: str,
+    limit: int = 0
+) -> StreamingResponse:
+    """
+    StreamingResponse выгрузки коллекции.
+
+    Args:
+        collection: Коллекция Motor
+        query: Фильтр (build_filter)
+        fields: Поля проекции и колонки CSV
+        fmt: ndjson | csv
+        filename: Имя файла без расширения (Content-Disposition)
+        limit: Максимум строк (0 - все)
+    """
+    fields = tuple(fields)
+    projection = {field: 1 for field in fields}
+    cursor = collection.find(query, projection).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+    return StreamingResponse(
+        stream_rows(cursor, fields, fmt, collection.name),
+        media_type=FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
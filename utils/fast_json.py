@@ -0,0 +1,61 @@
+"""
+Быстрая сериализация ответов API (orjson) с поддержкой типов BSON.
+
+Документы MongoDB (ObjectId, datetime, Decimal128) сериализуются напрямую,
+без копирования dict(order) и без валидации списков через Pydantic:
+эндпоинты со списками заказов возвращают ORJSONResponse, а response_model
+остается только для документации OpenAPI.
+
+Без orjson (pip install orjson) используется стандартный json с тем же форматом.
+"""
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any
+from bson import Decimal128, ObjectId
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # orjson указан в requirements.txt
+    orjson = None
+
+def bson_default(value: Any) -> Any:
+    """
+    Преобразование типов, которые JSON энкодер не знает.
+
+    ObjectId -> строка, Decimal128/Decimal -> строка (без потери точности),
+    модели Pydantic -> dict, множества -> список.
+    """
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, (datetime, date)):
+        # Только для fallback на json: orjson сериализует даты сам
+        return value.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(content: Any) -> bytes:
+        """JSON в bytes (UTF-8, без пробелов)"""
+        return orjson.dumps(content, default=bson_default, option=_OPTIONS)
+else:
+    def dumps(content: Any) -> bytes:
+        """JSON в bytes (UTF-8, без пробелов)"""
+        return json.dumps(content, default=bson_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse с сериализацией через dumps (ObjectId и datetime из MongoDB как есть)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,27 @@
+"""
+Расстояния на сфере Земли (numpy, векторно).
+
+Общие для подбора курьера (utils/courier_suggest.py), аналитики трека
+(utils/track_stats.py) и упрощения трека (utils/track.py).
+"""
+import numpy as np
+
+# Средний радиус Земли (IUGG)
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Расстояние по формуле гаверсинусов (км), поэлементно с broadcasting:
+    точка и массив точек или два массива одинаковой длины.
+
+    Args:
+        lat1, lon1: Первая точка или массивы точек (градусы)
+        lat2, lon2: Вторая точка или массивы точек (градусы)
+    """
+    lat1 = np.radians(lat1)
+    lat2 = np.radians(lat2)
+    dlat = lat2 - lat1
+    dlon = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    # Округление может дать a чуть больше 1 для почти противоположных точек
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
@@ -0,0 +1,178 @@
+"""
+Мониторинг задержек event loop и сэмплирующий профилировщик.
+
+Бот, API (uvicorn) и планировщик работают в одном event loop (bot.main): любая
+синхронная работа в обработчике (PIL, регулярные выражения по большим строкам,
+декодирование больших выборок) останавливает все остальные.
+
+LoopLagMonitor:
+    - задача в loop просыпается каждые LOOP_MONITOR_INTERVAL_MS и измеряет опоздание
+      (гистограмма shipbot_event_loop_lag_seconds);
+    - поток-сторож проверяет, что задача жива: если loop не отвечает дольше
+      LOOP_BLOCK_THRESHOLD_MS, в лог пишется стек потока loop в момент блокировки
+      (виден код, который блокирует, а не тот, кто проснулся после).
+
+sample_stacks - сэмплирующий профилировщик без зависимостей: периодически снимает
+стеки потоков через sys._current_frames и возвращает их в свернутом формате
+("frame;frame;frame count"), который принимают flamegraph.pl и speedscope
+(GET /api/admin/debug/profile).
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter
+from typing import Dict, Iterable, Optional
+from config import LOOP_MONITOR_INTERVAL_MS, LOOP_BLOCK_THRESHOLD_MS
+from utils.metrics import REGISTRY, Counter, Histogram
+import logging
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "shipbot_event_loop_lag_seconds", "Delay of a periodic event loop callback past its deadline",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+))
+EVENT_LOOP_BLOCKS = REGISTRY.register(Counter(
+    "shipbot_event_loop_blocks_total", "Event loop stalls longer than LOOP_BLOCK_THRESHOLD_MS"
+))
+
+_PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class LoopLagMonitor:
+    """Измерение опоздания event loop и дамп стека при блокировке"""
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.loop_thread_id: Optional[int] = None
+        self._heartbeat = time.monotonic()
+        self._reported_heartbeat: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        """Запускает задачу в текущем event loop и поток-сторож"""
+        self.loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.threshold > 0:
+            self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+            self._watchdog.start()
+        logger.info(
+            "[LOOP] 🩺 Мониторинг event loop: интервал %.0f ms, порог блокировки %.0f ms",
+            self.interval * 1000, self.threshold * 1000
+        )
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - expected, 0)
+            self._heartbeat = now
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            if self.threshold > 0 and lag >= self.threshold:
+                logger.warning("[LOOP] ⚠️ Event loop был заблокирован %.0f ms", lag * 1000)
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            # Одна блокировка - один дамп, даже если она длится дольше нескольких проверок
+            if stalled < self.threshold or heartbeat == self._reported_heartbeat:
+                continue
+            self._reported_heartbeat = heartbeat
+            EVENT_LOOP_BLOCKS.inc()
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<нет стека>"
+            logger.warning(
+                "[LOOP] 🧱 Event loop не отвечает %.0f ms, стек потока loop:\n%s", stalled * 1000, stack
+            )
+
+_monitor: Optional[LoopLagMonitor] = None
+
+def start_loop_monitor() -> Optional[LoopLagMonitor]:
+    """
+    Запускает мониторинг в текущем event loop (повторный вызов ничего не делает).
+    LOOP_MONITOR_INTERVAL_MS=0 отключает мониторинг.
+    """
+    global _monitor
+    if _monitor is None and LOOP_MONITOR_INTERVAL_MS > 0:
+        _monitor = LoopLagMonitor(LOOP_MONITOR_INTERVAL_MS / 1000, LOOP_BLOCK_THRESHOLD_MS / 1000)
+        _monitor.start()
+    return _monitor
+
+def get_loop_thread_id() -> int:
+    """Поток event loop (главный поток, если мониторинг не запущен)"""
+    if _monitor is not None and _monitor.loop_thread_id is not None:
+        return _monitor.loop_thread_id
+    return threading.main_thread().ident
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_PACKAGE_ROOT):
+        filename = os.path.relpath(filename, _PACKAGE_ROOT)
+    else:
+        filename = os.path.basename(filename)
+    # Первая строка функции, а не текущая: одна функция - один блок во flamegraph
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+def _fold(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+_profile_lock = threading.Lock()
+
+class ProfilerBusy(Exception):
+    """Профилирование уже выполняется"""
+
+def sample_stacks(seconds: float, interval: float, thread_ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+    """
+    Снимает стеки потоков каждые interval секунд в течение seconds (блокирующий вызов,
+    выполняется в отдельном потоке: asyncio.to_thread).
+
+    Args:
+        seconds: Длительность профилирования
+        interval: Интервал между сэмплами
+        thread_ids: Потоки для сэмплирования (None - все, кроме текущего)
+
+    Returns:
+        Свернутые стеки -> число сэмплов (имя потока - корневой кадр)
+
+    Raises:
+        ProfilerBusy: если профилирование уже запущено
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        own_id = threading.get_ident()
+        wanted = set(thread_ids) if thread_ids is not None else None
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks: StackCounter = StackCounter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (wanted is not None and thread_id not in wanted):
+                    continue
+                stacks[f"{names.get(thread_id, thread_id)};{_fold(frame)}"] += 1
+            time.sleep(interval)
+        return dict(stacks)
+    finally:
+        _profile_lock.release()
+
+def format_folded(stacks: Dict[str, int]) -> str:
+    """Свернутый формат flamegraph.pl / speedscope: одна строка "стек количество" """
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
@@ -0,0 +1,328 @@
+"""
+Метрики в формате Prometheus (text exposition 0.0.4), отдаются на GET /metrics.
+
+Реализация без внешних зависимостей: счетчики и гистограммы хранятся в словарях
+по кортежу значений меток, обновление - одна операция под блокировкой
+(слушатель команд pymongo вызывается из потоков драйвера).
+
+Источники:
+    FastAPI            - middleware в api_server.py
+    aiogram            - HandlerMetricsMiddleware на роутерах (bot.py)
+    Telegram Bot API   - BotRequestMetricsMiddleware на сессии бота (instrument_bot)
+    MongoDB            - MongoCommandMetrics (event_listeners клиента Motor)
+    Redis              - InstrumentedRedis (db/redis_client.py)
+    Odoo, webhooks     - observe_odoo_call, send_webhook
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from pymongo import monitoring
+
+# Границы бакетов (секунды): от быстрых запросов Redis до таймаутов HTTP (10 с)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]):
+        """Значение без меток, вычисляемое при сборе метрик"""
+        self._function = function
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        if self._function is not None:
+            samples = [f"{self.name} {_format_value(self._function())}"]
+        else:
+            samples = self._samples()
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *samples
+        ]
+
+class Counter(_Metric):
+    """Монотонный счетчик"""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(_Metric):
+    """Текущее значение"""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram(_Metric):
+    """Гистограмма длительностей (секунды)"""
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [счетчики по бакетам (не накопительные)..., +Inf, сумма]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            row[index] += 1
+            row[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Измеряет длительность блока; метка outcome=error при исключении (если она объявлена)"""
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            if "outcome" in self.labelnames and "outcome" not in labels:
+                labels["outcome"] = outcome
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(row)) for key, row in self._values.items()]
+        lines = []
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_value(cumulative)}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "shipbot_http_request_seconds", "FastAPI request latency", ("method", "route", "status")
+))
+BOT_HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "shipbot_bot_handler_seconds", "aiogram handler latency", ("router", "event", "outcome")
+))
+TELEGRAM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "shipbot_telegram_request_seconds", "Telegram Bot API request latency", ("method", "outcome")
+))
+MONGO_COMMAND_SECONDS = REGISTRY.register(Histogram(
+    "shipbot_mongo_command_seconds", "MongoDB command latency", ("command", "collection", "outcome")
+))
+REDIS_COMMAND_SECONDS = REGISTRY.register(Histogram(
+    "shipbot_redis_command_seconds", "Redis command latency", ("command", "outcome")
+))
+ODOO_CALL_SECONDS = REGISTRY.register(Histogram(
+    "shipbot_odoo_call_seconds", "Odoo JSON-RPC call latency", ("model", "method", "outcome")
+))
+WEBHOOK_SECONDS = REGISTRY.register(Histogram(
+    "shipbot_webhook_seconds", "Outgoing webhook POST latency", ("event_type", "outcome")
+))
+COURIERS_ON_SHIFT = REGISTRY.register(Gauge(
+    "shipbot_couriers_on_shift", "Couriers currently on shift"
+))
+ACTIVE_ORDERS = REGISTRY.register(Gauge(
+    "shipbot_active_orders", "Orders in waiting/in_transit status", ("status",)
+))
+LOG_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "shipbot_log_queue_depth", "Records waiting in the logging queue"
+))
+LOG_RECORDS_DROPPED = REGISTRY.register(Counter(
+    "shipbot_log_records_dropped_total", "Log records dropped because the logging queue was full"
+))
+
+def _log_queue_depth() -> float:
+    import logging_config
+    listener = logging_config.queue_listener
+    return listener.queue.qsize() if listener is not None else 0
+
+def _log_records_dropped() -> float:
+    from logging_config import DroppingQueueHandler
+    return DroppingQueueHandler.dropped
+
+LOG_QUEUE_DEPTH.set_function(_log_queue_depth)
+LOG_RECORDS_DROPPED.set_function(_log_records_dropped)
+
+async def refresh_business_gauges():
+    """
+    Обновляет gauge курьеров на смене и активных заказов (вызывается при сборе /metrics).
+    Запросы покрыты индексами couriers.is_on_shift и couriers_deliveries.status.
+    """
+    from db.mongo import get_db
+    db = await get_db()
+    COURIERS_ON_SHIFT.set(await db.couriers.count_documents({"is_on_shift": True}))
+    counts = {"waiting": 0, "in_transit": 0}
+    async for row in db.couriers_deliveries.aggregate([
+        {"$match": {"status": {"$in": list(counts)}}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]):
+        counts[row["_id"]] = row["count"]
+    for status, count in counts.items():
+        ACTIVE_ORDERS.set(count, status=status)
+    from utils.outbox import refresh_queue_gauges
+    await refresh_queue_gauges()
+
+# --- MongoDB ---
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Слушатель команд pymongo: длительность берется из события (duration_micros),
+    коллекция - из команды при старте (по request_id).
+    """
+
+    # Служебные команды драйвера не интересны
+    _IGNORED = frozenset(("hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions"))
+
+    def __init__(self):
+        self._collections: Dict[int, str] = {}
+
+    def started(self, event):
+        if event.command_name in self._IGNORED:
+            return
+        collection = event.command.get(event.command_name)
+        self._collections[event.request_id] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event, outcome: str):
+        if event.command_name in self._IGNORED:
+            return
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_COMMAND_SECONDS.observe(
+            event.duration_micros / 1e6, command=event.command_name, collection=collection, outcome=outcome
+        )
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+mongo_command_metrics = MongoCommandMetrics()
+
+# --- Odoo / Telegram / aiogram ---
+
+def observe_odoo_call(model: str, method_name: str, started: float, ok: bool):
+    ODOO_CALL_SECONDS.observe(
+        time.perf_counter() - started, model=model, method=method_name, outcome="ok" if ok else "error"
+    )
+
+def _bot_request_middleware():
+    from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+    class BotRequestMetricsMiddleware(BaseRequestMiddleware):
+        """Длительность запросов к Telegram Bot API по методу (sendMessage, deleteMessage, ...)"""
+
+        async def __call__(self, make_request, bot, method):
+            with TELEGRAM_REQUEST_SECONDS.time(method=method.__api_method__):
+                return await make_request(bot, method)
+
+    return BotRequestMetricsMiddleware()
+
+def instrument_bot(bot):
+    """
+    Подключает метрики запросов к сессии бота.
+
+    Returns:
+        Тот же экземпляр бота
+    """
+    bot.session.middleware(_bot_request_middleware())
+    return bot
+
+class HandlerMetricsMiddleware:
+    """Middleware aiogram: длительность обработчиков роутера (только сработавших)"""
+
+    def __init__(self, router_name: str, event_name: str):
+        self.router_name = router_name
+        self.event_name = event_name
+
+    async def __call__(self, handler, event, data):
+        with BOT_HANDLER_SECONDS.time(router=self.router_name, event=self.event_name):
+            return await handler(event, data)
+
+def instrument_router(router, router_name: Optional[str] = None):
+    """
+    Подключает HandlerMetricsMiddleware к событиям message, edited_message и callback_query роутера.
+
+    Args:
+        router: aiogram Router
+        router_name: Метка router (по умолчанию router.name)
+    """
+    router_name = router_name or router.name
+    for event_name in ("message", "edited_message", "callback_query"):
+        getattr(router, event_name).middleware(HandlerMetricsMiddleware(router_name, event_name))
+    return router
@@ -1,13 +1,22 @@
 from aiogram import Bot
 from config import MANAGER_CHAT_ID
+from utils.bot_registry import get_bot
+from utils.outbox import deferrable
 import logging
 
 logger = logging.getLogger(__name__)
 
+@deferrable("telegram.manager_message")
+async def send_manager_message(text: str) -> bool:
+    """Отправляет сообщение менеджеру через общий Bot (выполняется воркером при OUTBOX_ENABLED)"""
+    try:
+        await get_bot().send_message(MANAGER_CHAT_ID, text)
+        logger.info(f"Notified manager {MANAGER_CHAT_ID}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to notify manager: {e}")
+        return False
+
 async def notify_manager(bot: Bot, courier: dict, text: str):
     if MANAGER_CHAT_ID:
-        try:
-            await bot.send_message(MANAGER_CHAT_ID, text)
-            logger.info(f"Notified manager {MANAGER_CHAT_ID}")
-        except Exception as e:
-            logger.error(f"Failed to notify manager: {e}")
+        await send_manager_message(text)
@@ -1,8 +1,11 @@
 import aiohttp
 import logging
 import json
+import time
 from typing import Dict, Any, Optional, List
 from config import ODOO_URL, ODOO_DB, ODOO_LOGIN, ODOO_API_KEY
+from utils.metrics import observe_odoo_call
+from utils.outbox import deferrable
 
 logger = logging.getLogger(__name__)
 
@@ -96,6 +99,19 @@ async def get_odoo_uid() -> Optional[int]:
         return None
 
 async def odoo_call(method: str, model: str, method_name: str, args: list, kwargs: dict = None) -> Optional[Any]:
+    """
+    Выполняет JSON-RPC запрос к Odoo API и записывает его длительность
+    в метрику shipbot_odoo_call_seconds (outcome=error, если результат None).
+    Аргументы и результат - как у _odoo_call.
+    """
+    if not ODOO_URL:
+        return await _odoo_call(method, model, method_name, args, kwargs)
+    started = time.perf_counter()
+    result = await _odoo_call(method, model, method_name, args, kwargs)
+    observe_odoo_call(model, method_name, started, result is not None)
+    return result
+
+async def _odoo_call(method: str, model: str, method_name: str, args: list, kwargs: dict = None) -> Optional[Any]:
     """
     Выполняет JSON-RPC запрос к Odoo API (старый формат: /jsonrpc)
     Использует API ключ для аутентификации
@@ -231,6 +247,7 @@ async def create_courier(name: str, courier_tg_chat_id: str, phone: Optional[str
         logger.warning(f"Failed to create courier in Odoo: {name} (TG: {courier_tg_chat_id})")
         return None
 
+@deferrable("odoo.courier_status")
 async def update_courier_status(courier_tg_chat_id: str, is_online: bool) -> bool:
     """
     Обновляет статус онлайн/оффлайн курьера в Odoo по courier_tg_chat_id
@@ -433,7 +450,8 @@ async def get_lead(lead_id: int) -> Optional[Dict[str, Any]]:
         logger.error(f"Error getting lead {lead_id}: {e}", exc_info=True)
         return None
 
-async def send_message_to_lead_chatter(lead_id: int, message_body: str) -> bool:
+@deferrable("odoo.lead_chatter")
+async def send_message_to_lead_chatter(lead_id: int, message_body: str) -> Optional[bool]:
     """
     Отправляет сообщение в чаттер лида в Odoo от имени пользователя API ключа
     
@@ -442,7 +460,7 @@ async def send_message_to_lead_chatter(lead_id: int, message_body: str) -> bool:
         message_body: Текст сообщения для отправки в чаттер
         
     Returns:
-        True если успешно отправлено, False в противном случае
+        True если успешно отправлено, False при ошибке, None при некорректном lead_id
     """
     try:
         # Преобразуем lead_id в int, если это строка
@@ -468,12 +486,13 @@ async def send_message_to_lead_chatter(lead_id: int, message_body: str) -> bool:
             return False
     except ValueError:
         logger.error(f"Invalid lead_id format: {lead_id}")
-        return False
+        return None
     except Exception as e:
         logger.error(f"Error sending message to lead {lead_id} chatter: {e}", exc_info=True)
         return False
 
-async def update_order_courier(external_id: str, courier_tg_chat_id: str) -> bool:
+@deferrable("odoo.order_courier")
+async def update_order_courier(external_id: str, courier_tg_chat_id: str) -> Optional[bool]:
     """
     Обновляет курьера заказа в Odoo
     
@@ -482,7 +501,7 @@ async def update_order_courier(external_id: str, courier_tg_chat_id: str) -> boo
         courier_tg_chat_id: Telegram Chat ID нового курьера (строка)
         
     Returns:
-        True если успешно обновлено, False в противном случае
+        True если успешно обновлено, False при ошибке, None если external_id не число
     """
     try:
         # Преобразуем external_id в int, если это строка
@@ -491,7 +510,7 @@ async def update_order_courier(external_id: str, courier_tg_chat_id: str) -> boo
                 lead_id = int(external_id)
             except ValueError:
                 logger.warning(f"Invalid external_id format (not a number): {external_id}")
-                return False
+                return None
         else:
             lead_id = external_id
         
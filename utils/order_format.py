@@ -1,5 +1,13 @@
 import re
 
+# Telegram поддерживает: <b>, <i>, <u>, <s>, <code>, <pre>, <a>, <tg-spoiler>
+_ALLOWED_TAGS = ['b', 'i', 'u', 's', 'code', 'pre', 'a', 'tg-spoiler']
+# Регулярные выражения компилируются один раз: clean_html_notes вызывается при каждом форматировании заказа
+_P_OPEN_RE = re.compile(r'<p[^>]*>', re.IGNORECASE)
+_P_CLOSE_RE = re.compile(r'</p>', re.IGNORECASE)
+_UNSUPPORTED_TAG_RE = re.compile(r'<(?!\/?(?:' + '|'.join(_ALLOWED_TAGS) + r')\b)[^>]+>', re.IGNORECASE)
+_MULTIPLE_NEWLINES_RE = re.compile(r'\n{3,}')
+
 def clean_html_notes(notes: str) -> str:
     """
     Очищает HTML-теги из notes, оставляя только поддерживаемые Telegram теги.
@@ -11,19 +19,14 @@ def clean_html_notes(notes: str) -> str:
     
     # Удаляем неподдерживаемые HTML-теги, но сохраняем их содержимое
     # Сначала заменяем <p> и </p> на переносы строк
-    notes = re.sub(r'<p[^>]*>', '\n', notes, flags=re.IGNORECASE)
-    notes = re.sub(r'</p>', '\n', notes, flags=re.IGNORECASE)
-    
-    # Удаляем другие неподдерживаемые теги, но сохраняем содержимое
-    # Разрешаем только поддерживаемые Telegram теги
-    allowed_tags = ['b', 'i', 'u', 's', 'code', 'pre', 'a', 'tg-spoiler']
+    notes = _P_OPEN_RE.sub('\n', notes)
+    notes = _P_CLOSE_RE.sub('\n', notes)
     
-    # Удаляем все теги, кроме разрешенных
-    pattern = r'<(?!\/?(?:' + '|'.join(allowed_tags) + r')\b)[^>]+>'
-    notes = re.sub(pattern, '', notes, flags=re.IGNORECASE)
+    # Удаляем все теги, кроме разрешенных, но сохраняем содержимое
+    notes = _UNSUPPORTED_TAG_RE.sub('', notes)
     
     # Очищаем множественные переносы строк
-    notes = re.sub(r'\n{3,}', '\n\n', notes)
+    notes = _MULTIPLE_NEWLINES_RE.sub('\n\n', notes)
     
     # Убираем пробелы в начале и конце
     notes = notes.strip()
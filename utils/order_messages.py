@@ -1,128 +1,323 @@
 """
 Утилита для управления сообщениями о заказах в чате курьера.
 
-Функции для сохранения и удаления message_id сообщений с заказами,
-отправленных курьеру в Telegram.
+Отправленные сообщения записываются в реестр order_messages (db/message_registry.py)
+с чатом и хешем содержимого. По реестру:
+    - удаляются сообщения заказа во всех чатах (delete_order_messages_from_courier);
+    - очищается чат курьера при передаче заказов и закрытии смены (clear_chat_order_messages);
+    - сообщения сверяются с актуальным видом заказа (reconcile_order_messages):
+      редактируются только те, у которых изменился текст или клавиатура.
+
+Удаление идет через deleteMessages: ID группируются по чатам, до 100 в запросе,
+не больше TELEGRAM_DELETE_CONCURRENCY запросов одновременно, при flood control
+запрос повторяется после паузы, которую назвал Telegram.
 """
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any
+from collections import defaultdict
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
 from aiogram import Bot
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+from config import TELEGRAM_DELETE_CONCURRENCY
 from db.mongo import get_db
+from db import message_registry
 
 logger = logging.getLogger(__name__)
 
+# Telegram принимает не больше 100 message_id в одном deleteMessages
+DELETE_BATCH_SIZE = 100
+# Попыток запроса при flood control (429 Too Many Requests)
+DELETE_ATTEMPTS = 3
+
+_delete_slots = asyncio.Semaphore(TELEGRAM_DELETE_CONCURRENCY)
+
 
-async def save_order_message_id(order: Dict[str, Any], message_id: int) -> None:
+def render_hash(text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> str:
     """
-    Сохраняет message_id сообщения в массив courier_message_ids заказа.
-    
-    Использует $addToSet для избежания дубликатов.
-    
+    Хеш содержимого сообщения о заказе.
+
     Args:
-        order: Словарь с данными заказа (должен содержать external_id)
+        text: Текст сообщения (HTML)
+        reply_markup: Клавиатура сообщения
+
+    Returns:
+        str: 16 hex-символов sha1 от текста и JSON клавиатуры
+    """
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else ""
+    return hashlib.sha1(f"{text}\n{markup}".encode()).hexdigest()[:16]
+
+
+async def save_order_message_id(order: Dict[str, Any], message_id: int, content_hash: Optional[str] = None) -> None:
+    """
+    Записывает сообщение о заказе в реестр order_messages.
+
+    Чат сообщения - courier_tg_chat_id заказа (курьер, которому оно отправлено).
+
+    Args:
+        order: Словарь с данными заказа (должен содержать external_id и courier_tg_chat_id)
         message_id: ID сообщения из Telegram
+        content_hash: Хеш содержимого сообщения (render_hash). Без него первый же
+            показ заказов отредактирует сообщение, чтобы узнать его содержимое
     """
-    if not order or not order.get("external_id"):
-        logger.warning(f"[ORDER_MESSAGES] ⚠️ Не удалось сохранить message_id {message_id}: заказ не найден или нет external_id")
+    if not order or not order.get("external_id") or not order.get("courier_tg_chat_id"):
+        logger.warning("[ORDER_MESSAGES] ⚠️ Не удалось сохранить message_id %s: заказ не найден или нет external_id/courier_tg_chat_id", message_id)
         return
-    
+
     external_id = order.get("external_id")
     db = await get_db()
-    
+
     try:
-        await db.couriers_deliveries.update_one(
-            {"external_id": external_id},
-            {"$addToSet": {"courier_message_ids": message_id}}
-        )
-        logger.debug(f"[ORDER_MESSAGES] ✅ Сохранен message_id {message_id} для заказа {external_id}")
+        await message_registry.register(db, order["courier_tg_chat_id"], external_id, message_id, content_hash)
+        logger.debug("[ORDER_MESSAGES] ✅ Сохранен message_id %s для заказа %s", message_id, external_id)
     except Exception as e:
-        logger.error(f"[ORDER_MESSAGES] ❌ Ошибка сохранения message_id {message_id} для заказа {external_id}: {e}", exc_info=True)
+        logger.error("[ORDER_MESSAGES] ❌ Ошибка сохранения message_id %s для заказа %s: %s", message_id, external_id, e, exc_info=True)
+
+
+async def _delete_batch(bot: Bot, chat_id: int, message_ids: List[int]) -> bool:
+    """Один запрос deleteMessages с ограничением параллельности и повтором при flood control"""
+    async with _delete_slots:
+        for attempt in range(1, DELETE_ATTEMPTS + 1):
+            try:
+                await bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+                return True
+            except TelegramRetryAfter as e:
+                if attempt == DELETE_ATTEMPTS:
+                    logger.warning("[ORDER_MESSAGES] ⚠️ Flood control: %s сообщений в чате %s не удалены", len(message_ids), chat_id)
+                    return False
+                logger.warning("[ORDER_MESSAGES] ⏳ Flood control при удалении сообщений в чате %s, повтор через %s с", chat_id, e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                # Все сообщения пачки уже удалены или старше 48 часов
+                logger.debug("[ORDER_MESSAGES] ℹ️ Не удалось удалить %s сообщений в чате %s: %s", len(message_ids), chat_id, e)
+                return False
+            except Exception as e:
+                logger.error("[ORDER_MESSAGES] ❌ Ошибка удаления %s сообщений в чате %s: %s", len(message_ids), chat_id, e, exc_info=True)
+                return False
+    return False
 
 
-async def delete_order_messages_from_courier(bot: Bot, order: Dict[str, Any]) -> None:
+async def delete_chat_messages(bot: Bot, chat_id: int, message_ids: Iterable[int]) -> int:
     """
-    Удаляет все сообщения о заказе из чата курьера.
-    
-    Получает courier_message_ids из заказа, удаляет все сообщения через bot.delete_message(),
-    обрабатывает ошибки (сообщение уже удалено, не найдено и т.д.),
-    и после успешного удаления каждого сообщения удаляет его message_id из массива в БД.
-    
+    Удаляет сообщения из чата пачками через deleteMessages (до 100 за запрос).
+
+    Уже удаленные сообщения Telegram пропускает сам.
+
+    Args:
+        bot: Экземпляр бота
+        chat_id: Chat ID чата
+        message_ids: ID сообщений
+
+    Returns:
+        int: Число сообщений в успешно выполненных запросах
+    """
+    message_ids = sorted(set(message_ids))
+    deleted = 0
+    for start in range(0, len(message_ids), DELETE_BATCH_SIZE):
+        batch = message_ids[start:start + DELETE_BATCH_SIZE]
+        if await _delete_batch(bot, chat_id, batch):
+            deleted += len(batch)
+    return deleted
+
+
+async def delete_messages_by_chat(bot: Bot, entries: Iterable[Dict[str, Any]]) -> int:
+    """
+    Удаляет сообщения из записей реестра, сгруппировав ID по чатам.
+
+    Args:
+        bot: Экземпляр бота
+        entries: Записи реестра (chat_id, message_id)
+
+    Returns:
+        int: Число удаленных сообщений
+    """
+    by_chat: Dict[int, List[int]] = defaultdict(list)
+    for entry in entries:
+        by_chat[entry["chat_id"]].append(entry["message_id"])
+    if not by_chat:
+        return 0
+    results = await asyncio.gather(*[
+        delete_chat_messages(bot, chat_id, message_ids) for chat_id, message_ids in by_chat.items()
+    ])
+    return sum(results)
+
+
+async def delete_order_messages_from_courier(bot: Bot, order: Dict[str, Any], refresh: bool = True) -> None:
+    """
+    Удаляет все сообщения о заказе из чатов курьеров.
+
+    Сообщения берутся из реестра order_messages (во всех чатах, куда отправлялся заказ)
+    и удаляются пачками deleteMessages, записи реестра удаляются независимо от результата,
+    чтобы не накапливать несуществующие ID.
+
     Args:
         bot: Экземпляр бота для удаления сообщений
-        order: Словарь с данными заказа (должен содержать external_id и courier_tg_chat_id)
+        order: Словарь с данными заказа (должен содержать external_id)
+        refresh: Проверить статус заказа в БД и не трогать сообщения уже закрытого заказа.
+            False - заказ передан из атомарного перехода статуса (заказ только что закрыт)
     """
     if not order or not order.get("external_id"):
-        logger.warning(f"[ORDER_MESSAGES] ⚠️ Не удалось удалить сообщения: заказ не найден или нет external_id")
+        logger.warning("[ORDER_MESSAGES] ⚠️ Не удалось удалить сообщения: заказ не найден или нет external_id")
         return
-    
+
     external_id = order.get("external_id")
-    courier_chat_id = order.get("courier_tg_chat_id")
-    
-    if not courier_chat_id:
-        logger.warning(f"[ORDER_MESSAGES] ⚠️ Не удалось удалить сообщения для заказа {external_id}: нет courier_tg_chat_id")
-        return
-    
-    # Получаем актуальные данные заказа из БД
     db = await get_db()
-    current_order = await db.couriers_deliveries.find_one({"external_id": external_id})
-    
-    if not current_order:
-        logger.warning(f"[ORDER_MESSAGES] ⚠️ Заказ {external_id} не найден в БД")
+    entries = await message_registry.order_messages(db, external_id)
+
+    if refresh:
+        # Проверяем актуальный статус заказа
+        current_order = await db.couriers_deliveries.find_one({"external_id": external_id}, {"status": 1})
+        if not current_order:
+            logger.warning("[ORDER_MESSAGES] ⚠️ Заказ %s не найден в БД", external_id)
+            return
+
+        # Проверяем, что заказ не закрыт или удален (защита от повторного удаления)
+        status = current_order.get("status")
+        if status in ["done", "cancelled"]:
+            logger.debug("[ORDER_MESSAGES] ⚠️ Заказ %s уже закрыт (status: %s), пропускаем удаление сообщений", external_id, status)
+            # Но все равно удаляем записи из реестра, если они есть
+            await message_registry.forget(db, entries)
+            return
+
+    if not entries:
+        logger.debug("[ORDER_MESSAGES] ℹ️ Нет сообщений для удаления для заказа %s", external_id)
         return
-    
-    # Проверяем, что заказ не закрыт или удален (защита от повторного удаления)
-    status = current_order.get("status")
-    if status in ["done", "cancelled"]:
-        logger.debug(f"[ORDER_MESSAGES] ⚠️ Заказ {external_id} уже закрыт (status: {status}), пропускаем удаление сообщений")
-        # Но все равно удаляем message_id из массива, если они есть
-        if current_order.get("courier_message_ids"):
-            await db.couriers_deliveries.update_one(
-                {"external_id": external_id},
-                {"$set": {"courier_message_ids": []}}
+
+    logger.info("[ORDER_MESSAGES] 🗑️ Удаление %s сообщений для заказа %s", len(entries), external_id)
+    deleted = await delete_messages_by_chat(bot, entries)
+    await message_registry.forget(db, entries)
+    logger.info("[ORDER_MESSAGES] ✅ Удалено %s из %s сообщений для заказа %s", deleted, len(entries), external_id)
+
+
+async def clear_chat_order_messages(
+    bot: Bot,
+    chat_id: int,
+    external_ids: Optional[Iterable[str]] = None,
+    keep_active: bool = False
+) -> int:
+    """
+    Удаляет сообщения о заказах из чата курьера: несколько запросов deleteMessages на весь чат.
+
+    Ошибки логируются и не прерывают вызывающий сценарий (передача заказов, закрытие смены).
+
+    Args:
+        bot: Экземпляр бота
+        chat_id: Chat ID курьера
+        external_ids: Только сообщения этих заказов (None - все заказы)
+        keep_active: Оставить сообщения заказов курьера в статусах waiting/in_transit
+
+    Returns:
+        int: Число удаленных сообщений
+    """
+    try:
+        db = await get_db()
+        exclude: List[str] = []
+        if keep_active:
+            exclude = await db.couriers_deliveries.distinct(
+                "external_id",
+                {"courier_tg_chat_id": chat_id, "status": {"$in": ["waiting", "in_transit"]}}
             )
-        return
-    
-    message_ids = current_order.get("courier_message_ids", [])
-    
-    if not message_ids:
-        logger.debug(f"[ORDER_MESSAGES] ℹ️ Нет сообщений для удаления для заказа {external_id}")
-        return
-    
-    logger.info(f"[ORDER_MESSAGES] 🗑️ Удаление {len(message_ids)} сообщений для заказа {external_id} из чата курьера {courier_chat_id}")
-    
-    # Удаляем сообщения параллельно
-    import asyncio
-    
-    async def delete_single_message(msg_id: int) -> bool:
-        """Удаляет одно сообщение и возвращает True при успехе"""
-        try:
-            await bot.delete_message(chat_id=courier_chat_id, message_id=msg_id)
-            logger.debug(f"[ORDER_MESSAGES] ✅ Удалено сообщение {msg_id} для заказа {external_id}")
+        entries = await message_registry.chat_messages(db, chat_id, external_ids, exclude)
+        if not entries:
+            return 0
+        deleted = await delete_chat_messages(bot, chat_id, [entry["message_id"] for entry in entries])
+        await message_registry.forget(db, entries)
+        logger.info("[ORDER_MESSAGES] 🧹 Из чата %s удалено %s из %s сообщений о заказах", chat_id, deleted, len(entries))
+        return deleted
+    except Exception as e:
+        logger.error("[ORDER_MESSAGES] ❌ Ошибка очистки сообщений о заказах в чате %s: %s", chat_id, e, exc_info=True)
+        return 0
+
+
+async def _edit_order_message(
+    bot: Bot,
+    chat_id: int,
+    message_id: int,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup],
+    external_id: str
+) -> bool:
+    """Редактирует сообщение о заказе. False - сообщения нет или его нельзя отредактировать"""
+    try:
+        await bot.edit_message_text(
+            text, chat_id=chat_id, message_id=message_id, parse_mode="HTML", reply_markup=reply_markup
+        )
+        return True
+    except TelegramBadRequest as e:
+        if "message is not modified" in str(e).lower():
+            # Сообщение уже актуально, не было только сохраненного хеша
             return True
-        except TelegramBadRequest as e:
-            # Игнорируем ошибки "message not found", "message already deleted"
-            error_message = str(e).lower()
-            if "message not found" in error_message or "message to delete not found" in error_message:
-                logger.debug(f"[ORDER_MESSAGES] ℹ️ Сообщение {msg_id} уже удалено или не найдено для заказа {external_id}")
-            else:
-                logger.warning(f"[ORDER_MESSAGES] ⚠️ Ошибка удаления сообщения {msg_id} для заказа {external_id}: {e}")
-            return False
-        except Exception as e:
-            logger.error(f"[ORDER_MESSAGES] ❌ Неожиданная ошибка при удалении сообщения {msg_id} для заказа {external_id}: {e}", exc_info=True)
-            return False
-    
-    # Удаляем сообщения параллельно
-    results = await asyncio.gather(*[delete_single_message(msg_id) for msg_id in message_ids], return_exceptions=True)
-    
-    # Определяем, какие message_id нужно удалить из БД (те, что успешно удалены или уже не существуют)
-    # Удаляем все message_id из массива, так как мы уже попытались их удалить
-    # (независимо от результата, чтобы не накапливать несуществующие ID)
-    await db.couriers_deliveries.update_one(
-        {"external_id": external_id},
-        {"$set": {"courier_message_ids": []}}
-    )
-    
-    successful_deletes = sum(1 for r in results if r is True)
-    logger.info(f"[ORDER_MESSAGES] ✅ Удалено {successful_deletes} из {len(message_ids)} сообщений для заказа {external_id}")
+        logger.debug("[ORDER_MESSAGES] ℹ️ Сообщение %s заказа %s не отредактировано: %s", message_id, external_id, e)
+        return False
+
+
+async def reconcile_order_messages(
+    bot: Bot,
+    chat_id: int,
+    rendered: Sequence[Tuple[Dict[str, Any], str, Optional[InlineKeyboardMarkup]]]
+) -> Dict[str, int]:
+    """
+    Приводит сообщения о заказах в чате курьера к актуальному виду вместо удаления и переотправки.
+
+    У каждого заказа остается одно сообщение - последнее из реестра:
+        - хеш содержимого совпадает с сохраненным - сообщение не трогаем;
+        - изменился текст или клавиатура - редактируем на месте;
+        - сообщения нет или его нельзя отредактировать - отправляем новое.
+    Остальные сообщения заказов удаляются пачками после обхода.
+
+    Args:
+        bot: Экземпляр бота
+        chat_id: Chat ID курьера
+        rendered: (заказ, текст, клавиатура) в порядке показа
+
+    Returns:
+        dict: unchanged, edited, sent, deleted - число сообщений
+    """
+    db = await get_db()
+    result = {"unchanged": 0, "edited": 0, "sent": 0, "deleted": 0}
+
+    # Сообщения всех показываемых заказов в этом чате - одним запросом
+    known: Dict[str, Dict[int, Optional[str]]] = defaultdict(dict)
+    for entry in await message_registry.chat_messages(db, chat_id, [order["external_id"] for order, _, _ in rendered]):
+        known[entry["external_id"]][entry["message_id"]] = entry.get("content_hash")
+
+    edited: Dict[int, str] = {}
+    sent: List[Tuple[str, int, str]] = []
+    stale: List[int] = []
+
+    for order, text, reply_markup in rendered:
+        external_id = order["external_id"]
+        content_hash = render_hash(text, reply_markup)
+        messages = known.get(external_id, {})
+        current = max(messages) if messages else None
+        extra = [message_id for message_id in messages if message_id != current]
+
+        if current is not None and messages[current] == content_hash:
+            result["unchanged"] += 1
+        elif current is not None and await _edit_order_message(bot, chat_id, current, text, reply_markup, external_id):
+            result["edited"] += 1
+            edited[current] = content_hash
+            logger.debug("[ORDER_MESSAGES] ✏️ Отредактировано сообщение %s заказа %s", current, external_id)
+        else:
+            # Прежние сообщения заказа (включая неотредактированное) удаляются
+            extra = list(messages)
+            message = await bot.send_message(chat_id, text, parse_mode="HTML", reply_markup=reply_markup)
+            result["sent"] += 1
+            sent.append((external_id, message.message_id, content_hash))
+            logger.debug("[ORDER_MESSAGES] 📤 Отправлено сообщение %s заказа %s", message.message_id, external_id)
+        stale.extend(extra)
 
+    try:
+        await message_registry.apply_reconcile(db, chat_id, edited, sent, stale)
+    except Exception as e:
+        logger.error("[ORDER_MESSAGES] ❌ Ошибка сохранения сообщений в реестре для чата %s: %s", chat_id, e, exc_info=True)
+
+    if stale:
+        result["deleted"] = await delete_chat_messages(bot, chat_id, stale)
+
+    logger.info(
+        "[ORDER_MESSAGES] 🔄 Сверка сообщений в чате %s: без изменений %s, отредактировано %s, отправлено %s, удалено %s из %s",
+        chat_id, result["unchanged"], result["edited"], result["sent"], result["deleted"], len(stale)
+    )
+    return result
@@ -0,0 +1,163 @@
+"""
+Переходы заказа между статусами (state machine).
+
+Каждый переход - один условный find_one_and_update: фильтр содержит
+предусловие (допустимые исходные статусы, курьер, оплата), обновление пишет
+status_history.<key> точечно. Возвращается документ до изменения, документ
+после изменения собирается из него и записанных полей без повторного чтения.
+Два одновременных перехода не могут оба пройти, поэтому блокировки
+в Redis не нужны. Если предусловие не выполнено, причина определяется
+одним дополнительным чтением заказа.
+"""
+from typing import Optional, Dict, Any, Tuple, Iterable
+from pymongo import ReturnDocument
+from db.mongo import get_db
+from db.models import utcnow, status_history_fields
+from db.counters import apply_order_change
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Допустимые исходные статусы для каждого целевого статуса
+TRANSITIONS: Dict[str, Tuple[str, ...]] = {
+    "in_transit": ("waiting",),
+    "done": ("waiting", "in_transit"),
+    "cancelled": ("waiting", "in_transit"),
+}
+
+CLOSED_STATUSES = ("done", "cancelled")
+
+ERROR_NOT_FOUND = "Заказ не найден или удален"
+ERROR_CLOSED = "Заказ уже закрыт"
+ERROR_WRONG_STATUS = "Заказ в неверном статусе"
+ERROR_OTHER_COURIER = "Заказ назначен другому курьеру"
+ERROR_NOT_PAID = "Сначала проверьте оплату"
+
+def _courier_filter(chat_id: int) -> Dict[str, Any]:
+    # В старых заказах courier_tg_chat_id мог сохраниться строкой
+    return {"$in": [int(chat_id), str(chat_id)]}
+
+# Заказ можно закрыть, если он оплачен или у него есть client_ip
+_PAID_OR_CLIENT_IP = {"$or": [
+    {"payment_status": {"$ne": "NOT_PAID"}},
+    {"client_ip": {"$nin": [None, ""]}},
+]}
+
+def order_action_error(
+    order: Optional[Dict[str, Any]],
+    external_id: str,
+    user_chat_id: Optional[int] = None,
+    expected_statuses: Optional[Iterable[str]] = None,
+    require_paid: bool = False
+) -> Optional[str]:
+    """
+    Проверяет, можно ли выполнить действие с заказом.
+
+    Args:
+        order: Документ заказа (None, если не найден)
+        external_id: ID заказа (для логов)
+        user_chat_id: Chat ID курьера, выполняющего действие (None - проверка курьера не нужна)
+        expected_statuses: Ожидаемые статусы заказа (если None, проверяет что заказ не закрыт)
+        require_paid: Заказ должен быть оплачен (или иметь client_ip)
+
+    Returns:
+        Сообщение об ошибке или None, если действие допустимо
+    """
+    if not order:
+        logger.warning("[ORDERS] ⚠️ Заказ %s не найден (возможно удален)", external_id)
+        return ERROR_NOT_FOUND
+
+    status = order.get("status")
+    if status in CLOSED_STATUSES:
+        logger.warning("[ORDERS] ⚠️ Попытка выполнить действие с закрытым заказом %s (status: %s)", external_id, status)
+        return ERROR_CLOSED
+
+    if expected_statuses and status not in expected_statuses:
+        logger.warning("[ORDERS] ⚠️ Неверный статус заказа %s: ожидался %s, получен %s", external_id, list(expected_statuses), status)
+        return ERROR_WRONG_STATUS
+
+    if user_chat_id is not None:
+        order_courier_chat_id = order.get("courier_tg_chat_id")
+        if order_courier_chat_id is None or int(order_courier_chat_id) != int(user_chat_id):
+            logger.warning("[ORDERS] ⚠️ Попытка выполнить действие с заказом %s другого курьера. Заказ: %s, Пользователь: %s", external_id, order_courier_chat_id, user_chat_id)
+            return ERROR_OTHER_COURIER
+
+    if require_paid and order.get("payment_status") == "NOT_PAID" and not order.get("client_ip"):
+        logger.warning("[ORDERS] ⚠️ Попытка завершить заказ %s без оплаты", external_id)
+        return ERROR_NOT_PAID
+
+    return None
+
+def _with_fields(document: Dict[str, Any], fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Копия документа с примененным $set (ключи через точку - вложенные поля)"""
+    result = dict(document)
+    for key, value in fields.items():
+        *parents, leaf = key.split(".")
+        target = result
+        for part in parents:
+            nested = target.get(part)
+            target[part] = dict(nested) if isinstance(nested, dict) else {}
+            target = target[part]
+        target[leaf] = value
+    return result
+
+async def transition_order(
+    external_id: str,
+    new_status: str,
+    courier_chat_id: Optional[int] = None,
+    from_statuses: Optional[Iterable[str]] = None,
+    new_payment_status: Optional[str] = None,
+    require_paid: bool = False,
+    extra_fields: Optional[Dict[str, Any]] = None
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Атомарно переводит заказ в новый статус.
+
+    Args:
+        external_id: ID заказа
+        new_status: Целевой статус (in_transit, done, cancelled)
+        courier_chat_id: Курьер, которому должен принадлежать заказ (None - действие админа)
+        from_statuses: Допустимые исходные статусы (по умолчанию - из TRANSITIONS)
+        new_payment_status: Новый статус оплаты, записывается в том же обновлении
+        require_paid: Разрешить переход только для оплаченных заказов (или с client_ip)
+        extra_fields: Дополнительные поля для $set (например, closed_by_admin_id)
+
+    Returns:
+        (заказ после перехода, None) или (None, сообщение об ошибке)
+    """
+    from_statuses = tuple(from_statuses or TRANSITIONS[new_status])
+    db = await get_db()
+
+    query: Dict[str, Any] = {"external_id": external_id, "status": {"$in": list(from_statuses)}}
+    if courier_chat_id is not None:
+        query["courier_tg_chat_id"] = _courier_filter(courier_chat_id)
+    if require_paid:
+        query.update(_PAID_OR_CLIENT_IP)
+
+    now = utcnow()
+    fields = {
+        "status": new_status,
+        "updated_at": now,
+        **status_history_fields(new_status=new_status, new_payment_status=new_payment_status, at=now),
+        **(extra_fields or {})
+    }
+    if new_payment_status:
+        fields["payment_status"] = new_payment_status
+
+    # Документ до изменения: исходный статус для лога и счетчиков
+    before = await db.couriers_deliveries.find_one_and_update(
+        query,
+        {"$set": fields},
+        return_document=ReturnDocument.BEFORE
+    )
+
+    if before is None:
+        current = await db.couriers_deliveries.find_one({"external_id": external_id})
+        error = order_action_error(current, external_id, courier_chat_id, from_statuses, require_paid)
+        # Заказ мог измениться между обновлением и чтением
+        return None, error or ERROR_WRONG_STATUS
+
+    order = _with_fields(before, fields)
+    logger.info("[ORDERS] 🔄 Заказ %s: %s -> %s", external_id, before.get('status'), new_status)
+    await apply_order_change(db, before, order)
+    return order, None
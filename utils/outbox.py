@@ -0,0 +1,228 @@
+"""
+Очередь исходящих вызовов (outbox) в Redis для роли worker (python bot.py --role worker).
+
+Вызовы, результат которых обработчику не нужен (webhook, сообщения менеджеру,
+чаттер и статусы в Odoo), помечаются декоратором @deferrable. При OUTBOX_ENABLED
+вызов сериализуется в JSON и кладется в очередь, обработчик бота или API сразу
+продолжает работу; иначе функция выполняется как раньше, в том же процессе.
+
+Структуры в Redis:
+    outbox:queue                 - список задач (LPUSH / BLMOVE)
+    outbox:processing:<worker>   - задачи, взятые воркером (удаляются после выполнения)
+    outbox:worker:<worker>       - heartbeat воркера (TTL); задачи остановившегося
+                                   воркера возвращаются в очередь
+    outbox:delayed               - ZSET повторов с временем запуска
+    outbox:dead                  - задачи, исчерпавшие OUTBOX_MAX_ATTEMPTS
+
+Повтор выполняется, если функция выбросила исключение или вернула False
+(задержка растет экспоненциально). None - выполнять нечего (например, webhook
+не настроен), задача завершается без повтора.
+"""
+import asyncio
+import functools
+import importlib
+import json
+import os
+import socket
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+from config import OUTBOX_ENABLED, OUTBOX_CONCURRENCY, OUTBOX_MAX_ATTEMPTS
+from db.models import json_compatible
+from db.redis_client import get_redis
+from utils.metrics import REGISTRY, Counter, Gauge
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = "outbox:queue"
+DELAYED_KEY = "outbox:delayed"
+DEAD_KEY = "outbox:dead"
+PROCESSING_PREFIX = "outbox:processing:"
+HEARTBEAT_PREFIX = "outbox:worker:"
+HEARTBEAT_TTL = 30
+_DEAD_LIMIT = 10000
+
+OUTBOX_JOBS = REGISTRY.register(Counter(
+    "shipbot_outbox_jobs_total", "Outbox jobs processed by workers", ("task", "outcome")
+))
+OUTBOX_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "shipbot_outbox_queue_depth", "Jobs waiting in the outbox queue", ("queue",)
+))
+
+class TaskFailed(Exception):
+    """Задача вернула False: вызов не удался, нужен повтор"""
+
+# Имя задачи -> исходная (не откладываемая) функция
+_tasks: Dict[str, Callable[..., Awaitable[Any]]] = {}
+# Внутри воркера вызовы выполняются сразу (иначе задача снова попала бы в очередь)
+_in_worker: ContextVar[bool] = ContextVar("outbox_in_worker", default=False)
+
+async def enqueue(task: str, args: tuple = (), kwargs: Dict[str, Any] = None):
+    """
+    Кладет вызов в очередь.
+
+    Args:
+        task: Имя задачи (@deferrable)
+        args, kwargs: Аргументы, сериализуемые в JSON (datetime -> ISO строка)
+    """
+    job = {
+        "id": uuid.uuid4().hex,
+        "task": task,
+        "args": json_compatible(list(args)),
+        "kwargs": json_compatible(kwargs or {}),
+        "attempts": 0,
+        "enqueued_at": time.time(),
+    }
+    await get_redis().lpush(QUEUE_KEY, json.dumps(job, ensure_ascii=False, default=str))
+
+def deferrable(task: str):
+    """
+    Декоратор асинхронной функции: при OUTBOX_ENABLED вызов ставится в очередь
+    и сразу возвращает True (результат выполнения вызывающему недоступен).
+    Функция сообщает о неудаче исключением или False (воркер повторит вызов),
+    None - выполнять нечего.
+
+    Args:
+        task: Уникальное имя задачи в очереди
+    """
+    def decorator(function: Callable[..., Awaitable[Any]]):
+        _tasks[task] = function
+
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            if not OUTBOX_ENABLED or _in_worker.get():
+                return await function(*args, **kwargs)
+            try:
+                await enqueue(task, args, kwargs)
+                return True
+            except Exception as e:
+                # Redis недоступен: выполняем вызов сразу, чтобы не потерять его
+                logger.warning("[OUTBOX] ⚠️ Не удалось поставить %s в очередь, выполняем сразу: %s", task, e)
+                return await function(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+# Модули с @deferrable: воркер импортирует их, чтобы знать все задачи
+_TASK_MODULES = ("utils.webhooks", "utils.notifications", "utils.odoo")
+
+def _register_tasks():
+    for module in _TASK_MODULES:
+        importlib.import_module(module)
+
+class OutboxWorker:
+    """Воркер очереди: OUTBOX_CONCURRENCY задач одновременно"""
+
+    def __init__(self, concurrency: int = OUTBOX_CONCURRENCY):
+        self.concurrency = concurrency
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.processing_key = f"{PROCESSING_PREFIX}{self.worker_id}"
+        self.redis = get_redis()
+
+    async def run(self):
+        _register_tasks()
+        _in_worker.set(True)
+        logger.info("[OUTBOX] 📮 Воркер %s запущен, задач одновременно: %s, задачи: %s", self.worker_id, self.concurrency, sorted(_tasks))
+        await self._heartbeat()
+        await self._reclaim()
+        loops = [self._maintenance()] + [self._consume() for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*loops)
+        finally:
+            logger.info("[OUTBOX] Воркер %s остановлен", self.worker_id)
+
+    async def _heartbeat(self):
+        await self.redis.setex(f"{HEARTBEAT_PREFIX}{self.worker_id}", HEARTBEAT_TTL, str(time.time()))
+
+    async def _maintenance(self):
+        """Heartbeat, перенос наступивших повторов в очередь, возврат задач остановившихся воркеров"""
+        last_reclaim = time.monotonic()
+        while True:
+            await asyncio.sleep(1)
+            try:
+                await self._heartbeat()
+                await self._promote_delayed()
+                if time.monotonic() - last_reclaim > HEARTBEAT_TTL:
+                    last_reclaim = time.monotonic()
+                    await self._reclaim()
+            except Exception as e:
+                logger.warning("[OUTBOX] ⚠️ Ошибка обслуживания очереди: %s", e)
+
+    async def _promote_delayed(self):
+        due = await self.redis.zrangebyscore(DELAYED_KEY, 0, time.time(), start=0, num=100)
+        for raw in due:
+            # ZREM атомарен: задачу переносит только один воркер
+            if await self.redis.zrem(DELAYED_KEY, raw):
+                await self.redis.lpush(QUEUE_KEY, raw)
+
+    async def _reclaim(self):
+        async for key in self.redis.scan_iter(match=f"{PROCESSING_PREFIX}*"):
+            worker_id = key[len(PROCESSING_PREFIX):]
+            if worker_id == self.worker_id or await self.redis.exists(f"{HEARTBEAT_PREFIX}{worker_id}"):
+                continue
+            moved = 0
+            while await self.redis.lmove(key, QUEUE_KEY, "RIGHT", "LEFT"):
+                moved += 1
+            if moved:
+                logger.warning("[OUTBOX] ♻️ %s задач остановившегося воркера %s возвращены в очередь", moved, worker_id)
+
+    async def _consume(self):
+        while True:
+            try:
+                raw = await self.redis.blmove(QUEUE_KEY, self.processing_key, 5, "RIGHT", "LEFT")
+            except Exception as e:
+                logger.warning("[OUTBOX] ⚠️ Ошибка чтения очереди: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if raw is None:
+                continue
+            try:
+                await self._execute(raw)
+            finally:
+                await self.redis.lrem(self.processing_key, 1, raw)
+
+    async def _execute(self, raw: str):
+        try:
+            job = json.loads(raw)
+        except ValueError:
+            logger.error("[OUTBOX] ❌ Некорректная задача в очереди: %s", raw[:200])
+            return
+        function = _tasks.get(job.get("task"))
+        if function is None:
+            logger.error("[OUTBOX] ❌ Неизвестная задача %s, перенесена в %s", job.get('task'), DEAD_KEY)
+            await self._dead(raw)
+            OUTBOX_JOBS.inc(task=str(job.get("task")), outcome="unknown")
+            return
+        try:
+            # Задачи перехватывают свои ошибки и возвращают False
+            if await function(*job["args"], **job["kwargs"]) is False:
+                raise TaskFailed(f"{job['task']} вернула False")
+            OUTBOX_JOBS.inc(task=job["task"], outcome="ok")
+        except Exception as e:
+            job["attempts"] += 1
+            if job["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                logger.error("[OUTBOX] ❌ Задача %s не выполнена после %s попыток: %s", job['task'], job['attempts'], e, exc_info=True)
+                await self._dead(json.dumps(job, ensure_ascii=False))
+                OUTBOX_JOBS.inc(task=job["task"], outcome="dead")
+                return
+            delay = min(2 ** job["attempts"], 300)
+            logger.warning("[OUTBOX] ⚠️ Задача %s (попытка %s): %s, повтор через %s с", job['task'], job['attempts'], e, delay)
+            await self.redis.zadd(DELAYED_KEY, {json.dumps(job, ensure_ascii=False): time.time() + delay})
+            OUTBOX_JOBS.inc(task=job["task"], outcome="retry")
+
+    async def _dead(self, raw: str):
+        await self.redis.lpush(DEAD_KEY, raw)
+        await self.redis.ltrim(DEAD_KEY, 0, _DEAD_LIMIT - 1)
+
+async def run_outbox_worker():
+    """Запускает воркер очереди (роль worker или all при OUTBOX_ENABLED)"""
+    await OutboxWorker().run()
+
+async def refresh_queue_gauges():
+    """Обновляет глубину очередей outbox (вызывается при сборе /metrics)"""
+    redis = get_redis()
+    OUTBOX_QUEUE_DEPTH.set(await redis.llen(QUEUE_KEY), queue="queue")
+    OUTBOX_QUEUE_DEPTH.set(await redis.zcard(DELAYED_KEY), queue="delayed")
+    OUTBOX_QUEUE_DEPTH.set(await redis.llen(DEAD_KEY), queue="dead")
@@ -0,0 +1,257 @@
+"""
+Трассировка запросов MongoDB по обработчикам (N+1 и перерасход round-trip).
+
+Каждая команда pymongo привязывается к текущему обработчику через contextvar:
+middleware FastAPI и aiogram открывают QueryTrace, слушатель команд
+дописывает в него (команда, коллекция, форма запроса, длительность).
+Motor выполняет операции в пуле потоков с копией контекста, поэтому
+трассировка доступна и в потоке драйвера.
+
+После завершения обработчика трассировка проверяется:
+    - число round-trip больше MONGO_ROUNDTRIP_BUDGET;
+    - одна и та же форма запроса повторяется MONGO_REPEAT_THRESHOLD раз и больше
+      (запрос в цикле, N+1).
+Нарушения логируются и накапливаются в отчете top_offenders
+(GET /api/admin/debug/queries).
+"""
+import json
+import threading
+import time
+from collections import Counter as ShapeCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import monitoring
+from config import MONGO_ROUNDTRIP_BUDGET, MONGO_REPEAT_THRESHOLD
+from utils.metrics import REGISTRY, Counter, Histogram
+import logging
+
+logger = logging.getLogger(__name__)
+
+MONGO_ROUNDTRIPS = REGISTRY.register(Histogram(
+    "shipbot_mongo_roundtrips", "MongoDB round trips per handler", ("handler",),
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+))
+MONGO_FLAGGED_HANDLERS = REGISTRY.register(Counter(
+    "shipbot_mongo_flagged_total", "Handler executions over the round-trip budget or with repeated query shapes",
+    ("handler", "reason")
+))
+
+# Поле команды, в котором лежит фильтр (для формы запроса)
+_FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+}
+_BULK_FIELDS = {"update": ("updates", "q"), "delete": ("deletes", "q")}
+
+_MAX_OFFENDERS = 200
+
+def _shape(value: Any, depth: int = 0) -> Any:
+    """Заменяет значения на "?", оставляя ключи и операторы"""
+    if depth > 6:
+        return "?"
+    if isinstance(value, dict):
+        return {key: _shape(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # $in: [1, 2, 3] и $in: [1] - одна форма
+        return [_shape(value[0], depth + 1)] if value else []
+    return "?"
+
+def query_shape(command_name: str, command: Dict[str, Any]) -> str:
+    """
+    Форма запроса: коллекция, команда и фильтр без значений.
+
+    Returns:
+        Строка вида "couriers_deliveries.find {"status": "?"}"
+    """
+    collection = command.get(command_name)
+    collection = collection if isinstance(collection, str) else command.get("collection", "")
+    if command_name == "getMore":
+        query = {}
+    elif command_name in _BULK_FIELDS:
+        field, key = _BULK_FIELDS[command_name]
+        documents = command.get(field) or [{}]
+        query = documents[0].get(key, {})
+    elif command_name == "aggregate":
+        # Стадии пайплайна по порядку, фильтр - только у $match
+        query = [
+            {name: _shape(value) if name == "$match" else "?" for name, value in stage.items()}
+            for stage in command.get("pipeline", [])
+        ]
+    else:
+        query = _shape(command.get(_FILTER_FIELDS.get(command_name, ""), {}))
+    if command_name in _BULK_FIELDS:
+        query = _shape(query)
+    try:
+        shape = json.dumps(query, sort_keys=True, default=str)
+    except (TypeError, ValueError):
+        shape = "?"
+    return f"{collection}.{command_name} {shape}"
+
+class QueryTrace:
+    """Команды MongoDB, выполненные одним обработчиком"""
+
+    def __init__(self, handler: str):
+        self.handler = handler
+        self.started = time.perf_counter()
+        self.commands: List[Tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def add(self, shape: str, duration: float):
+        with self._lock:
+            self.commands.append((shape, duration))
+
+    @property
+    def roundtrips(self) -> int:
+        return len(self.commands)
+
+    def repeated_shapes(self, threshold: int) -> List[Tuple[str, int]]:
+        # getMore - продолжение того же курсора, а не повтор запроса
+        counts = ShapeCounter(shape for shape, _ in self.commands if not shape.endswith(".getMore {}"))
+        return [(shape, count) for shape, count in counts.most_common() if count >= threshold]
+
+current_trace: ContextVar[Optional[QueryTrace]] = ContextVar("current_trace", default=None)
+
+# handler -> статистика нарушений
+_offenders: Dict[str, Dict[str, Any]] = {}
+_offenders_lock = threading.Lock()
+
+def _record_offender(trace: QueryTrace, reasons: List[str], repeated: List[Tuple[str, int]]):
+    with _offenders_lock:
+        item = _offenders.get(trace.handler)
+        if item is None:
+            if len(_offenders) >= _MAX_OFFENDERS:
+                return
+            item = _offenders[trace.handler] = {
+                "handler": trace.handler,
+                "flagged": 0,
+                "max_roundtrips": 0,
+                "total_roundtrips": 0,
+                "reasons": {},
+                "top_repeated_shape": None,
+                "top_repeated_count": 0,
+                "last_seen": None,
+            }
+        item["flagged"] += 1
+        item["total_roundtrips"] += trace.roundtrips
+        item["max_roundtrips"] = max(item["max_roundtrips"], trace.roundtrips)
+        for reason in reasons:
+            item["reasons"][reason] = item["reasons"].get(reason, 0) + 1
+        if repeated and repeated[0][1] > item["top_repeated_count"]:
+            item["top_repeated_shape"], item["top_repeated_count"] = repeated[0]
+        item["last_seen"] = time.time()
+
+def finish_trace(trace: QueryTrace):
+    """Проверяет трассировку на перерасход round-trip и повторяющиеся запросы"""
+    if not trace.commands:
+        return
+    MONGO_ROUNDTRIPS.observe(trace.roundtrips, handler=trace.handler)
+
+    reasons = []
+    if trace.roundtrips > MONGO_ROUNDTRIP_BUDGET:
+        reasons.append("budget")
+    repeated = trace.repeated_shapes(MONGO_REPEAT_THRESHOLD)
+    if repeated:
+        reasons.append("repeated_shape")
+    if not reasons:
+        return
+
+    for reason in reasons:
+        MONGO_FLAGGED_HANDLERS.inc(handler=trace.handler, reason=reason)
+    _record_offender(trace, reasons, repeated)
+    mongo_ms = sum(duration for _, duration in trace.commands) * 1000
+    logger.warning(
+        "[MONGO] ⚠️ %s: %d round-trip (бюджет %d, %.1f ms в MongoDB)%s",
+        trace.handler, trace.roundtrips, MONGO_ROUNDTRIP_BUDGET, mongo_ms,
+        "".join(f"; x{count} {shape}" for shape, count in repeated[:3])
+    )
+
+@contextmanager
+def trace_queries(handler: str):
+    """
+    Привязывает команды MongoDB внутри блока к обработчику.
+    Вложенные блоки используют внешнюю трассировку.
+
+    Args:
+        handler: Имя обработчика (например "orders:cb_order_done" или "GET /api/orders")
+
+    Yields:
+        QueryTrace (имя можно уточнить до выхода из блока)
+    """
+    parent = current_trace.get()
+    if parent is not None:
+        yield parent
+        return
+    trace = QueryTrace(handler)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+        finish_trace(trace)
+
+def top_offenders(limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Обработчики с нарушениями, отсортированные по количеству нарушений.
+
+    Returns:
+        Список словарей: handler, flagged, max_roundtrips, avg_roundtrips, reasons,
+        top_repeated_shape, top_repeated_count, last_seen (unix time)
+    """
+    with _offenders_lock:
+        items = [dict(item, reasons=dict(item["reasons"])) for item in _offenders.values()]
+    for item in items:
+        item["avg_roundtrips"] = round(item.pop("total_roundtrips") / item["flagged"], 1)
+    items.sort(key=lambda item: (item["flagged"], item["max_roundtrips"]), reverse=True)
+    return items[:limit]
+
+def reset_offenders():
+    with _offenders_lock:
+        _offenders.clear()
+
+class QueryTraceListener(monitoring.CommandListener):
+    """Слушатель команд pymongo: дописывает команды в трассировку текущего обработчика"""
+
+    def __init__(self):
+        self._pending: Dict[int, Tuple[QueryTrace, str]] = {}
+
+    def started(self, event):
+        trace = current_trace.get()
+        if trace is None:
+            return
+        self._pending[event.request_id] = (trace, query_shape(event.command_name, event.command))
+
+    def _finish(self, event):
+        pending = self._pending.pop(event.request_id, None)
+        if pending is not None:
+            trace, shape = pending
+            trace.add(shape, event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+query_trace_listener = QueryTraceListener()
+
+class QueryTraceMiddleware:
+    """Middleware aiogram: трассировка команд MongoDB сработавшего обработчика"""
+
+    def __init__(self, router_name: str):
+        self.router_name = router_name
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        callback_name = getattr(getattr(handler_object, "callback", None), "__name__", "handler")
+        with trace_queries(f"{self.router_name}:{callback_name}"):
+            return await handler(event, data)
+
+def trace_router(router, router_name: str):
+    """Подключает QueryTraceMiddleware к событиям message, edited_message и callback_query роутера"""
+    middleware = QueryTraceMiddleware(router_name)
+    for event_name in ("message", "edited_message", "callback_query"):
+        getattr(router, event_name).middleware(middleware)
+    return router
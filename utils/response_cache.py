@@ -0,0 +1,107 @@
+"""
+Кэш ответов admin API с ETag и версиями данных в Redis (utils/data_versions.py).
+
+ETag ответа - хэш эндпоинта, параметров запроса, версий его областей и номера
+интервала TTL (время в ответах вроде "24ч назад" устаревает не позже TTL).
+Если версии не изменились:
+    - If-None-Match с тем же ETag -> 304 без обращения к MongoDB;
+    - иначе тело берется из Redis (cache:resp:<etag>, хранится TTL секунд).
+
+При недоступности Redis эндпоинт выполняется как без кэша.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import time
+from typing import Optional, Sequence, Tuple
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from config import RESPONSE_CACHE_ENABLED
+from db.redis_client import get_redis
+from utils.data_versions import EPOCH_KEY, version_key
+from utils.fast_json import dumps
+from utils.metrics import REGISTRY, Counter
+import logging
+
+logger = logging.getLogger(__name__)
+
+BODY_PREFIX = "cache:resp:"
+
+RESPONSE_CACHE = REGISTRY.register(Counter(
+    "shipbot_response_cache_total", "Admin API response cache lookups", ("endpoint", "outcome")
+))
+
+def _if_none_match(request: Request) -> set:
+    header = request.headers.get("if-none-match", "")
+    return {tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()}
+
+def cached_endpoint(name: str, ttl: int, scopes: Sequence[Tuple[str, Optional[str]]]):
+    """
+    Декоратор GET эндпоинта admin API: ETag, 304 и кэш тела ответа в Redis.
+
+    Args:
+        name: Имя эндпоинта (метрика, ключ кэша)
+        ttl: Максимальное время жизни ответа, секунды
+        scopes: Области данных ответа: (область, имя параметра с chat_id курьера или None для всей области)
+
+    Применяется под @app.get; зависимости эндпоинта (verify_admin) выполняются до проверки кэша.
+    """
+    def decorator(endpoint):
+        signature = inspect.signature(endpoint)
+
+        @functools.wraps(endpoint)
+        async def wrapper(*args, _cache_request: Request, **kwargs):
+            if not RESPONSE_CACHE_ENABLED:
+                return await endpoint(*args, **kwargs)
+            try:
+                etag = await _current_etag(name, ttl, scopes, _cache_request, kwargs)
+            except Exception as e:
+                logger.warning("[CACHE] ⚠️ Кэш ответов недоступен (%s): %s", name, e)
+                RESPONSE_CACHE.inc(endpoint=name, outcome="bypass")
+                return await endpoint(*args, **kwargs)
+
+            headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+            if etag in _if_none_match(_cache_request):
+                RESPONSE_CACHE.inc(endpoint=name, outcome="not_modified")
+                return Response(status_code=304, headers=headers)
+
+            redis = get_redis()
+            body_key = f"{BODY_PREFIX}{etag.strip(chr(34))}"
+            body = await redis.get(body_key)
+            if body is not None:
+                RESPONSE_CACHE.inc(endpoint=name, outcome="hit")
+                return Response(content=body, media_type="application/json", headers=headers)
+
+            result = await endpoint(*args, **kwargs)
+            if isinstance(result, JSONResponse):
+                body = result.body.decode()
+            elif isinstance(result, Response):
+                # Не JSON ответ (редирект и т.п.) не кэшируется
+                return result
+            else:
+                body = dumps(result).decode()
+            await redis.setex(body_key, ttl, body)
+            RESPONSE_CACHE.inc(endpoint=name, outcome="miss")
+            return Response(content=body, media_type="application/json", headers=headers)
+
+        wrapper.__signature__ = signature.replace(parameters=[
+            *signature.parameters.values(),
+            inspect.Parameter("_cache_request", inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+        ])
+        return wrapper
+    return decorator
+
+async def _current_etag(name: str, ttl: int, scopes, request: Request, params: dict) -> str:
+    keys = [EPOCH_KEY]
+    for scope, chat_param in scopes:
+        keys.append(version_key(scope, None if chat_param is None else params[chat_param]))
+    versions = await get_redis().mget(keys)
+    raw = json.dumps([
+        name,
+        request.url.path,
+        sorted(request.query_params.multi_items()),
+        versions,
+        int(time.time() // ttl),
+    ], default=str)
+    return f'"{hashlib.sha256(raw.encode()).hexdigest()[:32]}"'
@@ -1,15 +1,19 @@
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
 from aiogram import Bot
-from config import TIMEZONE, BOT_TOKEN
+from config import TIMEZONE, DELIVERY_STATS_REFRESH_MINUTES
 from handlers.shift import auto_end_all_shifts
 from db.mongo import get_db
+from utils.bot_registry import get_bot
 
 logger = logging.getLogger(__name__)
 
 # Флаг для предотвращения повторных запусков
 _last_run_date = None
+# Время последнего обновления агрегатов времени доставки (monotonic)
+_last_stats_refresh = None
 
 async def end_all_shifts_scheduled(bot: Bot):
     """
@@ -41,13 +45,12 @@ async def cleanup_old_locations():
         # Вычисляем дату 7 дней назад
         now = datetime.now(TIMEZONE)
         date_7_days_ago = now - timedelta(days=7)
-        date_7_days_ago_iso = date_7_days_ago.isoformat()
         
-        logger.debug(f"[SCHEDULER] Удаление записей старше {date_7_days_ago_iso}")
+        logger.debug(f"[SCHEDULER] Удаление записей старше {date_7_days_ago.isoformat()}")
         
-        # Удаляем все записи где timestamp < date_7_days_ago
+        # Удаляем все записи старше 7 дней (по индексу timestamp_ns)
         result = await db.locations.delete_many({
-            "timestamp": {"$lt": date_7_days_ago_iso}
+            "timestamp_ns": {"$lt": int(date_7_days_ago.timestamp() * 1_000_000_000)}
         })
         
         deleted_count = result.deleted_count
@@ -59,15 +62,49 @@ async def cleanup_old_locations():
         logger.error(f"[SCHEDULER] ❌ Ошибка при очистке старых записей location: {e}", exc_info=True)
         raise
 
+async def reconcile_order_counters():
+    """
+    Сверяет материализованные счетчики заказов курьеров с заказами
+    за последние двое суток и исправляет расхождения.
+    Вызывается планировщиком в 23:00
+    """
+    logger.info("[SCHEDULER] 🔢 Начало сверки счетчиков заказов")
+    
+    try:
+        from db.counters import reconcile_counters
+        db = await get_db()
+        fixed = await reconcile_counters(db, days=2)
+        logger.info(f"[SCHEDULER] ✅ Сверка счетчиков завершена: исправлено {fixed} документов")
+        return fixed
+        
+    except Exception as e:
+        logger.error(f"[SCHEDULER] ❌ Ошибка при сверке счетчиков заказов: {e}", exc_info=True)
+        raise
+
+async def refresh_delivery_stats():
+    """
+    Обновляет дневные агрегаты времени доставки за сегодня и вчера.
+    Вызывается планировщиком каждые DELIVERY_STATS_REFRESH_MINUTES
+    """
+    try:
+        from db.delivery_stats import refresh_rollups
+        db = await get_db()
+        return await refresh_rollups(db, days=2)
+        
+    except Exception as e:
+        logger.error(f"[SCHEDULER] ❌ Ошибка при обновлении агрегатов времени доставки: {e}", exc_info=True)
+        raise
+
 async def run_scheduler():
     """
     Планировщик, который проверяет время каждую минуту
     и запускает завершение всех смен в 23:00
     """
-    global _last_run_date
+    global _last_run_date, _last_stats_refresh
     
     logger.info("[SCHEDULER] Планировщик запущен")
-    bot = Bot(BOT_TOKEN)
+    # Общий Bot процесса, сессию закрывает bot.main
+    bot = get_bot()
     
     try:
         while True:
@@ -95,9 +132,26 @@ async def run_scheduler():
                         await cleanup_old_locations()
                     except Exception as e:
                         logger.error(f"[SCHEDULER] ❌ Ошибка при очистке location: {e}", exc_info=True)
+                    
+                    # Сверка счетчиков заказов
+                    try:
+                        await reconcile_order_counters()
+                    except Exception as e:
+                        logger.error(f"[SCHEDULER] ❌ Ошибка при сверке счетчиков: {e}", exc_info=True)
                 else:
                     logger.debug(f"[SCHEDULER] Завершение смен уже было запущено сегодня ({current_date})")
             
+            # Агрегаты времени доставки за сегодня и вчера
+            if DELIVERY_STATS_REFRESH_MINUTES > 0 and (
+                _last_stats_refresh is None
+                or time.monotonic() - _last_stats_refresh >= DELIVERY_STATS_REFRESH_MINUTES * 60
+            ):
+                _last_stats_refresh = time.monotonic()
+                try:
+                    await refresh_delivery_stats()
+                except Exception as e:
+                    logger.error(f"[SCHEDULER] ❌ Ошибка при обновлении агрегатов доставки: {e}", exc_info=True)
+            
             # Ждем 60 секунд до следующей проверки
             # Используем asyncio.wait_for для возможности прерывания
             try:
@@ -112,10 +166,4 @@ async def run_scheduler():
     except Exception as e:
         logger.error(f"[SCHEDULER] ❌ Критическая ошибка в планировщике: {e}", exc_info=True)
         raise
-    finally:
-        try:
-            await bot.session.close()
-            logger.debug("[SCHEDULER] Сессия бота закрыта")
-        except Exception as e:
-            logger.warning(f"[SCHEDULER] Ошибка при закрытии сессии бота: {e}")
 
@@ -0,0 +1,37 @@
+"""
+Время запуска процесса по этапам (импорты, логирование, polling, API).
+
+Модуль импортируется первым в bot.py: отсчет идет от начала импортов приложения.
+Этапы до настройки логирования накапливаются и выводятся при первом mark()
+после setup_logging.
+"""
+import time
+from typing import List, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+_started = time.perf_counter()
+_previous = _started
+_pending: List[Tuple[str, float, float]] = []
+
+def mark(phase: str, log: bool = True):
+    """
+    Отмечает завершение этапа запуска.
+
+    Args:
+        phase: Название этапа
+        log: Вывести накопленные этапы в лог (False - до настройки логирования)
+    """
+    global _previous
+    now = time.perf_counter()
+    _pending.append((phase, (now - _previous) * 1000, (now - _started) * 1000))
+    _previous = now
+    if log:
+        for name, step_ms, total_ms in _pending:
+            logger.info("[STARTUP] ⏱️ %s: +%.0f ms (с запуска %.0f ms)", name, step_ms, total_ms)
+        _pending.clear()
+
+def elapsed_ms() -> float:
+    """Миллисекунды с начала запуска"""
+    return (time.perf_counter() - _started) * 1000
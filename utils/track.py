@@ -0,0 +1,293 @@
+"""
+Трек смены курьера: GeoJSON, GPX и Google encoded polyline.
+
+Точки читаются курсором Motor из locations по индексу (shift_id, timestamp_ns)
+с проекцией lat/lon/timestamp_ns и сразу пишутся в StreamingResponse: длина
+трека не ограничена, как у ссылок Google Maps (несколько десятков точек).
+
+С параметром simplify точки смены собираются в список кортежей и
+прореживаются алгоритмом Дугласа-Пекера с допуском в метрах.
+"""
+import math
+from datetime import datetime, timezone
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Sequence, Tuple
+from xml.sax.saxutils import escape
+from fastapi.responses import StreamingResponse
+from config import EXPORT_BATCH_SIZE, TIMEZONE
+from utils.fast_json import dumps
+from utils.geodesy import EARTH_RADIUS_KM
+import logging
+
+logger = logging.getLogger(__name__)
+
+# (lat, lon, timestamp_ns)
+Point = Tuple[float, float, int]
+
+FORMATS = {
+    "geojson": ("application/geo+json", "geojson"),
+    "gpx": ("application/gpx+xml", "gpx"),
+    "polyline": ("application/json", "json"),
+}
+
+_EARTH_RADIUS_M = EARTH_RADIUS_KM * 1000
+_CHUNK_POINTS = 2000
+
+def track_query(chat_id: int, shift_id: str) -> Dict:
+    """Фильтр точек смены (индекс shift_id_1_timestamp_ns_1)"""
+    return {"shift_id": shift_id, "chat_id": chat_id}
+
+async def iter_points(collection, chat_id: int, shift_id: str) -> AsyncIterator[Point]:
+    """
+    Точки смены по времени; точки с некорректными координатами пропускаются.
+    Курсор закрывается по окончании или при отключении клиента.
+    """
+    cursor = collection.find(
+        track_query(chat_id, shift_id), {"_id": 0, "lat": 1, "lon": 1, "timestamp_ns": 1}
+    ).sort("timestamp_ns", 1).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        async for doc in cursor:
+            lat, lon = doc.get("lat"), doc.get("lon")
+            if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                continue
+            yield (lat, lon, doc.get("timestamp_ns") or 0)
+    finally:
+        await cursor.close()
+
+async def _from_list(points: Iterable[Point]) -> AsyncIterator[Point]:
+    for point in points:
+        yield point
+
+def _perpendicular_m(point: Point, start: Point, end: Point, cos_lat: float) -> float:
+    """Расстояние от точки до отрезка (равнопромежуточная проекция, метры)"""
+    px, py = point[1] * cos_lat, point[0]
+    ax, ay = start[1] * cos_lat, start[0]
+    bx, by = end[1] * cos_lat, end[0]
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+    if length == 0:
+        return math.radians(math.hypot(px - ax, py - ay)) * _EARTH_RADIUS_M
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / length))
+    return math.radians(math.hypot(px - (ax + t * dx), py - (ay + t * dy))) * _EARTH_RADIUS_M
+
+def simplify(points: Sequence[Point], tolerance_m: float) -> List[Point]:
+    """
+    Прореживание трека (Дуглас-Пекер, без рекурсии).
+
+    Args:
+        points: Точки по времени
+        tolerance_m: Допустимое отклонение от исходного трека, метры
+
+    Returns:
+        Подмножество точек с первой и последней
+    """
+    if tolerance_m <= 0 or len(points) < 3:
+        return list(points)
+    cos_lat = math.cos(math.radians(sum(p[0] for p in points) / len(points)))
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, max_distance = 0, 0.0
+        for index in range(first + 1, last):
+            distance = _perpendicular_m(points[index], points[first], points[last], cos_lat)
+            if distance > max_distance:
+                farthest, max_distance = index, distance
+        if max_distance > tolerance_m:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+def _encode_value(value: int) -> str:
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+def encode_polyline(points: Iterable[Point], precision: int = 5) -> str:
+    """Google encoded polyline (https://developers.google.com/maps/documentation/utilities/polylinealgorithm)"""
+    factor = 10 ** precision
+    result = []
+    prev_lat = prev_lon = 0
+    for lat, lon, _ in points:
+        lat_e5, lon_e5 = round(lat * factor), round(lon * factor)
+        result.append(_encode_value(lat_e5 - prev_lat))
+        result.append(_encode_value(lon_e5 - prev_lon))
+        prev_lat, prev_lon = lat_e5, lon_e5
+    return "".join(result)
+
+def _iso(timestamp_ns: int) -> str:
+    return datetime.fromtimestamp(timestamp_ns / 1e9, tz=TIMEZONE).isoformat()
+
+async def render_geojson(points: AsyncIterable[Point], properties: Dict) -> AsyncIterator[bytes]:
+    """
+    Feature с LineString. Координаты пишутся по мере чтения курсора, поэтому
+    properties (число точек, начало и конец) идут после geometry.
+    """
+    yield b'{"type":"Feature","geometry":{"type":"LineString","coordinates":['
+    chunk: List[bytes] = []
+    count, first_ns, last_ns = 0, None, None
+    async for lat, lon, timestamp_ns in points:
+        chunk.append(dumps([lon, lat]))
+        count += 1
+        first_ns = timestamp_ns if first_ns is None else first_ns
+        last_ns = timestamp_ns
+        if len(chunk) >= _CHUNK_POINTS:
+            yield (b"," if count > len(chunk) else b"") + b",".join(chunk)
+            chunk = []
+    if chunk:
+        yield (b"," if count > len(chunk) else b"") + b",".join(chunk)
+    yield b']},"properties":' + dumps({
+        **properties,
+        "points_count": count,
+        "start": _iso(first_ns) if first_ns is not None else None,
+        "end": _iso(last_ns) if last_ns is not None else None,
+    }) + b"}"
+
+async def render_gpx(points: AsyncIterable[Point], name: str) -> AsyncIterator[bytes]:
+    """GPX 1.1 с одним trk/trkseg; точки пишутся по мере чтения курсора"""
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx version="1.1" creator="shipbot" xmlns="http://www.topografix.com/GPX/1/1">\n'
+        f"<trk><name>{escape(name)}</name><trkseg>\n"
+    ).encode()
+    chunk: List[str] = []
+    async for lat, lon, timestamp_ns in points:
+        utc = datetime.fromtimestamp(timestamp_ns / 1e9, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        chunk.append(f'<trkpt lat="{lat}" lon="{lon}"><time>{utc}</time></trkpt>\n')
+        if len(chunk) >= _CHUNK_POINTS:
+            yield "".join(chunk).encode()
+            chunk = []
+    chunk.append("</trkseg></trk>\n</gpx>\n")
+    yield "".join(chunk).encode()
+
+async def render_polyline(points: AsyncIterable[Point], properties: Dict) -> AsyncIterator[bytes]:
+    """JSON: polyline, число точек и время начала/конца"""
+    collected = [point async for point in points]
+    yield dumps({
+        "ok": True,
+        **properties,
+        "points_count": len(collected),
+        "start": _iso(collected[0][2]) if collected else None,
+        "end": _iso(collected[-1][2]) if collected else None,
+        "polyline": encode_polyline(collected),
+    })
+
+async def track_response(
+    collection,
+    chat_id: int,
+    shift_id: str,
+    fmt: str,
+    simplify_m: float = 0,
+    download: bool = False
+) -> StreamingResponse:
+    """
+    Ответ с треком смены.
+
+    Args:
+        collection: Коллекция locations
+        chat_id: Telegram chat ID курьера
+        shift_id: ID смены
+        fmt: geojson | gpx | polyline
+        simplify_m: Допуск упрощения, метры (0 - все точки)
+        download: Content-Disposition: attachment
+    """
+    points: AsyncIterable[Point] = iter_points(collection, chat_id, shift_id)
+    if simplify_m > 0:
+        original = [point async for point in points]
+        simplified = simplify(original, simplify_m)
+        logger.info("[TRACK] ✂️ Трек смены %s: %s -> %s точек (допуск %s м)", shift_id, len(original), len(simplified), simplify_m)
+        points = _from_list(simplified)
+
+    properties = {"chat_id": chat_id, "shift_id": shift_id}
+    if fmt == "gpx":
+        body = render_gpx(points, f"{chat_id} {shift_id}")
+    elif fmt == "geojson":
+        body = render_geojson(points, properties)
+    else:
+        body = render_polyline(points, properties)
+
+    media_type, extension = FORMATS[fmt]
+    headers = {}
+    if download:
+        headers["Content-Disposition"] = f'attachment; filename="track_{shift_id}.{extension}"'
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+def viewer_page(leaflet_url: str, tile_url: str) -> str:
+    """HTML страница просмотра трека (Leaflet); трек загружается из track API в формате polyline"""
+    return _VIEWER_HTML.replace("{{LEAFLET}}", escape(leaflet_url)).replace("{{TILES}}", escape(tile_url))
+
+_VIEWER_HTML = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>Трек смены</title>
+<link rel="stylesheet" href="{{LEAFLET}}/leaflet.css">
+<script src="{{LEAFLET}}/leaflet.js"></script>
+<style>
+  html, body, #map { height: 100%; margin: 0; }
+  #panel { position: absolute; top: 10px; right: 10px; z-index: 1000; background: #fff;
+           padding: 8px 10px; border-radius: 4px; font: 13px sans-serif; box-shadow: 0 1px 4px rgba(0,0,0,.3); }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="panel">
+  <label>Admin ID <input id="admin" size="12"></label>
+  <label>Упрощение, м <input id="simplify" size="4" value="0"></label>
+  <button id="load">Показать</button>
+  <div id="info"></div>
+</div>
+<script>
+// Полилиния декодируется в браузере: один запрос, без ограничения длины URL
+function decode(str) {
+  var points = [], index = 0, lat = 0, lon = 0;
+  while (index < str.length) {
+    var values = [];
+    for (var k = 0; k < 2; k++) {
+      var result = 0, shift = 0, b;
+      do { b = str.charCodeAt(index++) - 63; result |= (b & 0x1f) << shift; shift += 5; } while (b >= 0x20);
+      values.push(result & 1 ? ~(result >> 1) : result >> 1);
+    }
+    lat += values[0]; lon += values[1];
+    points.push([lat / 1e5, lon / 1e5]);
+  }
+  return points;
+}
+
+var map = L.map("map").setView([-34.6037, -58.3816], 12);
+L.tileLayer("{{TILES}}", {maxZoom: 19, attribution: "&copy; OpenStreetMap"}).addTo(map);
+var layer = L.layerGroup().addTo(map);
+var admin = document.getElementById("admin");
+admin.value = localStorage.getItem("shipbot_admin_id") || "";
+
+function load() {
+  localStorage.setItem("shipbot_admin_id", admin.value);
+  var simplify = document.getElementById("simplify").value || "0";
+  var info = document.getElementById("info");
+  info.textContent = "Загрузка...";
+  fetch("../track?format=polyline&simplify=" + encodeURIComponent(simplify), {headers: {"X-Admin-User-ID": admin.value}})
+    .then(function (r) { if (!r.ok) throw new Error("HTTP " + r.status); return r.json(); })
+    .then(function (data) {
+      layer.clearLayers();
+      var points = decode(data.polyline);
+      info.textContent = data.points_count + " точек, " + (data.start || "") + " — " + (data.end || "");
+      if (!points.length) return;
+      var line = L.polyline(points, {color: "#1e6fd9", weight: 4}).addTo(layer);
+      L.circleMarker(points[0], {color: "#2a9d3c", radius: 6}).addTo(layer).bindTooltip("Начало");
+      L.circleMarker(points[points.length - 1], {color: "#d62828", radius: 6}).addTo(layer).bindTooltip("Конец");
+      map.fitBounds(line.getBounds(), {padding: [20, 20]});
+    })
+    .catch(function (e) { info.textContent = e.message; });
+}
+document.getElementById("load").onclick = load;
+if (admin.value) load();
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,174 @@
+"""
+Аналитика трека смены: пробег, время в движении и на стоянках, максимальная
+скорость и стоянки. Считается при завершении смены по точкам locations
+(векторно, numpy) и сохраняется в документе shift_ended (поле track_stats).
+
+Отрезок между соседними точками:
+    - разрыв: интервал больше TRACK_GAP_SECONDS (трансляция геопозиции прерывалась),
+      не входит ни в движение, ни в стоянку;
+    - выброс: скорость выше TRACK_MAX_SPEED_KMH (скачок GPS), пропускается;
+    - движение: скорость от TRACK_MOVING_SPEED_KMH и смещение от TRACK_JITTER_METERS,
+      только такие отрезки входят в пробег (дрожание координат на месте не накапливается);
+    - иначе стоянка. Подряд идущие отрезки стоянки от TRACK_STOP_MIN_SECONDS - стоянка в списке stops.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import numpy as np
+from config import (
+    TIMEZONE, EXPORT_BATCH_SIZE, TRACK_MOVING_SPEED_KMH, TRACK_JITTER_METERS, TRACK_MAX_SPEED_KMH,
+    TRACK_GAP_SECONDS, TRACK_STOP_MIN_SECONDS
+)
+from utils.geodesy import haversine_km
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Максимум стоянок в документе истории (самые длинные)
+MAX_STOPS = 50
+
+def segment_km(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Длины отрезков между соседними точками по формуле гаверсинусов (км), длина n-1"""
+    return haversine_km(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+def _runs(mask: np.ndarray):
+    """Границы серий True: массивы start (включительно) и end (не включительно)"""
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return edges[0::2], edges[1::2]
+
+def _time(timestamp_ns: int) -> datetime:
+    return datetime.fromtimestamp(int(timestamp_ns) / 1e9, tz=TIMEZONE).replace(microsecond=0)
+
+def compute_track_stats(lats: np.ndarray, lons: np.ndarray, timestamps_ns: np.ndarray) -> Dict[str, Any]:
+    """
+    Аналитика трека.
+
+    Args:
+        lats, lons: Координаты точек в порядке времени
+        timestamps_ns: Время точек, наносекунды
+
+    Returns:
+        dict: points, distance_km, moving_seconds, stationary_seconds, gap_seconds,
+        max_speed_kmh, stops_count, stops [{lat, lon, start, end, duration_seconds}]
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    stats: Dict[str, Any] = {
+        "points": int(lats.size),
+        "distance_km": 0.0,
+        "moving_seconds": 0,
+        "stationary_seconds": 0,
+        "gap_seconds": 0,
+        "max_speed_kmh": 0.0,
+        "stops_count": 0,
+        "stops": [],
+    }
+    if lats.size < 2:
+        return stats
+
+    distance = segment_km(lats, lons)
+    seconds = np.diff(timestamps_ns) / 1e9
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(seconds > 0, distance / seconds * 3600, np.inf)
+
+    gap = seconds > TRACK_GAP_SECONDS
+    valid = ~gap & (speed <= TRACK_MAX_SPEED_KMH)
+    moving = valid & (speed >= TRACK_MOVING_SPEED_KMH) & (distance * 1000 >= TRACK_JITTER_METERS)
+    stationary = valid & ~moving
+
+    stats["distance_km"] = round(float(distance[moving].sum()), 2)
+    stats["moving_seconds"] = int(seconds[moving].sum())
+    stats["stationary_seconds"] = int(seconds[stationary].sum())
+    stats["gap_seconds"] = int(seconds[gap].sum())
+    if moving.any():
+        stats["max_speed_kmh"] = round(float(speed[moving].max()), 1)
+
+    # Стоянки: серии отрезков стоянки (i -> i+1), точки серии - start..end включительно
+    starts, ends = _runs(stationary)
+    if starts.size:
+        # Отрезки серии - starts..ends-1, ее точки - starts..ends; суммы по префиксным суммам
+        cumulative = np.concatenate(([0.0], np.cumsum(np.where(stationary, seconds, 0.0))))
+        durations = cumulative[ends] - cumulative[starts]
+        long_enough = durations >= TRACK_STOP_MIN_SECONDS
+        starts, ends, durations = starts[long_enough], ends[long_enough], durations[long_enough]
+
+        point_lat = np.concatenate(([0.0], np.cumsum(lats)))
+        point_lon = np.concatenate(([0.0], np.cumsum(lons)))
+        counts = ends - starts + 1
+        centroid_lat = (point_lat[ends + 1] - point_lat[starts]) / counts
+        centroid_lon = (point_lon[ends + 1] - point_lon[starts]) / counts
+
+        stats["stops_count"] = int(starts.size)
+        order = np.argsort(-durations, kind="stable")[:MAX_STOPS]
+        stats["stops"] = [
+            {
+                "lat": round(float(centroid_lat[i]), 6),
+                "lon": round(float(centroid_lon[i]), 6),
+                "start": _time(timestamps_ns[starts[i]]),
+                "end": _time(timestamps_ns[ends[i]]),
+                "duration_seconds": int(durations[i]),
+            }
+            for i in np.sort(order)
+        ]
+    return stats
+
+async def load_track(db, chat_id: int, shift_id: str):
+    """Точки смены из locations в виде массивов (lats, lons, timestamps_ns)"""
+    lats: List[float] = []
+    lons: List[float] = []
+    timestamps: List[int] = []
+    cursor = db.locations.find(
+        {"shift_id": shift_id, "chat_id": chat_id},
+        {"_id": 0, "lat": 1, "lon": 1, "timestamp_ns": 1}
+    ).sort("timestamp_ns", 1).batch_size(EXPORT_BATCH_SIZE)
+    async for doc in cursor:
+        lat, lon = doc.get("lat"), doc.get("lon")
+        if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            continue
+        lats.append(lat)
+        lons.append(lon)
+        timestamps.append(doc.get("timestamp_ns") or 0)
+    return (
+        np.array(lats, dtype=np.float64),
+        np.array(lons, dtype=np.float64),
+        np.array(timestamps, dtype=np.int64),
+    )
+
+async def shift_track_stats(db, chat_id: int, shift_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Аналитика трека смены для записи в shift_history.
+
+    Returns:
+        dict (compute_track_stats) или None, если смена неизвестна или расчет не удался
+    """
+    if not shift_id:
+        return None
+    try:
+        lats, lons, timestamps = await load_track(db, chat_id, shift_id)
+        stats = compute_track_stats(lats, lons, timestamps)
+    except Exception as e:
+        logger.warning("[TRACK] ⚠️ Не удалось посчитать аналитику смены %s курьера %s: %s", shift_id, chat_id, e, exc_info=True)
+        return None
+    logger.info(
+        "[TRACK] 📏 Смена %s курьера %s: %s точек, %s км, в движении %s с, стоянок %s",
+        shift_id, chat_id, stats["points"], stats["distance_km"], stats["moving_seconds"], stats["stops_count"]
+    )
+    return stats
+
+def _duration(seconds: int) -> str:
+    hours, minutes = divmod(int(seconds) // 60, 60)
+    return f"{hours} ч {minutes} мин" if hours else f"{minutes} мин"
+
+def format_track_stats(stats: Optional[Dict[str, Any]]) -> str:
+    """Строки аналитики для сообщения о завершении смены (пусто, если точек нет)"""
+    if not stats or stats.get("points", 0) < 2:
+        return ""
+    text = (
+        f"\n🛣️ Пробег: {stats['distance_km']:.1f} км"
+        f"\n🚗 В движении: {_duration(stats['moving_seconds'])}"
+        f"\n⏸️ На стоянках: {_duration(stats['stationary_seconds'])}"
+    )
+    if stats.get("stops_count"):
+        text += f" ({stats['stops_count']})"
+    return text
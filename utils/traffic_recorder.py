@@ -0,0 +1,220 @@
+"""
+Запись входящего трафика (обновления Telegram и запросы API) для воспроизведения
+нагрузки (bench/replay.py).
+
+Включается переменной TRAFFIC_RECORD_DIR: каждый процесс пишет файл
+traffic-<время запуска>-<pid>.ndjson.gz, одна запись - одна строка JSON:
+    {"t": unix time, "kind": "update", "update": {...}}
+    {"t": unix time, "kind": "http", "method": ..., "path": ..., "query": ..., "route": ...,
+     "status": ..., "admin_id": ..., "body": {...}}
+
+Данные обезличиваются до записи: chat/user ID заменяются стабильным псевдонимом
+(HMAC с TRAFFIC_RECORD_SALT - связи курьер/заказ сохраняются), имена, телефоны,
+адреса и произвольный текст удаляются. Координаты, callback_data, команды и
+external_id сохраняются - они нужны для воспроизведения.
+
+Запись идет в отдельном потоке через ограниченную очередь: при переполнении
+записи отбрасываются, event loop не блокируется.
+"""
+import atexit
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import queue
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+from config import TRAFFIC_RECORD_DIR, TRAFFIC_RECORD_SALT, TRAFFIC_RECORD_MAX_MB
+import logging
+
+logger = logging.getLogger(__name__)
+
+REDACTED = "<redacted>"
+
+# Поля пользователя/чата Telegram, содержащие персональные данные
+_PERSONAL_FIELDS = {"first_name", "last_name", "username", "title", "phone_number", "bio", "description"}
+# Поля с ID пользователей/чатов (псевдонимизируются)
+_ID_FIELDS = {"id", "chat_id", "user_id", "courier_tg_chat_id", "client_chat_id", "transfer_to_chat_id", "courier_chat_id"}
+# Поля тела запросов API с персональными данными
+_BODY_PERSONAL_FIELDS = {"client_name", "client_phone", "client_tg", "contact_url", "address", "notes", "map_url"}
+# Текст сохраняется только для команд и коротких кнопок без цифр (телефонов, адресов)
+_SAFE_TEXT_RE = re.compile(r"^(/\w+|[^\d@+]{1,24})$")
+# ID курьера в пути запросов админ API
+_PATH_CHAT_ID_RE = re.compile(r"(/couriers/)(\d+)")
+
+def pseudonymize_id(value: Any) -> Any:
+    """Стабильный псевдоним для chat/user ID (положительное число той же длины порядка)"""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return value
+    digest = hmac.new(TRAFFIC_RECORD_SALT.encode(), str(number).encode(), hashlib.sha256).digest()
+    pseudonym = 1_000_000_000 + int.from_bytes(digest[:8], "big") % 1_000_000_000
+    return pseudonym if isinstance(value, int) else str(pseudonym)
+
+def _sanitize_text(text: str) -> str:
+    return text if _SAFE_TEXT_RE.match(text.strip()) else f"{REDACTED}:{len(text)}"
+
+def sanitize_path(path: str) -> str:
+    """Заменяет chat ID курьера в пути (/api/admin/couriers/<id>/...) псевдонимом"""
+    return _PATH_CHAT_ID_RE.sub(lambda match: f"{match.group(1)}{pseudonymize_id(match.group(2))}", path)
+
+def sanitize(value: Any, key: Optional[str] = None) -> Any:
+    """
+    Рекурсивно обезличивает обновление Telegram или тело запроса API.
+
+    Args:
+        value: dict/list/значение
+        key: Имя поля, в котором находится значение
+    """
+    if isinstance(value, dict):
+        return {k: sanitize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(item, key) for item in value]
+    if key in _ID_FIELDS and isinstance(value, (int, str)) and not isinstance(value, bool):
+        return pseudonymize_id(value)
+    if key in _PERSONAL_FIELDS or key in _BODY_PERSONAL_FIELDS:
+        return REDACTED if value is not None else None
+    if key in ("text", "caption") and isinstance(value, str):
+        return _sanitize_text(value)
+    return value
+
+class TrafficRecorder:
+    """Запись NDJSON.gz в фоновом потоке"""
+
+    def __init__(self, directory: str, max_bytes: int, queue_size: int = 10000):
+        os.makedirs(directory, exist_ok=True)
+        started = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.path = os.path.join(directory, f"traffic-{started}-{os.getpid()}.ndjson.gz")
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, entry: Dict[str, Any]):
+        if self.written >= self.max_bytes:
+            return
+        try:
+            line = json.dumps(entry, ensure_ascii=False, default=str, separators=(",", ":"))
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+        except (TypeError, ValueError) as e:
+            logger.debug("[RECORDER] Не удалось сериализовать запись: %s", e)
+
+    def _run(self):
+        with gzip.open(self.path, "at", encoding="utf-8") as f:
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    line = self._queue.get(timeout=1)
+                except queue.Empty:
+                    line = ""
+                if line is None:
+                    break
+                if line:
+                    f.write(line + "\n")
+                    self.written += len(line) + 1
+                    if self.written >= self.max_bytes:
+                        logger.warning("[RECORDER] ⚠️ Достигнут лимит %s MB, запись трафика остановлена", TRAFFIC_RECORD_MAX_MB)
+                # Периодический flush: после аварийной остановки файл читается до последнего блока
+                if time.monotonic() - last_flush > 5:
+                    f.flush()
+                    last_flush = time.monotonic()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+_recorder: Optional[TrafficRecorder] = None
+
+def get_recorder() -> Optional[TrafficRecorder]:
+    """Рекордер процесса или None, если запись не включена (TRAFFIC_RECORD_DIR)"""
+    global _recorder
+    if _recorder is None and TRAFFIC_RECORD_DIR:
+        _recorder = TrafficRecorder(os.path.expanduser(TRAFFIC_RECORD_DIR), TRAFFIC_RECORD_MAX_MB * 1024 * 1024)
+        atexit.register(_recorder.close)
+        logger.info("[RECORDER] 📼 Запись трафика в %s", _recorder.path)
+    return _recorder
+
+class UpdateRecorderMiddleware:
+    """Outer middleware aiogram на dp.update: записывает каждое входящее обновление"""
+
+    def __init__(self, recorder: TrafficRecorder):
+        self.recorder = recorder
+
+    async def __call__(self, handler, event, data):
+        self.recorder.record({
+            "t": time.time(),
+            "kind": "update",
+            "update": sanitize(event.model_dump(mode="json", exclude_none=True, by_alias=True)),
+        })
+        return await handler(event, data)
+
+# Эти запросы не воспроизводятся: метрики, отладка и редиректы ссылок
+_SKIP_PATH_PREFIXES = ("/metrics", "/api/admin/debug", "/api/location/")
+_MAX_BODY_BYTES = 256 * 1024
+
+class HttpRecorderMiddleware:
+    """
+    ASGI middleware: записывает запросы API (метод, путь, тело, шаблон маршрута, статус ответа).
+    Тело читается из receive по мере чтения приложением, ответ не задерживается.
+    """
+
+    def __init__(self, app, recorder: TrafficRecorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(_SKIP_PATH_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+
+        started = time.time()
+        chunks = []
+        status = None
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                chunks.append(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            self._record(scope, started, b"".join(chunks), status)
+
+    def _record(self, scope, started: float, raw_body: bytes, status: Optional[int]):
+        body = None
+        if raw_body and len(raw_body) <= _MAX_BODY_BYTES:
+            try:
+                body = sanitize(json.loads(raw_body))
+            except ValueError:
+                body = None
+        headers = dict(scope.get("headers") or [])
+        admin_id = headers.get(b"x-admin-user-id")
+        route = scope.get("route")
+        self.recorder.record({
+            "t": started,
+            "kind": "http",
+            "method": scope["method"],
+            "path": sanitize_path(scope["path"]),
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "route": getattr(route, "path", None),
+            "status": status,
+            "admin_id": pseudonymize_id(admin_id.decode()) if admin_id else None,
+            "body": body,
+        })
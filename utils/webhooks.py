@@ -1,7 +1,11 @@
 import aiohttp
 import logging
+import time
 from typing import Dict, Any, Optional
 from config import WEBHOOK_URL, WEBHOOK_PORT
+from db.models import to_iso, json_compatible
+from utils.metrics import WEBHOOK_SECONDS
+from utils.outbox import deferrable
 
 logger = logging.getLogger(__name__)
 
@@ -28,7 +32,8 @@ def map_order_status(status: str) -> str:
     """
     return ORDER_STATUS_MAPPING.get(status, status)
 
-async def send_webhook(event_type: str, data: Dict[str, Any], webhook_url: Optional[str] = None) -> bool:
+@deferrable("webhook.send")
+async def send_webhook(event_type: str, data: Dict[str, Any], webhook_url: Optional[str] = None) -> Optional[bool]:
     """
     Отправляет webhook с данными события
     
@@ -38,7 +43,8 @@ async def send_webhook(event_type: str, data: Dict[str, Any], webhook_url: Optio
         webhook_url: URL для отправки webhook (опционально, если не указан - определяется автоматически)
         
     Returns:
-        True если успешно отправлено, False в противном случае
+        True если успешно отправлено (или поставлено в очередь при OUTBOX_ENABLED), False при ошибке
+        отправки (воркер outbox повторит вызов), None если отправка не нужна (тестовый заказ, URL не задан)
     """
     # Проверка: для заказов с отрицательным external_id (тестовые заказы) не отправляем webhook
     if event_type in ("order_accepted", "order_completed"):
@@ -47,7 +53,7 @@ async def send_webhook(event_type: str, data: Dict[str, Any], webhook_url: Optio
             from utils.test_orders import is_test_order
             if is_test_order(external_id):
                 logger.info(f"[WEBHOOK] 🧪 Тестовый заказ {external_id} - webhook не отправляется")
-                return False
+                return None
     
     # Определяем URL для webhook
     target_url = webhook_url
@@ -69,14 +75,16 @@ async def send_webhook(event_type: str, data: Dict[str, Any], webhook_url: Optio
     
     if not target_url:
         logger.debug(f"[WEBHOOK] WEBHOOK_URL not configured, skipping webhook for {event_type}")
-        return False
+        return None
     
-    payload = {
+    payload = json_compatible({
         "event_type": event_type,
         "timestamp": data.get("timestamp"),
         "data": data
-    }
+    })
     
+    started = time.perf_counter()
+    outcome = "error"
     try:
         logger.debug(f"[WEBHOOK] 📤 Отправка webhook на {target_url} для события {event_type}")
         async with aiohttp.ClientSession() as session:
@@ -85,6 +93,7 @@ async def send_webhook(event_type: str, data: Dict[str, Any], webhook_url: Optio
                 json=payload,
                 timeout=aiohttp.ClientTimeout(total=10)
             ) as response:
+                outcome = str(response.status)
                 if response.status == 200:
                     logger.info(f"[WEBHOOK] ✅ Webhook успешно отправлен для {event_type} на {target_url}")
                     return True
@@ -95,6 +104,8 @@ async def send_webhook(event_type: str, data: Dict[str, Any], webhook_url: Optio
     except Exception as e:
         logger.error(f"[WEBHOOK] ❌ Error sending webhook for {event_type} на {target_url}: {e}", exc_info=True)
         return False
+    finally:
+        WEBHOOK_SECONDS.observe(time.perf_counter() - started, event_type=event_type, outcome=outcome)
 
 async def prepare_courier_data(db, courier: Dict[str, Any]) -> Dict[str, Any]:
     """Подготавливает данные курьера для webhook"""
@@ -104,7 +115,7 @@ async def prepare_courier_data(db, courier: Dict[str, Any]) -> Dict[str, Any]:
         "username": courier.get("username"),
         "tg_chat_id": courier.get("tg_chat_id"),
         "is_on_shift": courier.get("is_on_shift", False),
-        "shift_started_at": courier.get("shift_started_at"),
+        "shift_started_at": to_iso(courier.get("shift_started_at")),
         "current_shift_id": courier.get("current_shift_id"),
         "last_location": courier.get("last_location")
     }
@@ -154,8 +165,8 @@ async def prepare_order_data(db, order: Dict[str, Any]) -> Dict[str, Any]:
         "priority": order.get("priority", 0),
         "brand": order.get("brand"),
         "source": order.get("source"),
-        "created_at": order.get("created_at"),
-        "updated_at": order.get("updated_at"),
+        "created_at": to_iso(order.get("created_at")),
+        "updated_at": to_iso(order.get("updated_at")),
         "address": order.get("address"),
         "map_url": order.get("map_url"),
         "notes": order.get("notes"),